@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+压缩包成员索引模块（目录表 / TOC）
+Archive Member Index Module
+
+压缩时为每个 tar 类压缩包（.tar / .tar.gz / .tar.zst）记录成员位置，
+写成与压缩包同目录的小型索引文件（{压缩包名}.idx，gzip 压缩的 JSON），随压缩包一起写入磁带。
+恢复/浏览时可以直接定位到某个成员，而不必从 12GB 压缩包的开头解压。
+
+索引格式（version=1）:
+{
+    "version": 1,
+    "archive": "backup_xxx.tar.zst",
+    "format": "tar.zst",
+    "tar_size": 123456,                      # tar 流（未压缩）总长度
+    "members": [[arcname, header_offset, data_offset, size, mtime, checksum], ...],
+    "frames": [[compressed_offset, compressed_size, decompressed_offset, decompressed_size], ...]
+}
+偏移量均为 tar 流（未压缩数据）中的字节偏移；frames 只对 zstd 有意义。
+"""
+
+import gzip
+import json
+import logging
+import tarfile
+from pathlib import Path
+from typing import List, Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_INDEX_VERSION = 1
+ARCHIVE_INDEX_SUFFIX = ".idx"
+
+# members 列表中各字段的下标
+MEMBER_ARCNAME = 0
+MEMBER_HEADER_OFFSET = 1
+MEMBER_DATA_OFFSET = 2
+MEMBER_SIZE = 3
+MEMBER_MTIME = 4
+MEMBER_CHECKSUM = 5
+
+
+def get_archive_index_path(archive_path) -> Path:
+    """返回压缩包对应的索引文件路径"""
+    archive_path = Path(archive_path)
+    return archive_path.with_name(archive_path.name + ARCHIVE_INDEX_SUFFIX)
+
+
+def _archive_format(archive_name: str) -> str:
+    name = archive_name.lower()
+    if name.endswith('.tar.zst'):
+        return 'tar.zst'
+    if name.endswith('.tar.gz'):
+        return 'tar.gz'
+    if name.endswith('.tar'):
+        return 'tar'
+    return Path(name).suffix.lstrip('.')
+
+
+class ArchiveIndex:
+    """压缩包成员索引（在压缩线程中构建，压缩完成后写入索引文件）"""
+
+    def __init__(self):
+        self.members: List[List[Any]] = []
+        self.frames: List[List[int]] = []
+        self.tar_size: int = 0
+
+    def record_member(self, tar: tarfile.TarFile, header_offset: int, checksum: Optional[str] = None):
+        """记录刚通过 tar.add() 写入的成员
+
+        Args:
+            tar: 正在写入的 TarFile 对象
+            header_offset: 调用 tar.add() 之前的 tar.offset（即该成员头部的偏移）
+            checksum: 成员内容校验和（可选）
+        """
+        if not tar.members or tar.offset <= header_offset:
+            return
+        tarinfo = tar.members[-1]
+        if not tarinfo.isfile():
+            return
+        # 数据区按 512 字节对齐，数据起始偏移 = 写入后偏移 - 对齐后的数据长度
+        blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+        padded_size = (blocks + (1 if remainder else 0)) * tarfile.BLOCKSIZE
+        data_offset = tar.offset - padded_size
+        self.members.append([
+            tarinfo.name,
+            header_offset,
+            data_offset,
+            tarinfo.size,
+            int(tarinfo.mtime),
+            checksum,
+        ])
+        self.tar_size = tar.offset
+
+    def set_member_checksum(self, checksum: Optional[str]):
+        """为最近记录的成员补充校验和"""
+        if self.members:
+            self.members[-1][MEMBER_CHECKSUM] = checksum
+
+    def add_frame(self, compressed_offset: int, compressed_size: int,
+                  decompressed_offset: int, decompressed_size: int):
+        """记录一个 zstd 帧的边界"""
+        self.frames.append([compressed_offset, compressed_size, decompressed_offset, decompressed_size])
+
+    def to_dict(self, archive_path: Path) -> Dict[str, Any]:
+        return {
+            'version': ARCHIVE_INDEX_VERSION,
+            'archive': archive_path.name,
+            'format': _archive_format(archive_path.name),
+            'tar_size': self.tar_size,
+            'members': self.members,
+            'frames': self.frames,
+        }
+
+    def write(self, archive_path) -> Optional[Path]:
+        """把索引写到压缩包旁边，返回索引文件路径（失败返回 None，不影响备份）"""
+        archive_path = Path(archive_path)
+        if not self.members:
+            return None
+        index_path = get_archive_index_path(archive_path)
+        temp_path = index_path.with_name(index_path.name + '.tmp')
+        try:
+            payload = json.dumps(self.to_dict(archive_path), ensure_ascii=False, separators=(',', ':'))
+            with gzip.open(temp_path, 'wb', compresslevel=6) as fh:
+                fh.write(payload.encode('utf-8'))
+            temp_path.replace(index_path)
+            logger.info(f"[压缩包索引] 已写入索引: {index_path.name} ({len(self.members)} 个成员, {len(self.frames)} 个帧)")
+            return index_path
+        except Exception as e:
+            logger.warning(f"[压缩包索引] 写入索引失败（不影响备份）: {index_path}, 错误: {str(e)}")
+            try:
+                if temp_path.exists():
+                    temp_path.unlink()
+            except OSError:
+                pass
+            return None
+
+
+def load_archive_index(archive_path) -> Optional[Dict[str, Any]]:
+    """读取压缩包旁边的索引文件，不存在或格式不兼容时返回 None"""
+    index_path = get_archive_index_path(archive_path)
+    try:
+        if not index_path.is_file():
+            return None
+        with gzip.open(index_path, 'rb') as fh:
+            data = json.loads(fh.read().decode('utf-8'))
+        if not isinstance(data, dict) or data.get('version') != ARCHIVE_INDEX_VERSION:
+            logger.warning(f"[压缩包索引] 不支持的索引版本: {index_path}")
+            return None
+        return data
+    except Exception as e:
+        logger.warning(f"[压缩包索引] 读取索引失败: {index_path}, 错误: {str(e)}")
+        return None
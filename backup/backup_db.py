@@ -11,7 +11,7 @@ import json
 import re
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from models.backup import BackupTask, BackupSet, BackupFile, BackupTaskStatus, BackupFileType, BackupSetStatus
 from utils.datetime_utils import now, format_datetime
@@ -20,6 +20,8 @@ from backup.queued_files_optimizer import (
     verify_files_queued_optimized,
     ensure_index_exists
 )
+from backup.scan_readiness import notify_files_written
+from backup.bulk_loader import use_copy_protocol, copy_backup_files, record_copy_failure
 
 logger = logging.getLogger(__name__)
 
@@ -111,6 +113,12 @@ class BatchDBWriter:
         
         # 直接调用 _process_batch，不使用队列，同步等待写入完成
         await self._process_batch(file_batch)
+        # 上报就绪水位（扫描 → 压缩 交接）
+        notify_files_written(
+            self.backup_set_db_id,
+            len(file_batch),
+            sum(f.get('size', 0) or 0 for f in file_batch)
+        )
 
     async def _batch_worker(self):
         """批量写入worker"""
@@ -803,6 +811,15 @@ class BatchDBWriter:
             sample_backup_set_id = insert_data[0][0]
             table_name = await get_backup_files_table_by_set_id(conn, sample_backup_set_id)
 
+            # 优先使用 COPY FROM STDIN 整批写入，失败时回退到下面的 executemany
+            if use_copy_protocol():
+                try:
+                    await copy_backup_files(conn, table_name, insert_data)
+                    logger.info(f"[批量插入] ✅ openGauss模式下 COPY 批量写入成功：{len(insert_data)} 个文件")
+                    return
+                except Exception as copy_error:
+                    record_copy_failure(copy_error)
+
             while retry_count < max_retries and not insert_success:
                 try:
                     # 开始新事务
@@ -1327,6 +1344,10 @@ class BackupDB:
                                 logger.error(f"finalize_backup_set: ❌ 连接处于错误状态，回滚事务")
                                 await actual_conn.rollback()
                                 raise Exception("连接处于错误状态")
+
+                        # 在后台物化备份集目录树（恢复浏览按目录分页查询）
+                        from backup.directory_tree_index import schedule_directory_tree
+                        schedule_directory_tree(getattr(backup_set, 'id', None))
                     except Exception as db_error:
                         # 异常时显式回滚，避免长事务锁表
                         logger.error(f"finalize_backup_set: 数据库操作失败: {str(db_error)}", exc_info=True)
@@ -1538,6 +1559,10 @@ class BackupDB:
             logger.debug("mark_files_as_queued: 所有文件组都为空，跳过标记文件为已入队")
             return
         
+        if all(file_info.get('claimed') for file_group in file_groups for file_info in file_group):
+            logger.debug("mark_files_as_queued: 文件组已在装箱认领时标记为已入队，跳过")
+            return
+        
         backup_set_db_id = getattr(backup_set, 'id', None)
         if not backup_set_db_id:
             logger.info(f"[mark_files_as_queued] ❌ 无法获取 backup_set.id，跳过文件状态更新")
@@ -1796,6 +1821,7 @@ class BackupDB:
                         logger.error(f"mark_files_as_copied: ❌ 连接处于错误状态，回滚事务")
                         await actual_conn.rollback()
                         raise Exception("连接处于错误状态")
+
                         
             except Exception as e:
                 # 异常时显式回滚，避免长事务锁表
@@ -2175,6 +2201,11 @@ class BackupDB:
             logger.info("[fetch_pending_files_grouped_by_size] 当前仅支持 openGauss，返回空结果")
             return []
 
+        if str(getattr(get_settings(), 'COMPRESSION_GROUPING_MODE', 'legacy')).lower() == 'claim':
+            return await self._claim_pending_file_group(
+                backup_set_db_id, max_file_size, backup_task_id, should_wait_if_small, start_from_id
+            )
+
         # 获取重试计数（如果没有backup_task_id则使用0）
         retry_count = 0
         max_retries = 6
@@ -3259,6 +3290,61 @@ class BackupDB:
         
         return ([current_group], final_last_processed_id)
 
+    async def _claim_pending_file_group(
+        self,
+        backup_set_db_id: int,
+        max_file_size: int,
+        backup_task_id: int = None,
+        should_wait_if_small: bool = True,
+        start_from_id: int = 0
+    ) -> Tuple[List[List[Dict]], int]:
+        """服务端装箱并原子认领一个文件组（COMPRESSION_GROUPING_MODE = "claim"）
+
+        返回格式与 fetch_pending_files_grouped_by_size 相同；认领的文件已标记 is_copy_success = TRUE，
+        多个压缩工作者并发调用不会拿到同一文件，start_from_id 仅用于无结果时原样返回。
+        """
+        from utils.scheduler.db_utils import get_opengauss_connection, get_backup_files_table_by_set_id
+        from backup.group_packer import claim_pending_group
+        from config.settings import get_settings
+
+        settings = get_settings()
+        scan_status = None
+        if backup_task_id:
+            scan_status = await self.get_scan_status(backup_task_id)
+            if scan_status not in ('retrieving', 'completed'):
+                logger.info(f"[分组装箱] 标记检索状态为开始检索（backup_task_id={backup_task_id}，当前状态={scan_status}）")
+                await self.update_scan_status(backup_task_id, 'retrieving')
+                scan_status = 'retrieving'
+
+        try:
+            async with get_opengauss_connection() as conn:
+                table_name = await get_backup_files_table_by_set_id(conn, backup_set_db_id)
+                group, _ = await claim_pending_group(
+                    conn,
+                    table_name,
+                    backup_set_db_id,
+                    max_file_size,
+                    allow_partial=(not should_wait_if_small) or scan_status == 'completed',
+                    window_files=getattr(settings, 'COMPRESSION_PACK_WINDOW_FILES', 200000),
+                    window_factor=getattr(settings, 'COMPRESSION_PACK_WINDOW_FACTOR', 2.0),
+                    policy=str(getattr(settings, 'COMPRESSION_GROUPING_POLICY', 'size')).lower(),
+                )
+        except Exception as e:
+            error_msg = str(e)
+            if "does not exist" in error_msg.lower() or "UndefinedTable" in type(e).__name__:
+                logger.info(f"[分组装箱] backup_files 表不存在，返回空结果（可能是数据库未初始化）: {error_msg}")
+            else:
+                logger.warning(f"[分组装箱] 装箱认领文件组失败，返回空结果: {error_msg}", exc_info=True)
+            return ([], start_from_id)
+
+        if not group:
+            return ([], start_from_id)
+
+        if backup_task_id and scan_status == 'retrieving':
+            logger.info(f"[分组装箱] 标记检索状态为完成（backup_task_id={backup_task_id}）")
+            await self.update_scan_status(backup_task_id, 'completed')
+        return ([group], max(file_info['id'] for file_info in group))
+
     async def get_scan_status(self, backup_task_id: int) -> Optional[str]:
         """获取扫描状态"""
         from utils.scheduler.db_utils import is_opengauss, get_opengauss_connection
@@ -3376,6 +3462,8 @@ class BackupDB:
         per_file_compressed_size = per_file_compressed_size // len(processed_files) if processed_files else 0
         is_compressed = compressed_file.get('compression_enabled', True)
         checksum = compressed_file.get('checksum')
+        file_checksums = compressed_file.get('file_checksums') or {}  # 压缩时计算的每个文件内容校验和
+        file_references = compressed_file.get('file_references') or {}  # 内容去重命中的文件 {file_path: dedup_ref}，数据在其他备份集的压缩包中
         copy_time = datetime.now()
 
         # 批量查询已存在的文件
@@ -3579,6 +3667,10 @@ class BackupDB:
                     'chunk_number': chunk_number,
                     'original_path': file_path
                 })
+                dedup_ref = file_references.get(file_path)
+                if dedup_ref:
+                    metadata['tape_file_path'] = dedup_ref['tape_file_path']
+                    metadata['dedup_ref'] = dedup_ref
                 
                 # 确保 metadata_json 是有效的 JSON 字符串
                 try:
@@ -3596,7 +3688,7 @@ class BackupDB:
                         file_id,
                         per_file_compressed_size,
                         is_compressed,
-                        checksum,
+                        file_checksums.get(file_path, checksum),
                         backup_time,
                         chunk_number,
                         0,
@@ -3609,7 +3701,7 @@ class BackupDB:
                         file_path,  # 使用 file_path 而不是 id
                         per_file_compressed_size,
                         is_compressed,
-                        checksum,
+                        file_checksums.get(file_path, checksum),
                         backup_time,
                         chunk_number,
                         0,
@@ -3630,7 +3722,7 @@ class BackupDB:
                         datetime.fromtimestamp(file_stat.st_mtime) if file_stat else None,
                         datetime.fromtimestamp(file_stat.st_atime) if file_stat else None,
                         is_compressed,
-                        checksum,
+                        file_checksums.get(file_path, checksum),
                         backup_time,
                         chunk_number,
                         0,
@@ -49,6 +49,13 @@ from backup.backup_scanner import BackupScanner
 from backup.backup_task_manager import BackupTaskManager
 from backup.final_dir_monitor import FinalDirMonitor
 from backup.compression_worker import CompressionWorker
+from backup.scan_readiness import create_scan_readiness, release_scan_readiness
+from backup.file_state_catalog import ChangeDetector
+from backup.dir_state_catalog import DirScanCache
+from backup.dedup_index import DedupSession
+from backup.backup_files_lifecycle import schedule_index_build, schedule_archive
+from backup.directory_tree_index import schedule_directory_tree
+from backup.tape_throughput_governor import get_tape_governor
 
 logger = logging.getLogger(__name__)
 
@@ -133,13 +140,13 @@ class BackupEngine:
             for temp_dir in temp_dirs:
                 Path(temp_dir).mkdir(parents=True, exist_ok=True)
             
-            # 初始化Final目录监控器（独立线程，10秒轮询扫描）
+            # 初始化Final目录监控器（独立线程，消费待写磁带就绪队列）
             self.final_dir_monitor = FinalDirMonitor(
                 tape_handler=self.tape_handler,
                 settings=self.settings
             )
             self.final_dir_monitor.start()
-            logger.info("Final目录监控器已启动（独立线程，10秒轮询扫描）")
+            logger.info("Final目录监控器已启动（独立线程，就绪队列模式）")
 
             self._initialized = True
             logger.info("备份引擎初始化完成")
@@ -507,6 +514,8 @@ class BackupEngine:
                             )
                             
                             if format_success:
+                                # 磁带上原有的压缩包已不存在（去重索引据此移除该磁带的内容）
+                                backup_task.tape_formatted = True
                                 # 格式化完成，确保进度为100%
                                 backup_task.progress_percent = 100.0
                                 await self.backup_db.update_scan_progress(backup_task, 1, 1)
@@ -1259,6 +1268,34 @@ class BackupEngine:
                     "[扫描文件中] 正在扫描源路径..."
                 )
 
+                # 扫描就绪信号：写入的待压缩字节数达到水位线（约一个压缩组）或扫描结束时立即启动压缩
+                ready_threshold = getattr(self.settings, "SCAN_READY_THRESHOLD_BYTES", 0) or self.settings.MAX_FILE_SIZE
+                scan_readiness = create_scan_readiness(backup_set.id, ready_threshold)
+                backup_task.scan_to_first_group_seconds = None
+
+                # 增量/差异备份变更检测：扫描器只把新增或变化的文件写入 backup_files
+                backup_task.change_detector = None
+                try:
+                    backup_task.change_detector = ChangeDetector.from_task(backup_task, backup_set, self.settings)
+                except Exception as catalog_error:
+                    logger.warning(f"[变更检测] 打开文件状态目录失败，本次备份全部文件: {str(catalog_error)}")
+
+                # 目录状态缓存（SCAN_TRUST_DIR_MTIME）：增量/差异备份复用 mtime 未变化目录的上次列表
+                backup_task.dir_cache = None
+                try:
+                    backup_task.dir_cache = DirScanCache.from_task(
+                        backup_task, backup_set, self.settings, exclude_patterns=exclude_patterns
+                    )
+                except Exception as dir_cache_error:
+                    logger.warning(f"[目录状态] 打开目录状态目录失败，本次完整扫描: {str(dir_cache_error)}")
+
+                # 跨备份集内容去重：压缩器跳过内容已在保留磁带上的文件，只记录引用
+                backup_task.dedup_session = None
+                try:
+                    backup_task.dedup_session = DedupSession.from_task(backup_task, backup_set, self.settings)
+                except Exception as dedup_error:
+                    logger.warning(f"[内容去重] 打开去重索引失败，本次不去重: {str(dedup_error)}")
+
                 scan_progress_task = asyncio.create_task(
                     self.backup_scanner.scan_for_progress_update(
                         backup_task,
@@ -1268,10 +1305,26 @@ class BackupEngine:
                         restart=restart_scan
                     )
                 )
+                # 扫描任务结束（无论成功、失败还是取消）都视为就绪，避免压缩端空等
+                scan_progress_task.add_done_callback(lambda _task: scan_readiness.mark_finished())
+                # 扫描成功结束后在后台为分表创建二级索引（写入期间只有主键）
+                scan_progress_task.add_done_callback(
+                    lambda _task: None if _task.cancelled() or _task.exception() is not None
+                    else schedule_index_build(getattr(backup_set, 'id', None))
+                )
                 logger.info("后台扫描任务已启动")
+                # SCAN_WAIT_TIMEOUT 仅作为最长等待时间
                 scan_wait_timeout = getattr(self.settings, "SCAN_WAIT_TIMEOUT", 300) or 300
-                logger.info(f"等待后台扫描写入文件记录（{scan_wait_timeout}秒）...")
-                await asyncio.sleep(scan_wait_timeout)
+                logger.info(
+                    f"等待后台扫描写入文件记录（水位线 {format_bytes(ready_threshold)}，"
+                    f"最长 {scan_wait_timeout} 秒）..."
+                )
+                ready_reason = await scan_readiness.wait_ready(timeout=scan_wait_timeout)
+                logger.info(
+                    f"扫描就绪（原因: {ready_reason}），已写入 {scan_readiness.pending_files} 个文件 "
+                    f"({format_bytes(scan_readiness.pending_bytes)})，"
+                    f"等待 {time.time() - scan_readiness.scan_started_at:.1f} 秒，开始压缩"
+                )
             else:
                 logger.info("扫描状态为 completed，跳过扫描阶段")
             
@@ -1381,17 +1434,29 @@ class BackupEngine:
                 # 注意：不再需要file_move_worker，FinalDirMonitor独立运行
                 if file_group_prefetcher:
                     await file_group_prefetcher.stop()
+                release_scan_readiness(backup_set.id)
             
             # 压缩完成日志：换行输出，与其他日志有明显差异
             logger.info("=" * 80)
             logger.info("[备份引擎] ========== 数据库压缩完成 ==========")
             logger.info(f"  处理文件组数: {compression_worker.group_idx}")
+            scan_to_first_group = getattr(backup_task, 'scan_to_first_group_seconds', None)
+            if scan_to_first_group is not None:
+                logger.info(f"  扫描开始→首个压缩组完成: {scan_to_first_group:.1f} 秒")
             logger.info(f"  处理文件数: {compression_worker.processed_files:,} 个文件")
             logger.info(f"  原始总大小: {format_bytes(compression_worker.total_original_size)}")
             logger.info(f"  压缩后总大小: {format_bytes(total_size)}")
             if compression_worker.total_original_size > 0:
                 compression_ratio = (1 - total_size / compression_worker.total_original_size) * 100
                 logger.info(f"  压缩率: {compression_ratio:.2f}%")
+            tape_governor = get_tape_governor(self.settings)
+            if tape_governor is not None and tape_governor.total_bytes > 0:
+                tape_stats = tape_governor.get_stats()
+                logger.info(
+                    f"  磁带写入: 累计 {format_bytes(tape_stats['total_bytes'])}, "
+                    f"低于最低流式速度 {tape_stats['starved_seconds']} 秒, "
+                    f"压缩端等待 {tape_stats['producer_stalls']} 次, 写入端等待 {tape_stats['consumer_stalls']} 次"
+                )
             logger.info("=" * 80)
 
             # 等待所有文件移动到final目录（检查final目录是否为空）
@@ -1410,8 +1475,8 @@ class BackupEngine:
                         final_move_completed = True
                         break
                     
-                    remaining_files = self.final_dir_monitor.get_processed_count()
-                    logger.info(f"[备份引擎] final目录仍有文件，等待移动完成... (已处理: {remaining_files} 个文件)")
+                    processed_files = self.final_dir_monitor.get_processed_count()
+                    logger.info(f"[备份引擎] final目录仍有文件，等待移动完成... (已处理: {processed_files} 个文件)")
                     await asyncio.sleep(check_interval)
                     wait_count += 1
                 
@@ -1462,6 +1527,34 @@ class BackupEngine:
                 backup_task.status = BackupTaskStatus.COMPLETED
                 await self.backup_db.update_task_status(backup_task, BackupTaskStatus.COMPLETED)
                 
+                # 备份成功后才把本次文件状态合并到文件状态目录（供下次增量/差异备份比较）
+                change_detector = getattr(backup_task, 'change_detector', None)
+                if change_detector:
+                    try:
+                        change_detector.commit()
+                    except Exception as catalog_error:
+                        logger.error(f"[变更检测] 更新文件状态目录失败: {str(catalog_error)}", exc_info=True)
+
+                dir_cache = getattr(backup_task, 'dir_cache', None)
+                if dir_cache:
+                    try:
+                        dir_cache.commit()
+                    except Exception as dir_cache_error:
+                        logger.error(f"[目录状态] 更新目录状态目录失败: {str(dir_cache_error)}", exc_info=True)
+
+                # 备份成功后才让本次登记的内容/引用生效（被引用的磁带在引用到期前不会被自动擦除）
+                dedup_session = getattr(backup_task, 'dedup_session', None)
+                if dedup_session:
+                    try:
+                        dedup_session.commit()
+                    except Exception as dedup_error:
+                        logger.error(f"[内容去重] 更新去重索引失败: {str(dedup_error)}", exc_info=True)
+
+                # 备份集文件记录移入按月归档表（后台执行，失败时记录保留在原分表）
+                schedule_archive(getattr(backup_set, 'id', None))
+                # 归档结束后在后台物化备份集目录树（恢复浏览按目录分页查询）
+                schedule_directory_tree(getattr(backup_set, 'id', None))
+                
                 # 更新操作状态
                 await self.backup_db.update_scan_progress(
                     backup_task, 
@@ -1610,6 +1703,33 @@ class BackupEngine:
                     logger.error(f"清理后台扫描任务失败: {str(cleanup_error)}")
                 finally:
                     logger.info("后台扫描任务清理完成")
+            
+            # 未成功完成的备份丢弃暂存的文件状态（已提交的不受影响），并关闭文件状态目录
+            change_detector = getattr(backup_task, 'change_detector', None) if backup_task else None
+            if change_detector:
+                try:
+                    change_detector.discard()
+                    change_detector.close()
+                except Exception as catalog_error:
+                    logger.warning(f"[变更检测] 关闭文件状态目录失败: {str(catalog_error)}")
+                backup_task.change_detector = None
+
+            dir_cache = getattr(backup_task, 'dir_cache', None) if backup_task else None
+            if dir_cache:
+                try:
+                    dir_cache.discard()
+                    dir_cache.close()
+                except Exception as dir_cache_error:
+                    logger.warning(f"[目录状态] 关闭目录状态目录失败: {str(dir_cache_error)}")
+                backup_task.dir_cache = None
+
+            dedup_session = getattr(backup_task, 'dedup_session', None) if backup_task else None
+            if dedup_session:
+                try:
+                    dedup_session.discard()
+                except Exception as dedup_error:
+                    logger.warning(f"[内容去重] 丢弃暂存的去重数据失败: {str(dedup_error)}")
+                backup_task.dedup_session = None
 
     async def get_task_status(self, task_id: int) -> Optional[Dict]:
         """获取任务状态 - 委托给 BackupTaskManager"""
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+backup_files 分表生命周期模块
+Backup Files Table Lifecycle Module
+
+多表方案中每个执行任务有自己的 backup_files_{任务ID} 分表（LIKE backup_files_template，只有主键）。
+本模块管理分表从写入到归档的生命周期：
+1. 扫描写入期间不建二级索引（只有主键；压缩标记入队时按需创建 (backup_set_id, file_path) 索引）
+2. 扫描结束后用 CREATE INDEX CONCURRENTLY 建立二级索引（不阻塞压缩阶段的读写），失败时回退普通建索引
+3. 备份成功后把备份集的文件记录移入按月归档表 backup_files_archive_YYYYMM（按 backup_sets.backup_group），
+   在 backup_files_archive_sets 登记归档位置，分表中不再有其他备份集时删除分表；
+   get_backup_files_table_by_set_id 优先返回归档表，浏览/恢复查询只访问该备份集所在月份的一张表
+
+openGauss 不支持把 UNLOGGED 表改回普通表，因此写入期间不使用 UNLOGGED 表（归档后的记录必须可靠持久化）。
+"""
+
+import asyncio
+import logging
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from config.settings import get_settings
+from backup.bulk_loader import affected_rows, psycopg_connection, rollback_quietly
+from utils.scheduler.db_utils import (
+    is_opengauss, get_opengauss_connection, get_backup_files_table_by_set_id, invalidate_backup_files_table_cache
+)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_REGISTRY_TABLE = "backup_files_archive_sets"
+_TABLE_NAME_RE = re.compile(r"^backup_files_[0-9a-z_]+$")
+_BACKUP_GROUP_RE = re.compile(r"^(\d{4})-(\d{2})$")
+
+# backup_set_id -> 后台任务（索引创建 / 归档），保持引用避免被回收，归档前等待同一备份集的索引创建结束
+_background_tasks: Dict[int, asyncio.Task] = {}
+
+
+def _checked_table_name(table_name: str) -> str:
+    """表名只能通过受控字符串拼接进 SQL，拼接前校验"""
+    if not isinstance(table_name, str) or not _TABLE_NAME_RE.match(table_name) \
+            or table_name in ("backup_files_template", "backup_files_groups", ARCHIVE_REGISTRY_TABLE):
+        raise ValueError(f"非法的 backup_files 分表名: {table_name!r}")
+    return table_name
+
+
+def backup_files_index_definitions(table_name: str) -> List[Tuple[str, str]]:
+    """分表二级索引定义 [(索引名, ON 子句)]，与 DatabaseManager._create_indexes_for_backup_files 相同"""
+    return [
+        (
+            f"idx_{table_name}_set_path",
+            f"ON {table_name}(backup_set_id, file_path)",
+        ),
+        (
+            f"idx_{table_name}_set_copy_status",
+            f"ON {table_name}(backup_set_id, is_copy_success) "
+            f"WHERE is_copy_success = FALSE OR is_copy_success IS NULL",
+        ),
+        (
+            f"idx_{table_name}_set_copy_type_id",
+            f"ON {table_name}(backup_set_id, is_copy_success, file_type, id) "
+            f"WHERE (is_copy_success = FALSE OR is_copy_success IS NULL) AND file_type = 'file'::backupfiletype",
+        ),
+    ]
+
+
+def archive_table_name(backup_group: Optional[str], backup_time: Optional[datetime] = None) -> str:
+    """备份集所属月份的归档表名（backup_group 为 YYYY-MM，缺失时按备份时间）"""
+    match = _BACKUP_GROUP_RE.match(str(backup_group or ""))
+    if match:
+        return f"backup_files_archive_{match.group(1)}{match.group(2)}"
+    moment = backup_time or datetime.now()
+    return f"backup_files_archive_{moment:%Y%m}"
+
+
+async def _existing_indexes(conn, table_name: str) -> Dict[str, bool]:
+    """返回表上已存在的索引 {索引名: 是否有效}"""
+    rows = await conn.fetch(
+        """
+        SELECT c.relname AS index_name, i.indisvalid AS is_valid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_class t ON t.oid = i.indrelid
+        WHERE t.relname = $1
+        """,
+        table_name,
+    )
+    return {row["index_name"]: bool(row["is_valid"]) for row in rows or []}
+
+
+async def _set_autocommit(conn, autocommit: bool) -> bool:
+    """psycopg3 连接切换 autocommit（CREATE INDEX CONCURRENTLY 不能在事务中执行），asyncpg 本身不在事务中"""
+    raw_conn = psycopg_connection(conn)
+    if raw_conn is None:
+        return True
+    try:
+        if autocommit and raw_conn.info.transaction_status == 3:  # INERROR
+            await rollback_quietly(raw_conn)
+        elif autocommit and raw_conn.info.transaction_status != 0:
+            await raw_conn.commit()
+        await raw_conn.set_autocommit(autocommit)
+        return True
+    except Exception as e:
+        logger.debug(f"[分表生命周期] 切换 autocommit={autocommit} 失败: {e}")
+        return False
+
+
+async def build_backup_files_indexes(conn, table_name: str, concurrently: bool = True,
+                                     definitions: Optional[List[Tuple[str, str]]] = None) -> List[str]:
+    """为分表创建二级索引（已存在的有效索引跳过），返回新建的索引名
+
+    Args:
+        definitions: 索引定义 [(索引名, ON 子句)]，默认为 backup_files_index_definitions
+    """
+    table_name = _checked_table_name(table_name)
+    existing = await _existing_indexes(conn, table_name)
+    created = []
+    if definitions is None:
+        definitions = backup_files_index_definitions(table_name)
+    for index_name, on_clause in definitions:
+        if existing.get(index_name):
+            continue
+        if index_name in existing:
+            # 上次 CONCURRENTLY 失败留下的无效索引
+            await conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+        start_time = asyncio.get_running_loop().time()
+        built = False
+        if concurrently and await _set_autocommit(conn, True):
+            try:
+                await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} {on_clause}")
+                built = True
+            except Exception as e:
+                logger.warning(f"[分表生命周期] 并发创建索引 {index_name} 失败，改用普通方式: {e}")
+                await conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+            finally:
+                await _set_autocommit(conn, False)
+        if not built:
+            await conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} {on_clause}")
+        created.append(index_name)
+        logger.info(
+            f"[分表生命周期] 已创建索引 {index_name}，"
+            f"耗时 {asyncio.get_running_loop().time() - start_time:.1f} 秒"
+        )
+    return created
+
+
+async def ensure_archive_registry(conn):
+    """创建归档登记表（数据库初始化时也会创建）"""
+    await conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_REGISTRY_TABLE} (
+            backup_set_id BIGINT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            source_table TEXT,
+            file_count BIGINT DEFAULT 0,
+            archived_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """
+    )
+
+
+async def ensure_archive_table(conn, archive_table: str):
+    """创建月归档表及其索引（新表为空，直接建索引）"""
+    archive_table = _checked_table_name(archive_table)
+    await conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {archive_table} (LIKE backup_files_template INCLUDING ALL)"
+    )
+    for index_name, on_clause in backup_files_index_definitions(archive_table):
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} {on_clause}")
+    if getattr(get_settings(), "FILE_SEARCH_INDEX_ENABLED", True):
+        # 文件名搜索索引（跨备份集搜索按月表查询）
+        from backup.file_search_index import detect_substring_method, search_index_definitions
+        method = await detect_substring_method(conn)
+        for index_name, on_clause in search_index_definitions(archive_table, method):
+            await conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} {on_clause}")
+
+
+async def _table_columns(conn, table_name: str) -> List[str]:
+    rows = await conn.fetch(
+        """
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = $1
+        ORDER BY ordinal_position
+        """,
+        table_name,
+    )
+    return [row["column_name"] for row in rows or []]
+
+
+async def _run_in_transaction(conn, statements: List[Tuple[str, tuple]]) -> List:
+    """在一个事务中依次执行语句，返回各语句的影响行数"""
+    results = []
+    raw_conn = psycopg_connection(conn)
+    if raw_conn is None:
+        async with conn.transaction():
+            for sql, args in statements:
+                results.append(affected_rows(await conn.execute(sql, *args)))
+        return results
+
+    from utils.scheduler.psycopg3_compat import convert_asyncpg_to_psycopg3_query
+    if raw_conn.info.transaction_status == 3:  # INERROR
+        await rollback_quietly(raw_conn)
+    try:
+        async with raw_conn.cursor() as cur:
+            for sql, args in statements:
+                await cur.execute(convert_asyncpg_to_psycopg3_query(sql), args)
+                results.append(max(0, cur.rowcount))
+        await raw_conn.commit()
+    except Exception:
+        await rollback_quietly(raw_conn)
+        raise
+    return results
+
+
+async def archive_backup_set(conn, backup_set_id: int) -> Optional[str]:
+    """把备份集的文件记录移入月归档表，返回归档表名（已归档或无分表时返回 None）"""
+    row = await conn.fetchrow(
+        f"""
+        SELECT bs.backup_group, bs.backup_time, bs.backup_task_id, bt.backup_files_table,
+               a.table_name AS archive_table
+        FROM backup_sets bs
+        JOIN backup_tasks bt ON bs.backup_task_id = bt.id
+        LEFT JOIN {ARCHIVE_REGISTRY_TABLE} a ON a.backup_set_id = bs.id
+        WHERE bs.id = $1
+        """,
+        backup_set_id,
+    )
+    if not row or row.get("archive_table"):
+        return None
+    source_table = row.get("backup_files_table")
+    if not source_table or not _TABLE_NAME_RE.match(str(source_table)) \
+            or str(source_table).startswith("backup_files_archive_"):
+        return None
+    source_table = _checked_table_name(source_table)
+    archive_table = _checked_table_name(archive_table_name(row.get("backup_group"), row.get("backup_time")))
+
+    await ensure_archive_table(conn, archive_table)
+    archive_columns = set(await _table_columns(conn, archive_table))
+    columns = [column for column in await _table_columns(conn, source_table) if column in archive_columns]
+    if not columns:
+        logger.warning(f"[分表生命周期] 分表 {source_table} 不存在或没有可归档的列，跳过归档备份集 {backup_set_id}")
+        return None
+    column_sql = ", ".join(columns)
+
+    # 分表中只有本备份集时直接删除整张表，不逐行 DELETE
+    other_sets = await conn.fetchval(
+        f"SELECT 1 FROM {source_table} WHERE backup_set_id <> $1 LIMIT 1",
+        backup_set_id,
+    )
+    statements = [
+        (
+            f"INSERT INTO {archive_table} ({column_sql}) "
+            f"SELECT {column_sql} FROM {source_table} WHERE backup_set_id = $1",
+            (backup_set_id,),
+        ),
+        (
+            f"INSERT INTO {ARCHIVE_REGISTRY_TABLE} (backup_set_id, table_name, source_table, file_count) "
+            f"SELECT $1, $2, $3, COUNT(*) FROM {archive_table} WHERE backup_set_id = $1",
+            (backup_set_id, archive_table, source_table),
+        ),
+    ]
+    if other_sets:
+        statements.append((f"DELETE FROM {source_table} WHERE backup_set_id = $1", (backup_set_id,)))
+    else:
+        statements.append((f"DROP TABLE IF EXISTS {source_table}", ()))
+        statements.append((
+            "UPDATE backup_tasks SET backup_files_table = $1 WHERE id = $2",
+            (archive_table, row.get("backup_task_id")),
+        ))
+    results = await _run_in_transaction(conn, statements)
+    invalidate_backup_files_table_cache(backup_set_ids=[backup_set_id], task_ids=[row.get("backup_task_id")])
+    logger.info(
+        f"[分表生命周期] 备份集 {backup_set_id} 的 {results[0]:,} 条文件记录已从 {source_table} 归档到 {archive_table}"
+        + ("" if other_sets else f"，已删除空分表 {source_table}")
+    )
+    return archive_table
+
+
+def _track(backup_set_id: int, task: asyncio.Task):
+    _background_tasks[backup_set_id] = task
+
+    def _forget(done_task: asyncio.Task):
+        if _background_tasks.get(backup_set_id) is done_task:
+            _background_tasks.pop(backup_set_id, None)
+
+    task.add_done_callback(_forget)
+
+
+async def _build_indexes_for_set(backup_set_id: int):
+    try:
+        async with get_opengauss_connection() as conn:
+            table_name = await get_backup_files_table_by_set_id(conn, backup_set_id)
+            if table_name == "backup_files" or table_name.startswith("backup_files_archive_"):
+                return
+            created = await build_backup_files_indexes(conn, table_name)
+            if not getattr(get_settings(), "BACKUP_FILES_ARCHIVE_ENABLED", False):
+                # 不归档时文件记录留在分表，搜索索引也建在分表上（归档表创建时自带搜索索引）
+                from backup.file_search_index import build_search_indexes
+                created += await build_search_indexes(conn, table_name)
+            if created:
+                logger.info(f"[分表生命周期] 扫描结束，分表 {table_name} 已创建 {len(created)} 个二级索引")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"[分表生命周期] 扫描结束后创建分表索引失败（不影响备份）: {e}", exc_info=True)
+
+
+async def _archive_set(backup_set_id: int, previous: Optional[asyncio.Task]):
+    if previous is not None and not previous.done():
+        # 归档会删除分表，先等待同一备份集的索引创建结束
+        try:
+            await previous
+        except Exception:
+            pass
+    try:
+        async with get_opengauss_connection() as conn:
+            await archive_backup_set(conn, backup_set_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"[分表生命周期] 归档备份集 {backup_set_id} 的文件记录失败（记录保留在原分表）: {e}", exc_info=True)
+
+
+def schedule_index_build(backup_set_id: Optional[int]) -> Optional[asyncio.Task]:
+    """扫描结束后在后台为备份集所在分表创建二级索引（BACKUP_FILES_DEFER_INDEXES 关闭或非 openGauss 模式时不执行）"""
+    settings = get_settings()
+    if not backup_set_id or not is_opengauss() or not getattr(settings, "BACKUP_FILES_DEFER_INDEXES", False):
+        return None
+    task = asyncio.create_task(_build_indexes_for_set(backup_set_id))
+    _track(backup_set_id, task)
+    return task
+
+
+def schedule_archive(backup_set_id: Optional[int]) -> Optional[asyncio.Task]:
+    """备份成功后在后台归档备份集的文件记录（BACKUP_FILES_ARCHIVE_ENABLED 关闭或非 openGauss 模式时不执行）"""
+    settings = get_settings()
+    if not backup_set_id or not is_opengauss() or not getattr(settings, "BACKUP_FILES_ARCHIVE_ENABLED", False):
+        return None
+    task = asyncio.create_task(_archive_set(backup_set_id, _background_tasks.get(backup_set_id)))
+    _track(backup_set_id, task)
+    return task
@@ -13,10 +13,14 @@ import os
 import time
 from pathlib import Path
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timezone
 
 from models.backup import BackupTask, BackupSet
 from backup.utils import format_bytes
+from backup.scan_readiness import notify_files_written
+from backup.exclude_matcher import get_exclude_matcher
+from backup.parallel_dir_walker import (
+    ParallelDirWalker, ScanRecord, scan_record_from_path, scan_records_to_backup_files_rows
+)
 from config.settings import get_settings
 
 logger = logging.getLogger(__name__)
@@ -103,6 +107,8 @@ class BackupScanner:
             logger.warning(f"[后台扫描] 检测 openGauss 模式失败，回退到原有扫描逻辑: {e}")
 
         backup_set_db_id = getattr(backup_set, 'id', None)
+        # 变更检测器（增量/差异备份），由备份引擎按任务类型创建
+        change_detector = getattr(backup_task, 'change_detector', None) if backup_task else None
         logger.info(
             f"[后台扫描] 获取 backup_set_db_id: {backup_set_db_id}, "
             f"backup_set.id={backup_set.id if hasattr(backup_set, 'id') else 'N/A'}, "
@@ -240,6 +246,9 @@ class BackupScanner:
                         backup_task,
                         log_context="[后台扫描-ES]"
                     ):
+                        # 增量/差异备份：只保留新增或变化的文件
+                        if change_detector and file_batch:
+                            file_batch = change_detector.filter_batch(file_batch)
                         # ES扫描器返回的每个批次，直接全部写入内存数据库
                         if not file_batch:
                             continue
@@ -293,6 +302,11 @@ class BackupScanner:
                                         logger.debug(f"[Redis批量写入] 一次性写入 {batch_size} 个文件到数据库")
                                         try:
                                             await batch_writer._process_batch_redis(file_batch)
+                                            notify_files_written(
+                                                backup_set_db_id,
+                                                batch_size,
+                                                sum(f.get('size', 0) or 0 for f in file_batch)
+                                            )
                                             logger.info(f"[Redis批量写入] ✅ 已成功一次性写入 {batch_size} 个文件到数据库")
                                         except Exception as batch_error:
                                             logger.error(f"[Redis批量写入] ❌ 一次性写入失败: {str(batch_error)}", exc_info=True)
@@ -492,6 +506,9 @@ class BackupScanner:
                     batch_size=update_interval,  # 使用SCAN_UPDATE_INTERVAL作为批次大小
                     log_context="[后台扫描]"
                 ):
+                    # 增量/差异备份：只保留新增或变化的文件
+                    if change_detector and file_batch:
+                        file_batch = change_detector.filter_batch(file_batch)
                     # 从文件批次中提取当前正在扫描的目录（用于日志显示）
                     if file_batch:
                         # 从第一个文件的路径中提取当前目录
@@ -763,6 +780,8 @@ class BackupScanner:
             # 处理网络路径（UNC路径）
             from utils.network_path import is_unc_path, normalize_unc_path
             
+            # 排除规则编译一次：目录做完整检查，子条目只检查自身，被排除的目录不入队
+            exclude_matcher = get_exclude_matcher(exclude_patterns)
             for source_path_str in source_paths:
                 logger.info(f"后台扫描任务：扫描源路径 {source_path_str}")
                 
@@ -783,7 +802,7 @@ class BackupScanner:
                         # 单个文件
                         try:
                             # 检查是否应该排除
-                            if self.file_scanner.should_exclude_file(str(source_path), exclude_patterns):
+                            if exclude_matcher.excludes(str(source_path)):
                                 continue
                             
                             # 获取文件信息
@@ -810,7 +829,7 @@ class BackupScanner:
                         logger.info(f"后台扫描任务：扫描目录 {source_path_str}")
                         
                         # 检查目录本身是否应该排除
-                        if self.file_scanner.should_exclude_file(str(source_path), exclude_patterns):
+                        if exclude_matcher.excludes(str(source_path)):
                             logger.info(f"后台扫描任务：目录匹配排除规则，跳过整个目录: {source_path_str}")
                             continue
                         
@@ -939,6 +958,9 @@ class BackupScanner:
                                                 continue
                                             
                                             scanned_dirs.add(current_scan_dir_str)
+                                            # 解析后的路径可能与源路径不同（符号链接），目录本身做一次完整检查
+                                            if exclude_matcher.excludes(current_scan_dir_str):
+                                                continue
                                             current_dir = current_scan_dir_str
                                             dir_count += 1
                                             
@@ -985,7 +1007,7 @@ class BackupScanner:
                                                                 continue
                                                             
                                                             # 检查是否应该排除
-                                                            if current_path_str and self.file_scanner.should_exclude_file(current_path_str, exclude_patterns):
+                                                            if current_path_str and exclude_matcher.excludes_child(current_path_str):
                                                                 continue
                                                             
                                                             # 处理目录和文件
@@ -1501,6 +1523,12 @@ class BackupScanner:
                                                 batch_files, batch_bytes = item
                                                 file_info_batch = []
                                             
+                                            # 增量/差异备份：只保留新增或变化的文件
+                                            if change_detector and file_info_batch:
+                                                file_info_batch = change_detector.filter_batch(file_info_batch)
+                                                batch_files = len(file_info_batch)
+                                                batch_bytes = sum(f.get('size', 0) or 0 for f in file_info_batch)
+                                            
                                             # 写入文件信息到数据库（如果有）
                                             if file_info_batch and backup_set_db_id:
                                                 try:
@@ -1683,7 +1711,7 @@ class BackupScanner:
     ):
         """
         openGauss 模式下的简化扫描任务：
-        - 直接使用 os.scandir + FileScanner 扫描文件系统
+        - 使用 ParallelDirWalker（os.scandir 工作线程池）扫描文件系统
         - 参考 tests/test_scan_direct_write.py 的实现
         - 按批次直接批量写入 openGauss 的 backup_files 表（不使用内存数据库）
         - 定期更新 backup_task.total_files / total_bytes 和任务阶段描述
@@ -1692,6 +1720,8 @@ class BackupScanner:
         from utils.scheduler.db_utils import get_opengauss_connection
 
         backup_set_db_id = getattr(backup_set, "id", None)
+        # 变更检测器（增量/差异备份），由备份引擎按任务类型创建
+        change_detector = getattr(backup_task, "change_detector", None) if backup_task else None
         logger.info(
             f"[后台扫描-openGauss直写] backup_task_id={getattr(backup_task, 'id', 'N/A')}, "
             f"backup_set_id={backup_set_db_id}, source_paths={source_paths}, exclude_patterns={exclude_patterns}"
@@ -1735,6 +1765,14 @@ class BackupScanner:
             "symlinks_skipped": 0,  # 跳过的符号链接数
             "start_time": time.time(),
         }
+        # 排除规则编译一次：目录出队时完整检查，子条目只检查自身，被排除的目录不入队
+        exclude_matcher = get_exclude_matcher(exclude_patterns)
+        walker = ParallelDirWalker(
+            batch_size=getattr(self.settings, "SCAN_UPDATE_INTERVAL", 1000) or 1000,
+            exclude_matcher=exclude_matcher,
+            context_prefix="[后台扫描-openGauss直写]",
+            dir_cache=getattr(backup_task, 'dir_cache', None)
+        )
 
         # 优化：从内存获取分表名（backup_task.backup_files_table），避免查询数据库
         table_name = None
@@ -1762,7 +1800,7 @@ class BackupScanner:
 
         # 批次相关：沿用 SCAN_UPDATE_INTERVAL 作为批次大小
         batch_size = getattr(self.settings, "SCAN_UPDATE_INTERVAL", 1000) or 1000
-        current_batch: List[Dict[str, Any]] = []
+        current_batch: List[ScanRecord] = []  # 扫描记录，写入时整批转换为数据元组
         batch_number = 0
 
         # 进度输出相关（仅日志，不再写入数据库）
@@ -1790,21 +1828,14 @@ class BackupScanner:
                     current_batch = []
                     return
 
-                insert_data = []
-                for file_info in current_batch:
-                    try:
-                        data_tuple = self._prepare_insert_data_for_backup_files(file_info, backup_set_db_id)
-                        insert_data.append(data_tuple)
-                    except Exception as e:
-                        file_path = file_info.get("path", "unknown")
-                        logger.warning(
-                            f"[后台扫描-openGauss直写] 准备插入数据失败: {file_path[:200]}, 错误: {e}"
-                        )
-                        stats["total_failed"] += 1
+                # 增量/差异备份：只写入新增或变化的文件
+                if change_detector:
+                    current_batch = change_detector.filter_batch(current_batch)
+                    if not current_batch:
+                        return
 
-                if not insert_data:
-                    current_batch = []
-                    return
+                # 在数据库边界整批把扫描记录转换为数据元组（不经过 file_info 字典）
+                insert_data = scan_records_to_backup_files_rows(current_batch, backup_set_db_id)
 
                 # 批量插入 backup_files_*（使用复用的连接，短事务，避免长事务锁表）
                 try:
@@ -1847,10 +1878,11 @@ class BackupScanner:
                     written = len(insert_data)
                     stats["total_written"] += written
                     # 统计写入的总字节数（只统计成功写入的文件）
-                    stats["total_bytes"] += sum(
-                        (fi.get("size", 0) or 0) for fi in current_batch[:written]
-                    )
+                    written_bytes = sum(record.size for record in current_batch[:written])
+                    stats["total_bytes"] += written_bytes
                     batch_number += 1
+                    # 上报就绪水位，压缩流程可以提前开始
+                    notify_files_written(backup_set_db_id, written, written_bytes)
 
                     # 更新内存中的任务对象统计信息（供 UI 使用，基于实际写入成功的文件数）
                     if backup_task:
@@ -1959,17 +1991,13 @@ class BackupScanner:
                 # 单个文件
                 if source_path.is_file():
                     try:
-                        if self.file_scanner.should_exclude_file(
-                            str(source_path), exclude_patterns
-                        ):
+                        if exclude_matcher.excludes(str(source_path)):
                             stats["excluded_count"] += 1
                             continue
-                        file_info = await self.file_scanner.get_file_info(source_path)
-                        if file_info:
-                            current_batch.append(file_info)
-                            stats["total_scanned"] += 1
-                            if len(current_batch) >= batch_size:
-                                await flush_batch(str(source_path))
+                        current_batch.append(scan_record_from_path(source_path))
+                        stats["total_scanned"] += 1
+                        if len(current_batch) >= batch_size:
+                            await flush_batch(str(source_path))
                     except Exception as e:
                         logger.warning(
                             f"[后台扫描-openGauss直写] 处理单个文件失败: {source_path_str}, 错误: {e}"
@@ -1979,90 +2007,28 @@ class BackupScanner:
                     # 单个文件处理完成，直接继续下一个源路径（不做额外数据库统计，以提高性能）
                     continue
 
-                # 目录：使用 os.scandir 递归扫描
+                # 目录：使用 ParallelDirWalker 并行遍历（被排除的目录不会被列出）
                 if source_path.is_dir():
                     logger.info(
-                        f"[后台扫描-openGauss直写] 扫描目录: {source_path_str}（os.scandir 模式）"
+                        f"[后台扫描-openGauss直写] 扫描目录: {source_path_str}（并行遍历，线程数: {walker.workers}）"
                     )
 
                     # 检查目录本身是否被排除
-                    if self.file_scanner.should_exclude_file(
-                        str(source_path), exclude_patterns
-                    ):
+                    if exclude_matcher.excludes(str(source_path)):
                         logger.info(
                             f"[后台扫描-openGauss直写] 目录匹配排除规则，跳过整个目录: {source_path_str}"
                         )
                         stats["excluded_dirs"] += 1
                         continue
 
-                    dirs_to_scan = [source_path]
-                    scanned_dirs = set()
-
                     try:
-                        while dirs_to_scan:
-                            current_dir = dirs_to_scan.pop(0)
-                            current_dir_str = str(current_dir.resolve())
+                        async for records in walker.walk(source_path):
+                            for record in records:
+                                current_batch.append(record)
+                                stats["total_scanned"] += 1
 
-                            if current_dir_str in scanned_dirs:
-                                stats["dirs_skipped"] += 1
-                                continue
-                            scanned_dirs.add(current_dir_str)
-                            stats["dirs_scanned"] += 1
-
-                            # 检查目录排除
-                            if self.file_scanner.should_exclude_file(
-                                current_dir_str, exclude_patterns
-                            ):
-                                stats["excluded_dirs"] += 1
-                                continue
-
-                            try:
-                                with os.scandir(current_dir_str) as entries:
-                                    for entry in entries:
-                                        try:
-                                            entry_path = Path(entry.path)
-                                            entry_path_str = str(entry_path)
-
-                                            if self.file_scanner.should_exclude_file(
-                                                entry_path_str, exclude_patterns
-                                            ):
-                                                stats["excluded_count"] += 1
-                                                continue
-
-                                            # 目录：加入队列
-                                            if entry.is_dir(follow_symlinks=False):
-                                                dirs_to_scan.append(entry_path)
-                                                continue
-
-                                            # 文件：获取文件信息
-                                            if entry.is_file(follow_symlinks=False):
-                                                file_info = self.file_scanner.get_file_info_from_entry(
-                                                    entry
-                                                )
-                                                if file_info:
-                                                    current_batch.append(file_info)
-                                                    stats["total_scanned"] += 1
-
-                                                    if len(current_batch) >= batch_size:
-                                                        await flush_batch(current_dir_str)
-                                                else:
-                                                    stats["error_count"] += 1
-                                                continue
-
-                                            # 其他情况（符号链接等）简单跳过并计数
-                                            if entry.is_symlink():
-                                                stats["symlinks_skipped"] += 1
-                                            else:
-                                                stats["error_count"] += 1
-                                        except (PermissionError, OSError, FileNotFoundError):
-                                            stats["error_count"] += 1
-                                            continue
-                            except (PermissionError, OSError) as e:
-                                logger.warning(
-                                    f"[后台扫描-openGauss直写] 无法访问目录: {current_dir_str}, 错误: {e}"
-                                )
-                                stats["error_dirs"] += 1
-                                continue
+                                if len(current_batch) >= batch_size:
+                                    await flush_batch(source_path_str)
                     except Exception as e:
                         logger.warning(
                             f"[后台扫描-openGauss直写] 扫描目录失败: {source_path_str}, 错误: {e}"
@@ -2072,6 +2038,13 @@ class BackupScanner:
                     # 目录扫描完成后，直接继续下一个源路径（不做额外数据库统计，以提高性能）
                     continue
 
+            walk_stats = walker.stats
+            stats["dirs_scanned"] += walk_stats.dirs_scanned
+            stats["excluded_count"] += walk_stats.excluded_entries
+            stats["error_dirs"] += walk_stats.error_dirs
+            stats["error_count"] += walk_stats.error_entries
+            stats["symlinks_skipped"] += walk_stats.symlinks_skipped
+
             # 写入最后一个批次
             if current_batch:
                 logger.info(
@@ -2153,89 +2126,3 @@ class BackupScanner:
                     logger.debug("[后台扫描-openGauss直写] 已关闭数据库连接")
                 except Exception as e:
                     logger.warning(f"[后台扫描-openGauss直写] 关闭数据库连接失败: {e}")
-
-    def _prepare_insert_data_for_backup_files(
-        self, file_info: Dict[str, Any], backup_set_id: int
-    ) -> tuple:
-        """
-        为 openGauss 的 backup_files 表准备插入数据元组。
-        逻辑参考 MemoryDBWriter._prepare_insert_data_for_opengauss，保持字段一致性。
-        """
-        file_path = file_info.get("path", "")
-        file_name = file_info.get("name") or Path(file_path).name
-
-        # 目录路径
-        directory_path = (
-            str(Path(file_path).parent)
-            if file_path and Path(file_path).parent != Path(file_path).anchor
-            else None
-        )
-
-        display_name = file_name
-
-        # 文件类型
-        if file_info.get("is_file", True):
-            file_type = "file"
-        elif file_info.get("is_dir", False):
-            file_type = "directory"
-        elif file_info.get("is_symlink", False):
-            file_type = "symlink"
-        else:
-            file_type = "file"
-
-        file_size = file_info.get("size", 0) or 0
-        compressed_size = None
-        file_permissions = file_info.get("permissions")
-        file_owner = None
-        file_group = None
-
-        # 时间戳处理
-        modified_time = file_info.get("modified_time")
-        if isinstance(modified_time, datetime):
-            modified_time = modified_time.replace(tzinfo=timezone.utc)
-        else:
-            modified_time = datetime.now(timezone.utc)
-
-        created_time = modified_time
-        accessed_time = modified_time
-
-        tape_block_start = None
-        tape_block_count = None
-        compressed = False
-        encrypted = False
-        checksum = None
-        is_copy_success = False
-        copy_status_at = None
-
-        backup_time = datetime.now(timezone.utc)
-        chunk_number = None
-        version = 1
-
-        # 注意：file_metadata 和 tags 字段已从扫描阶段删除，压缩阶段会更新 file_metadata
-
-        return (
-            backup_set_id,
-            file_path,
-            file_name,
-            directory_path,
-            display_name,
-            file_type,
-            file_size,
-            compressed_size,
-            file_permissions,
-            file_owner,
-            file_group,
-            created_time,
-            modified_time,
-            accessed_time,
-            tape_block_start,
-            tape_block_count,
-            compressed,
-            encrypted,
-            checksum,
-            is_copy_success,
-            copy_status_at,
-            backup_time,
-            chunk_number,
-            version,
-        )
\ No newline at end of file
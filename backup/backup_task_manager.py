@@ -17,6 +17,7 @@ from pathlib import Path
 from config.database import get_db
 from config.settings import get_settings
 from models.backup import BackupTask, BackupTaskStatus, BackupTaskType
+from backup.tape_throughput_governor import get_tape_governor
 from utils.network_path import validate_network_path
 
 logger = logging.getLogger(__name__)
@@ -99,7 +100,9 @@ class BackupTaskManager:
             )
 
             # 保存到数据库 - 使用原生 openGauss / SQLite SQL
-            from utils.scheduler.db_utils import is_opengauss, get_opengauss_connection
+            from utils.scheduler.db_utils import (
+                is_opengauss, get_opengauss_connection, invalidate_backup_files_table_cache
+            )
             
             if is_opengauss():
                 # 使用连接池
@@ -158,6 +161,7 @@ class BackupTaskManager:
                         table_name,
                         task_id,
                     )
+                    invalidate_backup_files_table_cache(task_ids=[task_id])
                     
                     # 3. 为该任务创建物理表（基于 backup_files_template 结构）
                     # 注意：表名不能用参数占位符，只能通过受控字符串拼接
@@ -273,9 +277,11 @@ class BackupTaskManager:
                 in_memory_processed_bytes = None
                 in_memory_compressed_bytes = None
                 in_memory_scan_status = None
+                in_memory_scan_to_first_group = None
                 
                 # 1. 从 task_manager._current_task 获取
                 if self._current_task and self._current_task.id == task_id:
+                    in_memory_scan_to_first_group = getattr(self._current_task, 'scan_to_first_group_seconds', None)
                     in_memory_total_files = getattr(self._current_task, 'total_files', None)
                     in_memory_total_bytes = getattr(self._current_task, 'total_bytes', None)
                     in_memory_processed_files = getattr(self._current_task, 'processed_files', None)
@@ -305,6 +311,8 @@ class BackupTaskManager:
                                     in_memory_compressed_bytes = getattr(backup_engine._current_task, 'compressed_bytes', None)
                                 if in_memory_scan_status is None:
                                     in_memory_scan_status = getattr(backup_engine._current_task, 'scan_status', None)
+                                if in_memory_scan_to_first_group is None:
+                                    in_memory_scan_to_first_group = getattr(backup_engine._current_task, 'scan_to_first_group_seconds', None)
                     except Exception:
                         pass
                 
@@ -378,7 +386,9 @@ class BackupTaskManager:
                             'tape_device': row['tape_device'],
                             'tape_id': row['tape_id'],
                             'description': row['description'],
-                            'current_compression_progress': current_compression_progress
+                            'current_compression_progress': current_compression_progress,
+                            'scan_to_first_group_seconds': in_memory_scan_to_first_group,  # 扫描开始→首个压缩组完成耗时
+                            'tape_throughput': self._get_tape_throughput_stats()  # 磁带写入速度、缓冲区占用、等待次数
                         }
             else:
                 # 非 openGauss 使用 SQLAlchemy
@@ -425,6 +435,10 @@ class BackupTaskManager:
                         # 添加运行时的压缩进度信息
                         if current_compression_progress:
                             result['current_compression_progress'] = current_compression_progress
+                        # 扫描开始→首个压缩组完成耗时（仅运行中的任务在内存中有该值）
+                        if self._current_task and self._current_task.id == task_id:
+                            result['scan_to_first_group_seconds'] = getattr(self._current_task, 'scan_to_first_group_seconds', None)
+                        result['tape_throughput'] = self._get_tape_throughput_stats()
                         return result
             
             return None
@@ -432,6 +446,11 @@ class BackupTaskManager:
             logger.error(f"获取任务状态失败: {str(e)}")
             return None
     
+    def _get_tape_throughput_stats(self) -> Optional[Dict]:
+        """磁带吞吐调节器的实时统计（未启用时返回 None）"""
+        governor = get_tape_governor(self.settings)
+        return governor.get_stats() if governor is not None else None
+    
     async def cancel_task(self, task_id: int) -> bool:
         """取消任务
         
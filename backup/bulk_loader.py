@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+backup_files 批量写入模块（COPY 协议）
+Bulk Loader Module (COPY FROM STDIN)
+
+扫描写入 backup_files 的各条路径（BatchDBWriter / SimpleScanner / MemoryDBWriter /
+OpenGaussDBScheduler）原先都使用逐行参数化的 executemany INSERT，扫描千万级文件时
+耗时主要花在语句往返上。本模块通过 COPY ... FROM STDIN 整批流式写入：
+- native 格式：按连接类型选用驱动自身的 COPY 写法
+  - asyncpg 连接：copy_records_to_table（二进制格式，类型由服务端表结构决定）
+  - psycopg3 连接（psycopg3_compat.AsyncPGCompatConnection）：cursor.copy() + write_row
+    （文本格式，由服务端按列类型解析，枚举/jsonb 列无需在客户端注册类型）
+- csv 格式：两种连接都发送 CSV 文本
+copy_upsert 先 COPY 到临时暂存表，再用 UPDATE ... FROM + INSERT ... WHERE NOT EXISTS 合并
+（openGauss 不支持 ON CONFLICT）。
+
+连续失败 _COPY_MAX_FAILURES 次后停用 COPY，调用方回退到 executemany；
+停用 _COPY_RETRY_SECONDS 秒后放行一批重新试探，试探成功即恢复 COPY。
+"""
+
+import io
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, date, timezone
+from typing import List, Dict, Optional, Sequence, Tuple, Iterable
+
+logger = logging.getLogger(__name__)
+
+# backup_files 扫描写入的列（与各写入路径的数据元组顺序一致）
+BACKUP_FILES_COLUMNS = (
+    "backup_set_id", "file_path", "file_name", "directory_path", "display_name",
+    "file_type", "file_size", "compressed_size", "file_permissions", "file_owner",
+    "file_group", "created_time", "modified_time", "accessed_time", "tape_block_start",
+    "tape_block_count", "compressed", "encrypted", "checksum", "is_copy_success",
+    "copy_status_at", "backup_time", "chunk_number", "version",
+)
+BACKUP_FILES_METADATA_COLUMNS = ("file_metadata", "tags")
+BACKUP_FILES_TIMESTAMP_COLUMNS = ("created_at", "updated_at")
+
+COPY_FORMAT_NATIVE = "native"
+COPY_FORMAT_CSV = "csv"
+
+_CSV_ROWS_PER_CHUNK = 1000
+_COPY_MAX_FAILURES = 3
+_COPY_RETRY_SECONDS = 600
+
+_copy_failures = 0
+_copy_disabled_until = 0.0
+
+
+def use_copy_protocol(settings=None) -> bool:
+    """是否使用 COPY 写入 backup_files（DB_BULK_LOAD_METHOD=copy 且不在连续失败后的停用期内）"""
+    if settings is None:
+        from config.settings import get_settings
+        settings = get_settings()
+    method = str(getattr(settings, "DB_BULK_LOAD_METHOD", "copy") or "copy").strip().lower()
+    if method != "copy":
+        return False
+    # 停用期满后放行试探：成功则计数清零，失败则重新进入停用期
+    return _copy_failures < _COPY_MAX_FAILURES or time.monotonic() >= _copy_disabled_until
+
+
+def get_copy_format(settings=None) -> str:
+    """DB_COPY_FORMAT：csv，其余取值（含旧配置 binary）按 native 处理"""
+    if settings is None:
+        from config.settings import get_settings
+        settings = get_settings()
+    copy_format = str(getattr(settings, "DB_COPY_FORMAT", COPY_FORMAT_NATIVE) or COPY_FORMAT_NATIVE).strip().lower()
+    return COPY_FORMAT_CSV if copy_format == COPY_FORMAT_CSV else COPY_FORMAT_NATIVE
+
+
+def record_copy_failure(error: Exception):
+    """记录一次 COPY 失败（调用方回退到 executemany），连续失败达到上限后停用 COPY 一段时间"""
+    global _copy_failures, _copy_disabled_until
+    _copy_failures += 1
+    if _copy_failures >= _COPY_MAX_FAILURES:
+        _copy_disabled_until = time.monotonic() + _COPY_RETRY_SECONDS
+        logger.warning(
+            f"[批量写入] COPY 连续失败 {_copy_failures} 次，{_COPY_RETRY_SECONDS} 秒内改用 executemany 写入: {error}"
+        )
+    else:
+        logger.warning(f"[批量写入] COPY 写入失败，本批回退到 executemany: {error}")
+
+
+def _record_copy_success():
+    global _copy_failures
+    _copy_failures = 0
+
+
+def psycopg_connection(conn):
+    """返回 psycopg3 的 AsyncConnection（兼容层包装或原始连接），asyncpg 连接返回 None
+
+    需要直接使用游标（COPY、服务端游标）或显式事务控制的模块共用该函数判断连接类型
+    """
+    inner = getattr(conn, "_conn", None)
+    if inner is not None and hasattr(inner, "cursor") and hasattr(inner, "info"):
+        return inner
+    if hasattr(conn, "cursor") and hasattr(conn, "info"):
+        return conn
+    return None
+
+
+def _csv_value(value) -> str:
+    """CSV 字段编码：NULL 为不加引号的空字段，其余值一律加引号（区分空字符串与 NULL）"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        text = "t" if value else "f"
+    elif isinstance(value, (datetime, date)):
+        text = value.isoformat()
+    elif isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        text = "\\x" + bytes(value).hex()
+    else:
+        text = str(value)
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _iter_csv_chunks(records: Sequence[Sequence]) -> Iterable[bytes]:
+    for start in range(0, len(records), _CSV_ROWS_PER_CHUNK):
+        lines = [
+            ",".join(_csv_value(value) for value in record)
+            for record in records[start:start + _CSV_ROWS_PER_CHUNK]
+        ]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+async def rollback_quietly(raw_conn):
+    """回滚 psycopg3 连接上的事务，回滚失败（连接已自动回滚或已断开）只记录调试日志"""
+    try:
+        await raw_conn.rollback()
+    except Exception as rollback_error:
+        logger.debug(f"[批量写入] 回滚失败（可能已自动回滚）: {rollback_error}")
+
+
+async def _psycopg_copy(cur, table_name: str, columns: Sequence[str], records: Sequence[Sequence],
+                        copy_format: str):
+    column_sql = ", ".join(columns)
+    if copy_format == COPY_FORMAT_CSV:
+        async with cur.copy(f"COPY {table_name} ({column_sql}) FROM STDIN WITH CSV") as copy:
+            for chunk in _iter_csv_chunks(records):
+                await copy.write(chunk)
+    else:
+        # native：文本格式 COPY，由服务端按列类型解析（二进制需在客户端注册 backupfiletype 等类型）
+        async with cur.copy(f"COPY {table_name} ({column_sql}) FROM STDIN") as copy:
+            for record in records:
+                await copy.write_row(record)
+
+
+async def _asyncpg_copy(conn, table_name: str, columns: Sequence[str], records: Sequence[Sequence],
+                        copy_format: str):
+    if copy_format == COPY_FORMAT_CSV:
+        source = io.BytesIO(b"".join(_iter_csv_chunks(records)))
+        await conn.copy_to_table(table_name, source=source, columns=list(columns), format="csv")
+    else:
+        await conn.copy_records_to_table(table_name, records=records, columns=list(columns))
+
+
+def _begin_psycopg(raw_conn) -> bool:
+    """返回本次操作是否自行管理事务（调用方已 BEGIN 时由调用方提交）"""
+    status = raw_conn.info.transaction_status
+    return status in (0, 3)  # IDLE / INERROR（INERROR 先回滚）
+
+
+async def copy_records(conn, table_name: str, columns: Sequence[str], records: Sequence[Sequence],
+                       copy_format: str = COPY_FORMAT_NATIVE) -> int:
+    """COPY ... FROM STDIN 批量插入
+
+    调用方未开启事务时自行提交（与 psycopg3_compat.executemany 一致），
+    已开启事务时由调用方提交/回滚。
+
+    Returns:
+        int: 写入的行数
+    """
+    if not records:
+        return 0
+    raw_conn = psycopg_connection(conn)
+    if raw_conn is None:
+        await _asyncpg_copy(conn, table_name, columns, records, copy_format)
+        _record_copy_success()
+        return len(records)
+
+    owns_transaction = _begin_psycopg(raw_conn)
+    if raw_conn.info.transaction_status == 3:
+        await rollback_quietly(raw_conn)
+    try:
+        async with raw_conn.cursor() as cur:
+            await _psycopg_copy(cur, table_name, columns, records, copy_format)
+        if owns_transaction:
+            await raw_conn.commit()
+    except Exception:
+        if owns_transaction:
+            await rollback_quietly(raw_conn)
+        raise
+    _record_copy_success()
+    return len(records)
+
+
+def affected_rows(status) -> int:
+    """asyncpg execute 返回 "UPDATE 12" / "INSERT 0 12" 形式的状态串"""
+    try:
+        return int(str(status).rsplit(" ", 1)[-1])
+    except (TypeError, ValueError):
+        return 0
+
+
+async def copy_upsert(conn, table_name: str, columns: Sequence[str], records: Sequence[Sequence],
+                      key_columns: Sequence[str], update_columns: Optional[Sequence[str]] = None,
+                      copy_format: str = COPY_FORMAT_NATIVE) -> Tuple[int, int]:
+    """经临时暂存表的批量 upsert：COPY 到暂存表后，已存在的行更新，不存在的行插入
+
+    Args:
+        key_columns: 判断行是否已存在的列（如 backup_set_id, file_path），建议有对应索引
+        update_columns: 已存在时更新的列（默认除 key_columns 外的全部列；空序列表示只插入不存在的行）
+
+    Returns:
+        (更新行数, 插入行数)
+    """
+    if not records:
+        return 0, 0
+    columns = list(columns)
+    key_indexes = [columns.index(key) for key in key_columns]
+    # 同一批内的重复键只保留最后一条（UPDATE ... FROM 遇到重复键时结果不确定）
+    unique_records: Dict[tuple, Sequence] = {}
+    for record in records:
+        unique_records[tuple(record[i] for i in key_indexes)] = record
+    records = list(unique_records.values())
+
+    if update_columns is None:
+        update_columns = [column for column in columns if column not in key_columns]
+    staging = f"tmp_{table_name}_stage_{uuid.uuid4().hex[:8]}"
+    column_sql = ", ".join(columns)
+    key_match = " AND ".join(f"t.{key} = s.{key}" for key in key_columns)
+    statement_create = f"CREATE TEMP TABLE {staging} AS SELECT {column_sql} FROM {table_name} WHERE FALSE"
+    statement_update = (
+        f"UPDATE {table_name} AS t SET {', '.join(f'{column} = s.{column}' for column in update_columns)} "
+        f"FROM {staging} AS s WHERE {key_match}"
+    ) if update_columns else None
+    statement_insert = (
+        f"INSERT INTO {table_name} ({column_sql}) "
+        f"SELECT {', '.join('s.' + column for column in columns)} FROM {staging} AS s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {table_name} AS t WHERE {key_match})"
+    )
+    statement_drop = f"DROP TABLE IF EXISTS {staging}"
+
+    updated = inserted = 0
+    raw_conn = psycopg_connection(conn)
+    if raw_conn is None:
+        async with conn.transaction():
+            await conn.execute(statement_create)
+            await _asyncpg_copy(conn, staging, columns, records, copy_format)
+            if statement_update:
+                updated = affected_rows(await conn.execute(statement_update))
+            inserted = affected_rows(await conn.execute(statement_insert))
+            await conn.execute(statement_drop)
+        _record_copy_success()
+        return updated, inserted
+
+    owns_transaction = _begin_psycopg(raw_conn)
+    if raw_conn.info.transaction_status == 3:
+        await rollback_quietly(raw_conn)
+    try:
+        async with raw_conn.cursor() as cur:
+            await cur.execute(statement_create)
+            await _psycopg_copy(cur, staging, columns, records, copy_format)
+            if statement_update:
+                await cur.execute(statement_update)
+                updated = max(0, cur.rowcount)
+            await cur.execute(statement_insert)
+            inserted = max(0, cur.rowcount)
+            await cur.execute(statement_drop)
+        if owns_transaction:
+            await raw_conn.commit()
+    except Exception:
+        if owns_transaction:
+            await rollback_quietly(raw_conn)
+        raise
+    _record_copy_success()
+    return updated, inserted
+
+
+def backup_files_copy_columns(record_width: int) -> List[str]:
+    """按数据元组宽度（24 列扫描字段，或再加 file_metadata/tags 共 26 列）返回 COPY 列名"""
+    columns = list(BACKUP_FILES_COLUMNS)
+    if record_width == len(BACKUP_FILES_COLUMNS) + len(BACKUP_FILES_METADATA_COLUMNS):
+        columns.extend(BACKUP_FILES_METADATA_COLUMNS)
+    elif record_width != len(BACKUP_FILES_COLUMNS):
+        raise ValueError(f"backup_files 数据元组宽度 {record_width} 与 COPY 列不匹配")
+    columns.extend(BACKUP_FILES_TIMESTAMP_COLUMNS)
+    return columns
+
+
+async def copy_backup_files(conn, table_name: str, insert_data: List[tuple], settings=None) -> int:
+    """把扫描阶段的 backup_files 数据元组通过 COPY 写入 table_name
+
+    insert_data 与原 executemany INSERT 的参数元组相同；created_at/updated_at 原为 SQL 中的 NOW()，
+    这里整批使用同一个时间戳（NOW() 在一个事务内本来也是同一时刻）。
+    """
+    if not insert_data:
+        return 0
+    columns = backup_files_copy_columns(len(insert_data[0]))
+    now_ts = datetime.now(timezone.utc)
+    records = [tuple(record) + (now_ts, now_ts) for record in insert_data]
+    return await copy_records(conn, table_name, columns, records, get_copy_format(settings))
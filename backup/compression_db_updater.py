@@ -14,6 +14,8 @@ import json
 
 from utils.scheduler.db_utils import is_opengauss, get_opengauss_connection
 from backup.utils import format_bytes
+from backup.bulk_loader import use_copy_protocol, copy_backup_files, record_copy_failure
+from backup.directory_archive_map import record_directory_archives
 
 logger = logging.getLogger(__name__)
 
@@ -39,12 +41,12 @@ class OpenGaussDBScheduler:
         self.batch_size = batch_size
         
         # 无限队列，用于接收压缩完成的文件信息
-        # 格式: ('compression', group_idx, file_paths, chunk_number, compressed_size, original_size)
+        # 格式: ('compression', group_idx, file_paths, chunk_number, compressed_size, original_size, tape_file_path, file_checksums, file_references, directory_summary)
         # 或: ('sync', file_data_map)
         self.update_queue = asyncio.Queue(maxsize=0)
         
         # 压缩更新缓冲区
-        self.compression_buffer: List[Tuple[int, List[str], int, int, int]] = []  # (group_idx, file_paths, chunk_number, compressed_size, original_size)
+        self.compression_buffer: List[Tuple[int, List[str], int, int, int, Optional[str], Dict[str, str], Dict[str, Dict], Dict[str, List[int]]]] = []  # (group_idx, file_paths, chunk_number, compressed_size, original_size, tape_file_path, file_checksums, file_references, directory_summary)
         self.compression_buffer_file_count = 0  # 压缩缓冲区中的文件总数
         
         # 内存数据库同步缓冲区
@@ -126,7 +128,11 @@ class OpenGaussDBScheduler:
         file_paths: List[str],
         chunk_number: int,
         compressed_size: int,
-        original_size: int
+        original_size: int,
+        tape_file_path: Optional[str] = None,
+        file_checksums: Optional[Dict[str, str]] = None,
+        file_references: Optional[Dict[str, Dict]] = None,
+        directory_summary: Optional[Dict[str, List[int]]] = None
     ):
         """提交压缩完成的文件信息
         
@@ -136,6 +142,10 @@ class OpenGaussDBScheduler:
             chunk_number: 块编号
             compressed_size: 压缩后大小（整个文件组的总大小）
             original_size: 原始大小（整个文件组的总大小）
+            tape_file_path: 压缩包路径（写入 file_metadata，恢复时按压缩包分组读取）
+            file_checksums: 压缩时计算的文件内容校验和 {file_path: checksum}（写入 checksum 列）
+            file_references: 内容去重命中的文件 {file_path: dedup_ref}（未写入本压缩包，file_metadata 记录引用位置）
+            directory_summary: 按目录汇总的文件数和大小 {directory_path: [file_count, total_size]}（写入目录→压缩包映射）
         """
         # 空列表检查：避免执行无意义的 SQL
         if not file_paths:
@@ -153,7 +163,11 @@ class OpenGaussDBScheduler:
                 file_paths,
                 chunk_number,
                 compressed_size,
-                original_size
+                original_size,
+                tape_file_path,
+                file_checksums or {},
+                file_references or {},
+                directory_summary or {}
             ))
             self.total_compression_received += len(file_paths)
             logger.info(
@@ -208,14 +222,14 @@ class OpenGaussDBScheduler:
                     
                     if task_type == 'compression':
                         # 压缩更新任务（取消 batch_size 限制：每次收到就立即刷一次）
-                        _, group_idx, file_paths, chunk_number, compressed_size, original_size = item
+                        _, group_idx, file_paths, chunk_number, compressed_size, original_size, tape_file_path, file_checksums, file_references, directory_summary = item
                         # 空列表检查
                         if not file_paths:
                             continue
                         
                         file_count = len(file_paths)
                         async with self.buffer_lock:
-                            self.compression_buffer.append((group_idx, file_paths, chunk_number, compressed_size, original_size))
+                            self.compression_buffer.append((group_idx, file_paths, chunk_number, compressed_size, original_size, tape_file_path, file_checksums, file_references, directory_summary))
                             self.compression_buffer_file_count += file_count
                             
                             logger.debug(
@@ -294,7 +308,7 @@ class OpenGaussDBScheduler:
         files_to_process = 0
         
         for item in self.compression_buffer:
-            group_idx, file_paths, chunk_number, compressed_size, original_size = item
+            file_paths = item[1]
             file_count = len(file_paths)
             
             if files_to_process + file_count <= self.batch_size:
@@ -317,21 +331,46 @@ class OpenGaussDBScheduler:
         total_original_size = 0
         
         # 合并所有批次的文件信息
-        all_file_updates: Dict[str, Dict] = {}  # {file_path: {chunk_number, compressed_size}}
+        all_file_updates: Dict[str, Dict] = {}  # {file_path: {chunk_number, compressed_size, file_metadata, checksum}}
+        directory_archives: List[Tuple[int, Optional[str], Dict[str, List[int]]]] = []  # (chunk_number, tape_file_path, directory_summary)
         
-        for group_idx, file_paths, chunk_number, compressed_size, original_size in batches_to_process:
+        for group_idx, file_paths, chunk_number, compressed_size, original_size, tape_file_path, file_checksums, file_references, directory_summary in batches_to_process:
             total_files += len(file_paths)
+            if directory_summary:
+                directory_archives.append((chunk_number, tape_file_path, directory_summary))
             total_compressed_size += compressed_size
             total_original_size += original_size
             
-            # 计算每个文件的压缩大小（平均分配）
-            per_file_compressed_size = compressed_size // len(file_paths) if file_paths else 0
+            # 计算每个文件的压缩大小（平均分配给实际写入压缩包的文件）
+            archived_count = len(file_paths) - len(file_references)
+            per_file_compressed_size = compressed_size // archived_count if archived_count > 0 else 0
             
             # 合并到更新字典（如果同一个文件在多个批次中，使用最新的信息）
             for file_path in file_paths:
+                dedup_ref = file_references.get(file_path)
+                if dedup_ref:
+                    # 内容去重：数据在其他备份集的压缩包中，恢复时按引用读取
+                    all_file_updates[file_path] = {
+                        'chunk_number': chunk_number,
+                        'compressed_size': 0,
+                        'file_metadata': json.dumps({
+                            'tape_file_path': dedup_ref['tape_file_path'],
+                            'chunk_number': chunk_number,
+                            'original_path': file_path,
+                            'dedup_ref': dedup_ref
+                        }),
+                        'checksum': dedup_ref.get('checksum')
+                    }
+                    continue
                 all_file_updates[file_path] = {
                     'chunk_number': chunk_number,
-                    'compressed_size': per_file_compressed_size
+                    'compressed_size': per_file_compressed_size,
+                    'file_metadata': json.dumps({
+                        'tape_file_path': tape_file_path,
+                        'chunk_number': chunk_number,
+                        'original_path': file_path
+                    }) if tape_file_path else None,
+                    'checksum': file_checksums.get(file_path)
                 }
         
         if not all_file_updates:
@@ -347,7 +386,7 @@ class OpenGaussDBScheduler:
         # 批量更新数据库
         update_start_time = time.time()
         try:
-            await self._update_compression_opengauss(all_file_updates)
+            await self._update_compression_opengauss(all_file_updates, directory_archives)
             
             update_time = time.time() - update_start_time
             self.total_compression_updated += len(all_file_updates)
@@ -418,11 +457,13 @@ class OpenGaussDBScheduler:
                 self.sync_buffer_file_count += files_count
             raise
     
-    async def _update_compression_opengauss(self, file_updates: Dict[str, Dict]):
+    async def _update_compression_opengauss(self, file_updates: Dict[str, Dict],
+                                            directory_archives: Optional[List[Tuple[int, Optional[str], Dict[str, List[int]]]]] = None):
         """更新 openGauss 数据库 - 压缩信息更新
         
         Args:
-            file_updates: {file_path: {chunk_number, compressed_size}}
+            file_updates: {file_path: {chunk_number, compressed_size, file_metadata}}
+            directory_archives: [(chunk_number, tape_file_path, directory_summary)]，与文件记录在同一事务中写入目录→压缩包映射
         """
         # 空列表检查：避免执行无意义的 SQL
         if not file_updates:
@@ -434,6 +475,8 @@ class OpenGaussDBScheduler:
             update_params.append((
                 update_info['chunk_number'],
                 update_info['compressed_size'],
+                update_info.get('file_metadata'),
+                update_info.get('checksum'),
                 self.backup_set_db_id,
                 file_path
             ))
@@ -457,13 +500,21 @@ class OpenGaussDBScheduler:
                     UPDATE {table_name}
                     SET chunk_number = $1,
                         compressed_size = $2,
+                        file_metadata = COALESCE($3::jsonb, file_metadata),
+                        checksum = COALESCE($4, checksum),
                         updated_at = NOW()
-                    WHERE backup_set_id = $3
-                      AND file_path = $4
+                    WHERE backup_set_id = $5
+                      AND file_path = $6
                       AND (is_copy_success = TRUE OR is_copy_success IS NULL OR is_copy_success = FALSE)
                     """,
                     update_params
                 )
+
+                # 目录 → 压缩包映射（目录恢复时只读取相关压缩包），与文件记录一起提交
+                for chunk_number, tape_file_path, directory_summary in directory_archives or []:
+                    await record_directory_archives(
+                        conn, self.backup_set_db_id, chunk_number, tape_file_path, directory_summary
+                    )
                 
                 # 显式提交事务（openGauss 模式需要显式提交）
                 try:
@@ -608,24 +659,31 @@ class OpenGaussDBScheduler:
                 sample_backup_set_id = sample_record[0]
                 table_name = await get_backup_files_table_by_set_id(conn, sample_backup_set_id)
 
-                # 执行批量插入
-                rowcount = await conn.executemany(
-                    f"""
-                    INSERT INTO {table_name} (
-                        backup_set_id, file_path, file_name, directory_path, display_name,
-                        file_type, file_size, compressed_size, file_permissions, file_owner,
-                        file_group, created_time, modified_time, accessed_time, tape_block_start,
-                        tape_block_count, compressed, encrypted, checksum, is_copy_success,
-                        copy_status_at, backup_time, chunk_number, version, file_metadata, tags,
-                        created_at, updated_at
-                    ) VALUES (
-                        $1, $2, $3, $4, $5, $6, $7, $8, $9, $10,
-                        $11, $12, $13, $14, $15, $16, $17, $18, $19, $20,
-                        $21, $22, $23, $24, $25::jsonb, $26::jsonb, NOW(), NOW()
+                # 执行批量插入：优先 COPY FROM STDIN，失败时回退到 executemany
+                rowcount = None
+                if use_copy_protocol():
+                    try:
+                        rowcount = await copy_backup_files(conn, table_name, insert_data)
+                    except Exception as copy_error:
+                        record_copy_failure(copy_error)
+                if rowcount is None:
+                    rowcount = await conn.executemany(
+                        f"""
+                        INSERT INTO {table_name} (
+                            backup_set_id, file_path, file_name, directory_path, display_name,
+                            file_type, file_size, compressed_size, file_permissions, file_owner,
+                            file_group, created_time, modified_time, accessed_time, tape_block_start,
+                            tape_block_count, compressed, encrypted, checksum, is_copy_success,
+                            copy_status_at, backup_time, chunk_number, version, file_metadata, tags,
+                            created_at, updated_at
+                        ) VALUES (
+                            $1, $2, $3, $4, $5, $6, $7, $8, $9, $10,
+                            $11, $12, $13, $14, $15, $16, $17, $18, $19, $20,
+                            $21, $22, $23, $24, $25::jsonb, $26::jsonb, NOW(), NOW()
+                        )
+                        """,
+                        insert_data
                     )
-                    """,
-                    insert_data
-                )
                 
                 # 显式提交事务（openGauss 模式需要显式提交）
                 try:
@@ -7,12 +7,16 @@
 import asyncio
 import logging
 import os
+from pathlib import Path
 from typing import List, Dict, Optional, Any
 import tempfile
 
 from utils.scheduler.db_utils import is_opengauss
 from config.settings import get_settings
 from backup.utils import format_bytes
+from backup.scan_readiness import get_scan_readiness
+from backup.tape_throughput_governor import get_tape_governor
+from backup.directory_archive_map import summarize_directories
 
 logger = logging.getLogger(__name__)
 
@@ -63,6 +67,9 @@ class CompressionWorker:
         else:
             self.base_parallel_batches = 1
             self.parallel_batches = 1  # 非openGauss模式，顺序执行
+        self._planned_parallel_batches = self.parallel_batches  # 按扫描状态计算的并行批次（吞吐调节前）
+        # 磁带吞吐调节器（仅预取并发模式下调整并行批次）
+        self.tape_governor = get_tape_governor(settings) if self.use_prefetcher else None
         
         # 存储每个压缩任务的进度（用于实时查询）
         # 格式: {group_idx: {'current': int, 'total': int, 'percent': float, 'group_size_bytes': int, 'compress_progress': Dict}}
@@ -189,10 +196,12 @@ class CompressionWorker:
                 logger.info("压缩进度更新任务已停止")
     
     async def _adjust_parallel_batches(self):
-        """根据扫描状态调整并行批次数量
+        """根据扫描状态和磁带写入吞吐调整并行批次数量
         
-        策略：扫描阶段减少同时运行的压缩任务数量，扫描结束后恢复正常
+        策略：扫描阶段减少同时运行的压缩任务数量，扫描结束后恢复正常；
+        在此基础上由磁带吞吐调节器增减（驱动器供给不足时增加，驱动器跟不上时减少）
         """
+        planned_batches = self.parallel_batches
         try:
             # 优先从内存对象获取，如果没有则从数据库查询
             scan_status = getattr(self.backup_task, "scan_status", None)
@@ -204,20 +213,19 @@ class CompressionWorker:
             
             # 如果扫描未完成，减少并行批次数量（降低同时运行的压缩任务数）
             if scan_status not in (None, "completed"):
-                adjusted_batches = max(1, self.base_parallel_batches - 1)
-                if adjusted_batches != self.parallel_batches:
+                planned_batches = max(1, self.base_parallel_batches - 1)
+                if planned_batches != self._planned_parallel_batches:
                     logger.info(
                         f"[压缩配置] 扫描阶段（scan_status={scan_status}），"
-                        f"将并行批次数量从 {self.base_parallel_batches} 降为 {adjusted_batches}"
+                        f"将并行批次数量从 {self.base_parallel_batches} 降为 {planned_batches}"
                     )
-                    self.parallel_batches = adjusted_batches
             else:
-                if self.parallel_batches != self.base_parallel_batches:
+                planned_batches = self.base_parallel_batches
+                if planned_batches != self._planned_parallel_batches:
                     logger.info(
                         f"[压缩配置] 扫描已完成（scan_status=completed），"
-                        f"将并行批次数量从 {self.parallel_batches} 恢复为 {self.base_parallel_batches}"
+                        f"将并行批次数量从 {self._planned_parallel_batches} 恢复为 {planned_batches}"
                     )
-                    self.parallel_batches = self.base_parallel_batches
                 else:
                     logger.debug(
                         f"[压缩配置] 扫描已完成（scan_status=completed），"
@@ -226,6 +234,18 @@ class CompressionWorker:
         except Exception as e:
             # 即使无法获取 scan_status，也不影响压缩主流程
             logger.debug(f"[压缩配置] 获取 scan_status 时出错，使用默认配置: {e}")
+        self._planned_parallel_batches = planned_batches
+
+        # 磁带吞吐调节：保持驱动器在最低流式速度以上，避免停带重定位
+        adjusted_batches = planned_batches
+        if self.tape_governor is not None:
+            adjusted_batches = self.tape_governor.recommend_parallel_batches(planned_batches)
+            if adjusted_batches != planned_batches and adjusted_batches != self.parallel_batches:
+                logger.info(
+                    f"[压缩配置] 磁带吞吐调节（{self.tape_governor.last_action}），"
+                    f"并行批次数量 {planned_batches} → {adjusted_batches}"
+                )
+        self.parallel_batches = adjusted_batches
 
     async def _process_prefetched_file_groups(self):
         """处理预取的文件组（openGauss模式）- 并发控制"""
@@ -530,6 +550,31 @@ class CompressionWorker:
             logger.info(f"  压缩率: {compression_ratio:.2f}%")
         logger.info("=" * 80)
     
+    @staticmethod
+    def _archived_paths(file_group: List[Dict], compressed_info: Dict) -> List[str]:
+        """文件组中成功写入压缩包或命中内容去重引用的文件路径（与扫描时的路径写法一致）"""
+        compress_result = compressed_info.get('compress_result') or {}
+        successful = {str(Path(path)) for path in compress_result.get('successful_files') or []}
+        references = compressed_info.get('dedup_references') or {}
+        archived = []
+        for file_info in file_group:
+            path = file_info.get('file_path') or file_info.get('path')
+            if path and (path in references or str(Path(path)) in successful):
+                archived.append(path)
+        return archived
+
+    def _record_first_group(self):
+        """记录扫描开始 → 第一个压缩组完成的耗时（流水线启动延迟指标）"""
+        readiness = get_scan_readiness(getattr(self.backup_set, 'id', None))
+        if readiness is None:
+            return
+        elapsed = readiness.mark_first_group()
+        if elapsed is None:
+            return
+        if self.backup_task:
+            self.backup_task.scan_to_first_group_seconds = elapsed
+        logger.info(f"[压缩循环] 首个压缩组已完成，距扫描开始 {elapsed:.1f} 秒")
+
     def get_aggregated_compression_progress(self) -> Optional[Dict[str, Any]]:
         """获取所有并行压缩任务的聚合进度和各个任务的进度列表
         
@@ -1006,6 +1051,7 @@ class CompressionWorker:
                     
                     # 压缩完成后，更新统计和标记文件为已复制
                 if compressed_info:
+                    self._record_first_group()
                     # 更新内存中的统计
                     self.processed_files += total_files
                     compressed_size = compressed_info.get('compressed_size', 0) or 0
@@ -1030,7 +1076,11 @@ class CompressionWorker:
                                     file_paths=file_paths,
                                     chunk_number=chunk_number,
                                     compressed_size=compressed_size,
-                                    original_size=original_size
+                                    original_size=original_size,
+                                    tape_file_path=compressed_info.get('path') or None,
+                                    file_checksums=compressed_info.get('file_checksums'),
+                                    file_references=compressed_info.get('dedup_references'),
+                                    directory_summary=summarize_directories(processed_file_group)
                                 )
                                 logger.info(
                                     f"[压缩工作器] ✅ 已提交压缩文件组 #{group_idx + 1} 给调度器: "
@@ -1043,7 +1093,8 @@ class CompressionWorker:
                                 compressed_file_info = {
                                     'compressed_size': compressed_size,
                                     'compression_enabled': compressed_info.get('compression_enabled', True),
-                                    'checksum': compressed_info.get('checksum')
+                                    'file_checksums': compressed_info.get('file_checksums') or {},
+                                    'file_references': compressed_info.get('dedup_references') or {}
                                 }
                                 archive_path = compressed_info.get('path') or ''
                                 await self.backup_db.mark_files_as_copied(
@@ -1054,6 +1105,14 @@ class CompressionWorker:
                                     chunk_number=chunk_number
                                 )
                                 logger.info(f"[#{group_idx + 1}] ✅ 已更新 chunk_number={chunk_number}，文件数={len(processed_file_group)}")
+
+                            # 变更检测：只有成功写入压缩包（或内容去重引用）的文件在任务完成后更新文件状态目录
+                            change_detector = getattr(self.backup_task, 'change_detector', None)
+                            if change_detector:
+                                archived_paths = self._archived_paths(processed_file_group, compressed_info)
+                                await asyncio.get_running_loop().run_in_executor(
+                                    None, change_detector.mark_archived, archived_paths
+                                )
                     except Exception as update_error:
                         logger.error(f"[#{group_idx + 1}] ⚠️ 提交压缩文件信息失败: {str(update_error)}", exc_info=True)
                     
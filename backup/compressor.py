@@ -18,12 +18,20 @@ try:
     import zstandard as zstd
 except ImportError:
     zstd = None
+from contextlib import nullcontext
 from pathlib import Path
-from typing import List, Dict, Optional, Callable, Awaitable, Any
+from typing import List, Dict, Optional, Callable, Awaitable, Any, BinaryIO
 
 from models.backup import BackupSet, BackupTask
 from utils.datetime_utils import now, format_datetime
 from backup.utils import format_bytes
+from backup.archive_index import ArchiveIndex
+from backup.file_hasher import add_file_to_tar, resolve_algorithm
+from backup.small_file_reader import SmallFileTarWriter
+from backup.zstd_seekable import SeekableZstdWriter
+from backup.tape_stream_writer import TapeStreamWriter, PART_SUFFIX, compute_file_checksum
+from backup.tape_throughput_governor import get_tape_governor
+from backup.tape_ready_queue import get_tape_ready_queue
 
 logger = logging.getLogger(__name__)
 
@@ -46,16 +54,30 @@ def _parse_size_to_bytes(size_str: Optional[str], default_bytes: int = 1024 * 10
         return default_bytes
 
 
-def _finalize_compression_progress(compress_progress: Dict, archive: Optional[Path] = None):
+def _archive_output_size(archive_path_abs: Path, output_stream: Optional[BinaryIO] = None) -> int:
+    """已写出的压缩包字节数（流式写磁带时直接取输出流位置，避免对磁带文件 stat）"""
+    if output_stream is not None:
+        return output_stream.tell()
+    try:
+        return archive_path_abs.stat().st_size if archive_path_abs.exists() else 0
+    except OSError:
+        return 0
+
+
+def _finalize_compression_progress(compress_progress: Dict, archive: Optional[Path] = None,
+                                   output_stream: Optional[BinaryIO] = None):
     """统一更新压缩进度，避免调用方一直等待"""
+    compress_progress['running'] = False
+    compress_progress['completed'] = True
+    if output_stream is not None:
+        compress_progress['bytes_written'] = output_stream.tell()
+        return
     archive_abs = None
     try:
         if archive is not None:
             archive_abs = archive.absolute()
     except Exception:
         archive_abs = None
-    compress_progress['running'] = False
-    compress_progress['completed'] = True
     if archive_abs and archive_abs.exists():
         try:
             compress_progress['bytes_written'] = archive_abs.stat().st_size
@@ -65,6 +87,23 @@ def _finalize_compression_progress(compress_progress: Dict, archive: Optional[Pa
         compress_progress['bytes_written'] = 0
 
 
+def _member_arcname(file_path: Path, source_paths) -> str:
+    """tar 成员名：相对于所属源路径的路径（保留目录结构），不在任何源路径下时使用文件名"""
+    for src_path in source_paths or []:
+        src = Path(src_path)
+        try:
+            if file_path.is_relative_to(src):
+                return str(file_path.relative_to(src))
+        except (ValueError, AttributeError):
+            continue
+    return file_path.name
+
+
+def _tar_member_name(arcname: str) -> str:
+    """与 tarfile 写入时一致的成员名规范化（分隔符统一为 /，去掉开头的 /）"""
+    return arcname.replace(os.sep, "/").lstrip("/")
+
+
 # 尝试导入psutil用于内存检查
 try:
     import psutil
@@ -465,10 +504,15 @@ def _compress_with_pgzip(
     compress_progress: Dict,
     total_files: int,
     base_processed_files: int,
+    archive_index: Optional[ArchiveIndex] = None,
+    output_stream: Optional[BinaryIO] = None,
+    checksum_algorithm: Optional[str] = None,
+    settings=None,
 ) -> Dict:
     """使用PGZip压缩文件"""
     successful_files: List[str] = []
     failed_files: List[Dict[str, str]] = []
+    file_checksums: Dict[str, str] = {}  # {文件路径: 内容校验和}，在写入 tar 的同一次读取中计算
     archive_path_abs = archive_path.absolute()
     archive_path_abs.parent.mkdir(parents=True, exist_ok=True)
 
@@ -482,7 +526,7 @@ def _compress_with_pgzip(
     try:
         logger.info(f"[PGZip] 开始打开压缩文件: {archive_path_abs}")
         with pgzip.open(
-            archive_path_abs,
+            output_stream if output_stream is not None else archive_path_abs,
             'wb',
             thread=threads,
             blocksize=block_size_bytes,
@@ -493,8 +537,9 @@ def _compress_with_pgzip(
                 total_files_in_group = len(file_group)
                 last_log_time = time.time()
                 log_interval = 10.0  # 每10秒输出一次进度
+                small_files = SmallFileTarWriter(file_group, source_paths, settings)
                 
-                for file_idx, file_info in enumerate(file_group):
+                for file_idx, (file_info, prefetched) in enumerate(small_files):
                     file_path = Path(file_info['path'])
                     
                     # 每10秒输出一次进度（不再按文件数量）
@@ -517,20 +562,12 @@ def _compress_with_pgzip(
                             }
                         last_log_time = current_time
                     
-                    if not file_path.exists():
+                    if prefetched is None and not file_path.exists():
                         logger.warning(f"文件不存在，跳过: {file_path}")
                         failed_files.append({'path': str(file_path), 'reason': '文件不存在'})
                         continue
 
-                    arcname = file_path.name
-                    for src_path in source_paths:
-                        src = Path(src_path)
-                        try:
-                            if file_path.is_relative_to(src):
-                                arcname = str(file_path.relative_to(src))
-                                break
-                        except (ValueError, AttributeError):
-                            continue
+                    arcname = small_files.arcname(str(file_path))
 
                     try:
                         # 记录开始添加文件（仅对前10个和每1000个文件，或大文件）
@@ -553,8 +590,12 @@ def _compress_with_pgzip(
                         
                         # 使用 filter 参数处理特殊文件名，避免阻塞
                         # filter 参数可以自定义文件元数据，避免某些文件系统操作
+                        header_offset = tar.offset
                         try:
-                            tar.add(file_path, arcname=arcname, filter=None)
+                            if prefetched is not None:
+                                checksum = small_files.add(tar, prefetched, arcname, checksum_algorithm)
+                            else:
+                                checksum = add_file_to_tar(tar, file_path, arcname, checksum_algorithm)
                         except Exception as tar_add_error:
                             # 如果 tar.add 失败，尝试使用 filter 参数
                             logger.warning(f"[PGZip] tar.add 失败，尝试使用 filter 参数: {file_path}, 错误: {tar_add_error}")
@@ -562,7 +603,11 @@ def _compress_with_pgzip(
                             def safe_filter(tarinfo):
                                 # 只保留基本信息，避免触发文件系统的某些操作
                                 return tarinfo
-                            tar.add(file_path, arcname=arcname, filter=safe_filter)
+                            checksum = add_file_to_tar(tar, file_path, arcname, checksum_algorithm, filter=safe_filter)
+                        if archive_index is not None:
+                            archive_index.record_member(tar, header_offset, checksum)
+                        if checksum:
+                            file_checksums[file_info['path']] = checksum
                         
                         # 对于大文件，记录耗时
                         if is_large_file:
@@ -573,14 +618,17 @@ def _compress_with_pgzip(
                         if total_files > 0:
                             current_processed = base_processed_files + file_idx + 1
                             compress_progress_value = 10.0 + (current_processed / total_files) * 90.0
-                            compress_progress['bytes_written'] = archive_path_abs.stat().st_size if archive_path_abs.exists() else 0
+                            compress_progress['bytes_written'] = _archive_output_size(archive_path_abs, output_stream)
                             backup_task.progress_percent = min(100.0, compress_progress_value)
                     except Exception as add_error:
                         logger.warning(f"添加文件到PGZip压缩包失败: {file_path}, 错误: {add_error}")
                         failed_files.append({'path': str(file_path), 'reason': f'写入失败: {add_error}'})
                         continue
                 
-                logger.info(f"[PGZip] 所有文件已添加到tar，共 {len(successful_files)} 个成功，{len(failed_files)} 个失败")
+                logger.info(
+                    f"[PGZip] 所有文件已添加到tar，共 {len(successful_files)} 个成功，{len(failed_files)} 个失败"
+                    f"（小文件预读 {small_files.prefetched_count} 个）"
+                )
             
             logger.info(f"[PGZip] tar文件已关闭，准备关闭PGZip文件")
             # tar 文件已关闭，现在需要关闭 PGZip 文件
@@ -609,16 +657,17 @@ def _compress_with_pgzip(
             logger.info(f"[PGZip] PGZip文件已关闭（耗时: {close_elapsed:.2f}秒），检查文件是否存在")
         else:
             logger.info(f"[PGZip] PGZip文件已关闭，检查文件是否存在")
-        if archive_path_abs.exists():
+        if output_stream is not None or archive_path_abs.exists():
+            archive_size = _archive_output_size(archive_path_abs, output_stream)
             logger.info(
                 f"PGZip压缩完成: {len(successful_files)} 个文件成功, "
-                f"压缩包大小: {format_bytes(archive_path_abs.stat().st_size)}"
+                f"压缩包大小: {format_bytes(archive_size)}"
             )
-            compress_progress['bytes_written'] = archive_path_abs.stat().st_size
+            compress_progress['bytes_written'] = archive_size
 
         # 标记压缩完成（关键修复）
         logger.info(f"[PGZip] 标记压缩进度为完成")
-        _finalize_compression_progress(compress_progress, archive_path_abs)
+        _finalize_compression_progress(compress_progress, archive_path_abs, output_stream)
 
         successful_original_size = sum(
             f['size'] for f in file_group if str(f['path']) in successful_files
@@ -628,7 +677,8 @@ def _compress_with_pgzip(
             'successful_files': successful_files,
             'failed_files': failed_files,
             'successful_original_size': successful_original_size,
-            'archive_path': str(archive_path_abs)
+            'archive_path': str(archive_path_abs),
+            'file_checksums': file_checksums
         }
     except Exception as e:
         logger.error(f"PGZip压缩操作失败: {str(e)}")
@@ -651,6 +701,10 @@ def _compress_with_tar(
     compress_progress: Dict,
     total_files: int,
     base_processed_files: int,
+    archive_index: Optional[ArchiveIndex] = None,
+    output_stream: Optional[BinaryIO] = None,
+    checksum_algorithm: Optional[str] = None,
+    settings=None,
 ) -> Dict:
     """使用 tar 打包文件（不压缩）"""
     archive_path_abs = archive_path.absolute()
@@ -658,6 +712,7 @@ def _compress_with_tar(
 
     successful_files: List[str] = []
     failed_files: List[Dict[str, str]] = []
+    file_checksums: Dict[str, str] = {}  # {文件路径: 内容校验和}，在写入 tar 的同一次读取中计算
     source_paths = getattr(backup_task, 'source_paths', None) or []
     total_files_in_group = len(file_group)
     last_log_time = time.time()
@@ -665,8 +720,10 @@ def _compress_with_tar(
 
     logger.info(f"[tar] 开始创建tar归档文件: {archive_path_abs}")
     try:
-        with tarfile.open(archive_path_abs, 'w') as tar:
-            for file_idx, file_info in enumerate(file_group):
+        tar_target = {'fileobj': output_stream} if output_stream is not None else {'name': archive_path_abs}
+        small_files = SmallFileTarWriter(file_group, source_paths, settings)
+        with tarfile.open(mode='w', **tar_target) as tar:
+            for file_idx, (file_info, prefetched) in enumerate(small_files):
                 file_path = Path(file_info['path'])
 
                 current_time = time.time()
@@ -674,39 +731,42 @@ def _compress_with_tar(
                     logger.debug(f"[tar] 打包进度: {file_idx + 1}/{total_files_in_group} 个文件 ({((file_idx + 1) / max(total_files_in_group, 1) * 100):.1f}%)")
                     last_log_time = current_time
 
-                if not file_path.exists():
+                if prefetched is None and not file_path.exists():
                     logger.warning(f"[tar] 文件不存在，跳过: {file_path}")
                     failed_files.append({'path': str(file_path), 'reason': '文件不存在'})
                     continue
 
-                arcname = file_path.name
-                for src_path in source_paths:
-                    src = Path(src_path)
-                    try:
-                        if file_path.is_relative_to(src):
-                            arcname = str(file_path.relative_to(src))
-                            break
-                    except (ValueError, AttributeError):
-                        continue
+                arcname = small_files.arcname(str(file_path))
 
                 try:
-                    tar.add(file_path, arcname=arcname)
+                    header_offset = tar.offset
+                    if prefetched is not None:
+                        checksum = small_files.add(tar, prefetched, arcname, checksum_algorithm)
+                    else:
+                        checksum = add_file_to_tar(tar, file_path, arcname, checksum_algorithm)
+                    if archive_index is not None:
+                        archive_index.record_member(tar, header_offset, checksum)
+                    if checksum:
+                        file_checksums[file_info['path']] = checksum
                     successful_files.append(str(file_path))
 
                     if total_files > 0:
                         current_processed = base_processed_files + file_idx + 1
                         compress_progress_value = 10.0 + (current_processed / total_files) * 90.0
-                        compress_progress['bytes_written'] = archive_path_abs.stat().st_size if archive_path_abs.exists() else 0
+                        compress_progress['bytes_written'] = _archive_output_size(archive_path_abs, output_stream)
                         backup_task.progress_percent = min(100.0, compress_progress_value)
                 except Exception as add_error:
                     logger.warning(f"[tar] 添加文件失败: {file_path}, 错误: {add_error}")
                     failed_files.append({'path': str(file_path), 'reason': f'写入失败: {add_error}'})
                     continue
 
-        logger.info(f"[tar] 打包完成：{len(successful_files)} 个文件成功，{len(failed_files)} 个失败")
+        logger.info(
+            f"[tar] 打包完成：{len(successful_files)} 个文件成功，{len(failed_files)} 个失败"
+            f"（小文件预读 {small_files.prefetched_count} 个）"
+        )
         compress_progress['completed'] = True
         compress_progress['running'] = False
-        compress_progress['bytes_written'] = archive_path_abs.stat().st_size if archive_path_abs.exists() else 0
+        compress_progress['bytes_written'] = _archive_output_size(archive_path_abs, output_stream)
 
         successful_original_size = sum(f.get('size', 0) or 0 for f in file_group if str(f.get('path')) in successful_files)
 
@@ -714,7 +774,8 @@ def _compress_with_tar(
             'successful_files': successful_files,
             'failed_files': failed_files,
             'successful_original_size': successful_original_size,
-            'archive_path': str(archive_path_abs)
+            'archive_path': str(archive_path_abs),
+            'file_checksums': file_checksums
         }
     except Exception as tar_error:
         logger.error(f"tar打包失败: {tar_error}")
@@ -724,7 +785,7 @@ def _compress_with_tar(
             failed_files.append({'path': file_path, 'reason': 'tar打包失败'})
 
         # 标记压缩完成（即使失败也要标记，避免无限等待）
-        _finalize_compression_progress(compress_progress, archive_path_abs)
+        _finalize_compression_progress(compress_progress, archive_path_abs, output_stream)
 
         return {
             'successful_files': [],
@@ -743,6 +804,10 @@ def _compress_with_zstd(
     compress_progress: Dict,
     total_files: int,
     base_processed_files: int,
+    archive_index: Optional[ArchiveIndex] = None,
+    output_stream: Optional[BinaryIO] = None,
+    checksum_algorithm: Optional[str] = None,
+    settings=None,
 ) -> Dict:
     """使用 Zstandard 压缩（先打包成tar，再用zstd压缩）"""
     if zstd is None:
@@ -764,6 +829,7 @@ def _compress_with_zstd(
 
     successful_files: List[str] = []
     failed_files: List[Dict[str, str]] = []
+    file_checksums: Dict[str, str] = {}  # {文件路径: 内容校验和}，在写入 tar 的同一次读取中计算
     source_paths = getattr(backup_task, 'source_paths', None) or []
     total_files_in_group = len(file_group)
     last_log_time = time.time()
@@ -808,8 +874,9 @@ def _compress_with_zstd(
         zstd_write_size = 10 * 1024 * 1024  # 10MB
     
     # 如果配置中有 ZSTD_WRITE_SIZE，优先使用配置值（但需要在合理范围内）
-    from config.settings import get_settings
-    settings = get_settings()
+    if settings is None:
+        from config.settings import get_settings
+        settings = get_settings()
     config_write_size = getattr(settings, 'ZSTD_WRITE_SIZE', None)
     if config_write_size is not None:
         # 如果配置值在合理范围内，使用配置值
@@ -820,14 +887,28 @@ def _compress_with_zstd(
             logger.warning(f"[zstd] 配置的 ZSTD_WRITE_SIZE ({config_write_size}) 不在合理范围内 (128KB ~ 10MB)，使用根据平均文件大小计算的值: {zstd_write_size}")
     
     logger.info(f"[zstd] 文件组总大小: {format_bytes(total_size)}, 平均文件大小: {format_bytes(avg_file_size)}, 写入缓冲区大小: {format_bytes(zstd_write_size)}")
+
+    # 可随机访问模式：在 tar 成员边界按帧大小切分独立的 zstd 帧，文件尾部写入 seek table
+    seekable = bool(getattr(settings, 'ZSTD_SEEKABLE', False))
+    seekable_frame_size = int(getattr(settings, 'ZSTD_SEEKABLE_FRAME_SIZE', 32 * 1024 * 1024) or 32 * 1024 * 1024)
+    if seekable:
+        logger.info(f"[zstd] 启用可随机访问多帧模式，帧大小: {format_bytes(seekable_frame_size)}")
     
     try:
-        with archive_path_abs.open('wb') as raw_out:
+        with (nullcontext(output_stream) if output_stream is not None else archive_path_abs.open('wb')) as raw_out:
             compressor = zstd.ZstdCompressor(level=level, threads=threads)
             logger.debug(f"[zstd] 使用写入缓冲区大小: {format_bytes(zstd_write_size)}")
-            with compressor.stream_writer(raw_out, closefd=False, write_size=zstd_write_size) as zstd_stream:
-                with tarfile.open(fileobj=zstd_stream, mode='w|') as tar:
-                    for file_idx, file_info in enumerate(file_group):
+            if seekable:
+                # tarfile 使用 'w' 模式直接写入（无内部缓冲），保证切帧位置正好落在成员边界
+                zstd_stream_ctx = SeekableZstdWriter(raw_out, compressor, zstd_write_size)
+                tar_mode = 'w'
+            else:
+                zstd_stream_ctx = compressor.stream_writer(raw_out, closefd=False, write_size=zstd_write_size)
+                tar_mode = 'w|'
+            with zstd_stream_ctx as zstd_stream:
+                small_files = SmallFileTarWriter(file_group, source_paths, settings)
+                with tarfile.open(fileobj=zstd_stream, mode=tar_mode) as tar:
+                    for file_idx, (file_info, prefetched) in enumerate(small_files):
                         file_path = Path(file_info['path'])
 
                         current_time = time.time()
@@ -890,15 +971,7 @@ def _compress_with_zstd(
                         # 1. file_info 中有 size 说明扫描时文件存在
                         # 2. 如果文件不存在，tar.add() 会抛出异常，在异常处理中处理
 
-                        arcname = file_path.name
-                        for src_path in source_paths:
-                            src = Path(src_path)
-                            try:
-                                if file_path.is_relative_to(src):
-                                    arcname = str(file_path.relative_to(src))
-                                    break
-                            except (ValueError, AttributeError):
-                                continue
+                        arcname = small_files.arcname(str(file_path))
 
                         # 记录文件处理开始时间和文件信息
                         file_start_time = time.time()
@@ -908,7 +981,17 @@ def _compress_with_zstd(
                             logger.info(f"[zstd] 开始处理大文件 ({file_size_display}): {file_path.name}")
                         
                         try:
-                            tar.add(file_path, arcname=arcname)
+                            header_offset = tar.offset
+                            if prefetched is not None:
+                                checksum = small_files.add(tar, prefetched, arcname, checksum_algorithm)
+                            else:
+                                checksum = add_file_to_tar(tar, file_path, arcname, checksum_algorithm)
+                            if archive_index is not None:
+                                archive_index.record_member(tar, header_offset, checksum)
+                            if checksum:
+                                file_checksums[file_info['path']] = checksum
+                            if seekable and zstd_stream.frame_bytes >= seekable_frame_size:
+                                zstd_stream.end_frame()
                             successful_files.append(str(file_path))
                             # 累计已处理文件的实际大小（用于按文件大小计算百分比）
                             if 'processed_bytes' not in compress_progress:
@@ -948,15 +1031,21 @@ def _compress_with_zstd(
         # 压缩完成后，获取一次最终文件大小（避免压缩过程中频繁调用 stat()）
         compressed_size = 0
         try:
-            if archive_path_abs.exists():
-                compressed_size = archive_path_abs.stat().st_size
-                compress_progress['bytes_written'] = compressed_size
+            compressed_size = _archive_output_size(archive_path_abs, output_stream)
+            compress_progress['bytes_written'] = compressed_size
         except Exception:
             compressed_size = 0
             compress_progress['bytes_written'] = 0
         
         compress_progress['completed'] = True
         compress_progress['running'] = False
+
+        # 记录 zstd 帧边界（单帧输出时整个压缩包是一个帧）
+        if archive_index is not None and compressed_size > 0:
+            if seekable:
+                archive_index.frames = list(zstd_stream_ctx.frames)
+            else:
+                archive_index.add_frame(0, compressed_size, 0, archive_index.tar_size)
         
         # 计算压缩比（如果 compressed_size 为 0，压缩比也为 0）
         compression_ratio = (compressed_size / successful_original_size) if (successful_original_size > 0 and compressed_size > 0) else 0.0
@@ -973,7 +1062,8 @@ def _compress_with_zstd(
             'successful_files': successful_files,
             'failed_files': failed_files,
             'successful_original_size': successful_original_size,
-            'archive_path': str(archive_path_abs)
+            'archive_path': str(archive_path_abs),
+            'file_checksums': file_checksums
         }
     except Exception as zstd_error:
         logger.error(f"zstd压缩失败: {zstd_error}")
@@ -1008,13 +1098,14 @@ def _compress_with_zstd(
         )
 
         # 标记压缩完成（即使失败也要标记，避免无限等待）
-        _finalize_compression_progress(compress_progress, archive_path_abs)
+        _finalize_compression_progress(compress_progress, archive_path_abs, output_stream)
 
         return {
             'successful_files': successful_files,  # 保留已经成功添加的文件
             'failed_files': failed_files,  # 只包含真正失败的文件
             'successful_original_size': successful_original_size,
-            'archive_path': str(archive_path_abs)
+            'archive_path': str(archive_path_abs),
+            'file_checksums': file_checksums
         }
 
 
@@ -1260,6 +1351,46 @@ class Compressor:
                 else:
                     logger.info(f"固定字典={dict_size_str}, 线程={compression_command_threads}, 预计内存={memory_gb}GB")
             
+            # 跨备份集内容去重：内容已存在于仍保留磁带上的文件只记录引用，不写入本压缩包
+            dedup_session = getattr(backup_task, 'dedup_session', None)
+            dedup_references: Dict[str, Dict] = {}
+            dedup_bytes = 0
+            if dedup_session is not None and compression_enabled and compression_method in ('pgzip', 'tar', 'zstd'):
+                all_files = file_group
+                file_group, dedup_references = await asyncio.get_event_loop().run_in_executor(
+                    None, dedup_session.split_group, file_group
+                )
+                if dedup_references:
+                    dedup_bytes = sum(f['size'] for f in all_files if f['path'] in dedup_references)
+                    # 记录文件自身的成员名，恢复时按它确定目标路径（引用的成员名来自原备份集）
+                    source_paths = getattr(backup_task, 'source_paths', None) or []
+                    for path, ref in dedup_references.items():
+                        ref['arcname'] = _tar_member_name(_member_arcname(Path(path), source_paths))
+                    logger.info(f"[内容去重] 文件组 {len(all_files)} 个文件中 {len(dedup_references)} 个内容已在磁带上，只记录引用")
+                if not file_group:
+                    # 整组都是已有内容：不生成压缩包
+                    if shared_compress_progress is not None:
+                        shared_compress_progress['running'] = False
+                        shared_compress_progress['completed'] = True
+                    return {
+                        'path': None,
+                        'compressed_size': 0,
+                        'original_size': dedup_bytes,
+                        'successful_files': 0,
+                        'failed_files': 0,
+                        'checksum': None,
+                        'file_checksums': {path: ref['checksum'] for path, ref in dedup_references.items()},
+                        'dedup_references': dedup_references,
+                        'written_to_tape': False,
+                        'index_path': None,
+                        'compression_enabled': compression_enabled,
+                        'compression_method': compression_method,
+                        'compression_level': compression_level,
+                        'compression_threads': compression_threads,
+                        'compress_progress': shared_compress_progress or {'running': False, 'completed': True, 'bytes_written': 0},
+                        'compress_result': {'successful_files': [], 'failed_files': [], 'successful_original_size': 0}
+                    }
+
             # 统一使用相同的压缩流程：先压缩到temp目录
             # 根据配置决定是否移动文件（直接压缩到磁带时，不移动文件）
             compress_directly_to_tape = getattr(self.settings, 'COMPRESS_DIRECTLY_TO_TAPE', True)
@@ -1274,10 +1405,24 @@ class Compressor:
             temp_dir.mkdir(parents=True, exist_ok=True)
             backup_dir = temp_dir  # 统一使用temp目录作为压缩目标
 
-            await self._ensure_disk_space(temp_dir)
+            # 流式直写磁带：tar 类压缩输出经环形缓冲区直接写入 LTFS 目标文件，不经过 temp/final
+            stream_to_tape = (
+                compress_directly_to_tape and compression_enabled
+                and compression_method in ('pgzip', 'tar', 'zstd')
+                and getattr(self.settings, 'TAPE_STREAM_WRITE', False)
+            )
+            tape_drive_root = None
+            if stream_to_tape:
+                tape_drive_root = Path(self.settings.TAPE_DRIVE_LETTER.upper() + ":\\")
+                backup_dir = tape_drive_root / backup_set.set_id
+            else:
+                await self._ensure_disk_space(temp_dir)
             
             # 如果不直接压缩到磁带，需要final目录用于移动队列
-            if compress_directly_to_tape:
+            if stream_to_tape:
+                final_dir = None
+                logger.info(f"流式直写磁带: {backup_dir}（不经过临时目录）")
+            elif compress_directly_to_tape:
                 # 直接压缩到磁带，不需要final_dir（不移动文件）
                 final_dir = None
                 logger.info(f"压缩到临时目录: {backup_dir}，直接压缩到磁带模式（不移动文件）")
@@ -1371,11 +1516,18 @@ class Compressor:
                     'total_files_in_group': len(file_group)
                 }
             total_original_size = sum(f['size'] for f in file_group)
+            # tar 类压缩包同时生成成员索引（{压缩包名}.idx），恢复时可直接定位成员
+            archive_index = None
+            if compression_enabled and compression_method in ('pgzip', 'tar', 'zstd') \
+                    and getattr(self.settings, 'ARCHIVE_INDEX_ENABLED', True):
+                archive_index = ArchiveIndex()
+            # tar 类压缩包在写入成员的同时计算每个文件的内容校验和（FILE_CHECKSUM_ALGORITHM 为空时不计算）
+            file_checksum_algorithm = resolve_algorithm(getattr(self.settings, 'FILE_CHECKSUM_ALGORITHM', 'xxh3'))
             # 用于存储成功和失败的文件信息（在线程间共享）
             compress_result = {'successful_files': [], 'failed_files': [], 'successful_original_size': 0, 'archive_path': str(temp_archive_path)}
             
             # 将压缩操作放到线程池中执行，避免阻塞事件循环
-            def _do_7z_compress():
+            def _do_7z_compress(output_stream: Optional[BinaryIO] = None):
                 """在线程中执行7z压缩操作，带进度跟踪（同步顺序执行）"""
                 try:
                     # 在线程中创建目录（避免阻塞事件循环）
@@ -1397,6 +1549,7 @@ class Compressor:
                             compress_result['successful_files'] = compress_result_inner['successful_files']
                             compress_result['failed_files'] = compress_result_inner['failed_files']
                             compress_result['successful_original_size'] = compress_result_inner['successful_original_size']
+                            compress_result['file_checksums'] = compress_result_inner.get('file_checksums', {})
                             # 使用预设路径
                             compress_result['archive_path'] = str(temp_archive_path)
                         elif compression_method == 'pgzip':
@@ -1404,11 +1557,14 @@ class Compressor:
                             compress_result_inner = _compress_with_pgzip(
                                 archive_path, file_group, backup_task,
                                 compression_level, pgzip_threads, pgzip_block_size,
-                                compress_progress, total_files, base_processed_files
+                                compress_progress, total_files, base_processed_files,
+                                archive_index=archive_index, output_stream=output_stream,
+                                checksum_algorithm=file_checksum_algorithm, settings=self.settings
                             )
                             compress_result['successful_files'] = compress_result_inner['successful_files']
                             compress_result['failed_files'] = compress_result_inner['failed_files']
                             compress_result['successful_original_size'] = compress_result_inner['successful_original_size']
+                            compress_result['file_checksums'] = compress_result_inner.get('file_checksums', {})
                             # 使用预设路径
                             compress_result['archive_path'] = str(temp_archive_path)
                         elif compression_method == 'tar':
@@ -1416,11 +1572,14 @@ class Compressor:
                             compress_result_inner = _compress_with_tar(
                                 archive_path, file_group, backup_task,
                                 compression_level,
-                                compress_progress, total_files, base_processed_files
+                                compress_progress, total_files, base_processed_files,
+                                archive_index=archive_index, output_stream=output_stream,
+                                checksum_algorithm=file_checksum_algorithm, settings=self.settings
                             )
                             compress_result['successful_files'] = compress_result_inner['successful_files']
                             compress_result['failed_files'] = compress_result_inner['failed_files']
                             compress_result['successful_original_size'] = compress_result_inner['successful_original_size']
+                            compress_result['file_checksums'] = compress_result_inner.get('file_checksums', {})
                             # 使用预设路径
                             compress_result['archive_path'] = str(temp_archive_path)
                         elif compression_method == 'zstd':
@@ -1428,11 +1587,14 @@ class Compressor:
                             compress_result_inner = _compress_with_zstd(
                                 archive_path, file_group, backup_task,
                                 compression_level, zstd_threads,
-                                compress_progress, total_files, base_processed_files
+                                compress_progress, total_files, base_processed_files,
+                                archive_index=archive_index, output_stream=output_stream,
+                                checksum_algorithm=file_checksum_algorithm, settings=self.settings
                             )
                             compress_result['successful_files'] = compress_result_inner['successful_files']
                             compress_result['failed_files'] = compress_result_inner['failed_files']
                             compress_result['successful_original_size'] = compress_result_inner['successful_original_size']
+                            compress_result['file_checksums'] = compress_result_inner.get('file_checksums', {})
                             # 使用预设路径
                             compress_result['archive_path'] = str(temp_archive_path)
                         else:
@@ -1557,30 +1719,64 @@ class Compressor:
                     logger.error(f"压缩操作失败: {str(e)}")
                     import traceback
                     logger.error(traceback.format_exc())
+                    compress_result['compress_error'] = str(e)
                     compress_progress['completed'] = True
                     compress_progress['running'] = False
             
+            def _do_stream_compress():
+                """在线程中压缩并通过环形缓冲区直写磁带（先写 .part，校验通过后改名）"""
+                part_path = temp_archive_path.with_name(temp_archive_path.name + PART_SUFFIX)
+                governor = get_tape_governor(self.settings)
+                buffer_size = getattr(self.settings, 'TAPE_STREAM_BUFFER_SIZE', 256 * 1024 * 1024)
+                if governor is not None:
+                    buffer_size = governor.stream_buffer_size(buffer_size)
+                try:
+                    tape_stream = TapeStreamWriter(
+                        part_path,
+                        block_size=getattr(self.settings, 'TAPE_STREAM_BLOCK_SIZE', 1024 * 1024),
+                        buffer_size=buffer_size,
+                        checksum_algorithm=getattr(self.settings, 'TAPE_STREAM_CHECKSUM', 'sha256'),
+                        governor=governor,
+                    )
+                except Exception as open_error:
+                    logger.error(f"[直写磁带] 打开磁带目标文件失败: {part_path}, 错误: {open_error}")
+                    compress_result['tape_stream_error'] = str(open_error)
+                    compress_progress['completed'] = True
+                    compress_progress['running'] = False
+                    return
+                _do_7z_compress(tape_stream)
+                compress_result['tape_stream_error'] = self._finish_tape_stream(
+                    tape_stream, part_path, temp_archive_path, compress_result
+                )
+
             # 在线程池中异步启动压缩操作，立即返回，不等待完成
             loop = asyncio.get_event_loop()
             logger.warning(f"[压缩] 异步启动压缩任务，立即返回，不等待完成")
-            compression_future = loop.run_in_executor(None, _do_7z_compress)
+            compression_future = loop.run_in_executor(None, _do_stream_compress if stream_to_tape else _do_7z_compress)
             
             # 顺序执行：等待压缩完成、标注完成、移动到final
             # 等待压缩完成（不设置超时，让压缩自然完成）
             await compression_future
             logger.warning(f"[压缩] 压缩任务已完成")
             
-            # 等待文件完全关闭（Windows上文件句柄释放可能需要时间）
-            logger.debug("[压缩] 等待文件句柄完全释放...")
-            await asyncio.sleep(1.0)
-            
-            # 验证压缩文件是否存在
-            if not temp_archive_path.exists():
-                logger.error(f"[压缩] 压缩文件不存在: {temp_archive_path}")
-                return None
-            
-            # 验证压缩文件大小是否合理
-            compressed_size = temp_archive_path.stat().st_size
+            if stream_to_tape:
+                # 直写磁带：写入线程已 fsync 并核对写入字节数，大小取自写入字节数（不再 stat 磁带文件）
+                if compress_result.get('tape_stream_error'):
+                    logger.error(f"[压缩] 直写磁带失败: {compress_result['tape_stream_error']}")
+                    return None
+                compressed_size = compress_result.get('bytes_written', 0)
+            else:
+                # 等待文件完全关闭（Windows上文件句柄释放可能需要时间）
+                logger.debug("[压缩] 等待文件句柄完全释放...")
+                await asyncio.sleep(1.0)
+                
+                # 验证压缩文件是否存在
+                if not temp_archive_path.exists():
+                    logger.error(f"[压缩] 压缩文件不存在: {temp_archive_path}")
+                    return None
+                
+                # 验证压缩文件大小是否合理
+                compressed_size = temp_archive_path.stat().st_size
             total_original_size = sum(f['size'] for f in file_group)
             
             # 计算压缩比
@@ -1607,6 +1803,11 @@ class Compressor:
                         return None
             else:
                 logger.info(f"[压缩] 压缩文件存在，大小: {format_bytes(compressed_size)}, 路径: {temp_archive_path}")
+
+            # 写入成员索引（与压缩包同目录，随压缩包一起移动/写入磁带）
+            index_path = None
+            if archive_index is not None:
+                index_path = await loop.run_in_executor(None, archive_index.write, temp_archive_path)
             
             # 压缩完成后，标注完成
             from backup.backup_db import BackupDB
@@ -1620,7 +1821,11 @@ class Compressor:
             
             # 根据配置决定是否需要移动文件
             final_archive_path_for_db = temp_archive_path  # 默认使用temp路径
-            if compress_directly_to_tape:
+            if stream_to_tape:
+                # 与 TapeHandler.write_to_tape_drive 一致，记录磁带上的相对路径
+                final_archive_path_for_db = temp_archive_path.relative_to(tape_drive_root)
+                logger.info(f"[压缩] ✅ 已流式写入磁带: {temp_archive_path}")
+            elif compress_directly_to_tape:
                 # 直接压缩到磁带模式：不移动文件
                 logger.info(f"[压缩] 直接压缩到磁带模式：文件保留在临时目录: {temp_archive_path}")
                 # 直接压缩到磁带模式，使用temp路径
@@ -1677,16 +1882,53 @@ class Compressor:
                     return None
                 
                 logger.info(f"[压缩] ✅ 文件已成功移动到final目录: {final_archive_path}")
+
+                # 索引文件跟随压缩包移动
+                if index_path is not None and index_path.exists():
+                    final_index_path = final_dir / index_path.name
+                    try:
+                        await loop_move.run_in_executor(None, shutil.move, str(index_path), str(final_index_path))
+                        index_path = final_index_path
+                    except Exception as index_move_error:
+                        logger.warning(f"[压缩] 移动索引文件失败（不影响备份）: {index_move_error}")
                 
                 # 更新compress_result中的路径
                 compress_result['archive_path'] = str(final_archive_path)
                 # 更新最终路径（用于数据库更新）
                 final_archive_path_for_db = final_archive_path
-            
+
+                # 发布到待写磁带就绪队列（压缩包在前、索引在后），FinalDirMonitor 立即开始写入磁带
+                try:
+                    ready_queue = get_tape_ready_queue(self.settings)
+                    ready_queue.publish(final_archive_path, backup_set.set_id, compressed_size)
+                    if index_path is not None and Path(index_path).exists():
+                        ready_queue.publish(index_path, backup_set.set_id, Path(index_path).stat().st_size)
+                except Exception as publish_error:
+                    logger.error(f"[压缩] 发布到待写磁带队列失败（重启后会从final目录恢复）: {publish_error}")
+            
+            # 登记本压缩包中的文件内容，后续备份可引用（备份任务成功后才生效）
+            file_checksums = compress_result.get('file_checksums', {})
+            if dedup_session is not None and file_checksums:
+                source_paths = getattr(backup_task, 'source_paths', None) or []
+                member_names = {
+                    f['path']: _tar_member_name(_member_arcname(Path(f['path']), source_paths))
+                    for f in file_group if f['path'] in file_checksums
+                }
+                try:
+                    await loop.run_in_executor(
+                        None, dedup_session.register_archive,
+                        file_group, file_checksums, str(final_archive_path_for_db), member_names
+                    )
+                except Exception as dedup_error:
+                    logger.warning(f"[内容去重] 登记压缩包内容失败（不影响备份）: {dedup_error}")
+            if dedup_references:
+                file_checksums = dict(file_checksums)
+                file_checksums.update({path: ref['checksum'] for path, ref in dedup_references.items()})
+
             # 注意：is_copy_success 已在预读程序入队时设置为 TRUE，此处不再更新
             
-            # 计算原始大小
-            total_original_size = sum(f['size'] for f in file_group)
+            # 计算原始大小（含只记录引用的文件）
+            total_original_size = sum(f['size'] for f in file_group) + dedup_bytes
             
             # 使用最终路径（已移动到final或保留在temp）
             final_path = final_archive_path_for_db
@@ -1696,11 +1938,15 @@ class Compressor:
                 'path': str(final_path),  # 最终路径（已移动到final或保留在temp）
                 'temp_path': temp_archive_path,  # temp目录中的路径（Path对象）
                 'final_path': final_dir / temp_archive_path.name if final_dir else temp_archive_path,  # final目录中的路径（Path对象）
-                'compressed_size': final_path.stat().st_size if final_path.exists() else 0,  # 压缩文件大小
+                'compressed_size': compressed_size if stream_to_tape else (final_path.stat().st_size if final_path.exists() else 0),  # 压缩文件大小
                 'original_size': total_original_size,
                 'successful_files': len(compress_result.get('successful_files', [])),  # 实际成功文件数
                 'failed_files': len(compress_result.get('failed_files', [])),  # 实际失败文件数
-                'checksum': None,
+                'checksum': compress_result.get('checksum'),  # 直写磁带时为写入流的校验和
+                'file_checksums': file_checksums,  # 每个文件的内容校验和 {文件路径: 校验和}
+                'dedup_references': dedup_references,  # 内容去重命中的文件 {文件路径: 引用}（未写入本压缩包）
+                'written_to_tape': stream_to_tape,
+                'index_path': str(index_path) if index_path else None,  # 成员索引文件路径
                 'compression_enabled': compression_enabled,
                 'compression_method': compression_method,
                 'compression_level': compression_level if compression_enabled else None,
@@ -1717,6 +1963,40 @@ class Compressor:
             traceback.print_exc()
             return None
 
+    def _finish_tape_stream(self, tape_stream: TapeStreamWriter, part_path: Path, target_path: Path,
+                            compress_result: Dict) -> Optional[str]:
+        """关闭直写磁带的写入流，核对写入字节数并回读校验（TAPE_STREAM_VERIFY_READBACK，默认开启）后把 .part 改名为正式文件
+
+        Returns:
+            错误信息；成功返回 None（校验和、写入字节数写入 compress_result）
+        """
+        # 压缩出错或没有任何文件写入成功时 .part 内容不完整，丢弃而不是改名为正式文件
+        compress_error = compress_result.get('compress_error')
+        if compress_error or not compress_result.get('successful_files'):
+            tape_stream.abort()
+            error = compress_error or "没有文件压缩成功"
+            logger.error(f"[直写磁带] 压缩未成功，已丢弃: {part_path}, 原因: {error}")
+            return error
+        try:
+            digest = tape_stream.close()
+            if tape_stream.bytes_written != tape_stream.tell():
+                raise IOError(f"写入字节数不一致: 接收 {tape_stream.tell()}, 落盘 {tape_stream.bytes_written}")
+            if getattr(self.settings, 'TAPE_STREAM_VERIFY_READBACK', True):
+                readback = compute_file_checksum(part_path, tape_stream.checksum_algorithm, tape_stream.block_size)
+                if readback != digest:
+                    raise IOError(f"回读校验失败: 写入 {digest}, 回读 {readback}")
+            os.replace(part_path, target_path)
+        except Exception as e:
+            tape_stream.abort()
+            logger.error(f"[直写磁带] 完成写入失败: {target_path}, 错误: {e}")
+            return str(e)
+
+        compress_result['checksum'] = digest
+        compress_result['bytes_written'] = tape_stream.bytes_written
+        compress_result['tape_stream_stats'] = tape_stream.get_stats()
+        compress_result['archive_path'] = str(target_path)
+        return None
+
     async def _ensure_disk_space(self, target_dir: Path):
         """确保磁盘剩余空间满足 3 * MAX_FILE_SIZE 的要求"""
         try:
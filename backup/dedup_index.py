@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨备份集内容去重索引
+Cross-Backup-Set Content Deduplication Index
+
+按文件内容校验和（backup.file_hasher，压缩时在写入 tar 成员的同一次读取中计算）记录每份内容
+在磁带上的位置：(备份集, 磁带, 压缩包, 成员名)。开启 DEDUP_ENABLED 后，压缩前先查询索引，
+内容已存在于仍保留的磁带上的文件只记录引用（写入 backup_files.file_metadata.dedup_ref），
+不再写入新的压缩包；恢复时 RecoveryEngine 按引用从原压缩包中读取。
+
+索引是一个 SQLite 文件（DEDUP_INDEX_PATH）：
+    content_store : checksum → 内容当前副本所在的备份集/磁带/压缩包/成员
+    path_hint     : path → (size, mtime_ns, file_id, checksum)，未变化的文件不必重新读取即可得到校验和
+    tape_pin      : tape_id → 引用该磁带内容的备份集的最晚保留时间
+与文件状态目录一样，本次备份登记的内容/引用先写入 pending_* 暂存表，只有备份任务成功完成后才合并，
+避免引用尚未成功写入磁带的压缩包。
+
+被引用的磁带在 tape_pin.pinned_until 之前不会被自动擦除（TapeManager 过期检查），
+磁带被擦除或格式化后其内容从索引中移除。
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict, Optional, Any, Tuple
+
+from backup.file_hasher import compute_checksum, resolve_algorithm
+
+logger = logging.getLogger(__name__)
+
+# SQLite 单条语句参数个数上限（兼容旧版本的 999）
+_LOOKUP_CHUNK_SIZE = 900
+
+# 永久保留的备份集引用内容时，磁带固定到该时间（9999-12-31）
+_PIN_FOREVER = 253402300799.0
+
+
+def _to_timestamp(value) -> Optional[float]:
+    """datetime / 数字 / None 转换为时间戳"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return value.timestamp()
+    except Exception:
+        return None
+
+
+class ContentDedupIndex:
+    """内容去重索引（SQLite，线程安全）"""
+
+    def __init__(self, index_path):
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.index_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS content_store (
+                    checksum TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    set_id TEXT NOT NULL,
+                    backup_set_db_id INTEGER,
+                    tape_id TEXT,
+                    tape_file_path TEXT NOT NULL,
+                    member_name TEXT NOT NULL,
+                    registered_at REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_content_store_tape ON content_store(tape_id)"
+            )
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS path_hint (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    file_id INTEGER NOT NULL DEFAULT 0,
+                    checksum TEXT NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_content (
+                    set_id TEXT NOT NULL,
+                    checksum TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    backup_set_db_id INTEGER,
+                    tape_id TEXT,
+                    tape_file_path TEXT NOT NULL,
+                    member_name TEXT NOT NULL,
+                    PRIMARY KEY (set_id, checksum)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_hint (
+                    set_id TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    file_id INTEGER NOT NULL DEFAULT 0,
+                    checksum TEXT NOT NULL,
+                    PRIMARY KEY (set_id, path)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_pin (
+                    set_id TEXT NOT NULL,
+                    tape_id TEXT NOT NULL,
+                    pinned_until REAL NOT NULL,
+                    PRIMARY KEY (set_id, tape_id)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tape_pin (
+                    tape_id TEXT PRIMARY KEY,
+                    pinned_until REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+    # ---------- 查询 ----------
+
+    def lookup_hints(self, paths: List[str]) -> Dict[str, Tuple[int, int, int, str]]:
+        """批量查询路径提示 {path: (size, mtime_ns, file_id, checksum)}"""
+        result = {}
+        with self._lock:
+            for start in range(0, len(paths), _LOOKUP_CHUNK_SIZE):
+                chunk = paths[start:start + _LOOKUP_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT path, size, mtime_ns, file_id, checksum FROM path_hint WHERE path IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    result[row[0]] = (row[1], row[2], row[3], row[4])
+        return result
+
+    def lookup_content(self, checksums: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量查询内容位置 {checksum: {...}}"""
+        result = {}
+        columns = ("checksum", "size", "set_id", "backup_set_db_id", "tape_id",
+                   "tape_file_path", "member_name", "registered_at")
+        with self._lock:
+            for start in range(0, len(checksums), _LOOKUP_CHUNK_SIZE):
+                chunk = checksums[start:start + _LOOKUP_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT {', '.join(columns)} FROM content_store WHERE checksum IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    result[row[0]] = dict(zip(columns, row))
+        return result
+
+    def tape_pinned_until(self, tape_id: str) -> Optional[float]:
+        """磁带上被其他备份集引用的内容的最晚保留时间（没有引用返回 None）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pinned_until FROM tape_pin WHERE tape_id = ?", (tape_id,)
+            ).fetchone()
+        return row[0] if row and row[0] else None
+
+    # ---------- 暂存与提交 ----------
+
+    def stage(self, set_id: str, contents: List[Tuple] = None, hints: List[Tuple] = None,
+              pins: List[Tuple] = None):
+        """暂存本次备份登记的内容、路径提示和引用
+
+        Args:
+            contents: [(checksum, size, backup_set_db_id, tape_id, tape_file_path, member_name), ...]
+            hints: [(path, size, mtime_ns, file_id, checksum), ...]
+            pins: [(tape_id, pinned_until), ...]
+        """
+        if not (contents or hints or pins):
+            return
+        with self._lock, self._conn:
+            if contents:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO pending_content (set_id, checksum, size, backup_set_db_id, tape_id, "
+                    "tape_file_path, member_name) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(set_id,) + tuple(item) for item in contents]
+                )
+            if hints:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO pending_hint (set_id, path, size, mtime_ns, file_id, checksum) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(set_id,) + tuple(item) for item in hints]
+                )
+            if pins:
+                self._conn.executemany(
+                    "INSERT INTO pending_pin (set_id, tape_id, pinned_until) VALUES (?, ?, ?) "
+                    "ON CONFLICT(set_id, tape_id) DO UPDATE SET pinned_until = MAX(pinned_until, excluded.pinned_until)",
+                    [(set_id,) + tuple(item) for item in pins]
+                )
+
+    def commit_stage(self, set_id: str) -> Tuple[int, int]:
+        """备份成功后合并暂存数据，返回 (新登记的内容数, 被引用的磁带数)"""
+        now_ts = time.time()
+        with self._lock, self._conn:
+            contents = self._conn.execute(
+                "SELECT COUNT(*) FROM pending_content WHERE set_id = ?", (set_id,)
+            ).fetchone()[0]
+            pinned_tapes = self._conn.execute(
+                "SELECT COUNT(*) FROM pending_pin WHERE set_id = ?", (set_id,)
+            ).fetchone()[0]
+            # 新写入磁带的内容（新内容，或原副本过旧而重新归档的内容）成为该校验和的当前副本
+            self._conn.execute("""
+                INSERT OR REPLACE INTO content_store (
+                    checksum, size, set_id, backup_set_db_id, tape_id, tape_file_path, member_name, registered_at
+                )
+                SELECT checksum, size, set_id, backup_set_db_id, tape_id, tape_file_path, member_name, ?
+                FROM pending_content WHERE set_id = ?
+            """, (now_ts, set_id))
+            # 被引用的磁带至少保留到引用它的备份集到期（按磁带记录，副本被替换后固定仍然有效）
+            self._conn.execute("""
+                INSERT INTO tape_pin (tape_id, pinned_until)
+                SELECT tape_id, pinned_until FROM pending_pin WHERE set_id = ?
+                ON CONFLICT(tape_id) DO UPDATE SET pinned_until = MAX(pinned_until, excluded.pinned_until)
+            """, (set_id,))
+            self._conn.execute("""
+                INSERT OR REPLACE INTO path_hint (path, size, mtime_ns, file_id, checksum)
+                SELECT path, size, mtime_ns, file_id, checksum FROM pending_hint WHERE set_id = ?
+            """, (set_id,))
+            for table in ("pending_content", "pending_hint", "pending_pin"):
+                self._conn.execute(f"DELETE FROM {table} WHERE set_id = ?", (set_id,))
+        return contents, pinned_tapes
+
+    def discard_stage(self, set_id: Optional[str] = None):
+        """丢弃暂存数据（set_id 为 None 时丢弃全部，用于清理上次异常退出的残留）"""
+        with self._lock, self._conn:
+            for table in ("pending_content", "pending_hint", "pending_pin"):
+                if set_id is None:
+                    self._conn.execute(f"DELETE FROM {table}")
+                else:
+                    self._conn.execute(f"DELETE FROM {table} WHERE set_id = ?", (set_id,))
+
+    def forget_tape(self, tape_id: str) -> int:
+        """磁带被擦除/格式化：移除其上的全部内容，返回移除条数"""
+        if not tape_id:
+            return 0
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM content_store WHERE tape_id = ?", (tape_id,))
+            removed = cursor.rowcount or 0
+            self._conn.execute("DELETE FROM tape_pin WHERE tape_id = ?", (tape_id,))
+        if removed:
+            logger.info(f"[内容去重] 磁带 {tape_id} 已擦除，从去重索引中移除 {removed} 份内容")
+        return removed
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class DedupSession:
+    """一次备份运行的去重会话（压缩器在压缩文件组之前调用）"""
+
+    def __init__(self, index: ContentDedupIndex, set_id: str, backup_set_db_id: Optional[int],
+                 tape_id: Optional[str], retention_until: Optional[float], algorithm: str,
+                 min_file_size: int = 0, max_reference_age_days: int = 90, hash_unknown_files: bool = False):
+        self.index = index
+        self.set_id = str(set_id)
+        self.backup_set_db_id = backup_set_db_id
+        self.tape_id = tape_id
+        self.retention_until = retention_until if retention_until is not None else _PIN_FOREVER
+        self.algorithm = algorithm
+        self.min_file_size = max(0, int(min_file_size or 0))
+        self.max_reference_age = max(0, int(max_reference_age_days or 0)) * 86400
+        self.hash_unknown_files = bool(hash_unknown_files)
+        self._lock = threading.Lock()
+        self.stats = {
+            "checked": 0,
+            "referenced": 0,
+            "referenced_bytes": 0,
+            "hashed": 0,
+            "registered": 0,
+        }
+
+    @classmethod
+    def from_task(cls, backup_task, backup_set, settings) -> Optional["DedupSession"]:
+        """根据配置创建去重会话，未启用时返回 None"""
+        if not getattr(settings, "DEDUP_ENABLED", False):
+            return None
+        algorithm = resolve_algorithm(getattr(settings, "FILE_CHECKSUM_ALGORITHM", "xxh3"))
+        if algorithm is None:
+            logger.warning("[内容去重] FILE_CHECKSUM_ALGORITHM 为空，无法按内容去重，本次不启用")
+            return None
+        index = get_dedup_index(settings)
+        set_id = getattr(backup_set, "set_id", None) or getattr(backup_set, "id", None)
+        index.discard_stage(str(set_id))
+        tape_id = getattr(backup_set, "tape_id", None) or getattr(backup_task, "tape_id", None)
+        if getattr(backup_task, "tape_formatted", False) and tape_id:
+            # 本次备份前格式化了磁带，磁带上原有的压缩包已不存在
+            index.forget_tape(tape_id)
+        session = cls(
+            index=index,
+            set_id=set_id,
+            backup_set_db_id=getattr(backup_set, "id", None),
+            tape_id=tape_id,
+            retention_until=_to_timestamp(getattr(backup_set, "retention_until", None)),
+            algorithm=algorithm,
+            min_file_size=getattr(settings, "DEDUP_MIN_FILE_SIZE", 1048576),
+            max_reference_age_days=getattr(settings, "DEDUP_MAX_REFERENCE_AGE_DAYS", 90),
+            hash_unknown_files=getattr(settings, "DEDUP_HASH_UNKNOWN_FILES", False),
+        )
+        logger.info(
+            f"[内容去重] 已启用：备份集={set_id}，磁带={tape_id}，算法={algorithm}，"
+            f"最小文件={session.min_file_size} 字节，引用最长 {getattr(settings, 'DEDUP_MAX_REFERENCE_AGE_DAYS', 90)} 天"
+        )
+        return session
+
+    def split_group(self, file_group: List[Dict]) -> Tuple[List[Dict], Dict[str, Dict[str, Any]]]:
+        """把文件组拆分为需要压缩的文件和只记录引用的文件
+
+        Returns:
+            (to_compress, references): references 为 {file_path: dedup_ref}
+        """
+        candidates = []
+        for file_info in file_group:
+            if (file_info.get("size", 0) or 0) < self.min_file_size or file_info.get("is_dir"):
+                continue
+            try:
+                st = os.stat(file_info["path"])
+            except OSError:
+                continue
+            candidates.append((file_info, st))
+        if not candidates:
+            return file_group, {}
+
+        hints = self.index.lookup_hints([info["path"] for info, _ in candidates])
+        known: List[Tuple[Dict, os.stat_result, str]] = []
+        new_hints = []
+        for file_info, st in candidates:
+            path = file_info["path"]
+            hint = hints.get(path)
+            if hint and hint[0] == st.st_size and hint[1] == st.st_mtime_ns \
+                    and (not hint[2] or not st.st_ino or hint[2] == st.st_ino):
+                known.append((file_info, st, hint[3]))
+            elif self.hash_unknown_files:
+                # 未见过或已变化的文件：额外读取一遍计算校验和（可发现改名/复制的文件）
+                try:
+                    checksum = compute_checksum(path, algorithm=self.algorithm)
+                except OSError:
+                    continue
+                self.stats["hashed"] += 1
+                known.append((file_info, st, checksum))
+                new_hints.append((path, st.st_size, st.st_mtime_ns, st.st_ino or 0, checksum))
+
+        contents = self.index.lookup_content(list({checksum for _, _, checksum in known}))
+        now_ts = time.time()
+        references: Dict[str, Dict[str, Any]] = {}
+        pinned_tapes = set()
+        for file_info, st, checksum in known:
+            content = contents.get(checksum)
+            if not content or content["size"] != st.st_size or content["set_id"] == self.set_id:
+                continue
+            if self.max_reference_age and now_ts - content["registered_at"] > self.max_reference_age:
+                # 原副本太旧：重新归档，新副本成为当前副本，避免磁带长期被引用
+                continue
+            references[file_info["path"]] = {
+                "checksum": checksum,
+                "set_id": content["set_id"],
+                "backup_set_id": content["backup_set_db_id"],
+                "tape_id": content["tape_id"],
+                "tape_file_path": content["tape_file_path"],
+                "member": content["member_name"],
+            }
+            if content["tape_id"] and content["tape_id"] != self.tape_id:
+                pinned_tapes.add(content["tape_id"])
+
+        self.index.stage(self.set_id, hints=new_hints,
+                         pins=[(tape_id, self.retention_until) for tape_id in pinned_tapes])
+        with self._lock:
+            self.stats["checked"] += len(file_group)
+            self.stats["referenced"] += len(references)
+            self.stats["referenced_bytes"] += sum(
+                info.get("size", 0) or 0 for info in file_group if info["path"] in references
+            )
+        if not references:
+            return file_group, references
+        return [info for info in file_group if info["path"] not in references], references
+
+    def register_archive(self, file_group: List[Dict], file_checksums: Dict[str, str],
+                         tape_file_path: str, member_names: Dict[str, str]):
+        """登记本次写入压缩包的文件内容（备份成功后才生效）"""
+        contents = []
+        hints = []
+        for file_info in file_group:
+            path = file_info["path"]
+            checksum = file_checksums.get(path)
+            member_name = member_names.get(path)
+            if not checksum or not member_name:
+                continue
+            size = file_info.get("size", 0) or 0
+            contents.append((checksum, size, self.backup_set_db_id, self.tape_id, str(tape_file_path), member_name))
+            try:
+                st = os.stat(path)
+                if st.st_size == size:
+                    hints.append((path, st.st_size, st.st_mtime_ns, st.st_ino or 0, checksum))
+            except OSError:
+                pass
+        self.index.stage(self.set_id, contents=contents, hints=hints)
+        with self._lock:
+            self.stats["registered"] += len(contents)
+
+    def commit(self):
+        """备份任务成功完成后调用"""
+        contents, pinned_tapes = self.index.commit_stage(self.set_id)
+        logger.info(
+            f"[内容去重] 已更新去重索引（备份集={self.set_id}）：新登记 {contents} 份内容，"
+            f"引用已有内容 {self.stats['referenced']} 个文件 / {self.stats['referenced_bytes']} 字节，"
+            f"固定 {pinned_tapes} 盘磁带"
+        )
+
+    def discard(self):
+        """备份失败或取消时调用"""
+        self.index.discard_stage(self.set_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+
+_dedup_index: Optional[ContentDedupIndex] = None
+_dedup_index_lock = threading.Lock()
+
+
+def get_dedup_index(settings=None) -> ContentDedupIndex:
+    """获取进程内唯一的去重索引"""
+    global _dedup_index
+    if _dedup_index is not None:
+        return _dedup_index
+    if settings is None:
+        from config.settings import get_settings
+        settings = get_settings()
+    with _dedup_index_lock:
+        if _dedup_index is None:
+            _dedup_index = ContentDedupIndex(getattr(settings, "DEDUP_INDEX_PATH", "data/dedup_index.db"))
+    return _dedup_index
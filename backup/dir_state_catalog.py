@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录状态目录模块（重复扫描时跳过未变化的目录）
+Directory State Catalog Module
+
+每个源路径一个持久化的 SQLite 目录文件（{FILE_CATALOG_DIR}/dir_state_{源路径哈希}.db），记录上次成功扫描的：
+    dir_state:   目录路径、父目录、mtime_ns、子条目数、直接文件数/字节数、子树文件数/字节数
+    dir_entries: 每个目录的列表（子目录名；文件名、大小、mtime_ns、inode、mode）
+
+启用 SCAN_TRUST_DIR_MTIME 后，增量/差异备份扫描时 ParallelDirWalker 对每个目录只做一次 stat：
+目录 mtime 与上次成功扫描相同则直接复用上次的列表（不 scandir、不逐个 stat 文件），否则正常扫描。
+目录 mtime 只在增删/改名子条目时变化，原地修改文件内容不会改变目录 mtime，
+因此信任目录 mtime 的扫描会漏掉"原地修改且目录未变化"的文件；完整备份始终完整扫描并重建本目录。
+
+与文件状态目录一样，本次扫描结果先写入暂存表，备份任务成功完成后才合并，失败或取消时丢弃。
+排除规则变化后不信任上次的列表（本次完整扫描）。
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+
+from backup.file_state_catalog import MODE_FULL, backup_mode_for_task, _normalize_source_path
+from backup.parallel_dir_walker import ScanRecord
+
+logger = logging.getLogger(__name__)
+
+_KIND_DIR = "d"
+_KIND_FILE = "f"
+_STAGE_FLUSH_DIRS = 500  # 暂存多少个目录后写入 SQLite
+
+
+def get_dir_catalog_path(source_path: str, catalog_dir) -> Path:
+    """返回源路径对应的目录状态文件路径"""
+    digest = hashlib.sha1(_normalize_source_path(source_path).encode("utf-8")).hexdigest()[:16]
+    return Path(catalog_dir) / f"dir_state_{digest}.db"
+
+
+def exclude_patterns_key(exclude_patterns: Optional[List[str]]) -> str:
+    """排除规则指纹（规则变化后上次的目录列表不再可信）"""
+    return hashlib.sha1("\n".join(exclude_patterns or []).encode("utf-8")).hexdigest()
+
+
+def _subtree_range(path: str) -> Tuple[str, str]:
+    """返回 path 子树（不含自身）在按字符串排序的主键上的区间 [low, high)"""
+    low = path.rstrip("\\/") + os.sep
+    return low, low[:-1] + chr(ord(os.sep) + 1)
+
+
+class DirStateCatalog:
+    """单个源路径的目录状态目录（SQLite）"""
+
+    def __init__(self, source_path: str, catalog_path: Path, backup_set: str, exclude_key: str,
+                 trust: bool = False):
+        self.source_path = source_path
+        self.catalog_path = Path(catalog_path)
+        self.catalog_path.parent.mkdir(parents=True, exist_ok=True)
+        self.backup_set = backup_set
+        self.exclude_key = exclude_key
+        self._lock = threading.Lock()
+        self._staged_dirs: List[Tuple] = []
+        self._staged_entries: List[Tuple] = []
+        self._conn = sqlite3.connect(str(self.catalog_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        self.trusted = trust and self._is_trustworthy()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS dir_state (
+                    path TEXT PRIMARY KEY,
+                    parent TEXT,
+                    mtime_ns INTEGER NOT NULL,
+                    child_count INTEGER NOT NULL DEFAULT 0,
+                    file_count INTEGER NOT NULL DEFAULT 0,
+                    total_bytes INTEGER NOT NULL DEFAULT 0,
+                    subtree_files INTEGER NOT NULL DEFAULT 0,
+                    subtree_bytes INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS dir_entries (
+                    dir TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    mtime_ns INTEGER NOT NULL DEFAULT 0,
+                    file_id INTEGER NOT NULL DEFAULT 0,
+                    mode INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (dir, name)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_dir_state (
+                    backup_set TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    parent TEXT,
+                    mtime_ns INTEGER NOT NULL,
+                    child_count INTEGER NOT NULL DEFAULT 0,
+                    file_count INTEGER NOT NULL DEFAULT 0,
+                    total_bytes INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (backup_set, path)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_dir_entries (
+                    backup_set TEXT NOT NULL,
+                    dir TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    mtime_ns INTEGER NOT NULL DEFAULT 0,
+                    file_id INTEGER NOT NULL DEFAULT 0,
+                    mode INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (backup_set, dir, name)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS catalog_info (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO catalog_info (key, value) VALUES ('source_path', ?)",
+                (self.source_path,)
+            )
+
+    def _get_info(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM catalog_info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _is_trustworthy(self) -> bool:
+        with self._lock:
+            if not self._get_info("last_backup_set"):
+                return False
+            if self._get_info("exclude_key") != self.exclude_key:
+                logger.info(f"[目录状态] 排除规则已变化，本次完整扫描: {self.source_path}")
+                return False
+        return True
+
+    def subtree_totals(self, path: str) -> Optional[Tuple[int, int]]:
+        """上次成功扫描时 path 子树的 (文件数, 字节数)，未记录时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT subtree_files, subtree_bytes FROM dir_state WHERE path = ?", (path,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def lookup(self, dir_path: str, mtime_ns: int) -> Optional[Tuple[List[str], List[ScanRecord]]]:
+        """目录 mtime 与上次成功扫描相同时返回上次的 (子目录列表, 文件记录列表)，否则返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime_ns FROM dir_state WHERE path = ?", (dir_path,)
+            ).fetchone()
+            if row is None or row[0] != mtime_ns:
+                return None
+            rows = self._conn.execute(
+                "SELECT name, kind, size, mtime_ns, file_id, mode FROM dir_entries WHERE dir = ?",
+                (dir_path,)
+            ).fetchall()
+        join = os.path.join
+        subdirs = []
+        files = []
+        for name, kind, size, file_mtime_ns, file_id, mode in rows:
+            if kind == _KIND_DIR:
+                subdirs.append(join(dir_path, name))
+            else:
+                files.append(ScanRecord(join(dir_path, name), size, file_mtime_ns, file_id, mode))
+        return subdirs, files
+
+    def record(self, dir_path: str, mtime_ns: int, child_count: int,
+               subdirs: List[str], files: List[ScanRecord]):
+        """暂存一个完整扫描过的目录（由遍历线程调用）"""
+        basename = os.path.basename
+        entries = [(self.backup_set, dir_path, basename(path), _KIND_DIR, 0, 0, 0, 0) for path in subdirs]
+        entries.extend(
+            (self.backup_set, dir_path, basename(rec.path), _KIND_FILE, rec.size, rec.mtime_ns, rec.inode, rec.mode)
+            for rec in files
+        )
+        parent = os.path.dirname(dir_path) if dir_path != self.source_path else None
+        dir_row = (self.backup_set, dir_path, parent, mtime_ns, child_count,
+                   len(files), sum(rec.size for rec in files))
+        with self._lock:
+            self._staged_dirs.append(dir_row)
+            self._staged_entries.extend(entries)
+            if len(self._staged_dirs) >= _STAGE_FLUSH_DIRS:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._staged_dirs:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pending_dir_state "
+                "(backup_set, path, parent, mtime_ns, child_count, file_count, total_bytes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._staged_dirs
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pending_dir_entries "
+                "(backup_set, dir, name, kind, size, mtime_ns, file_id, mode) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._staged_entries
+            )
+        self._staged_dirs = []
+        self._staged_entries = []
+
+    def commit_stage(self, complete_walk: bool) -> int:
+        """备份成功后合并暂存的目录状态，返回合并的目录数
+
+        Args:
+            complete_walk: 本次是否完整扫描了整个源路径（未复用任何目录列表）
+        """
+        backup_set = self.backup_set
+        with self._lock:
+            self._flush_locked()
+            with self._conn:
+                staged = self._conn.execute(
+                    "SELECT COUNT(*) FROM pending_dir_state WHERE backup_set = ?", (backup_set,)
+                ).fetchone()[0]
+                if complete_walk:
+                    self._conn.execute("DELETE FROM dir_state")
+                    self._conn.execute("DELETE FROM dir_entries")
+                else:
+                    # 重新扫描过的目录中消失的子目录：连同其子树一起删除
+                    removed = self._conn.execute("""
+                        SELECT e.dir, e.name FROM dir_entries e
+                        JOIN pending_dir_state p ON p.backup_set = ? AND p.path = e.dir
+                        WHERE e.kind = ? AND NOT EXISTS (
+                            SELECT 1 FROM pending_dir_entries n
+                            WHERE n.backup_set = p.backup_set AND n.dir = e.dir AND n.name = e.name AND n.kind = ?
+                        )
+                    """, (backup_set, _KIND_DIR, _KIND_DIR)).fetchall()
+                    for parent_dir, name in removed:
+                        removed_path = os.path.join(parent_dir, name)
+                        low, high = _subtree_range(removed_path)
+                        self._conn.execute(
+                            "DELETE FROM dir_state WHERE path = ? OR (path >= ? AND path < ?)",
+                            (removed_path, low, high)
+                        )
+                        self._conn.execute(
+                            "DELETE FROM dir_entries WHERE dir = ? OR (dir >= ? AND dir < ?)",
+                            (removed_path, low, high)
+                        )
+                    self._conn.execute(
+                        "DELETE FROM dir_entries WHERE dir IN "
+                        "(SELECT path FROM pending_dir_state WHERE backup_set = ?)",
+                        (backup_set,)
+                    )
+                self._conn.execute("""
+                    INSERT OR REPLACE INTO dir_entries (dir, name, kind, size, mtime_ns, file_id, mode)
+                    SELECT dir, name, kind, size, mtime_ns, file_id, mode
+                    FROM pending_dir_entries WHERE backup_set = ?
+                """, (backup_set,))
+                self._conn.execute("""
+                    INSERT OR REPLACE INTO dir_state
+                        (path, parent, mtime_ns, child_count, file_count, total_bytes)
+                    SELECT path, parent, mtime_ns, child_count, file_count, total_bytes
+                    FROM pending_dir_state WHERE backup_set = ?
+                """, (backup_set,))
+                self._conn.execute("DELETE FROM pending_dir_entries WHERE backup_set = ?", (backup_set,))
+                self._conn.execute("DELETE FROM pending_dir_state WHERE backup_set = ?", (backup_set,))
+                self._update_subtree_totals()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO catalog_info (key, value) VALUES (?, ?)",
+                    [("last_backup_set", backup_set), ("exclude_key", self.exclude_key)]
+                )
+        return staged
+
+    def _update_subtree_totals(self):
+        """自底向上汇总每个目录子树的文件数和字节数"""
+        rows = self._conn.execute(
+            "SELECT path, parent, file_count, total_bytes FROM dir_state"
+        ).fetchall()
+        totals: Dict[str, List[int]] = {path: [files, size] for path, _, files, size in rows}
+        # 路径越长越深，先处理子目录再累加到父目录
+        for path, parent, _, _ in sorted(rows, key=lambda row: len(row[0]), reverse=True):
+            parent_totals = totals.get(parent) if parent else None
+            if parent_totals is not None:
+                parent_totals[0] += totals[path][0]
+                parent_totals[1] += totals[path][1]
+        self._conn.executemany(
+            "UPDATE dir_state SET subtree_files = ?, subtree_bytes = ? WHERE path = ?",
+            [(files, size, path) for path, (files, size) in totals.items()]
+        )
+
+    def discard_stage(self, backup_set: Optional[str] = None):
+        """丢弃暂存状态（backup_set 为 None 时丢弃全部，用于清理上次异常退出的残留）"""
+        with self._lock:
+            self._staged_dirs = []
+            self._staged_entries = []
+            with self._conn:
+                if backup_set is None:
+                    self._conn.execute("DELETE FROM pending_dir_entries")
+                    self._conn.execute("DELETE FROM pending_dir_state")
+                else:
+                    self._conn.execute("DELETE FROM pending_dir_entries WHERE backup_set = ?", (backup_set,))
+                    self._conn.execute("DELETE FROM pending_dir_state WHERE backup_set = ?", (backup_set,))
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class DirScanCache:
+    """一次备份运行的目录状态缓存（ParallelDirWalker 按根目录取对应的目录状态目录）"""
+
+    def __init__(self, source_paths: List[str], backup_set: str, catalog_dir,
+                 exclude_patterns: Optional[List[str]] = None, trust: bool = False):
+        self.backup_set = str(backup_set)
+        exclude_key = exclude_patterns_key(exclude_patterns)
+        self._catalogs: Dict[str, DirStateCatalog] = {}
+        for source_path in dict.fromkeys(source_paths or []):
+            catalog = DirStateCatalog(
+                source_path, get_dir_catalog_path(source_path, catalog_dir),
+                self.backup_set, exclude_key, trust=trust
+            )
+            # 清理上次异常退出残留的暂存数据
+            catalog.discard_stage()
+            self._catalogs[_normalize_source_path(source_path)] = catalog
+        self._walked = set()
+
+    @classmethod
+    def from_task(cls, backup_task, backup_set, settings,
+                  exclude_patterns: Optional[List[str]] = None) -> Optional["DirScanCache"]:
+        """SCAN_TRUST_DIR_MTIME 启用时创建目录状态缓存（完整备份只记录不复用），否则返回 None"""
+        if not getattr(settings, "FILE_CATALOG_ENABLED", True) or not getattr(settings, "SCAN_TRUST_DIR_MTIME", False):
+            return None
+        mode = backup_mode_for_task(backup_task)
+        backup_set_key = getattr(backup_set, "set_id", None) or getattr(backup_set, "id", None)
+        cache = cls(
+            source_paths=getattr(backup_task, "source_paths", None) or [],
+            backup_set=backup_set_key,
+            catalog_dir=getattr(settings, "FILE_CATALOG_DIR", "data/file_catalog"),
+            exclude_patterns=exclude_patterns,
+            trust=mode != MODE_FULL,
+        )
+        trusted = [catalog.source_path for catalog in cache._catalogs.values() if catalog.trusted]
+        logger.info(
+            f"[目录状态] 模式={mode}，备份集={backup_set_key}，"
+            f"复用未变化目录列表的源路径: {trusted if trusted else '无（本次完整扫描并记录）'}"
+        )
+        return cache
+
+    def catalog_for(self, root: str) -> Optional[DirStateCatalog]:
+        """返回根目录对应的目录状态目录（只有源路径本身作为遍历根时才记录）"""
+        catalog = self._catalogs.get(_normalize_source_path(root))
+        if catalog is not None:
+            self._walked.add(id(catalog))
+            # 以遍历时的实际路径作为目录状态的根
+            catalog.source_path = str(root)
+        return catalog
+
+    def commit(self) -> int:
+        """备份任务成功完成后调用：合并本次扫描的目录状态"""
+        committed = 0
+        for catalog in self._catalogs.values():
+            if id(catalog) not in self._walked:
+                catalog.discard_stage(self.backup_set)
+                continue
+            committed += catalog.commit_stage(complete_walk=not catalog.trusted)
+        logger.info(f"[目录状态] 已更新目录状态目录（备份集={self.backup_set}，重新扫描的目录数={committed}）")
+        return committed
+
+    def discard(self):
+        """备份失败或取消时调用：丢弃本次暂存状态"""
+        for catalog in self._catalogs.values():
+            try:
+                catalog.discard_stage(self.backup_set)
+            except sqlite3.Error as e:
+                logger.warning(f"[目录状态] 丢弃暂存状态失败: {catalog.catalog_path}, 错误: {e}")
+
+    def close(self):
+        for catalog in self._catalogs.values():
+            catalog.close()
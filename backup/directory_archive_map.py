@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录 → 压缩包映射模块
+Directory To Archive Map Module
+
+压缩工作器按目录汇总每个压缩包中的文件（summarize_directories），openGauss 调度器更新文件记录时
+在同一事务中写入 backup_directory_archives(backup_set_id, directory_path, chunk_number, tape_file_path,
+file_count, total_size)。恢复某个目录时先查询该表，只需读取包含该目录（及子目录）文件的压缩包，
+不必扫描整个备份集的文件记录。
+配合 COMPRESSION_GROUPING_POLICY = "directory" 按目录装箱，一个目录通常只落在一两个压缩包中。
+"""
+
+import logging
+import os
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY_ARCHIVE_TABLE = "backup_directory_archives"
+
+
+def _directory_of(file_info: Dict) -> str:
+    directory = file_info.get('directory_path')
+    if directory:
+        return directory
+    file_path = file_info.get('file_path') or file_info.get('path') or ""
+    return os.path.dirname(file_path)
+
+
+def summarize_directories(files: Sequence[Dict]) -> Dict[str, List[int]]:
+    """按目录汇总 {目录: [文件数, 总大小]}"""
+    summary: Dict[str, List[int]] = {}
+    for file_info in files:
+        entry = summary.setdefault(_directory_of(file_info), [0, 0])
+        entry[0] += 1
+        entry[1] += int(file_info.get('size') or file_info.get('file_size') or 0)
+    return summary
+
+
+async def record_directory_archives(conn, backup_set_id: int, chunk_number: Optional[int],
+                                    tape_file_path: Optional[str], summary: Dict[str, List[int]]) -> int:
+    """记录一个压缩包包含的目录（summary 为 summarize_directories 的结果，同一压缩包重复记录时先删除旧记录）
+
+    不提交事务，由调用方与文件记录的更新一起提交。返回记录的目录数
+    """
+    if not summary or chunk_number is None:
+        return 0
+    # openGauss 不支持 ON CONFLICT，先删除同一压缩包的旧记录
+    await conn.execute(
+        f"DELETE FROM {DIRECTORY_ARCHIVE_TABLE} WHERE backup_set_id = $1 AND chunk_number = $2",
+        backup_set_id,
+        chunk_number,
+    )
+    await conn.executemany(
+        f"""
+        INSERT INTO {DIRECTORY_ARCHIVE_TABLE}
+            (backup_set_id, directory_path, chunk_number, tape_file_path, file_count, total_size)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        """,
+        [
+            (backup_set_id, directory, chunk_number, tape_file_path, counts[0], counts[1])
+            for directory, counts in summary.items()
+        ],
+    )
+    return len(summary)
+
+
+def _like_prefix(directory_path: str) -> str:
+    """子目录的 LIKE 前缀（转义 LIKE 通配符，分隔符与路径本身一致）"""
+    separator = "\\" if "\\" in directory_path and "/" not in directory_path else "/"
+    prefix = directory_path.rstrip("/\\") + separator
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+async def find_directory_archives(conn, backup_set_id: int, directory_path: str,
+                                  include_subdirs: bool = True) -> List[Dict]:
+    """查询目录（默认含子目录）所在的压缩包，按 chunk_number 排序
+
+    Returns:
+        [{'chunk_number', 'tape_file_path', 'file_count', 'total_size'}]
+    """
+    directory_path = directory_path.rstrip("/\\") or directory_path
+    if include_subdirs:
+        rows = await conn.fetch(
+            f"""
+            SELECT chunk_number, MAX(tape_file_path) AS tape_file_path,
+                   SUM(file_count)::BIGINT AS file_count, SUM(total_size)::BIGINT AS total_size
+            FROM {DIRECTORY_ARCHIVE_TABLE}
+            WHERE backup_set_id = $1
+              AND (directory_path = $2 OR directory_path LIKE $3 ESCAPE '\\')
+            GROUP BY chunk_number
+            ORDER BY chunk_number
+            """,
+            backup_set_id,
+            directory_path,
+            _like_prefix(directory_path),
+        )
+    else:
+        rows = await conn.fetch(
+            f"""
+            SELECT chunk_number, tape_file_path, file_count, total_size
+            FROM {DIRECTORY_ARCHIVE_TABLE}
+            WHERE backup_set_id = $1 AND directory_path = $2
+            ORDER BY chunk_number
+            """,
+            backup_set_id,
+            directory_path,
+        )
+    return [
+        {
+            'chunk_number': row['chunk_number'],
+            'tape_file_path': row['tape_file_path'],
+            'file_count': int(row['file_count'] or 0),
+            'total_size': int(row['total_size'] or 0),
+        }
+        for row in rows or []
+    ]
+
+
+async def find_directory_files(conn, table_name: str, backup_set_id: int, directory_path: str) -> List:
+    """查询目录（含子目录）下的文件记录（含 file_metadata）
+
+    先通过 find_directory_archives 确定目录所在的压缩包，只在这些压缩包（chunk_number）的文件中查找；
+    没有映射记录（映射写入前的备份集）时按目录前缀查询全部文件记录。
+    """
+    directory_path = directory_path.rstrip("/\\") or directory_path
+    archives = await find_directory_archives(conn, backup_set_id, directory_path)
+    conditions = "backup_set_id = $1 AND (directory_path = $2 OR directory_path LIKE $3 ESCAPE '\\')"
+    params = [backup_set_id, directory_path, _like_prefix(directory_path)]
+    if archives:
+        conditions += " AND chunk_number = ANY($4)"
+        params.append([archive['chunk_number'] for archive in archives])
+    return await conn.fetch(
+        f"""
+        SELECT id, file_path, file_name, directory_path, display_name,
+               file_type, file_size, compressed_size,
+               file_permissions, created_time, modified_time, accessed_time,
+               compressed, checksum, backup_time, chunk_number, file_metadata
+        FROM {table_name}
+        WHERE {conditions}
+        ORDER BY file_path
+        """,
+        *params,
+    )
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份集目录树索引模块
+Backup Set Directory Tree Index Module
+
+恢复浏览（/backup-sets/{id}/top-level、/directory）原来每次点击都在整个备份集上做
+REPLACE(file_path, ...) LIKE 匹配和 DISTINCT 去重，无法使用索引，千万级文件的备份集会超时。
+备份集完成后在后台物化一次目录树：
+1. backup_directory_nodes：每个目录一个节点 (dir_id, parent_id, name, path_key, 子树文件数/字节数,
+   直属文件数/字节数, 子目录数)，dir_id 在备份集内按路径先序编号，根节点（path_key 为空）dir_id = 1
+2. 文件表的 dir_id 列记录文件所在目录节点，配合 (backup_set_id, dir_id, file_name) 索引按目录分页列出文件
+3. backup_directory_trees 登记已建好的备份集及其文件表；文件表变化（如归档）后登记失效，浏览时回退原查询并重建
+
+路径键 path_key：反斜杠统一为正斜杠，去掉空分量（SQL 与 Python 的规范化方式必须一致）。
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from config.settings import get_settings
+from backup.backup_files_lifecycle import (
+    _background_tasks, _checked_table_name, _run_in_transaction, _table_columns
+)
+from utils.scheduler.db_utils import is_opengauss, get_opengauss_connection, get_backup_files_table_by_set_id
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY_NODE_TABLE = "backup_directory_nodes"
+DIRECTORY_TREE_TABLE = "backup_directory_trees"
+
+_NODE_INSERT_BATCH = 10000
+_FILE_UPDATE_ID_BATCH = 200000
+
+# SQL 中的路径键与父目录键（与 normalize_path_key / parent_key 一致）
+_PATH_KEY_SQL = "TRIM(BOTH '/' FROM regexp_replace(REPLACE({column}, '\\', '/'), '/+', '/', 'g'))"
+_PARENT_KEY_SQL = (
+    "CASE WHEN POSITION('/' IN {key}) > 0 THEN regexp_replace({key}, '/[^/]*$', '') ELSE '' END"
+)
+
+_FILE_COLUMNS = (
+    "id, file_path, file_name, directory_path, display_name, file_type, file_size, compressed_size, "
+    "file_permissions, created_time, modified_time, accessed_time, compressed, checksum, backup_time, chunk_number"
+)
+
+# backup_set_id -> 目录树构建任务（同一备份集同时只构建一次）
+_tree_tasks: Dict[int, asyncio.Task] = {}
+# 浏览时已触发过补建的备份集（构建失败时不在每次浏览时重试）
+_lazy_scheduled: set = set()
+
+
+class DirectoryNode(NamedTuple):
+    """目录节点（file_count / total_bytes 为子树合计）"""
+    dir_id: int
+    parent_id: Optional[int]
+    name: str
+    path_key: str
+    depth: int
+    file_count: int
+    total_bytes: int
+    direct_file_count: int
+    direct_bytes: int
+    child_dir_count: int
+
+
+def normalize_path_key(path: Optional[str]) -> str:
+    """路径键：反斜杠统一为正斜杠并去掉空分量（'D:\\a\\b' → 'D:/a/b'，'/home/a/' → 'home/a'）"""
+    return "/".join(part for part in (path or "").replace("\\", "/").split("/") if part)
+
+
+def parent_key(path_key: str) -> str:
+    return path_key.rpartition("/")[0]
+
+
+def _key_parts(path_key: str) -> Tuple[str, ...]:
+    return tuple(path_key.split("/")) if path_key else ()
+
+
+def build_directory_nodes(directory_rows: Iterable[Tuple[str, int, int]]) -> List[DirectoryNode]:
+    """由 (目录键, 直属文件数, 直属字节数) 构建完整目录树（补齐中间目录），按路径先序编号"""
+    direct: Dict[str, List[int]] = {"": [0, 0]}
+    for key, count, size in directory_rows:
+        key = key or ""
+        entry = direct.get(key)
+        if entry is None:
+            entry = direct[key] = [0, 0]
+            ancestor = parent_key(key)
+            while ancestor not in direct:
+                direct[ancestor] = [0, 0]
+                ancestor = parent_key(ancestor)
+        entry[0] += int(count or 0)
+        entry[1] += int(size or 0)
+
+    ordered = sorted(direct, key=_key_parts)
+    dir_ids = {key: index + 1 for index, key in enumerate(ordered)}
+    subtree = {key: list(values) for key, values in direct.items()}
+    child_dirs: Dict[str, int] = {}
+    for key in reversed(ordered):
+        if key:
+            parent = parent_key(key)
+            subtree[parent][0] += subtree[key][0]
+            subtree[parent][1] += subtree[key][1]
+            child_dirs[parent] = child_dirs.get(parent, 0) + 1
+
+    return [
+        DirectoryNode(
+            dir_id=dir_ids[key],
+            parent_id=dir_ids[parent_key(key)] if key else None,
+            name=key.rpartition("/")[2],
+            path_key=key,
+            depth=len(_key_parts(key)),
+            file_count=subtree[key][0],
+            total_bytes=subtree[key][1],
+            direct_file_count=direct[key][0],
+            direct_bytes=direct[key][1],
+            child_dir_count=child_dirs.get(key, 0),
+        )
+        for key in ordered
+    ]
+
+
+async def ensure_directory_tree_tables(conn):
+    """创建目录节点表和登记表（数据库初始化时也会创建）"""
+    await conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {DIRECTORY_NODE_TABLE} (
+            backup_set_id BIGINT NOT NULL,
+            dir_id BIGINT NOT NULL,
+            parent_id BIGINT,
+            name TEXT NOT NULL,
+            path_key TEXT NOT NULL,
+            depth INTEGER DEFAULT 0,
+            file_count BIGINT DEFAULT 0,
+            total_bytes BIGINT DEFAULT 0,
+            direct_file_count BIGINT DEFAULT 0,
+            direct_bytes BIGINT DEFAULT 0,
+            child_dir_count INTEGER DEFAULT 0,
+            PRIMARY KEY (backup_set_id, dir_id)
+        )
+        """
+    )
+    await conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{DIRECTORY_NODE_TABLE}_parent "
+        f"ON {DIRECTORY_NODE_TABLE}(backup_set_id, parent_id, name)"
+    )
+    await conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{DIRECTORY_NODE_TABLE}_path "
+        f"ON {DIRECTORY_NODE_TABLE}(backup_set_id, path_key)"
+    )
+    await conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {DIRECTORY_TREE_TABLE} (
+            backup_set_id BIGINT PRIMARY KEY,
+            files_table TEXT NOT NULL,
+            node_count BIGINT DEFAULT 0,
+            file_count BIGINT DEFAULT 0,
+            built_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """
+    )
+
+
+async def _ensure_dir_id_column(conn, table_name: str):
+    """文件表增加 dir_id 列（新分表从 backup_files_template 继承该列）"""
+    if "dir_id" not in await _table_columns(conn, table_name):
+        await conn.execute(f"ALTER TABLE {table_name} ADD COLUMN dir_id BIGINT")
+
+
+async def build_directory_tree(conn, backup_set_id: int) -> int:
+    """为备份集构建目录树索引，返回目录节点数（文件表不是分表/归档表时返回 0）"""
+    table_name = await get_backup_files_table_by_set_id(conn, backup_set_id)
+    try:
+        table_name = _checked_table_name(table_name)
+    except ValueError:
+        logger.debug(f"[目录树索引] 备份集 {backup_set_id} 的文件表 {table_name} 不是分表，跳过构建")
+        return 0
+    start_time = time.time()
+    await ensure_directory_tree_tables(conn)
+    await _ensure_dir_id_column(conn, table_name)
+    # 先撤销登记，构建期间浏览回退原查询
+    await _run_in_transaction(conn, [
+        (f"DELETE FROM {DIRECTORY_TREE_TABLE} WHERE backup_set_id = $1", (backup_set_id,)),
+        (f"DELETE FROM {DIRECTORY_NODE_TABLE} WHERE backup_set_id = $1", (backup_set_id,)),
+    ])
+
+    # 1. 一次扫描按目录汇总直属文件（目录记录本身只作为节点，不计入文件数）
+    path_key = _PATH_KEY_SQL.format(column="file_path")
+    rows = await conn.fetch(
+        f"""
+        WITH keys AS (
+            SELECT {path_key} AS path_key, file_type, COALESCE(file_size, 0) AS file_size
+            FROM {table_name}
+            WHERE backup_set_id = $1
+        )
+        SELECT CASE WHEN file_type = 'directory'::backupfiletype THEN path_key
+                    ELSE {_PARENT_KEY_SQL.format(key="path_key")} END AS dir_key,
+               SUM(CASE WHEN file_type = 'directory'::backupfiletype THEN 0 ELSE 1 END)::BIGINT AS file_count,
+               SUM(CASE WHEN file_type = 'directory'::backupfiletype THEN 0 ELSE file_size END)::BIGINT AS total_bytes
+        FROM keys
+        GROUP BY 1
+        """,
+        backup_set_id,
+    )
+    nodes = build_directory_nodes((row["dir_key"], row["file_count"], row["total_bytes"]) for row in rows or [])
+
+    # 2. 写入目录节点
+    insert_sql = (
+        f"INSERT INTO {DIRECTORY_NODE_TABLE} (backup_set_id, dir_id, parent_id, name, path_key, depth, "
+        f"file_count, total_bytes, direct_file_count, direct_bytes, child_dir_count) "
+        f"VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)"
+    )
+    for start in range(0, len(nodes), _NODE_INSERT_BATCH):
+        await conn.executemany(
+            insert_sql,
+            [(backup_set_id,) + tuple(node) for node in nodes[start:start + _NODE_INSERT_BATCH]],
+        )
+
+    # 3. 按 id 分段回填文件的 dir_id（文件和目录记录都指向所在目录）
+    bounds = await conn.fetchrow(
+        f"SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM {table_name} WHERE backup_set_id = $1",
+        backup_set_id,
+    )
+    file_parent_key = _PARENT_KEY_SQL.format(key=_PATH_KEY_SQL.format(column="f.file_path"))
+    updated = 0
+    if bounds and bounds["min_id"] is not None:
+        for low in range(int(bounds["min_id"]), int(bounds["max_id"]) + 1, _FILE_UPDATE_ID_BATCH):
+            updated += max(0, (await _run_in_transaction(conn, [(
+                f"""
+                UPDATE {table_name} f
+                SET dir_id = n.dir_id
+                FROM {DIRECTORY_NODE_TABLE} n
+                WHERE f.backup_set_id = $1
+                  AND f.id >= $2 AND f.id < $3
+                  AND n.backup_set_id = $1
+                  AND n.path_key = {file_parent_key}
+                  AND f.dir_id IS DISTINCT FROM n.dir_id
+                """,
+                (backup_set_id, low, low + _FILE_UPDATE_ID_BATCH),
+            )]))[0] or 0)
+    await conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{table_name}_set_dir ON {table_name}(backup_set_id, dir_id, file_name)"
+    )
+
+    # 4. 登记
+    total_files = nodes[0].file_count if nodes else 0
+    await _run_in_transaction(conn, [(
+        f"INSERT INTO {DIRECTORY_TREE_TABLE} (backup_set_id, files_table, node_count, file_count) "
+        f"VALUES ($1, $2, $3, $4)",
+        (backup_set_id, table_name, len(nodes), total_files),
+    )])
+    logger.info(
+        f"[目录树索引] 备份集 {backup_set_id} 目录树已构建：{len(nodes):,} 个目录，{total_files:,} 个文件，"
+        f"回填 dir_id {updated:,} 条（{table_name}），耗时 {time.time() - start_time:.1f} 秒"
+    )
+    return len(nodes)
+
+
+async def _build_tree_for_set(backup_set_id: int, previous: Optional[asyncio.Task]):
+    if previous is not None and not previous.done():
+        # 归档会移动文件记录，先等待同一备份集的索引创建/归档结束，在最终所在的表上构建
+        try:
+            await previous
+        except Exception:
+            pass
+    try:
+        async with get_opengauss_connection() as conn:
+            await build_directory_tree(conn, backup_set_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"[目录树索引] 构建备份集 {backup_set_id} 的目录树失败（浏览回退原查询）: {e}", exc_info=True)
+
+
+def schedule_directory_tree(backup_set_id: Optional[int]) -> Optional[asyncio.Task]:
+    """在后台为已完成的备份集构建目录树（BACKUP_DIRECTORY_TREE_ENABLED 关闭或非 openGauss 模式时不执行）"""
+    settings = get_settings()
+    if not backup_set_id or not is_opengauss() or not getattr(settings, "BACKUP_DIRECTORY_TREE_ENABLED", True):
+        return None
+    running = _tree_tasks.get(backup_set_id)
+    if running is not None and not running.done():
+        return running
+    task = asyncio.create_task(_build_tree_for_set(backup_set_id, _background_tasks.get(backup_set_id)))
+    _tree_tasks[backup_set_id] = task
+
+    def _forget(done_task: asyncio.Task):
+        if _tree_tasks.get(backup_set_id) is done_task:
+            _tree_tasks.pop(backup_set_id, None)
+
+    task.add_done_callback(_forget)
+    return task
+
+
+async def _tree_files_table(conn, backup_set_id: int) -> Optional[str]:
+    """已建好且仍有效的目录树对应的文件表；未构建或文件表已变化时返回 None"""
+    try:
+        files_table = await conn.fetchval(
+            f"SELECT files_table FROM {DIRECTORY_TREE_TABLE} WHERE backup_set_id = $1",
+            backup_set_id,
+        )
+    except Exception as e:
+        logger.debug(f"[目录树索引] 查询目录树登记失败（按未构建处理）: {e}")
+        return None
+    if not files_table or files_table != await get_backup_files_table_by_set_id(conn, backup_set_id):
+        return None
+    return files_table
+
+
+async def _schedule_if_completed(conn, backup_set_id: int):
+    """目录树缺失时，备份任务已完成的备份集在后台补建（本次浏览仍使用原查询）"""
+    if not is_opengauss() or backup_set_id in _lazy_scheduled:
+        return
+    completed = await conn.fetchval(
+        """
+        SELECT 1
+        FROM backup_sets bs
+        JOIN backup_tasks bt ON bs.backup_task_id = bt.id
+        WHERE bs.id = $1 AND LOWER(bt.status::text) = 'completed'
+        """,
+        backup_set_id,
+    )
+    if completed:
+        _lazy_scheduled.add(backup_set_id)
+        schedule_directory_tree(backup_set_id)
+
+
+def _iso(value):
+    if value is None:
+        return None
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def _directory_item(row) -> Dict:
+    return {
+        'name': row['name'],
+        'type': 'directory',
+        'path': row['path_key'],
+        'file': None,
+        'has_children': bool(row['child_dir_count'] or row['direct_file_count']),
+        'dir_id': row['dir_id'],
+        'file_count': int(row['file_count'] or 0),
+        'total_bytes': int(row['total_bytes'] or 0),
+        'child_dir_count': int(row['child_dir_count'] or 0),
+    }
+
+
+def file_row_to_dict(row) -> Dict:
+    """文件记录行 → 文件信息字典（与 RecoveryEngine 浏览接口的 file 字段格式相同）"""
+    file_type = row['file_type']
+    return {
+        'id': row['id'],
+        'file_path': row['file_path'],
+        'file_name': row['file_name'],
+        'directory_path': row['directory_path'],
+        'display_name': row['display_name'],
+        'file_type': file_type.value if hasattr(file_type, 'value') else str(file_type),
+        'file_size': row['file_size'] or 0,
+        'compressed_size': row['compressed_size'] or 0,
+        'file_permissions': row['file_permissions'],
+        'created_time': _iso(row['created_time']),
+        'modified_time': _iso(row['modified_time']),
+        'accessed_time': _iso(row['accessed_time']),
+        'compressed': row['compressed'] or False,
+        'checksum': row['checksum'],
+        'backup_time': _iso(row['backup_time']),
+        'chunk_number': row['chunk_number'],
+    }
+
+
+def _file_item(row) -> Dict:
+    return {
+        'name': normalize_path_key(row['file_path']).rpartition("/")[2] or row['file_name'],
+        'type': 'file',
+        'path': row['file_path'],
+        'file': file_row_to_dict(row),
+        'has_children': False,
+    }
+
+
+def _page_clause(offset: int, limit: Optional[int], first_param: int) -> Tuple[str, list]:
+    if limit is None:
+        return f" OFFSET ${first_param}", [offset]
+    return f" LIMIT ${first_param} OFFSET ${first_param + 1}", [limit, offset]
+
+
+async def list_directory_page(conn, backup_set_id: int, directory_path: str,
+                              offset: int = 0, limit: Optional[int] = None) -> Optional[Dict]:
+    """按目录树索引分页列出目录内容（子目录在前，按名称排序；再按文件名排序列出直属文件）
+
+    Returns:
+        {'items', 'total', 'offset', 'limit', 'file_count', 'total_bytes'}；目录树不可用时返回 None
+    """
+    files_table = await _tree_files_table(conn, backup_set_id)
+    if files_table is None:
+        await _schedule_if_completed(conn, backup_set_id)
+        return None
+    offset = max(0, int(offset or 0))
+    limit = None if limit is None else max(0, int(limit))
+
+    node = await conn.fetchrow(
+        f"""
+        SELECT dir_id, file_count, total_bytes, direct_file_count, child_dir_count
+        FROM {DIRECTORY_NODE_TABLE}
+        WHERE backup_set_id = $1 AND path_key = $2
+        """,
+        backup_set_id,
+        normalize_path_key(directory_path),
+    )
+    if not node:
+        return {'items': [], 'total': 0, 'offset': offset, 'limit': limit, 'file_count': 0, 'total_bytes': 0}
+
+    child_dir_count = int(node['child_dir_count'] or 0)
+    items: List[Dict] = []
+    if offset < child_dir_count and limit != 0:
+        page_sql, page_args = _page_clause(offset, limit, 3)
+        rows = await conn.fetch(
+            f"""
+            SELECT dir_id, name, path_key, file_count, total_bytes, direct_file_count, child_dir_count
+            FROM {DIRECTORY_NODE_TABLE}
+            WHERE backup_set_id = $1 AND parent_id = $2
+            ORDER BY name
+            """ + page_sql,
+            backup_set_id,
+            node['dir_id'],
+            *page_args,
+        )
+        items.extend(_directory_item(row) for row in rows or [])
+
+    remaining = None if limit is None else limit - len(items)
+    if (remaining is None or remaining > 0) and node['direct_file_count']:
+        page_sql, page_args = _page_clause(max(0, offset - child_dir_count), remaining, 3)
+        rows = await conn.fetch(
+            f"""
+            SELECT {_FILE_COLUMNS}
+            FROM {files_table}
+            WHERE backup_set_id = $1 AND dir_id = $2 AND file_type <> 'directory'::backupfiletype
+            ORDER BY file_name, id
+            """ + page_sql,
+            backup_set_id,
+            node['dir_id'],
+            *page_args,
+        )
+        items.extend(_file_item(row) for row in rows or [])
+
+    return {
+        'items': items,
+        'total': child_dir_count + int(node['direct_file_count'] or 0),
+        'offset': offset,
+        'limit': limit,
+        'file_count': int(node['file_count'] or 0),
+        'total_bytes': int(node['total_bytes'] or 0),
+    }
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+排除规则匹配模块
+Exclude Pattern Matcher Module
+
+把计划任务 action_config.exclude_patterns 中的排除规则在每个任务开始时编译一次：
+- 不含通配符的规则放入集合，按路径前缀直接查找
+- 含通配符的规则合并为一个正则表达式（fnmatch.translate 后用 | 连接）
+
+匹配语义与 FileScanner.should_exclude_file 原实现一致：路径本身或其任一父目录
+匹配规则（或父目录加 "/*" 匹配规则）即排除；Windows 下不区分大小写。
+
+目录扫描时父目录已经检查过，子条目只需调用 excludes_child() 检查自身（两次正则匹配），
+被排除的目录不再加入待扫描队列，整个子树不会被列出。
+"""
+
+import fnmatch
+import logging
+import os
+import re
+import threading
+from typing import Iterable, Optional, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MAGIC_CHARS = re.compile(r'[*?\[]')
+_CASE_INSENSITIVE = os.name == 'nt'  # 与 fnmatch.fnmatch 的 os.path.normcase 行为一致
+
+_MATCHER_CACHE_SIZE = 64
+
+
+def _normalize(path: str) -> str:
+    normalized = path.replace('\\', '/')
+    return normalized.lower() if _CASE_INSENSITIVE else normalized
+
+
+class ExcludeMatcher:
+    """编译后的排除规则匹配器（不可变，可在多个扫描线程间共享）"""
+
+    def __init__(self, patterns: Optional[Iterable[str]] = None):
+        self.patterns: Tuple[str, ...] = tuple(p for p in (patterns or []) if p)
+        normalized = [_normalize(p) for p in self.patterns]
+        self._literals = frozenset(p for p in normalized if not _MAGIC_CHARS.search(p))
+        globs = [p for p in normalized if _MAGIC_CHARS.search(p)]
+        self._glob_regex = re.compile('|'.join(fnmatch.translate(p) for p in globs)) if globs else None
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def _matches(self, normalized_path: str) -> bool:
+        if normalized_path in self._literals:
+            return True
+        regex = self._glob_regex
+        if regex is not None:
+            # "D:/temp/*" 这类规则同时排除 D:/temp 目录本身
+            return bool(regex.match(normalized_path) or regex.match(normalized_path + '/*'))
+        return False
+
+    def excludes(self, path: str) -> bool:
+        """完整检查：路径本身或其任一父目录匹配排除规则时返回 True"""
+        if not self.patterns:
+            return False
+        parts = _normalize(path).split('/')
+        for i in range(len(parts)):
+            parent_path = '/'.join(parts[:i + 1])
+            if parent_path and self._matches(parent_path):
+                return True
+        return False
+
+    def excludes_child(self, path: str) -> bool:
+        """只检查路径本身（调用方保证其父目录已用 excludes() 检查且未被排除）"""
+        if not self.patterns:
+            return False
+        return self._matches(_normalize(path))
+
+
+_EMPTY_MATCHER = ExcludeMatcher()
+_matcher_cache: Dict[Tuple[str, ...], ExcludeMatcher] = {}
+_matcher_cache_lock = threading.Lock()
+
+
+def get_exclude_matcher(patterns: Optional[Iterable[str]]) -> ExcludeMatcher:
+    """按规则列表获取编译后的匹配器（相同规则只编译一次）"""
+    if not patterns:
+        return _EMPTY_MATCHER
+    key = tuple(patterns)
+    matcher = _matcher_cache.get(key)
+    if matcher is not None:
+        return matcher
+    matcher = ExcludeMatcher(key)
+    with _matcher_cache_lock:
+        if len(_matcher_cache) >= _MATCHER_CACHE_SIZE:
+            _matcher_cache.clear()
+        _matcher_cache[key] = matcher
+    logger.debug(
+        f"[排除规则] 已编译 {len(matcher.patterns)} 条排除规则 "
+        f"(字面路径 {len(matcher._literals)} 条, 通配符 {len(matcher.patterns) - len(matcher._literals)} 条)"
+    )
+    return matcher
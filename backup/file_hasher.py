@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件内容校验和模块
+File Content Hasher Module
+
+压缩时在写入 tar 成员的同一次读取中计算每个文件的校验和（不再单独读一遍源文件），
+校验和随压缩结果写回 backup_files.checksum 和压缩包成员索引，恢复时据此校验。
+
+支持的算法：
+- xxh3   : xxHash XXH3-128（需要 xxhash 包，速度接近内存带宽）
+- blake3 : BLAKE3（需要 blake3 包）
+- sha256 : hashlib 内置，无额外依赖
+可选依赖不可用时回退到 sha256。
+
+存储格式：sha256 保持原有的纯十六进制字符串（兼容已有数据），
+其他算法带算法前缀，例如 "xxh3:9f86d081884c7d65..."。
+"""
+
+import hashlib
+import logging
+import tarfile
+from typing import Optional, Tuple, Callable
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    xxhash = None
+    XXHASH_AVAILABLE = False
+
+try:
+    import blake3
+    BLAKE3_AVAILABLE = True
+except ImportError:
+    blake3 = None
+    BLAKE3_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ALGO_XXH3 = "xxh3"
+ALGO_BLAKE3 = "blake3"
+ALGO_SHA256 = "sha256"
+
+DEFAULT_READ_SIZE = 1024 * 1024  # 校验时的读取块大小
+
+_warned_algorithms = set()
+
+
+def _warn_once(algorithm: str, message: str):
+    if algorithm not in _warned_algorithms:
+        _warned_algorithms.add(algorithm)
+        logger.warning(message)
+
+
+def resolve_algorithm(algorithm: Optional[str]) -> Optional[str]:
+    """返回实际可用的算法名；algorithm 为空表示不计算校验和，返回 None"""
+    algorithm = (algorithm or "").strip().lower()
+    if not algorithm:
+        return None
+    if algorithm in ("xxh3", "xxh128", "xxh3_128"):
+        if XXHASH_AVAILABLE:
+            return ALGO_XXH3
+        _warn_once(algorithm, "[文件校验] 未安装 xxhash，文件校验和使用 sha256")
+        return ALGO_SHA256
+    if algorithm == ALGO_BLAKE3:
+        if BLAKE3_AVAILABLE:
+            return ALGO_BLAKE3
+        _warn_once(algorithm, "[文件校验] 未安装 blake3，文件校验和使用 sha256")
+        return ALGO_SHA256
+    if algorithm != ALGO_SHA256:
+        _warn_once(algorithm, f"[文件校验] 不支持的校验算法 {algorithm}，使用 sha256")
+    return ALGO_SHA256
+
+
+def create_hasher(algorithm: str):
+    """创建校验和对象（algorithm 应为 resolve_algorithm 的返回值）"""
+    if algorithm == ALGO_XXH3:
+        return xxhash.xxh3_128()
+    if algorithm == ALGO_BLAKE3:
+        return blake3.blake3()
+    return hashlib.sha256()
+
+
+def format_checksum(algorithm: str, hexdigest: str) -> str:
+    """生成存储用的校验和字符串（sha256 不带前缀）"""
+    if algorithm == ALGO_SHA256:
+        return hexdigest
+    return f"{algorithm}:{hexdigest}"
+
+
+def parse_checksum(value: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """解析存储的校验和字符串，返回 (算法, 十六进制摘要)；无前缀的按 sha256 处理"""
+    if not value:
+        return None, None
+    value = str(value).strip()
+    if ":" in value:
+        algorithm, hexdigest = value.split(":", 1)
+        return algorithm.lower(), hexdigest.lower()
+    return ALGO_SHA256, value.lower()
+
+
+def create_verifier(expected_checksum: Optional[str]):
+    """按存储的校验和创建校验对象；算法在本机不可用时返回 None（跳过校验）"""
+    algorithm, _ = parse_checksum(expected_checksum)
+    if algorithm is None:
+        return None
+    if algorithm == ALGO_XXH3 and not XXHASH_AVAILABLE:
+        _warn_once("verify-xxh3", "[文件校验] 未安装 xxhash，无法校验 xxh3 校验和，跳过校验")
+        return None
+    if algorithm == ALGO_BLAKE3 and not BLAKE3_AVAILABLE:
+        _warn_once("verify-blake3", "[文件校验] 未安装 blake3，无法校验 blake3 校验和，跳过校验")
+        return None
+    if algorithm not in (ALGO_XXH3, ALGO_BLAKE3, ALGO_SHA256):
+        _warn_once(f"verify-{algorithm}", f"[文件校验] 未知的校验算法 {algorithm}，跳过校验")
+        return None
+    return create_hasher(algorithm)
+
+
+def checksum_matches(expected_checksum: Optional[str], hasher) -> bool:
+    """比较校验对象的结果与存储的校验和"""
+    _, expected_hex = parse_checksum(expected_checksum)
+    return expected_hex is not None and hasher.hexdigest().lower() == expected_hex
+
+
+def compute_checksum(path, expected_checksum: Optional[str] = None,
+                     algorithm: Optional[str] = None, read_size: int = DEFAULT_READ_SIZE) -> Optional[str]:
+    """读取文件计算校验和（算法取自 expected_checksum 或 algorithm），返回存储格式的字符串"""
+    if expected_checksum:
+        hasher = create_verifier(expected_checksum)
+        if hasher is None:
+            return None
+        algorithm = parse_checksum(expected_checksum)[0]
+    else:
+        algorithm = resolve_algorithm(algorithm or ALGO_SHA256)
+        hasher = create_hasher(algorithm)
+    with open(path, "rb") as fh:
+        while True:
+            chunk = fh.read(read_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return format_checksum(algorithm, hasher.hexdigest())
+
+
+class HashingReader:
+    """只读文件包装器：tarfile 读取成员数据时顺带更新校验和"""
+
+    def __init__(self, fileobj, hasher):
+        self._fileobj = fileobj
+        self._hasher = hasher
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._fileobj.read(size)
+        if data:
+            self._hasher.update(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        count = self._fileobj.readinto(buffer)
+        if count:
+            self._hasher.update(memoryview(buffer)[:count])
+        return count
+
+
+def add_file_to_tar(tar: tarfile.TarFile, file_path, arcname: str, algorithm: Optional[str],
+                    filter: Optional[Callable] = None) -> Optional[str]:
+    """把文件写入 tar 并返回内容校验和（存储格式）
+
+    普通文件通过 tar.addfile() + HashingReader 写入，校验和在 tar 读取文件数据的同一次读取中计算；
+    algorithm 为 None 或成员不是普通文件时退回 tar.add()，返回 None。
+    """
+    if algorithm is None:
+        tar.add(file_path, arcname=arcname, filter=filter)
+        return None
+    tarinfo = tar.gettarinfo(str(file_path), arcname)
+    if tarinfo is None:
+        # 不支持的文件类型（socket 等），与 tar.add 一样跳过
+        return None
+    if filter is not None:
+        tarinfo = filter(tarinfo)
+        if tarinfo is None:
+            return None
+    if not tarinfo.isreg():
+        tar.add(file_path, arcname=arcname, filter=filter)
+        return None
+    hasher = create_hasher(algorithm)
+    with open(file_path, "rb") as fh:
+        tar.addfile(tarinfo, HashingReader(fh, hasher))
+    return format_checksum(algorithm, hasher.hexdigest())
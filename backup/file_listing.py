@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份集文件列表分页 / 流式读取模块
+Backup Set File Listing Module
+
+RecoveryEngine.get_backup_set_files 一次性把整个备份集的文件读成字典列表再整体返回 JSON，
+千万级备份集会占用大量内存，且客户端要等全部查询完成才能收到第一行。本模块提供：
+1. 键集分页：按 (file_path, id) 排序，游标为上一页最后一行的 (file_path, id)，走 (backup_set_id, file_path) 索引，
+   翻页代价与页码无关；Redis 按 SSCAN 游标续读（无序，页大小为近似值）
+2. 流式读取：openGauss 使用服务端游标（asyncpg cursor / psycopg3 命名游标），SQLite 逐批迭代游标，
+   Redis 按 SSCAN 批次读取，内存占用与备份集大小无关；NDJSON 编码后第一批行立即发送
+
+游标令牌为 URL 安全的 base64 编码 JSON，对客户端不透明。
+"""
+
+import base64
+import binascii
+import json
+import logging
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from config.settings import get_settings
+from backup.bulk_loader import psycopg_connection, rollback_quietly
+from backup.directory_tree_index import file_row_to_dict
+from utils.scheduler.db_utils import is_opengauss, is_redis, get_opengauss_connection, get_backup_files_table_by_set_id
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+_LIST_COLUMNS = (
+    "id", "file_path", "file_name", "directory_path", "display_name",
+    "file_type", "file_size", "compressed_size", "file_permissions",
+    "created_time", "modified_time", "accessed_time",
+    "compressed", "checksum", "backup_time", "chunk_number",
+)
+_NDJSON_FLUSH_BYTES = 64 * 1024
+
+
+def _page_limit(limit: Optional[int]) -> int:
+    default = int(getattr(settings, 'BACKUP_FILE_LIST_PAGE_SIZE', 1000))
+    maximum = int(getattr(settings, 'BACKUP_FILE_LIST_MAX_LIMIT', 10000))
+    return max(1, min(int(limit or default), maximum))
+
+
+def _fetch_rows() -> int:
+    return max(1, int(getattr(settings, 'BACKUP_FILE_LIST_FETCH_ROWS', 2000)))
+
+
+# ---------------------------------------------------------------------------
+# 游标令牌
+# ---------------------------------------------------------------------------
+
+def encode_cursor(value) -> str:
+    """游标值（SQL 为 [file_path, id]，Redis 为 SSCAN 游标）→ 令牌"""
+    raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str]):
+    """令牌 → 游标值，空令牌返回 None，格式不合法时抛出 ValueError"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        return json.loads(raw.decode("utf-8"))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"无效的分页游标: {token!r}")
+
+
+def _keyset_after(after) -> Optional[Tuple[str, int]]:
+    if after is None:
+        return None
+    if not isinstance(after, list) or len(after) != 2 or not isinstance(after[1], int):
+        raise ValueError("无效的分页游标")
+    return str(after[0] or ""), after[1]
+
+
+def _scan_after(after) -> int:
+    if after is None:
+        return 0
+    if not isinstance(after, int) or after < 0:
+        raise ValueError("无效的分页游标")
+    return after
+
+
+# ---------------------------------------------------------------------------
+# 行转换（各后端共用，不在逐行循环中定义辅助函数）
+# ---------------------------------------------------------------------------
+
+def _redis_iso(value):
+    from backup.redis_backup_db import _parse_datetime_value
+    parsed = _parse_datetime_value(value) if value else None
+    return parsed.isoformat() if parsed else None
+
+
+def redis_file_to_dict(file_id, file_data: Dict) -> Dict:
+    """Redis 文件哈希 → 文件信息字典（Redis 客户端配置了 decode_responses=True，键值都是字符串）"""
+    file_id = str(file_id)
+    return {
+        'id': int(file_id) if file_id.isdigit() else file_id,
+        'file_path': file_data.get('file_path', ''),
+        'file_name': file_data.get('file_name', ''),
+        'directory_path': file_data.get('directory_path', ''),
+        'display_name': file_data.get('display_name', ''),
+        'file_type': file_data.get('file_type', 'file'),
+        'file_size': int(file_data.get('file_size', 0) or 0),
+        'compressed_size': int(file_data.get('compressed_size', 0) or 0),
+        'file_permissions': file_data.get('file_permissions', ''),
+        'created_time': _redis_iso(file_data.get('created_time')),
+        'modified_time': _redis_iso(file_data.get('modified_time')),
+        'accessed_time': _redis_iso(file_data.get('accessed_time')),
+        'compressed': bool(int(file_data.get('compressed', 0) or 0)),
+        'checksum': file_data.get('checksum'),
+        'backup_time': _redis_iso(file_data.get('backup_time')),
+        'chunk_number': int(file_data.get('chunk_number', 0) or 0),
+    }
+
+
+def sqlite_file_row_to_dict(row) -> Dict:
+    """SQLite 元组行（列顺序同 _LIST_COLUMNS）→ 文件信息字典"""
+    values = dict(zip(_LIST_COLUMNS, row))
+    values['compressed'] = bool(values['compressed']) if values['compressed'] is not None else False
+    return file_row_to_dict(values)
+
+
+def _record_to_dict(row) -> Dict:
+    """asyncpg Record / psycopg 元组行 → 文件信息字典"""
+    if isinstance(row, tuple):
+        row = dict(zip(_LIST_COLUMNS, row))
+    return file_row_to_dict(row)
+
+
+# ---------------------------------------------------------------------------
+# openGauss
+# ---------------------------------------------------------------------------
+
+async def _opengauss_set(conn, backup_set_id: str) -> Optional[Tuple[int, str]]:
+    row = await conn.fetchrow("SELECT id FROM backup_sets WHERE set_id = $1", backup_set_id)
+    if not row:
+        logger.warning(f"[文件列表] 备份集不存在: {backup_set_id}")
+        return None
+    return row['id'], await get_backup_files_table_by_set_id(conn, row['id'])
+
+
+def _opengauss_sql(table_name: str, after: Optional[Tuple[str, int]], limit: Optional[int]) -> Tuple[str, list]:
+    sql = f"SELECT {', '.join(_LIST_COLUMNS)} FROM {table_name} WHERE backup_set_id = $1"
+    params: list = []
+    if after is not None:
+        # file_path >= 作为索引范围条件；占位符不重复使用（psycopg3 兼容层按位置替换为 %s）
+        sql += " AND file_path >= $2 AND (file_path > $3 OR id > $4)"
+        params.extend([after[0], after[0], after[1]])
+    sql += " ORDER BY file_path, id"
+    if limit is not None:
+        sql += f" LIMIT ${len(params) + 2}"
+        params.append(limit)
+    return sql, params
+
+
+async def _opengauss_page(backup_set_id: str, after, limit: int) -> Optional[List[Dict]]:
+    async with get_opengauss_connection() as conn:
+        resolved = await _opengauss_set(conn, backup_set_id)
+        if resolved is None:
+            return None
+        backup_set_db_id, table_name = resolved
+        sql, params = _opengauss_sql(table_name, _keyset_after(after), limit)
+        rows = await conn.fetch(sql, backup_set_db_id, *params)
+        return [_record_to_dict(row) for row in rows]
+
+
+async def _opengauss_stream(backup_set_id: str, after: Optional[Tuple[str, int]]) -> AsyncIterator[Dict]:
+    async with get_opengauss_connection() as conn:
+        resolved = await _opengauss_set(conn, backup_set_id)
+        if resolved is None:
+            return
+        backup_set_db_id, table_name = resolved
+        sql, params = _opengauss_sql(table_name, after, None)
+        fetch_rows = _fetch_rows()
+
+        raw_conn = psycopg_connection(conn)
+        if raw_conn is None:
+            async with conn.transaction():
+                async for row in conn.cursor(sql, backup_set_db_id, *params, prefetch=fetch_rows):
+                    yield _record_to_dict(row)
+            return
+
+        from utils.scheduler.psycopg3_compat import convert_asyncpg_to_psycopg3_query
+        if raw_conn.info.transaction_status == 3:  # INERROR
+            await rollback_quietly(raw_conn)
+        committed = False
+        try:
+            # 命名游标即服务端游标（需在事务中，读完后提交释放；客户端断开时回滚释放）
+            async with raw_conn.cursor(name=f"file_list_{backup_set_db_id}_{time.monotonic_ns()}") as cur:
+                await cur.execute(convert_asyncpg_to_psycopg3_query(sql), (backup_set_db_id, *params))
+                while True:
+                    rows = await cur.fetchmany(fetch_rows)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield _record_to_dict(row)
+            await raw_conn.commit()
+            committed = True
+        finally:
+            if not committed:
+                await rollback_quietly(raw_conn)
+
+
+# ---------------------------------------------------------------------------
+# SQLite
+# ---------------------------------------------------------------------------
+
+async def _sqlite_set(conn, backup_set_id: str) -> Optional[int]:
+    cursor = await conn.execute("SELECT id FROM backup_sets WHERE set_id = ?", (backup_set_id,))
+    row = await cursor.fetchone()
+    if not row:
+        logger.warning(f"[文件列表] 备份集不存在: {backup_set_id}")
+        return None
+    return row[0]
+
+
+def _sqlite_sql(after: Optional[Tuple[str, int]], limit: Optional[int]) -> Tuple[str, list]:
+    sql = f"SELECT {', '.join(_LIST_COLUMNS)} FROM backup_files WHERE backup_set_id = ?"
+    params: list = []
+    if after is not None:
+        sql += " AND file_path >= ? AND (file_path > ? OR id > ?)"
+        params.extend([after[0], after[0], after[1]])
+    sql += " ORDER BY file_path, id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+async def ensure_sqlite_listing_index(conn):
+    """键集分页使用的 (backup_set_id, file_path) 索引"""
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_backup_files_set_path ON backup_files(backup_set_id, file_path)"
+    )
+
+
+async def _sqlite_page(backup_set_id: str, after, limit: int) -> Optional[List[Dict]]:
+    from utils.scheduler.sqlite_utils import get_sqlite_connection
+    async with get_sqlite_connection() as conn:
+        backup_set_db_id = await _sqlite_set(conn, backup_set_id)
+        if backup_set_db_id is None:
+            return None
+        sql, params = _sqlite_sql(_keyset_after(after), limit)
+        cursor = await conn.execute(sql, (backup_set_db_id, *params))
+        return [sqlite_file_row_to_dict(row) for row in await cursor.fetchall()]
+
+
+async def _sqlite_stream(backup_set_id: str, after: Optional[Tuple[str, int]]) -> AsyncIterator[Dict]:
+    from utils.scheduler.sqlite_utils import get_sqlite_connection
+    async with get_sqlite_connection() as conn:
+        backup_set_db_id = await _sqlite_set(conn, backup_set_id)
+        if backup_set_db_id is None:
+            return
+        sql, params = _sqlite_sql(after, None)
+        cursor = await conn.execute(sql, (backup_set_db_id, *params))
+        fetch_rows = _fetch_rows()
+        try:
+            while True:
+                rows = await cursor.fetchmany(fetch_rows)
+                if not rows:
+                    break
+                for row in rows:
+                    yield sqlite_file_row_to_dict(row)
+        finally:
+            await cursor.close()
+
+
+# ---------------------------------------------------------------------------
+# Redis
+# ---------------------------------------------------------------------------
+
+async def _redis_set_key(redis, backup_set_id: str) -> Optional[str]:
+    from backup.redis_backup_db import KEY_PREFIX_BACKUP_SET, KEY_INDEX_BACKUP_FILE_BY_SET_ID
+    backup_set_data = await redis.hgetall(f"{KEY_PREFIX_BACKUP_SET}:{backup_set_id}")
+    if not backup_set_data:
+        logger.warning(f"[文件列表] [Redis模式] 备份集不存在: {backup_set_id}")
+        return None
+    return f"{KEY_INDEX_BACKUP_FILE_BY_SET_ID}:{backup_set_data.get('id', backup_set_id)}"
+
+
+async def _redis_scan_batches(redis, file_index_key: str, scan_cursor: int, count: int):
+    """按 SSCAN 批次产出 (已复制文件字典列表, 下一个 SSCAN 游标)，游标为 0 表示读完
+
+    只返回已成功复制的文件（is_copy_success = '1'）
+    """
+    from backup.redis_backup_db import KEY_PREFIX_BACKUP_FILE, _get_redis_key
+    while True:
+        scan_cursor, file_ids = await redis.sscan(file_index_key, scan_cursor, count=count)
+        files = []
+        if file_ids:
+            pipe = redis.pipeline()
+            for file_id in file_ids:
+                pipe.hgetall(_get_redis_key(KEY_PREFIX_BACKUP_FILE, file_id))
+            for file_id, file_data in zip(file_ids, await pipe.execute()):
+                if file_data and file_data.get('is_copy_success', '0') == '1':
+                    files.append(redis_file_to_dict(file_id, file_data))
+        yield files, int(scan_cursor)
+        if int(scan_cursor) == 0:
+            return
+
+
+async def _redis_page(backup_set_id: str, after, limit: int) -> Optional[Tuple[List[Dict], Optional[int]]]:
+    from config.redis_db import get_redis_client
+    redis = await get_redis_client()
+    file_index_key = await _redis_set_key(redis, backup_set_id)
+    if file_index_key is None:
+        return None
+    # SSCAN 游标只能停在批次边界：整批返回，页大小为近似值
+    files: List[Dict] = []
+    next_cursor: Optional[int] = None
+    async for batch, scan_cursor in _redis_scan_batches(redis, file_index_key, _scan_after(after), limit):
+        files.extend(batch)
+        next_cursor = scan_cursor or None
+        if len(files) >= limit:
+            break
+    return files, next_cursor
+
+
+async def _redis_stream(backup_set_id: str, scan_cursor: int) -> AsyncIterator[Dict]:
+    from config.redis_db import get_redis_client
+    redis = await get_redis_client()
+    file_index_key = await _redis_set_key(redis, backup_set_id)
+    if file_index_key is None:
+        return
+    async for batch, _ in _redis_scan_batches(redis, file_index_key, scan_cursor, _fetch_rows()):
+        for file_info in batch:
+            yield file_info
+
+
+# ---------------------------------------------------------------------------
+# 对外接口
+# ---------------------------------------------------------------------------
+
+async def list_backup_set_files_page(backup_set_id: str, cursor: Optional[str] = None,
+                                     limit: Optional[int] = None) -> Optional[Dict]:
+    """键集分页读取备份集文件
+
+    Args:
+        cursor: 上一页返回的 next_cursor（为空时从头读取）
+        limit: 每页条数（默认 BACKUP_FILE_LIST_PAGE_SIZE，不超过 BACKUP_FILE_LIST_MAX_LIMIT）
+
+    Returns:
+        {'files', 'next_cursor', 'limit'}，next_cursor 为 None 表示已读完；备份集不存在时返回 None。
+        SQL 后端按 (file_path, id) 排序；Redis 后端无序，且按 SSCAN 批次返回，条数可能略多于 limit。
+        游标不合法时抛出 ValueError
+    """
+    limit = _page_limit(limit)
+    after = decode_cursor(cursor)
+    if is_redis():
+        result = await _redis_page(backup_set_id, after, limit)
+        if result is None:
+            return None
+        files, scan_cursor = result
+        next_cursor = encode_cursor(scan_cursor) if scan_cursor else None
+    else:
+        if is_opengauss():
+            files = await _opengauss_page(backup_set_id, after, limit)
+        else:
+            files = await _sqlite_page(backup_set_id, after, limit)
+        if files is None:
+            return None
+        next_cursor = encode_cursor([files[-1]['file_path'], files[-1]['id']]) if len(files) >= limit else None
+    return {'files': files, 'next_cursor': next_cursor, 'limit': limit}
+
+
+def iter_backup_set_files(backup_set_id: str, cursor: Optional[str] = None) -> AsyncIterator[Dict]:
+    """流式读取备份集全部文件（服务端游标，逐批读取），可从分页接口返回的 next_cursor 继续
+
+    游标在开始读取前校验，不合法时立即抛出 ValueError；备份集不存在时不产出任何行
+    """
+    after = decode_cursor(cursor)
+    if is_redis():
+        return _redis_stream(backup_set_id, _scan_after(after))
+    if is_opengauss():
+        return _opengauss_stream(backup_set_id, _keyset_after(after))
+    return _sqlite_stream(backup_set_id, _keyset_after(after))
+
+
+async def ndjson_chunks(files: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    """文件字典流 → NDJSON 字节块（第一行立即发送，之后攒到 64KB 再发送）
+
+    读取中途出错时追加一行 {"error": ...} 后结束，客户端据此判断列表不完整
+    """
+    buffer: List[bytes] = []
+    size = 0
+    first = True
+    try:
+        async for file_info in files:
+            line = json.dumps(file_info, ensure_ascii=False).encode("utf-8") + b"\n"
+            buffer.append(line)
+            size += len(line)
+            if first or size >= _NDJSON_FLUSH_BYTES:
+                yield b"".join(buffer)
+                buffer.clear()
+                size = 0
+                first = False
+    except Exception as e:
+        logger.error(f"[文件列表] 流式读取备份集文件失败: {str(e)}", exc_info=True)
+        buffer.append(json.dumps({'error': str(e)}, ensure_ascii=False).encode("utf-8") + b"\n")
+    if buffer:
+        yield b"".join(buffer)
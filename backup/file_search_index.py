@@ -0,0 +1,669 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件名搜索索引模块
+File Name Search Index Module
+
+RecoveryEngine.search_files 原来先把整个备份集的文件加载成字典，再逐个做小写子串匹配。
+本模块在各数据库后端上建立文件名/路径索引，支持前缀、子串、扩展名三种查询，分页返回，并支持跨备份集搜索：
+1. openGauss：分表/归档表上建立 (backup_set_id, lower(file_name) text_pattern_ops) 前缀索引、
+   reverse(lower(file_name)) 后缀索引（扩展名查询）；子串查询优先使用 pg_trgm GIN 索引，
+   不支持 pg_trgm 时使用 openGauss ngram 全文索引预筛选再用 LIKE 精确匹配
+2. SQLite：FTS5 trigram 外部内容表 backup_files_fts（触发器与 backup_files 同步），LIKE 查询走 trigram 索引
+3. Redis：每个备份集三个字典序有序集合（小写文件名、反转文件名、小写路径，成员为 "键\\0文件ID"），
+   前缀/扩展名查询用 ZRANGEBYLEX，子串查询用 ZSCAN MATCH 只扫描文件名索引，不再 HGETALL 全部文件
+
+跨备份集搜索按备份时间倒序逐个备份集查询，凑满一页即停止；group_by_set 返回包含匹配文件的备份集及匹配数。
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from config.settings import get_settings
+from backup.backup_files_lifecycle import _checked_table_name, _existing_indexes, build_backup_files_indexes
+from backup.directory_tree_index import file_row_to_dict
+from backup.file_listing import redis_file_to_dict
+from utils.scheduler.db_utils import is_opengauss, is_redis, get_opengauss_connection, get_backup_files_table_by_set_id
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MODES = ("auto", "prefix", "substring", "extension")
+SEARCH_FIELDS = ("name", "path")
+
+SQLITE_FTS_TABLE = "backup_files_fts"
+_FILE_COLUMNS = (
+    "id", "file_path", "file_name", "directory_path", "display_name", "file_type", "file_size", "compressed_size",
+    "file_permissions", "created_time", "modified_time", "accessed_time", "compressed", "checksum", "backup_time",
+    "chunk_number",
+)
+_REDIS_BATCH = 1000
+# openGauss ngram 解析器默认的 gram 长度（ngram_gram_size）
+_NGRAM_SIZE = 2
+_MATCH_COUNT_CAP = 10000
+
+# openGauss 子串索引方式（trgm / ngram / none），首次使用时探测
+_substring_method: Optional[str] = None
+# 已在后台补建搜索索引的表
+_index_builds: Dict[str, Optional[asyncio.Task]] = {}
+
+
+class SearchQuery(NamedTuple):
+    """解析后的搜索条件（term 已转为小写）"""
+    mode: str
+    term: str
+    field: str = "name"
+
+
+def parse_search_query(search_term: str, mode: str = "auto", field: str = "name") -> SearchQuery:
+    """解析搜索词
+
+    mode 为 auto 时："*.pdf" / ".pdf" → 扩展名，"report*" → 前缀，其他 → 子串
+    """
+    term = (search_term or "").strip()
+    mode = (mode or "auto").lower()
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"不支持的搜索方式: {mode}（可选: {', '.join(SEARCH_MODES)}）")
+    field = (field or "name").lower()
+    if field not in SEARCH_FIELDS:
+        raise ValueError(f"不支持的搜索字段: {field}（可选: {', '.join(SEARCH_FIELDS)}）")
+    if mode == "auto":
+        if term.startswith("*.") and len(term) > 2:
+            mode, term = "extension", term[1:]
+        elif term.startswith(".") and len(term) > 1 and "." not in term[1:] and "/" not in term and "\\" not in term:
+            mode = "extension"
+        elif term.endswith("*") and len(term) > 1:
+            mode, term = "prefix", term.rstrip("*")
+        else:
+            mode = "substring"
+    if mode == "extension":
+        term = term.lstrip("*")
+        if not term.startswith("."):
+            term = "." + term
+    if not term:
+        raise ValueError("搜索词不能为空")
+    return SearchQuery(mode, term.lower(), field)
+
+
+def _like_escape(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def like_pattern(query: SearchQuery) -> str:
+    """LIKE 匹配模式（大小写不敏感的列上使用，已转义通配符）"""
+    escaped = _like_escape(query.term)
+    if query.mode == "prefix":
+        return escaped + "%"
+    if query.mode == "extension":
+        return "%" + escaped
+    return "%" + escaped + "%"
+
+
+# ---------------------------------------------------------------------------
+# openGauss
+# ---------------------------------------------------------------------------
+
+async def detect_substring_method(conn) -> str:
+    """子串索引方式：FILE_SEARCH_SUBSTRING_INDEX 指定，或自动探测 pg_trgm → ngram 解析器 → none
+
+    只查询已安装的扩展，不在搜索请求中 CREATE EXTENSION（pg_trgm 在数据库初始化时启用）
+    """
+    global _substring_method
+    configured = str(getattr(get_settings(), "FILE_SEARCH_SUBSTRING_INDEX", "auto") or "auto").lower()
+    if configured in ("trgm", "ngram", "none"):
+        return configured
+    if _substring_method is not None:
+        return _substring_method
+    method = "none"
+    if await conn.fetchval("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"):
+        method = "trgm"
+    elif await conn.fetchval("SELECT 1 FROM pg_ts_parser WHERE prsname = 'ngram'"):
+        method = "ngram"
+    _substring_method = method
+    logger.info(f"[文件搜索] 子串索引方式: {method}")
+    return method
+
+
+def _column_expr(field: str) -> str:
+    return "lower(file_path)" if field == "path" else "lower(file_name)"
+
+
+def search_index_definitions(table_name: str, substring_method: str) -> List[Tuple[str, str]]:
+    """文件表搜索索引定义 [(索引名, ON 子句)]"""
+    definitions = [
+        (
+            f"idx_{table_name}_name_prefix",
+            f"ON {table_name}(backup_set_id, lower(file_name) text_pattern_ops)",
+        ),
+        (
+            f"idx_{table_name}_name_suffix",
+            f"ON {table_name}(backup_set_id, reverse(lower(file_name)) text_pattern_ops)",
+        ),
+    ]
+    for field in SEARCH_FIELDS:
+        column = _column_expr(field)
+        if substring_method == "trgm":
+            definitions.append((f"idx_{table_name}_{field}_trgm", f"ON {table_name} USING gin ({column} gin_trgm_ops)"))
+        elif substring_method == "ngram":
+            definitions.append(
+                (f"idx_{table_name}_{field}_ngram", f"ON {table_name} USING gin (to_tsvector('ngram', {column}))")
+            )
+    return definitions
+
+
+async def build_search_indexes(conn, table_name: str, concurrently: bool = True) -> List[str]:
+    """为文件表创建搜索索引（已存在的跳过），返回新建的索引名"""
+    if not getattr(get_settings(), "FILE_SEARCH_INDEX_ENABLED", True):
+        return []
+    table_name = _checked_table_name(table_name)
+    method = await detect_substring_method(conn)
+    return await build_backup_files_indexes(
+        conn, table_name, concurrently=concurrently, definitions=search_index_definitions(table_name, method)
+    )
+
+
+async def _build_search_indexes_in_background(table_name: str):
+    try:
+        async with get_opengauss_connection() as conn:
+            created = await build_search_indexes(conn, table_name)
+            if created:
+                logger.info(f"[文件搜索] 文件表 {table_name} 已补建 {len(created)} 个搜索索引")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"[文件搜索] 补建文件表 {table_name} 的搜索索引失败（搜索仍可用，但需顺序扫描）: {e}")
+
+
+async def _ensure_search_indexes_scheduled(conn, table_name: str):
+    """搜索时发现文件表缺少搜索索引，在后台补建（每张表只触发一次）"""
+    if table_name in _index_builds or not getattr(get_settings(), "FILE_SEARCH_INDEX_ENABLED", True):
+        return
+    try:
+        table_name = _checked_table_name(table_name)
+    except ValueError:
+        return
+    existing = await _existing_indexes(conn, table_name)
+    if f"idx_{table_name}_name_prefix" in existing:
+        _index_builds[table_name] = None
+        return
+    _index_builds[table_name] = asyncio.create_task(_build_search_indexes_in_background(table_name))
+
+
+def _ngram_searchable(term: str) -> bool:
+    """ngram 预筛选只适用于不短于 gram 长度、只含单词字符的搜索词
+
+    更短的词（"x"）生成不出 gram，含标点的词（"o.p"）会被解析器切开，预筛选会漏掉匹配，这两种情况直接用 LIKE
+    """
+    return len(term) >= _NGRAM_SIZE and all(char.isalnum() or char == "_" for char in term)
+
+
+def _opengauss_predicate(query: SearchQuery, method: str, first_param: int) -> Tuple[str, list]:
+    """openGauss 匹配条件（与搜索索引的表达式一致），返回 (SQL, 参数)"""
+    if query.mode == "extension":
+        # 扩展名总是文件名后缀：反转后按前缀匹配，使用后缀索引
+        return (
+            f"reverse(lower(file_name)) LIKE ${first_param} ESCAPE '\\'",
+            [_like_escape(query.term[::-1]) + "%"],
+        )
+    column = _column_expr(query.field)
+    pattern = like_pattern(query)
+    if query.mode == "substring" and method == "ngram" and _ngram_searchable(query.term):
+        return (
+            f"to_tsvector('ngram', {column}) @@ plainto_tsquery('ngram', ${first_param}) "
+            f"AND {column} LIKE ${first_param + 1} ESCAPE '\\'",
+            [query.term, pattern],
+        )
+    return f"{column} LIKE ${first_param} ESCAPE '\\'", [pattern]
+
+
+async def _opengauss_search_set(conn, backup_set_db_id: int, query: SearchQuery, file_type: Optional[str],
+                                limit: int) -> List[Dict]:
+    table_name = await get_backup_files_table_by_set_id(conn, backup_set_db_id)
+    await _ensure_search_indexes_scheduled(conn, table_name)
+    method = await detect_substring_method(conn)
+    predicate, args = _opengauss_predicate(query, method, 2)
+    type_sql = ""
+    if file_type:
+        type_sql = f" AND file_type = ${2 + len(args)}::backupfiletype"
+        args.append(file_type.lower())
+    rows = await conn.fetch(
+        f"""
+        SELECT {", ".join(_FILE_COLUMNS)}
+        FROM {table_name}
+        WHERE backup_set_id = $1 AND {predicate}{type_sql}
+        ORDER BY file_path
+        LIMIT ${2 + len(args)}
+        """,
+        backup_set_db_id,
+        *args,
+        limit,
+    )
+    return [file_row_to_dict(row) for row in rows or []]
+
+
+async def _opengauss_count_set(conn, backup_set_db_id: int, query: SearchQuery, file_type: Optional[str],
+                               cap: int) -> Tuple[int, Optional[str]]:
+    table_name = await get_backup_files_table_by_set_id(conn, backup_set_db_id)
+    method = await detect_substring_method(conn)
+    predicate, args = _opengauss_predicate(query, method, 2)
+    type_sql = ""
+    if file_type:
+        type_sql = f" AND file_type = ${2 + len(args)}::backupfiletype"
+        args.append(file_type.lower())
+    row = await conn.fetchrow(
+        f"""
+        SELECT COUNT(*) AS match_count, MIN(file_path) AS sample_path
+        FROM (
+            SELECT file_path FROM {table_name}
+            WHERE backup_set_id = $1 AND {predicate}{type_sql}
+            LIMIT ${2 + len(args)}
+        ) matched
+        """,
+        backup_set_db_id,
+        *args,
+        cap,
+    )
+    return (int(row["match_count"] or 0), row["sample_path"]) if row else (0, None)
+
+
+# ---------------------------------------------------------------------------
+# SQLite
+# ---------------------------------------------------------------------------
+
+async def ensure_sqlite_search_index(conn) -> bool:
+    """创建 FTS5 trigram 外部内容表和同步触发器（SQLite 不支持 trigram 时返回 False）"""
+    cursor = await conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SQLITE_FTS_TABLE,)
+    )
+    exists = await cursor.fetchone()
+    try:
+        await conn.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE}
+            USING fts5(file_name, file_path, content='backup_files', content_rowid='id', tokenize='trigram')
+            """
+        )
+    except Exception as e:
+        logger.warning(f"[文件搜索] SQLite 不支持 FTS5 trigram，文件搜索使用 LIKE 顺序扫描: {e}")
+        return False
+    await conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ai AFTER INSERT ON backup_files BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, file_name, file_path) VALUES (new.id, new.file_name, new.file_path);
+        END
+        """
+    )
+    await conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ad AFTER DELETE ON backup_files BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, file_name, file_path)
+            VALUES ('delete', old.id, old.file_name, old.file_path);
+        END
+        """
+    )
+    await conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_au AFTER UPDATE OF file_name, file_path ON backup_files BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, file_name, file_path)
+            VALUES ('delete', old.id, old.file_name, old.file_path);
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, file_name, file_path) VALUES (new.id, new.file_name, new.file_path);
+        END
+        """
+    )
+    if not exists:
+        # 新建索引时导入已有文件记录
+        await conn.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+        logger.info(f"[文件搜索] 已建立 SQLite 文件名索引 {SQLITE_FTS_TABLE}")
+    await conn.commit()
+    return True
+
+
+async def _sqlite_has_fts(conn) -> bool:
+    cursor = await conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SQLITE_FTS_TABLE,)
+    )
+    return bool(await cursor.fetchone())
+
+
+async def _sqlite_match_sql(conn, query: SearchQuery, file_type: Optional[str]) -> Tuple[str, list]:
+    """SQLite 匹配的 FROM/WHERE 子句（有 FTS 表时在 trigram 索引上 LIKE）"""
+    column = "file_path" if query.field == "path" and query.mode != "extension" else "file_name"
+    pattern = like_pattern(query)
+    # trigram 索引上的 LIKE 不需要 ESCAPE 时不加（搜索词含通配符时才转义）
+    escape = " ESCAPE '\\'" if _like_escape(query.term) != query.term else ""
+    if await _sqlite_has_fts(conn):
+        from_sql = f"{SQLITE_FTS_TABLE} s JOIN backup_files f ON f.id = s.rowid"
+        where_sql = f"f.backup_set_id = ? AND s.{column} LIKE ?{escape}"
+    else:
+        from_sql = "backup_files f"
+        where_sql = f"f.backup_set_id = ? AND f.{column} LIKE ?{escape}"
+    args = [pattern]
+    if file_type:
+        where_sql += " AND LOWER(f.file_type) = ?"
+        args.append(file_type.lower())
+    return f"FROM {from_sql} WHERE {where_sql}", args
+
+
+async def _sqlite_search_set(conn, backup_set_db_id: int, query: SearchQuery, file_type: Optional[str],
+                             limit: int) -> List[Dict]:
+    match_sql, args = await _sqlite_match_sql(conn, query, file_type)
+    cursor = await conn.execute(
+        f"SELECT {', '.join('f.' + column for column in _FILE_COLUMNS)} {match_sql} ORDER BY f.file_path LIMIT ?",
+        (backup_set_db_id, *args, limit),
+    )
+    rows = await cursor.fetchall()
+    return [file_row_to_dict(dict(zip(_FILE_COLUMNS, row))) for row in rows or []]
+
+
+async def _sqlite_count_set(conn, backup_set_db_id: int, query: SearchQuery, file_type: Optional[str],
+                            cap: int) -> Tuple[int, Optional[str]]:
+    match_sql, args = await _sqlite_match_sql(conn, query, file_type)
+    cursor = await conn.execute(
+        f"SELECT COUNT(*), MIN(file_path) FROM (SELECT f.file_path AS file_path {match_sql} LIMIT ?)",
+        (backup_set_db_id, *args, cap),
+    )
+    row = await cursor.fetchone()
+    return (int(row[0] or 0), row[1]) if row else (0, None)
+
+
+# ---------------------------------------------------------------------------
+# Redis
+# ---------------------------------------------------------------------------
+
+def _redis_index_keys(backup_set_db_id) -> Dict[str, str]:
+    from backup.redis_backup_db import (
+        KEY_INDEX_BACKUP_FILE_NAME_LEX, KEY_INDEX_BACKUP_FILE_RNAME_LEX,
+        KEY_INDEX_BACKUP_FILE_PATH_LEX, KEY_INDEX_BACKUP_FILE_LEX_META,
+    )
+    return {
+        'name': f"{KEY_INDEX_BACKUP_FILE_NAME_LEX}:{backup_set_db_id}",
+        'rname': f"{KEY_INDEX_BACKUP_FILE_RNAME_LEX}:{backup_set_db_id}",
+        'path': f"{KEY_INDEX_BACKUP_FILE_PATH_LEX}:{backup_set_db_id}",
+        'meta': f"{KEY_INDEX_BACKUP_FILE_LEX_META}:{backup_set_db_id}",
+    }
+
+
+async def ensure_redis_search_index(redis, backup_set_db_id) -> Dict[str, str]:
+    """建立/刷新备份集的字典序索引（文件数与上次建立时不同才重建），返回索引键"""
+    from backup.redis_backup_db import KEY_INDEX_BACKUP_FILE_BY_SET_ID, KEY_PREFIX_BACKUP_FILE, _get_redis_key
+    keys = _redis_index_keys(backup_set_db_id)
+    file_index_key = f"{KEY_INDEX_BACKUP_FILE_BY_SET_ID}:{backup_set_db_id}"
+    file_count = int(await redis.scard(file_index_key) or 0)
+    indexed_count = await redis.hget(keys['meta'], 'file_count')
+    if indexed_count is not None and int(indexed_count) == file_count:
+        return keys
+
+    indexed = 0
+    await redis.delete(keys['name'], keys['rname'], keys['path'])
+    cursor = 0
+    while True:
+        cursor, file_ids = await redis.sscan(file_index_key, cursor, count=_REDIS_BATCH)
+        if file_ids:
+            pipe = redis.pipeline()
+            for file_id in file_ids:
+                pipe.hmget(_get_redis_key(KEY_PREFIX_BACKUP_FILE, file_id), 'file_name', 'file_path')
+            values = await pipe.execute()
+            names, rnames, paths = {}, {}, {}
+            for file_id, (file_name, file_path) in zip(file_ids, values):
+                if not file_path:
+                    continue
+                name = (file_name or file_path.replace("\\", "/").rpartition("/")[2]).lower()
+                names[f"{name}\x00{file_id}"] = 0
+                rnames[f"{name[::-1]}\x00{file_id}"] = 0
+                paths[f"{file_path.lower()}\x00{file_id}"] = 0
+            if names:
+                pipe = redis.pipeline()
+                pipe.zadd(keys['name'], names)
+                pipe.zadd(keys['rname'], rnames)
+                pipe.zadd(keys['path'], paths)
+                await pipe.execute()
+                indexed += len(names)
+        if cursor == 0:
+            break
+    await redis.hset(keys['meta'], mapping={'file_count': file_count})
+    logger.info(f"[文件搜索] 已建立备份集 {backup_set_db_id} 的 Redis 文件名索引（{indexed:,} 个文件）")
+    return keys
+
+
+def _glob_escape(term: str) -> str:
+    return "".join("\\" + char if char in "*?[]\\" else char for char in term)
+
+
+async def _redis_candidate_ids(redis, keys: Dict[str, str], query: SearchQuery):
+    """按索引顺序产出候选文件ID（分批）"""
+    if query.mode == "substring":
+        key = keys['path' if query.field == "path" else 'name']
+        match = f"*{_glob_escape(query.term)}*\x00*"
+        matched = []
+        cursor = 0
+        while True:
+            cursor, items = await redis.zscan(key, cursor=cursor, match=match, count=_REDIS_BATCH * 10)
+            matched.extend(member for member, _ in items)
+            if cursor == 0:
+                break
+        matched.sort()
+        for start in range(0, len(matched), _REDIS_BATCH):
+            yield [member.rpartition("\x00")[2] for member in matched[start:start + _REDIS_BATCH]]
+        return
+
+    if query.mode == "extension":
+        key, prefix = keys['rname'], query.term[::-1]
+    else:
+        key, prefix = keys['path' if query.field == "path" else 'name'], query.term
+    offset = 0
+    while True:
+        # 上界用字节 0xFF（大于任何 UTF-8 字节），不能用字符 "\xff"（编码后为 0xC3 0xBF）
+        members = await redis.zrangebylex(
+            key, b"[" + prefix.encode("utf-8"), b"[" + prefix.encode("utf-8") + b"\xff",
+            start=offset, num=_REDIS_BATCH,
+        )
+        if not members:
+            return
+        yield [member.rpartition("\x00")[2] for member in members]
+        if len(members) < _REDIS_BATCH:
+            return
+        offset += len(members)
+
+
+async def _redis_iter_matches(redis, backup_set_db_id, query: SearchQuery, file_type: Optional[str]):
+    """产出匹配的已复制文件（按索引顺序）"""
+    from backup.redis_backup_db import KEY_PREFIX_BACKUP_FILE, _get_redis_key
+    keys = await ensure_redis_search_index(redis, backup_set_db_id)
+    async for file_ids in _redis_candidate_ids(redis, keys, query):
+        pipe = redis.pipeline()
+        for file_id in file_ids:
+            pipe.hgetall(_get_redis_key(KEY_PREFIX_BACKUP_FILE, file_id))
+        for file_id, file_data in zip(file_ids, await pipe.execute()):
+            if not file_data or file_data.get('is_copy_success', '0') != '1':
+                continue
+            if file_type and str(file_data.get('file_type', '')).lower() != file_type.lower():
+                continue
+            yield file_id, file_data
+
+
+async def _redis_search_set(redis, backup_set_db_id, query: SearchQuery, file_type: Optional[str],
+                            limit: int) -> List[Dict]:
+    files = []
+    async for file_id, file_data in _redis_iter_matches(redis, backup_set_db_id, query, file_type):
+        files.append(redis_file_to_dict(file_id, file_data))
+        if len(files) >= limit:
+            break
+    return files
+
+
+async def _redis_count_set(redis, backup_set_db_id, query: SearchQuery, file_type: Optional[str],
+                           cap: int) -> Tuple[int, Optional[str]]:
+    count = 0
+    sample_path = None
+    async for _, file_data in _redis_iter_matches(redis, backup_set_db_id, query, file_type):
+        count += 1
+        file_path = file_data.get('file_path')
+        if file_path and (sample_path is None or file_path < sample_path):
+            sample_path = file_path
+        if count >= cap:
+            break
+    return count, sample_path
+
+
+# ---------------------------------------------------------------------------
+# 对外接口
+# ---------------------------------------------------------------------------
+
+async def _candidate_sets_sql(conn, set_ids: Optional[Sequence[str]], group_from: Optional[str],
+                              group_to: Optional[str], max_sets: int, sqlite: bool) -> List[Dict]:
+    conditions = ["LOWER(status) <> 'deleted'" if sqlite else "LOWER(status::text) <> 'deleted'"]
+    args: list = []
+
+    def _param() -> str:
+        return "?" if sqlite else f"${len(args)}"
+
+    if set_ids:
+        if sqlite:
+            conditions.append(f"set_id IN ({', '.join('?' for _ in set_ids)})")
+            args.extend(set_ids)
+        else:
+            args.append(list(set_ids))
+            conditions.append(f"set_id = ANY({_param()}::TEXT[])")
+    if group_from:
+        args.append(group_from)
+        conditions.append(f"backup_group >= {_param()}")
+    if group_to:
+        args.append(group_to)
+        conditions.append(f"backup_group <= {_param()}")
+    args.append(max_sets)
+    sql = (
+        "SELECT id, set_id, set_name, backup_group, backup_time FROM backup_sets "
+        f"WHERE {' AND '.join(conditions)} ORDER BY backup_time DESC LIMIT {_param()}"
+    )
+    if sqlite:
+        cursor = await conn.execute(sql, tuple(args))
+        rows = [dict(zip(("id", "set_id", "set_name", "backup_group", "backup_time"), row))
+                for row in await cursor.fetchall()]
+    else:
+        rows = [dict(row) for row in await conn.fetch(sql, *args) or []]
+    return rows
+
+
+async def _candidate_sets_redis(redis, set_ids: Optional[Sequence[str]], group_from: Optional[str],
+                                group_to: Optional[str], max_sets: int) -> List[Dict]:
+    from backup.redis_backup_db import KEY_INDEX_BACKUP_SETS, KEY_PREFIX_BACKUP_SET
+    candidates = list(set_ids) if set_ids else list(await redis.smembers(KEY_INDEX_BACKUP_SETS))
+    pipe = redis.pipeline()
+    for set_id in candidates:
+        pipe.hgetall(f"{KEY_PREFIX_BACKUP_SET}:{set_id}")
+    rows = []
+    for set_id, data in zip(candidates, await pipe.execute()):
+        if not data or str(data.get('status', '')).lower() == 'deleted':
+            continue
+        group = data.get('backup_group') or ''
+        if (group_from and group < group_from) or (group_to and group > group_to):
+            continue
+        rows.append({
+            'id': data.get('id', set_id),
+            'set_id': set_id,
+            'set_name': data.get('set_name'),
+            'backup_group': group,
+            'backup_time': data.get('backup_time'),
+        })
+    rows.sort(key=lambda row: str(row['backup_time'] or ''), reverse=True)
+    return rows[:max_sets]
+
+
+def _set_fields(set_row: Dict) -> Dict:
+    backup_time = set_row.get('backup_time')
+    return {
+        'backup_set_id': set_row['set_id'],
+        'set_name': set_row.get('set_name'),
+        'backup_group': set_row.get('backup_group'),
+        'backup_time': backup_time.isoformat() if hasattr(backup_time, 'isoformat') else backup_time,
+    }
+
+
+async def _run_search(conn, backend: str, sets: List[Dict], query: SearchQuery, file_type: Optional[str],
+                      offset: int, limit: int, group_by_set: bool) -> Dict:
+    search_set = {
+        'opengauss': _opengauss_search_set, 'sqlite': _sqlite_search_set, 'redis': _redis_search_set,
+    }[backend]
+    count_set = {
+        'opengauss': _opengauss_count_set, 'sqlite': _sqlite_count_set, 'redis': _redis_count_set,
+    }[backend]
+
+    if group_by_set:
+        matched_sets = []
+        for set_row in sets:
+            count, sample_path = await count_set(conn, set_row['id'], query, file_type, _MATCH_COUNT_CAP)
+            if count:
+                matched_sets.append(dict(
+                    _set_fields(set_row),
+                    match_count=count,
+                    match_count_capped=count >= _MATCH_COUNT_CAP,
+                    sample_path=sample_path,
+                ))
+        return {'sets': matched_sets, 'searched_sets': len(sets)}
+
+    # 按备份集顺序逐个查询，凑满 offset + limit + 1 条即停止
+    items: List[Dict] = []
+    skip = offset
+    for set_row in sets:
+        need = skip + (limit + 1 - len(items))
+        rows = await search_set(conn, set_row['id'], query, file_type, need)
+        if len(rows) <= skip:
+            skip -= len(rows)
+            continue
+        fields = _set_fields(set_row)
+        items.extend(dict(row, **fields) for row in rows[skip:])
+        skip = 0
+        if len(items) > limit:
+            break
+    return {'items': items[:limit], 'has_more': len(items) > limit}
+
+
+async def search_backup_files(search_term: str, mode: str = "auto", field: str = "name",
+                              set_ids: Optional[Sequence[str]] = None, backup_group_from: Optional[str] = None,
+                              backup_group_to: Optional[str] = None, file_type: Optional[str] = None,
+                              offset: int = 0, limit: int = 100, group_by_set: bool = False) -> Dict:
+    """搜索一个或多个备份集中的文件
+
+    Args:
+        search_term: 搜索词（mode 为 auto 时按写法判断前缀/子串/扩展名）
+        mode: auto / prefix / substring / extension
+        field: name（文件名）或 path（完整路径，扩展名查询总是匹配文件名）
+        set_ids: 限定的备份集 set_id，为空时搜索全部备份集（最近 FILE_SEARCH_MAX_SETS 个）
+        backup_group_from / backup_group_to: 备份组（YYYY-MM）范围
+        file_type: 文件类型过滤（file / directory / symlink）
+        offset / limit: 分页
+        group_by_set: 只返回包含匹配文件的备份集（"哪些备份集包含这个文件？"）
+
+    Returns:
+        {'items', 'offset', 'limit', 'has_more', 'mode', 'searched_sets'}，
+        group_by_set 时为 {'sets': [{备份集信息, match_count, match_count_capped, sample_path}], ...}
+    """
+    query = parse_search_query(search_term, mode, field)
+    offset = max(0, int(offset or 0))
+    limit = max(1, min(int(limit or 100), int(getattr(get_settings(), "FILE_SEARCH_MAX_LIMIT", 1000) or 1000)))
+    max_sets = int(getattr(get_settings(), "FILE_SEARCH_MAX_SETS", 120) or 120)
+    start_time = asyncio.get_running_loop().time()
+
+    if is_redis():
+        from config.redis_db import get_redis_client
+        conn = await get_redis_client()
+        sets = await _candidate_sets_redis(conn, set_ids, backup_group_from, backup_group_to, max_sets)
+        result = await _run_search(conn, 'redis', sets, query, file_type, offset, limit, group_by_set)
+    elif is_opengauss():
+        async with get_opengauss_connection() as conn:
+            sets = await _candidate_sets_sql(conn, set_ids, backup_group_from, backup_group_to, max_sets, False)
+            result = await _run_search(conn, 'opengauss', sets, query, file_type, offset, limit, group_by_set)
+    else:
+        from utils.scheduler.sqlite_utils import get_sqlite_connection
+        async with get_sqlite_connection() as conn:
+            sets = await _candidate_sets_sql(conn, set_ids, backup_group_from, backup_group_to, max_sets, True)
+            result = await _run_search(conn, 'sqlite', sets, query, file_type, offset, limit, group_by_set)
+
+    result.setdefault('searched_sets', len(sets))
+    result.update({'mode': query.mode, 'field': query.field, 'offset': offset, 'limit': limit})
+    logger.info(
+        f"[文件搜索] {query.mode} 搜索 {query.field}={query.term!r}，{len(sets)} 个备份集，"
+        f"返回 {len(result.get('sets' if group_by_set else 'items', []))} 条，"
+        f"耗时 {asyncio.get_running_loop().time() - start_time:.3f} 秒"
+    )
+    return result
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件状态目录模块（增量/差异备份变更检测）
+File State Catalog Module
+
+每个源路径一个持久化的 SQLite 目录文件（{FILE_CATALOG_DIR}/{源路径哈希}.db），记录：
+    path, size, mtime_ns, file_id(inode), last_backup_set,
+    full_size, full_mtime_ns, full_file_id, full_backup_set
+
+扫描时逐个文件与目录比较：
+- 完整备份（FULL / MONTHLY_FULL）：所有文件都备份，并把本次状态作为新的完整备份基线
+- 增量备份（INCREMENTAL）：只备份相对于上一次成功备份（任意类型）新增或变化的文件
+- 差异备份（DIFFERENTIAL）：只备份相对于上一次成功完整备份新增或变化的文件
+
+扫描过程中本次文件状态先写入 pending_state 暂存表，压缩成功写入压缩包（或内容去重引用）的文件
+再登记到 archived_state。备份任务成功完成后只把已登记的文件合并到 file_state，失败或取消时全部丢弃，
+保证下次增量备份不会漏掉本次未写入磁带的文件（包括任务成功但个别文件压缩/读取失败的情况）。
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODE_FULL = "full"
+MODE_INCREMENTAL = "incremental"
+MODE_DIFFERENTIAL = "differential"
+
+# SQLite 单条语句参数个数上限（兼容旧版本的 999）
+_LOOKUP_CHUNK_SIZE = 900
+
+
+def _normalize_source_path(source_path: str) -> str:
+    normalized = os.path.normcase(os.path.abspath(str(source_path)))
+    return normalized.rstrip("\\/") or normalized
+
+
+def get_catalog_path(source_path: str, catalog_dir) -> Path:
+    """返回源路径对应的目录文件路径"""
+    digest = hashlib.sha1(_normalize_source_path(source_path).encode("utf-8")).hexdigest()[:16]
+    return Path(catalog_dir) / f"file_state_{digest}.db"
+
+
+def backup_mode_for_task(backup_task) -> str:
+    """根据任务类型返回备份模式（full/incremental/differential）"""
+    task_type = getattr(backup_task, "task_type", None)
+    task_type_value = getattr(task_type, "value", task_type)
+    task_type_value = str(task_type_value or "full").lower()
+    if task_type_value == MODE_INCREMENTAL:
+        return MODE_INCREMENTAL
+    if task_type_value == MODE_DIFFERENTIAL:
+        return MODE_DIFFERENTIAL
+    return MODE_FULL
+
+
+def _file_path_from_info(file_info) -> str:
+    if isinstance(file_info, dict):
+        return file_info.get("path", "")
+    return file_info.path
+
+
+def _file_state_from_info(file_info) -> Tuple[int, int, int]:
+    """从扫描器的 file_info 字典或 ScanRecord 中提取 (size, mtime_ns, file_id)"""
+    if not isinstance(file_info, dict):
+        return file_info.size, file_info.mtime_ns, file_info.inode
+    size = int(file_info.get("size", 0) or 0)
+    mtime_ns = file_info.get("mtime_ns")
+    if mtime_ns is None:
+        modified_time = file_info.get("modified_time")
+        try:
+            mtime_ns = int(modified_time.timestamp() * 1_000_000_000) if modified_time else 0
+        except Exception:
+            mtime_ns = 0
+    file_id = int(file_info.get("inode", 0) or 0)
+    return size, int(mtime_ns), file_id
+
+
+class FileStateCatalog:
+    """单个源路径的文件状态目录（SQLite）"""
+
+    def __init__(self, source_path: str, catalog_path: Path):
+        self.source_path = source_path
+        self.catalog_path = Path(catalog_path)
+        self.catalog_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.catalog_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS file_state (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    file_id INTEGER NOT NULL DEFAULT 0,
+                    last_backup_set TEXT,
+                    full_size INTEGER,
+                    full_mtime_ns INTEGER,
+                    full_file_id INTEGER,
+                    full_backup_set TEXT
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_state (
+                    backup_set TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    file_id INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (backup_set, path)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS archived_state (
+                    backup_set TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    PRIMARY KEY (backup_set, path)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS catalog_info (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO catalog_info (key, value) VALUES ('source_path', ?)",
+                (self.source_path,)
+            )
+
+    def lookup(self, paths: List[str], baseline: str) -> Dict[str, Tuple[Optional[int], Optional[int], Optional[int]]]:
+        """批量查询文件的基线状态
+
+        Args:
+            paths: 文件路径列表
+            baseline: 'last'（上一次备份）或 'full'（上一次完整备份）
+
+        Returns:
+            {path: (size, mtime_ns, file_id)}，目录中不存在的路径不返回
+        """
+        if baseline == "full":
+            columns = "path, full_size, full_mtime_ns, full_file_id"
+        else:
+            columns = "path, size, mtime_ns, file_id"
+        result = {}
+        with self._lock:
+            for start in range(0, len(paths), _LOOKUP_CHUNK_SIZE):
+                chunk = paths[start:start + _LOOKUP_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM file_state WHERE path IN ({placeholders})", chunk
+                ).fetchall()
+                for row in rows:
+                    result[row[0]] = (row[1], row[2], row[3])
+        return result
+
+    def stage(self, backup_set: str, records: List[Tuple[str, int, int, int]]):
+        """暂存本次备份的文件状态 [(path, size, mtime_ns, file_id), ...]"""
+        if not records:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pending_state (backup_set, path, size, mtime_ns, file_id) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(backup_set,) + tuple(record) for record in records]
+            )
+
+    def mark_archived(self, backup_set: str, paths: List[str]):
+        """登记已成功写入压缩包的文件（只有登记过的文件在 commit_stage 时合并）"""
+        if not paths:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO archived_state (backup_set, path) VALUES (?, ?)",
+                [(backup_set, path) for path in paths]
+            )
+
+    def commit_stage(self, backup_set: str, mode: str) -> int:
+        """备份成功后把已写入压缩包的文件状态合并到目录，返回合并的文件数"""
+        archived = ("SELECT p.* FROM pending_state p JOIN archived_state a "
+                    "ON a.backup_set = p.backup_set AND a.path = p.path WHERE p.backup_set = ?")
+        with self._lock, self._conn:
+            staged = self._conn.execute(
+                f"SELECT COUNT(*) FROM ({archived})", (backup_set,)
+            ).fetchone()[0]
+            if mode == MODE_FULL:
+                # 完整备份扫描了全部文件：不在本次扫描结果中的路径已被删除，从目录中移除；
+                # 本次没有成功写入压缩包的文件也移除，下次增量/差异备份按新文件处理
+                self._conn.execute(
+                    "DELETE FROM file_state WHERE path NOT IN "
+                    "(SELECT path FROM archived_state WHERE backup_set = ?)",
+                    (backup_set,)
+                )
+                self._conn.execute("""
+                    INSERT OR REPLACE INTO file_state (
+                        path, size, mtime_ns, file_id, last_backup_set,
+                        full_size, full_mtime_ns, full_file_id, full_backup_set
+                    )
+                    SELECT path, size, mtime_ns, file_id, backup_set,
+                           size, mtime_ns, file_id, backup_set
+                    FROM ({archived})
+                """.format(archived=archived), (backup_set,))
+            else:
+                # 增量/差异备份只更新"上一次备份"状态，完整备份基线保持不变
+                self._conn.execute("""
+                    INSERT INTO file_state (path, size, mtime_ns, file_id, last_backup_set)
+                    SELECT path, size, mtime_ns, file_id, backup_set
+                    FROM ({archived}) WHERE true
+                    ON CONFLICT(path) DO UPDATE SET
+                        size = excluded.size,
+                        mtime_ns = excluded.mtime_ns,
+                        file_id = excluded.file_id,
+                        last_backup_set = excluded.last_backup_set
+                """.format(archived=archived), (backup_set,))
+            self._conn.execute("DELETE FROM pending_state WHERE backup_set = ?", (backup_set,))
+            self._conn.execute("DELETE FROM archived_state WHERE backup_set = ?", (backup_set,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO catalog_info (key, value) VALUES ('last_backup_set', ?)",
+                (backup_set,)
+            )
+            if mode == MODE_FULL:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO catalog_info (key, value) VALUES ('full_backup_set', ?)",
+                    (backup_set,)
+                )
+        return staged
+
+    def discard_stage(self, backup_set: Optional[str] = None):
+        """丢弃暂存状态（backup_set 为 None 时丢弃全部，用于清理上次异常退出的残留）"""
+        with self._lock, self._conn:
+            if backup_set is None:
+                self._conn.execute("DELETE FROM pending_state")
+                self._conn.execute("DELETE FROM archived_state")
+            else:
+                self._conn.execute("DELETE FROM pending_state WHERE backup_set = ?", (backup_set,))
+                self._conn.execute("DELETE FROM archived_state WHERE backup_set = ?", (backup_set,))
+
+    def has_full_baseline(self) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM catalog_info WHERE key = 'full_backup_set'"
+            ).fetchone()
+        return bool(row and row[0])
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class ChangeDetector:
+    """一次备份运行的变更检测器（扫描器在写入 backup_files 之前调用）"""
+
+    def __init__(self, source_paths: List[str], mode: str, backup_set: str, catalog_dir,
+                 stage_batch_size: int = 5000):
+        self.mode = mode
+        self.backup_set = str(backup_set)
+        self.stage_batch_size = max(1, int(stage_batch_size))
+        self._catalogs: List[Tuple[str, FileStateCatalog]] = []
+        for source_path in dict.fromkeys(source_paths or []):
+            catalog = FileStateCatalog(source_path, get_catalog_path(source_path, catalog_dir))
+            # 清理上次异常退出残留的暂存数据
+            catalog.discard_stage()
+            self._catalogs.append((_normalize_source_path(source_path), catalog))
+        # 最长前缀优先，嵌套的源路径归属到更具体的目录
+        self._catalogs.sort(key=lambda item: len(item[0]), reverse=True)
+        self._staged: Dict[int, List[Tuple[str, int, int, int]]] = {}
+        self.stats = {
+            "checked": 0,
+            "new": 0,
+            "changed": 0,
+            "unchanged": 0,
+            "unchanged_bytes": 0,
+        }
+
+    @classmethod
+    def from_task(cls, backup_task, backup_set, settings) -> Optional["ChangeDetector"]:
+        """根据任务类型创建变更检测器，未启用时返回 None"""
+        if not getattr(settings, "FILE_CATALOG_ENABLED", True):
+            return None
+        mode = backup_mode_for_task(backup_task)
+        catalog_dir = getattr(settings, "FILE_CATALOG_DIR", "data/file_catalog")
+        backup_set_key = getattr(backup_set, "set_id", None) or getattr(backup_set, "id", None)
+        detector = cls(
+            source_paths=getattr(backup_task, "source_paths", None) or [],
+            mode=mode,
+            backup_set=backup_set_key,
+            catalog_dir=catalog_dir,
+        )
+        if mode != MODE_FULL:
+            missing = [catalog.source_path for _, catalog in detector._catalogs if not catalog.has_full_baseline()]
+            if missing:
+                logger.warning(f"[变更检测] 以下源路径没有完整备份基线，将备份全部文件: {missing}")
+        logger.info(f"[变更检测] 模式={mode}，备份集={backup_set_key}，源路径数={len(detector._catalogs)}")
+        return detector
+
+    def _catalog_index_for(self, file_path: str) -> Optional[int]:
+        normalized = os.path.normcase(file_path)
+        for index, (source_prefix, _) in enumerate(self._catalogs):
+            if normalized == source_prefix or normalized.startswith(source_prefix + os.sep) \
+                    or normalized.startswith(source_prefix + "/"):
+                return index
+        return 0 if len(self._catalogs) == 1 else None
+
+    def filter_batch(self, file_infos: List) -> List:
+        """过滤出需要备份的文件（新增或变化），并暂存本次状态
+
+        file_infos 可以是扫描器的 file_info 字典，也可以是 ScanRecord。
+        """
+        if not file_infos:
+            return file_infos
+        grouped: Dict[Optional[int], List[Dict]] = {}
+        for file_info in file_infos:
+            grouped.setdefault(self._catalog_index_for(_file_path_from_info(file_info)), []).append(file_info)
+
+        accepted_ids = set()
+        for index, infos in grouped.items():
+            if index is None:
+                # 不属于任何源路径（理论上不会出现），按新文件处理
+                accepted_ids.update(id(info) for info in infos)
+                self.stats["checked"] += len(infos)
+                self.stats["new"] += len(infos)
+                continue
+            catalog = self._catalogs[index][1]
+            states = [(info, _file_state_from_info(info)) for info in infos]
+            baseline = {}
+            if self.mode != MODE_FULL:
+                baseline = catalog.lookup(
+                    [_file_path_from_info(info) for info in infos],
+                    "full" if self.mode == MODE_DIFFERENTIAL else "last"
+                )
+            staged = self._staged.setdefault(index, [])
+            for info, (size, mtime_ns, file_id) in states:
+                self.stats["checked"] += 1
+                path = _file_path_from_info(info)
+                if self.mode != MODE_FULL:
+                    previous = baseline.get(path)
+                    if previous is None or previous[0] is None:
+                        self.stats["new"] += 1
+                    elif (previous[0] != size or previous[1] != mtime_ns
+                          or (previous[2] and file_id and previous[2] != file_id)):
+                        self.stats["changed"] += 1
+                    else:
+                        self.stats["unchanged"] += 1
+                        self.stats["unchanged_bytes"] += size
+                        continue
+                else:
+                    self.stats["new"] += 1
+                accepted_ids.add(id(info))
+                staged.append((path, size, mtime_ns, file_id))
+            if len(staged) >= self.stage_batch_size:
+                catalog.stage(self.backup_set, staged)
+                staged.clear()
+
+        if len(accepted_ids) == len(file_infos):
+            return file_infos
+        return [info for info in file_infos if id(info) in accepted_ids]
+
+    def accept(self, file_info: Dict) -> bool:
+        """单个文件版本的 filter_batch"""
+        return bool(self.filter_batch([file_info]))
+
+    def mark_archived(self, paths: List[str]):
+        """登记已成功写入压缩包（或内容去重引用）的文件，压缩失败的文件不登记、不更新目录"""
+        grouped: Dict[int, List[str]] = {}
+        for path in paths:
+            index = self._catalog_index_for(path)
+            if index is not None:
+                grouped.setdefault(index, []).append(path)
+        for index, catalog_paths in grouped.items():
+            self._catalogs[index][1].mark_archived(self.backup_set, catalog_paths)
+
+    def _flush_staged(self):
+        for index, staged in self._staged.items():
+            if staged:
+                self._catalogs[index][1].stage(self.backup_set, staged)
+                staged.clear()
+
+    def commit(self) -> int:
+        """备份任务成功完成后调用：把本次已写入压缩包的文件状态合并到目录"""
+        self._flush_staged()
+        committed = 0
+        for _, catalog in self._catalogs:
+            committed += catalog.commit_stage(self.backup_set, self.mode)
+        logger.info(
+            f"[变更检测] 已更新文件状态目录（模式={self.mode}，备份集={self.backup_set}，文件数={committed}）"
+        )
+        return committed
+
+    def discard(self):
+        """备份失败或取消时调用：丢弃本次暂存状态"""
+        self._staged.clear()
+        for _, catalog in self._catalogs:
+            try:
+                catalog.discard_stage(self.backup_set)
+            except sqlite3.Error as e:
+                logger.warning(f"[变更检测] 丢弃暂存状态失败: {catalog.catalog_path}, 错误: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, mode=self.mode)
+
+    def close(self):
+        for _, catalog in self._catalogs:
+            catalog.close()
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """
 Final目录监控器
-独立线程监控final目录，发现文件后顺序移动到磁带
+独立线程消费待写磁带就绪队列（TapeReadyQueue），把final目录中的压缩包顺序写入磁带
 """
 
 import asyncio
@@ -11,24 +11,29 @@ import os
 import threading
 import time
 from pathlib import Path
-from typing import Optional, Dict, Set
+from typing import Optional, Dict
 from datetime import datetime
 
 from config.settings import get_settings
 from backup.tape_handler import TapeHandler
+from backup.tape_throughput_governor import get_tape_governor
+from backup.tape_ready_queue import get_tape_ready_queue, STATE_FAILED
 from models.backup import BackupSet
 from backup.utils import format_bytes
 
 logger = logging.getLogger(__name__)
 
+# final 目录中需要写入磁带的文件类型
+ARCHIVE_SUFFIXES = ('.7z', '.gz', '.tar', '.zst', '.idx')
+
 
 class FinalDirMonitor:
     """Final目录监控器
     
     功能：
-    1. 独立线程监控final目录（不阻塞其他程序，也不被其他程序阻塞）
-    2. 每10秒轮询扫描final目录
-    3. 发现文件后顺序移动到磁带（移动完一个再移动下一个）
+    1. 独立线程消费待写磁带就绪队列（压缩器把移动到final目录的压缩包发布到队列，发布后立即唤醒）
+    2. 整个线程生命周期只使用一个事件循环，顺序写入磁带（写完一个再写下一个）
+    3. 队列持久化在SQLite日志中，启动时只恢复未完成的条目（pending/copying）
     4. 支持任务完成判断
     """
     
@@ -45,8 +50,12 @@ class FinalDirMonitor:
         self._worker_thread: Optional[threading.Thread] = None
         self._running = False
         self._lock = threading.Lock()
-        self._scan_interval = 10  # 扫描间隔（秒）
-        self._processed_files: Set[str] = set()  # 已处理文件的集合（完整路径）
+        self._wait_timeout = 10  # 队列为空时的最长等待时间（秒），仅用于检查停止信号
+        self._retry_delay = 5  # 写入失败后重试前的等待时间（秒）
+        self._processed_count = 0  # 本次运行已写入磁带的文件数
+        self._ready_queue = get_tape_ready_queue(self.settings)
+        self._governor = get_tape_governor(self.settings)  # 磁带吞吐调节器（上报待写队列深度）
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
         
     def start(self):
         """启动监控线程"""
@@ -55,6 +64,7 @@ class FinalDirMonitor:
                 logger.warning("[Final监控] 监控线程已经在运行")
                 return
             
+            self._recover_unfinished()
             self._running = True
             self._worker_thread = threading.Thread(
                 target=self._monitor_loop,
@@ -62,7 +72,7 @@ class FinalDirMonitor:
                 daemon=True
             )
             self._worker_thread.start()
-            logger.info("[Final监控] Final目录监控线程已启动（10秒轮询扫描）")
+            logger.info("[Final监控] Final目录监控线程已启动（就绪队列模式）")
     
     def stop(self):
         """停止监控线程"""
@@ -71,6 +81,7 @@ class FinalDirMonitor:
                 return
             
             self._running = False
+            self._ready_queue.wake_up()
             if self._worker_thread and self._worker_thread.is_alive():
                 self._worker_thread.join(timeout=30)
                 if self._worker_thread.is_alive():
@@ -78,6 +89,37 @@ class FinalDirMonitor:
                 else:
                     logger.info("[Final监控] Final目录监控线程已停止")
     
+    def _recover_unfinished(self):
+        """启动恢复：重置写入中断的条目，并登记 final 目录中尚未进入队列的遗留文件"""
+        try:
+            recovered = self._ready_queue.recover()
+            retention_days = getattr(self.settings, 'TAPE_READY_QUEUE_RETENTION_DAYS', 7)
+            purged = self._ready_queue.purge_verified(retention_days * 86400)
+            
+            # 升级前或发布前崩溃遗留在 final 目录中的文件（仅启动时扫描一次）
+            adopted = 0
+            final_dir = self._get_final_dir()
+            if final_dir.exists():
+                for root, dirs, files in os.walk(final_dir):
+                    for file_name in sorted(files, key=lambda name: name.endswith('.idx')):
+                        file_path = Path(root) / file_name
+                        if not file_name.endswith(ARCHIVE_SUFFIXES) or self._ready_queue.is_known(file_path):
+                            continue
+                        set_id = self._extract_backup_set_id_from_path(file_path) or "unknown"
+                        try:
+                            file_size = file_path.stat().st_size
+                        except OSError:
+                            continue
+                        self._ready_queue.publish(file_path, set_id, file_size)
+                        adopted += 1
+            
+            logger.info(
+                f"[Final监控] 就绪队列恢复完成: 重置写入中断条目 {recovered} 个，"
+                f"登记遗留文件 {adopted} 个，清理已完成条目 {purged} 个，当前状态: {self._ready_queue.state_counts()}"
+            )
+        except Exception as e:
+            logger.error(f"[Final监控] 恢复就绪队列失败: {str(e)}", exc_info=True)
+    
     def _get_final_dir(self) -> Path:
         """获取final目录路径"""
         compress_dir = Path(self.settings.BACKUP_COMPRESS_DIR)
@@ -110,28 +152,29 @@ class FinalDirMonitor:
             logger.debug(f"[Final监控] 提取backup_set_id失败: {file_path}, 错误: {str(e)}")
             return None
     
-    def _move_file_to_tape(self, file_path: Path) -> bool:
+    def _move_file_to_tape(self, file_path: Path, set_id: Optional[str] = None) -> Optional[str]:
         """
         移动单个文件到磁带
         
         Args:
             file_path: 源文件路径
+            set_id: 备份集ID（就绪队列中记录的值，缺省时从路径提取）
             
         Returns:
-            bool: 是否成功
+            str: 磁带上的相对路径，失败返回None
         """
         try:
             source_file = file_path
             if not source_file.exists():
                 logger.warning(f"[Final监控] 文件不存在: {source_file}")
-                return False
+                return None
             
             # 获取源文件大小（用于验证）
             source_size = source_file.stat().st_size
             logger.info(f"[Final监控] 开始移动文件到磁带: {source_file.name} (大小: {format_bytes(source_size)})")
             
-            # 从路径提取backup_set_id
-            backup_set_id = self._extract_backup_set_id_from_path(source_file)
+            # 优先使用就绪队列中记录的backup_set_id，否则从路径提取
+            backup_set_id = set_id or self._extract_backup_set_id_from_path(source_file)
             if not backup_set_id:
                 logger.warning(f"[Final监控] 无法从路径提取backup_set_id: {source_file}")
                 # 创建一个临时的BackupSet对象
@@ -141,154 +184,102 @@ class FinalDirMonitor:
                 backup_set = BackupSet()
                 backup_set.set_id = backup_set_id
             
-            # 目标路径：磁带盘符（通过LTFS挂载）
-            tape_drive = self.settings.TAPE_DRIVE_LETTER.upper() + ":\\"
-            tape_backup_dir = Path(tape_drive) / backup_set.set_id
-            tape_backup_dir.mkdir(parents=True, exist_ok=True)
-            
-            # 目标文件路径
-            target_file = tape_backup_dir / source_file.name
-            
-            # 在工作线程中运行异步操作
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                # 调用tape_handler的write_to_tape_drive方法
-                tape_file_path = loop.run_until_complete(
-                    self.tape_handler.write_to_tape_drive(
-                        str(source_file),
-                        backup_set,
-                        0  # group_idx，这里不需要，传0
-                    )
+            # 调用tape_handler的write_to_tape_drive方法（在监控线程的长期事件循环中执行）
+            tape_file_path = self._loop.run_until_complete(
+                self.tape_handler.write_to_tape_drive(
+                    str(source_file),
+                    backup_set,
+                    0  # group_idx，这里不需要，传0
                 )
-                
-                if tape_file_path:
-                    logger.info(f"[Final监控] ✅ 文件已成功移动到磁带: {source_file.name} -> {tape_file_path}")
-                    return True
-                else:
-                    logger.error(f"[Final监控] ❌ 文件移动到磁带失败: {source_file.name}")
-                    return False
-                    
-            finally:
-                # 确保关闭事件循环，释放资源
-                try:
-                    pending = asyncio.all_tasks(loop)
-                    for task_obj in pending:
-                        task_obj.cancel()
-                    if pending:
-                        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
-                except Exception:
-                    pass
-                finally:
-                    loop.close()
-                    asyncio.set_event_loop(None)
+            )
+            
+            if tape_file_path:
+                logger.info(f"[Final监控] ✅ 文件已成功移动到磁带: {source_file.name} -> {tape_file_path}")
+            else:
+                logger.error(f"[Final监控] ❌ 文件移动到磁带失败: {source_file.name}")
+            return tape_file_path
                     
         except Exception as e:
             logger.error(f"[Final监控] 移动文件到磁带失败: {file_path}, 错误: {str(e)}", exc_info=True)
-            return False
+            return None
     
+    def _report_ready_queue(self):
+        """把待写磁带的文件数量和大小上报给磁带吞吐调节器"""
+        if self._governor is None:
+            return
+        file_count, total_bytes = self._ready_queue.unfinished_stats()
+        self._governor.set_ready_queue(file_count, total_bytes)
+
     def _monitor_loop(self):
-        """监控循环：扫描final目录，发现文件后顺序移动到磁带"""
+        """监控循环：从就绪队列取出文件，顺序写入磁带（整个线程只创建一个事件循环）"""
         logger.info("[Final监控] ========== Final目录监控线程已启动 ==========")
-        logger.info(f"[Final监控] 扫描间隔: {self._scan_interval}秒")
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
         
         try:
             while self._running:
                 try:
-                    # 扫描final目录
-                    final_dir = self._get_final_dir()
-                    
-                    if not final_dir.exists():
-                        logger.debug(f"[Final监控] final目录不存在: {final_dir}，等待 {self._scan_interval} 秒后重试")
-                        time.sleep(self._scan_interval)
+                    self._report_ready_queue()
+                    entry = self._ready_queue.claim_next(timeout=self._wait_timeout)
+                    if entry is None:
                         continue
                     
-                    # 递归扫描所有子目录，查找压缩文件
-                    found_files = []
-                    for root, dirs, files in os.walk(final_dir):
-                        root_path = Path(root)
-                        for file_name in files:
-                            file_path = root_path / file_name
-                            
-                            if not file_path.is_file():
-                                continue
-                            
-                            # 检查是否是压缩文件
-                            if file_path.suffix in ['.7z', '.gz', '.tar', '.zst'] or file_path.name.endswith('.tar.gz'):
-                                # 检查是否已处理过
-                                file_key = str(file_path)
-                                if file_key not in self._processed_files:
-                                    found_files.append(file_path)
+                    file_path = Path(entry['source_path'])
+                    if not file_path.exists():
+                        logger.warning(f"[Final监控] 队列中的文件已不存在，跳过: {file_path}")
+                        self._ready_queue.mark_missing(entry['id'])
+                        continue
                     
-                    # 顺序处理找到的文件（移动完一个再移动下一个）
-                    if found_files:
-                        logger.info(f"[Final监控] 扫描到 {len(found_files)} 个新文件待移动到磁带")
-                        
-                        for file_path in found_files:
-                            if not self._running:
-                                break
-                            
-                            file_key = str(file_path)
-                            
-                            # 检查文件是否仍然存在
-                            if not file_path.exists():
-                                logger.debug(f"[Final监控] 文件已不存在，跳过: {file_path.name}")
-                                self._processed_files.add(file_key)
-                                continue
-                            
-                            # 移动文件到磁带
-                            success = self._move_file_to_tape(file_path)
-                            
-                            # 标记为已处理（无论成功与否，避免重复处理）
-                            self._processed_files.add(file_key)
-                            
-                            if success:
-                                logger.info(f"[Final监控] 文件处理完成: {file_path.name}")
-                            else:
-                                logger.error(f"[Final监控] 文件处理失败: {file_path.name}")
+                    tape_file_path = self._move_file_to_tape(file_path, entry['set_id'])
+                    if tape_file_path:
+                        self._ready_queue.mark_verified(entry['id'], tape_file_path)
+                        self._processed_count += 1
+                        logger.info(f"[Final监控] 文件处理完成: {file_path.name}")
                     else:
-                        # 没有找到新文件，等待后继续扫描
-                        time.sleep(self._scan_interval)
+                        state = self._ready_queue.mark_failed(
+                            entry['id'], "写入磁带失败", entry['attempts']
+                        )
+                        logger.error(
+                            f"[Final监控] 文件处理失败: {file_path.name}（第 {entry['attempts']} 次，"
+                            f"{'已放弃，保留源文件' if state == STATE_FAILED else f'{self._retry_delay}秒后重试'}）"
+                        )
+                        time.sleep(self._retry_delay)
                         
-                except Exception as scan_error:
-                    logger.error(f"[Final监控] 扫描final目录时发生错误: {str(scan_error)}", exc_info=True)
-                    time.sleep(self._scan_interval)
+                except Exception as loop_error:
+                    logger.error(f"[Final监控] 处理就绪队列时发生错误: {str(loop_error)}", exc_info=True)
+                    time.sleep(self._retry_delay)
                     
         except Exception as e:
             logger.error(f"[Final监控] 监控循环异常: {str(e)}", exc_info=True)
         finally:
+            try:
+                pending = asyncio.all_tasks(self._loop)
+                for task_obj in pending:
+                    task_obj.cancel()
+                if pending:
+                    self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            except Exception:
+                pass
+            finally:
+                self._loop.close()
+                self._loop = None
+                asyncio.set_event_loop(None)
             logger.info("[Final监控] Final目录监控线程已退出")
     
     def is_final_dir_empty(self) -> bool:
         """
-        检查final目录是否为空（用于任务完成判断）
+        检查是否还有待写入磁带的文件（用于任务完成判断）
         
         Returns:
-            bool: final目录是否为空
+            bool: 就绪队列中没有 pending/copying 条目
         """
         try:
-            final_dir = self._get_final_dir()
-            if not final_dir.exists():
-                return True
-            
-            # 检查是否有压缩文件
-            for root, dirs, files in os.walk(final_dir):
-                for file_name in files:
-                    file_path = Path(root) / file_name
-                    if file_path.is_file():
-                        # 检查是否是压缩文件
-                        if file_path.suffix in ['.7z', '.gz', '.tar', '.zst'] or file_path.name.endswith('.tar.gz'):
-                            return False
-            
-            return True
+            file_count, _ = self._ready_queue.unfinished_stats()
+            return file_count == 0
         except Exception as e:
-            logger.error(f"[Final监控] 检查final目录是否为空时发生错误: {str(e)}")
+            logger.error(f"[Final监控] 检查就绪队列时发生错误: {str(e)}")
             return True  # 出错时假设为空，避免阻塞
     
     def get_processed_count(self) -> int:
-        """获取已处理文件数量"""
-        return len(self._processed_files)
-
-
-
+        """获取本次运行已写入磁带的文件数量"""
+        return self._processed_count
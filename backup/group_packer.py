@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+待压缩文件组装箱与认领模块
+Pending File Group Packer Module
+
+压缩文件组直接在数据库侧组装：
+1. 服务端游标按 id 顺序流式读取待压缩文件的 (id, file_size)，只读两列，不逐批 LIMIT 翻页
+2. 窗口内按大小降序首次适应（First-Fit-Decreasing）装一个接近 MAX_FILE_SIZE 的组，
+   超过容差下限的大文件单独成组
+   COMPRESSION_GROUPING_POLICY 为 "directory"/"directory_ext" 时按目录装箱：同一目录（及相邻子目录）的文件尽量
+   整体放进同一个压缩包，组内按目录（和扩展名）排序，目录恢复只需读取少量压缩包，相似文件在 tar 流中相邻也利于压缩
+3. UPDATE ... RETURNING 原子认领（is_copy_success 置为 TRUE），并发的多个压缩工作者不会认领同一文件；
+   认领后同路径的重复记录一并标记，保持"相同 file_path 只压缩一次"
+"""
+
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from backup.bulk_loader import psycopg_connection, rollback_quietly
+from backup.queued_files_optimizer import ensure_index_exists
+from backup.utils import format_bytes
+
+logger = logging.getLogger(__name__)
+
+# 与 idx_{表}_set_copy_type_id 部分索引的谓词一致，查询才能使用该索引
+_PENDING_PREDICATE = (
+    "backup_set_id = $1 "
+    "AND (is_copy_success = FALSE OR is_copy_success IS NULL) "
+    "AND file_type = 'file'::backupfiletype"
+)
+
+_CURSOR_FETCH_ROWS = 10000
+# 装箱的文件全部被其他压缩工作者抢先认领时，重新读取候选窗口的最多次数
+_CLAIM_MAX_ATTEMPTS = 5
+
+
+def pack_first_fit_decreasing(candidates: Sequence[Tuple[int, int]], capacity: int,
+                              oversize_threshold: int) -> Tuple[List[int], int]:
+    """从候选 (id, 大小) 中装一个不超过 capacity 的组
+
+    - 超过 oversize_threshold 的文件单独成组（取最早的一个，与原"第一原则"一致）
+    - 其余文件按大小降序首次适应，剩余空间用小文件填满
+
+    Returns:
+        (选中的 id 列表（按 id 升序）, 组大小)
+    """
+    for file_id, size in candidates:
+        if size > oversize_threshold:
+            return [file_id], size
+
+    chosen = []
+    total = 0
+    for file_id, size in sorted(candidates, key=lambda item: item[1], reverse=True):
+        if total + size <= capacity:
+            chosen.append(file_id)
+            total += size
+            if total == capacity:
+                break
+    chosen.sort()
+    return chosen, total
+
+
+def _directory_sort_key(directory_path: str) -> Tuple[str, ...]:
+    """按路径分量排序，子目录紧跟在父目录之后（"a/b" 排在 "a-b" 之前）"""
+    return tuple(directory_path.replace("\\", "/").split("/"))
+
+
+def _file_extension(file_name: Optional[str]) -> str:
+    return os.path.splitext(file_name or "")[1].lower()
+
+
+def pack_by_directory(candidates: Sequence[Tuple], capacity: int, oversize_threshold: int,
+                      min_fill: int, by_extension: bool = False) -> Tuple[List[int], int]:
+    """按目录装一个不超过 capacity 的组
+
+    候选为 (id, 大小, 目录, 文件名)。从最早待压缩文件所在目录开始，按路径顺序依次放入能整体装下的目录；
+    组仍不足 min_fill 时，再从装不下的目录中逐个文件补满（按扩展名/id 顺序）。
+
+    Returns:
+        (选中的 id 列表（按 id 升序）, 组大小)
+    """
+    for candidate in candidates:
+        if candidate[1] > oversize_threshold:
+            return [candidate[0]], candidate[1]
+    if not candidates:
+        return [], 0
+
+    blocks: Dict[str, List[Tuple]] = {}
+    block_sizes: Dict[str, int] = {}
+    for candidate in candidates:
+        directory = candidate[2] or ""
+        blocks.setdefault(directory, []).append(candidate)
+        block_sizes[directory] = block_sizes.get(directory, 0) + candidate[1]
+
+    ordered = sorted(blocks, key=_directory_sort_key)
+    start = ordered.index(candidates[0][2] or "")
+    ordered = ordered[start:] + ordered[:start]
+
+    chosen = []
+    total = 0
+    skipped = []
+    for directory in ordered:
+        if total + block_sizes[directory] <= capacity:
+            chosen.extend(candidate[0] for candidate in blocks[directory])
+            total += block_sizes[directory]
+        else:
+            skipped.append(directory)
+        if total == capacity:
+            break
+
+    if total < min_fill:
+        for directory in skipped:
+            files = blocks[directory]
+            if by_extension:
+                files = sorted(files, key=lambda candidate: (_file_extension(candidate[3]), candidate[0]))
+            for candidate in files:
+                if total + candidate[1] <= capacity:
+                    chosen.append(candidate[0])
+                    total += candidate[1]
+            if total >= min_fill:
+                break
+
+    chosen.sort()
+    return chosen, total
+
+
+def order_group_by_locality(group: List[Dict], by_extension: bool = False) -> List[Dict]:
+    """组内按目录（和扩展名）排序，同目录、同类型文件在 tar 流中相邻"""
+    def _key(file_info):
+        directory = file_info.get('directory_path') or os.path.dirname(file_info.get('file_path') or "")
+        extension = _file_extension(file_info.get('file_name')) if by_extension else ""
+        return (_directory_sort_key(directory), extension, file_info.get('file_name') or "")
+    return sorted(group, key=_key)
+
+
+async def stream_pending_window(conn, table_name: str, backup_set_id: int,
+                                max_files: int, max_bytes: int,
+                                with_locality: bool = False) -> Tuple[List[Tuple], bool]:
+    """服务端游标读取候选窗口（按 id 顺序），达到文件数或字节数上限即停止
+
+    Args:
+        with_locality: 同时读取目录和文件名（按目录装箱时使用）
+
+    Returns:
+        (候选 (id, 大小[, 目录, 文件名]) 列表, 待压缩文件是否已全部读完)
+    """
+    locality_columns = ", directory_path, file_name" if with_locality else ""
+    sql = (
+        f"SELECT id, COALESCE(file_size, 0) AS file_size{locality_columns} FROM {table_name} "
+        f"WHERE {_PENDING_PREDICATE} ORDER BY id"
+    )
+    candidates: List[Tuple] = []
+    window_bytes = 0
+
+    def _accept(row) -> bool:
+        nonlocal window_bytes
+        size = int(row[1] or 0)
+        candidates.append((int(row[0]), size) + tuple(row[2:]))
+        window_bytes += size
+        return len(candidates) < max_files and window_bytes < max_bytes
+
+    raw_conn = psycopg_connection(conn)
+    if raw_conn is None:
+        exhausted = True
+        async with conn.transaction():
+            async for row in conn.cursor(sql, backup_set_id, prefetch=_CURSOR_FETCH_ROWS):
+                if not _accept(tuple(row.values())):
+                    exhausted = False
+                    break
+        return candidates, exhausted
+
+    from utils.scheduler.psycopg3_compat import convert_asyncpg_to_psycopg3_query
+    if raw_conn.info.transaction_status == 3:  # INERROR
+        await rollback_quietly(raw_conn)
+    exhausted = True
+    try:
+        # 命名游标即服务端游标（需在事务中，读完后提交释放）
+        async with raw_conn.cursor(name=f"pending_pack_{backup_set_id}_{time.monotonic_ns()}") as cur:
+            await cur.execute(convert_asyncpg_to_psycopg3_query(sql), (backup_set_id,))
+            while exhausted:
+                rows = await cur.fetchmany(_CURSOR_FETCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    if not _accept(row):
+                        exhausted = False
+                        break
+        await raw_conn.commit()
+    except Exception:
+        await rollback_quietly(raw_conn)
+        raise
+    return candidates, exhausted
+
+
+async def claim_files(conn, table_name: str, backup_set_id: int, file_ids: Sequence[int]) -> List[Dict]:
+    """原子认领文件（只认领仍未标记的行），返回文件信息字典（相同路径只保留 id 最小的记录）"""
+    if not file_ids:
+        return []
+    rows = await conn.fetch(
+        f"""
+        UPDATE {table_name}
+        SET is_copy_success = TRUE, copy_status_at = NOW(), updated_at = NOW()
+        WHERE backup_set_id = $1
+          AND id = ANY($2::BIGINT[])
+          AND (is_copy_success = FALSE OR is_copy_success IS NULL)
+        RETURNING id, file_path, file_name, directory_path, display_name, file_type,
+                  file_size, file_permissions, modified_time, accessed_time
+        """,
+        backup_set_id,
+        list(file_ids),
+    )
+    by_path: Dict[str, Dict] = {}
+    for row in sorted(rows or [], key=lambda item: item["id"]):
+        file_path = row["file_path"]
+        if file_path in by_path:
+            continue
+        file_type = str(row["file_type"]).lower()
+        by_path[file_path] = {
+            'id': row['id'],
+            'path': file_path,
+            'file_path': file_path,
+            'name': row['file_name'],
+            'file_name': row['file_name'],
+            'directory_path': row['directory_path'],
+            'display_name': row['display_name'],
+            'size': row['file_size'] or 0,
+            'permissions': row['file_permissions'],
+            'modified_time': row['modified_time'],
+            'accessed_time': row['accessed_time'],
+            'is_dir': file_type.endswith('directory'),
+            'is_file': file_type.endswith('file'),
+            'is_symlink': file_type.endswith('symlink'),
+            'claimed': True,  # 已在认领时标记 is_copy_success = TRUE，mark_files_as_queued 无需再更新
+        }
+    group = list(by_path.values())
+    if group:
+        # 同路径的重复记录（重扫产生）一并标记，避免下次被单独打包（按路径更新需要 (backup_set_id, file_path) 索引）
+        await ensure_index_exists(conn, table_name)
+        await conn.execute(
+            f"""
+            UPDATE {table_name}
+            SET is_copy_success = TRUE, copy_status_at = NOW(), updated_at = NOW()
+            WHERE backup_set_id = $1
+              AND file_path = ANY($2::TEXT[])
+              AND (is_copy_success = FALSE OR is_copy_success IS NULL)
+            """,
+            backup_set_id,
+            [file_info['file_path'] for file_info in group],
+        )
+    return group
+
+
+async def claim_pending_group(conn, table_name: str, backup_set_id: int, max_file_size: int,
+                              allow_partial: bool, window_files: int = 200000,
+                              window_factor: float = 2.0, policy: str = "size") -> Tuple[List[Dict], bool]:
+    """装箱并认领一个文件组
+
+    Args:
+        allow_partial: 组大小不足容差下限（MAX_FILE_SIZE - 5%）时是否也认领（扫描完成或等待超时）
+        window_files: 候选窗口最多文件数
+        window_factor: 候选窗口最多字节数 = MAX_FILE_SIZE × window_factor
+        policy: "size"（按大小降序装满）、"directory"（按目录装箱）或 "directory_ext"（按目录装箱，组内再按扩展名排序）
+
+    Returns:
+        (认领的文件组（可能为空）, 待压缩文件是否已全部在窗口内)
+    """
+    min_group_size = int(max_file_size * 0.95)
+    by_directory = policy in ("directory", "directory_ext")
+    by_extension = policy == "directory_ext"
+    start_time = time.time()
+    for attempt in range(1, _CLAIM_MAX_ATTEMPTS + 1):
+        candidates, exhausted = await stream_pending_window(
+            conn, table_name, backup_set_id,
+            max_files=max(1, int(window_files)),
+            max_bytes=max(max_file_size, int(max_file_size * max(1.0, window_factor))),
+            with_locality=by_directory,
+        )
+        if not candidates:
+            return [], True
+
+        if by_directory:
+            file_ids, group_size = pack_by_directory(
+                candidates, max_file_size, min_group_size, min_group_size, by_extension=by_extension
+            )
+        else:
+            file_ids, group_size = pack_first_fit_decreasing(candidates, max_file_size, min_group_size)
+        if group_size < min_group_size and exhausted and not allow_partial:
+            logger.info(
+                f"[分组装箱] 待压缩文件 {len(candidates):,} 个，最多可装 {format_bytes(group_size)}，"
+                f"不足容差下限 {format_bytes(min_group_size)}，等待更多文件"
+            )
+            return [], exhausted
+
+        group = await claim_files(conn, table_name, backup_set_id, file_ids)
+        if not group:
+            # 窗口内装箱的文件已被其他压缩工作者认领（已认领的文件不再出现在候选中），读取下一个窗口重新装箱
+            logger.info(f"[分组装箱] 装箱的 {len(file_ids):,} 个文件已被其他工作者认领，重新装箱（第 {attempt} 次）")
+            continue
+        if by_directory:
+            group = order_group_by_locality(group, by_extension=by_extension)
+        logger.info(
+            f"[分组装箱] 窗口 {len(candidates):,} 个文件，装箱 {len(file_ids):,} 个（{format_bytes(group_size)}，"
+            f"{group_size / max_file_size * 100 if max_file_size else 0:.1f}% of MAX_FILE_SIZE），"
+            f"认领成功 {len(group):,} 个，耗时 {time.time() - start_time:.2f} 秒"
+        )
+        return group, exhausted
+    return [], False
@@ -17,6 +17,8 @@ import aiosqlite
 
 from utils.scheduler.db_utils import get_opengauss_connection
 from utils.datetime_utils import now, format_datetime
+from backup.scan_readiness import notify_files_written
+from backup.bulk_loader import use_copy_protocol, copy_backup_files, record_copy_failure
 
 logger = logging.getLogger(__name__)
 
@@ -409,36 +411,46 @@ class MemoryDBWriter:
                 except Exception as table_err:
                     logger.warning(f"[openGauss直接写入] 获取 backup_files 目标表名失败，将回退到主表 backup_files: {table_err}")
 
-                await conn.executemany(
-                    f"""
-                    INSERT INTO {table_name} (
-                        backup_set_id, file_path, file_name, directory_path, display_name,
-                        file_type, file_size, compressed_size, file_permissions, file_owner,
-                        file_group, created_time, modified_time, accessed_time, tape_block_start,
-                        tape_block_count, compressed, encrypted, checksum, is_copy_success,
-                        copy_status_at, backup_time, chunk_number, version, file_metadata, tags,
-                        created_at, updated_at
-                    ) VALUES (
-                        $1, $2, $3, $4, $5, $6, $7, $8, $9, $10,
-                        $11, $12, $13, $14, $15, $16, $17, $18, $19, $20,
-                        $21, $22, $23, $24, $25::jsonb, $26::jsonb, NOW(), NOW()
+                # 优先使用 COPY FROM STDIN 整批写入（内部已提交），失败时回退到 executemany
+                copied = False
+                if use_copy_protocol():
+                    try:
+                        await copy_backup_files(conn, table_name, insert_data)
+                        copied = True
+                    except Exception as copy_error:
+                        record_copy_failure(copy_error)
+
+                if not copied:
+                    await conn.executemany(
+                        f"""
+                        INSERT INTO {table_name} (
+                            backup_set_id, file_path, file_name, directory_path, display_name,
+                            file_type, file_size, compressed_size, file_permissions, file_owner,
+                            file_group, created_time, modified_time, accessed_time, tape_block_start,
+                            tape_block_count, compressed, encrypted, checksum, is_copy_success,
+                            copy_status_at, backup_time, chunk_number, version, file_metadata, tags,
+                            created_at, updated_at
+                        ) VALUES (
+                            $1, $2, $3, $4, $5, $6, $7, $8, $9, $10,
+                            $11, $12, $13, $14, $15, $16, $17, $18, $19, $20,
+                            $21, $22, $23, $24, $25::jsonb, $26::jsonb, NOW(), NOW()
+                        )
+                        """,
+                        insert_data,
                     )
-                    """,
-                    insert_data,
-                )
 
-                # psycopg3 binary protocol 需要显式提交事务
-                actual_conn = conn._conn if hasattr(conn, '_conn') else conn
-                try:
-                    await actual_conn.commit()
-                    logger.debug(f"[openGauss直接插入] 批量插入事务已提交: {len(insert_data)} 个文件，到表 {table_name}")
-                except Exception as commit_err:
-                    logger.warning(f"提交批量插入事务失败（可能已自动提交）: {commit_err}")
-                    # 如果不在事务中，commit() 可能会失败，尝试回滚
+                    # psycopg3 binary protocol 需要显式提交事务
+                    actual_conn = conn._conn if hasattr(conn, '_conn') else conn
                     try:
-                        await actual_conn.rollback()
-                    except Exception:
-                        pass
+                        await actual_conn.commit()
+                        logger.debug(f"[openGauss直接插入] 批量插入事务已提交: {len(insert_data)} 个文件，到表 {table_name}")
+                    except Exception as commit_err:
+                        logger.warning(f"提交批量插入事务失败（可能已自动提交）: {commit_err}")
+                        # 如果不在事务中，commit() 可能会失败，尝试回滚
+                        try:
+                            await actual_conn.rollback()
+                        except Exception:
+                            pass
             
             # 更新统计信息
             inserted_count = len(insert_data)
@@ -1091,6 +1103,7 @@ class MemoryDBWriter:
                 # 更新同步状态（只标记成功同步的文件）
                 if synced_file_ids:
                     await self._mark_files_synced(synced_file_ids)
+                    self._notify_synced_files(files_to_sync, synced_file_ids)
 
                 # 更新统计
                 synced_count = len(synced_file_ids)
@@ -1138,6 +1151,15 @@ class MemoryDBWriter:
             self._is_syncing = False
             self._sync_start_time = 0  # 重置同步开始时间
 
+    def _notify_synced_files(self, files_to_sync: List[Tuple], synced_file_ids: List[int]):
+        """向扫描就绪信号上报已同步到主数据库的文件数和字节数（file_record[7] 为 file_size）"""
+        synced_ids = set(int(file_id) for file_id in synced_file_ids)
+        synced_bytes = sum(
+            (file_record[7] or 0) for file_record in files_to_sync
+            if file_record and int(file_record[0]) in synced_ids
+        )
+        notify_files_written(self.backup_set_db_id, len(synced_ids), synced_bytes)
+
     async def _get_files_to_sync(self) -> List[Tuple]:
         """获取待同步的文件 - 按照BackupFile模型字段顺序（仅当前备份集）"""
         # 先检查内存数据库中有多少文件
@@ -1927,6 +1949,7 @@ class MemoryDBWriter:
                 # 更新同步状态（只标记成功同步的文件）
                 if synced_file_ids:
                     await self._mark_files_synced(synced_file_ids)
+                    self._notify_synced_files(files_to_sync, synced_file_ids)
 
                 # 更新统计
                 synced_count = len(synced_file_ids)
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并行目录遍历模块
+Parallel Directory Walker Module
+
+所有扫描模式（FileScanner 流式扫描、SimpleScanner、BackupScanner openGauss直写）共用的目录遍历引擎：
+- SCAN_THREADS 个 os.scandir 工作线程，每个线程有自己的目录双端队列；
+  本线程从队尾取（深度优先，局部性好），空闲线程从其他线程的队头窃取（靠近根的大子树）
+- 每个线程有自己的批次缓冲区，满 batch_size 条直接整体交给消费者（不复制、不加锁）
+- 最多 max_pending_batches 个批次等待消费，消费者处理慢时工作线程阻塞（有界背压），内存占用可控
+- 批次通过 loop.call_soon_threadsafe 投递给异步消费者，每批只跨线程一次
+- 排除规则：根目录做完整检查，子条目只检查自身（excludes_child），被排除的目录不会被列出
+- 不跟随符号链接；Windows 目录联接（junction）跳过，不需要逐目录 resolve() 去重
+- 传入 dir_cache（DirScanCache）时记录每个完整扫描的目录列表；可信任时目录 mtime 未变化则直接复用上次的列表
+
+输出为 ScanRecord 元组（路径、大小、mtime_ns、inode、mode），只保存 stat 原始数值，不创建字典和 datetime；
+写入数据库时用 scan_records_to_backup_files_rows() 整批转换为 backup_files 数据元组（可直接用于 COPY），
+需要旧格式字典时用 scan_record_to_file_info() 转换。
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone
+from typing import AsyncGenerator, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from config.settings import get_settings
+from backup.exclude_matcher import ExcludeMatcher
+
+logger = logging.getLogger(__name__)
+
+_IO_REPARSE_TAG_MOUNT_POINT = 0xA0000003  # Windows 目录联接（junction）的重解析标记
+_DONE = object()  # 遍历结束信号
+_SLOT_WAIT_TIMEOUT = 0.5  # 等待消费者腾出批次槽位时检查取消标志的间隔（秒）
+_IDLE_WAIT_TIMEOUT = 0.05  # 空闲线程等待新目录的间隔（秒）
+
+
+class ScanRecord(NamedTuple):
+    """扫描记录（一个普通文件）"""
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    mode: int
+
+
+def scan_record_to_file_info(record: ScanRecord) -> Dict:
+    """把扫描记录转换为 FileScanner.get_file_info_from_entry 格式的文件信息字典"""
+    return {
+        'path': record.path,
+        'name': os.path.basename(record.path),
+        'size': record.size,
+        'modified_time': datetime.fromtimestamp(record.mtime_ns / 1_000_000_000),
+        'mtime_ns': record.mtime_ns,
+        'inode': record.inode,
+        'permissions': oct(record.mode)[-3:],
+        'is_file': True,
+        'is_dir': False,
+        'is_symlink': False
+    }
+
+
+def scan_record_from_path(path) -> ScanRecord:
+    """为单个文件生成扫描记录（源路径本身是文件时使用，不跟随符号链接）"""
+    path_str = str(path)
+    st = os.stat(path_str, follow_symlinks=False)
+    return ScanRecord(path_str, st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode)
+
+
+def _record_modified_time(mtime_ns: int, fallback: datetime) -> datetime:
+    # 与 file_info['modified_time'].replace(tzinfo=timezone.utc) 写入的值保持一致
+    try:
+        return datetime.fromtimestamp(mtime_ns / 1_000_000_000).replace(tzinfo=timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        return fallback
+
+
+def scan_records_to_backup_files_rows(records: Sequence[ScanRecord], backup_set_id: int,
+                                      backup_time: Optional[datetime] = None) -> List[tuple]:
+    """把一批扫描记录转换为 backup_files 数据元组（24 列，顺序同扫描阶段的 INSERT / COPY 列）
+
+    时间字段与 file_info['modified_time'] 的写法一致（本地时间标记为 UTC）；directory_path 为父目录
+    （根目录下的文件为 "C:\\" 或 "/"，与原 BackupScanner / MemoryDBWriter 写入的值相同，目录恢复和按目录装箱据此匹配）；
+    每批只取一次当前时间，同一目录只计算一次目录路径（同目录文件共用一个字符串）。
+    """
+    now = backup_time or datetime.now(timezone.utc)
+    split = os.path.split
+    directories: Dict[str, Optional[str]] = {}
+    rows = []
+    for record in records:
+        parent, file_name = split(record.path)
+        try:
+            directory_path = directories[parent]
+        except KeyError:
+            directory_path = parent or None
+            directories[parent] = directory_path
+        modified_time = _record_modified_time(record.mtime_ns, now)
+        rows.append((
+            backup_set_id,              # backup_set_id
+            record.path,                # file_path
+            file_name,                  # file_name
+            directory_path,             # directory_path
+            file_name,                  # display_name
+            'file',                     # file_type
+            record.size,                # file_size
+            None,                       # compressed_size
+            oct(record.mode)[-3:],      # file_permissions
+            None,                       # file_owner
+            None,                       # file_group
+            modified_time,              # created_time
+            modified_time,              # modified_time
+            modified_time,              # accessed_time
+            None,                       # tape_block_start
+            None,                       # tape_block_count
+            False,                      # compressed
+            False,                      # encrypted
+            None,                       # checksum
+            False,                      # is_copy_success
+            None,                       # copy_status_at
+            now,                        # backup_time
+            None,                       # chunk_number
+            1,                          # version
+        ))
+    return rows
+
+
+def get_scan_workers(settings=None) -> int:
+    """按配置返回目录遍历线程数（USE_SCAN_MULTITHREAD=False 时为1）"""
+    settings = settings or get_settings()
+    if not getattr(settings, 'USE_SCAN_MULTITHREAD', True):
+        return 1
+    return max(1, min(64, int(getattr(settings, 'SCAN_THREADS', 4) or 1)))
+
+
+@dataclass
+class WalkStats:
+    """遍历统计"""
+    dirs_scanned: int = 0  # 已扫描目录数
+    files_found: int = 0  # 发现的文件数
+    bytes_found: int = 0  # 发现的文件总字节数
+    excluded_entries: int = 0  # 被排除的条目数（被排除的目录只计1次）
+    excluded_bytes: int = 0  # 被排除文件的总字节数
+    error_dirs: int = 0  # 无法打开的目录数
+    error_entries: int = 0  # 无法读取的条目数
+    symlinks_skipped: int = 0  # 跳过的符号链接/目录联接数
+    dirs_reused: int = 0  # mtime 未变化、复用上次列表的目录数
+    files_reused: int = 0  # 从复用的目录列表中产出的文件数
+
+    def add(self, other: 'WalkStats'):
+        for f in fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+
+def _is_junction(entry) -> bool:
+    if os.name != 'nt':
+        return False
+    is_junction = getattr(entry, 'is_junction', None)  # Python 3.12+
+    if is_junction is not None:
+        return is_junction()
+    try:
+        return getattr(entry.stat(follow_symlinks=False), 'st_reparse_tag', 0) == _IO_REPARSE_TAG_MOUNT_POINT
+    except OSError:
+        return False
+
+
+class _WalkRun:
+    """单次遍历（一个根目录）的工作线程和共享状态"""
+
+    def __init__(self, walker: 'ParallelDirWalker', root: str, sink: Callable[[object], None]):
+        self.walker = walker
+        self.root = root
+        self.sink = sink
+        self.worker_count = walker.workers
+        self.dir_queues = [deque() for _ in range(self.worker_count)]
+        self.worker_stats = [WalkStats() for _ in range(self.worker_count)]
+        self.pending_dirs = 0  # 已入队但尚未扫描完的目录数，为0且无线程在扫描时遍历结束
+        self.idle_workers = 0
+        self.cond = threading.Condition()
+        self.cancelled = threading.Event()
+        self.batch_slots = threading.Semaphore(walker.max_pending_batches)
+        self.alive = self.worker_count
+        self.alive_lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+        self.catalog = walker.dir_cache.catalog_for(root) if walker.dir_cache is not None else None
+
+    def start(self):
+        self.pending_dirs = 1
+        self.dir_queues[0].append(self.root)
+        for idx in range(self.worker_count):
+            thread = threading.Thread(
+                target=self._worker, args=(idx,),
+                name=f"scan-walker-{idx}", daemon=True
+            )
+            self.threads.append(thread)
+            thread.start()
+
+    def cancel(self):
+        self.cancelled.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def release_slot(self):
+        self.batch_slots.release()
+
+    def snapshot(self) -> WalkStats:
+        total = WalkStats()
+        for stats in self.worker_stats:
+            total.add(stats)
+        return total
+
+    def _emit(self, batch: List[ScanRecord]) -> bool:
+        """把一个批次交给消费者（批次槽位用完时阻塞，实现背压）"""
+        while not self.batch_slots.acquire(timeout=_SLOT_WAIT_TIMEOUT):
+            if self.cancelled.is_set():
+                return False
+        if self.cancelled.is_set():
+            return False
+        try:
+            self.sink(batch)
+        except RuntimeError:
+            # 事件循环已关闭，消费者不再存在
+            self.cancel()
+            return False
+        return True
+
+    def _next_dir(self, idx: int) -> Optional[str]:
+        try:
+            return self.dir_queues[idx].pop()
+        except IndexError:
+            pass
+        # 从其他线程队头窃取（最早入队、离根最近的目录，子树通常最大）
+        for offset in range(1, self.worker_count):
+            try:
+                return self.dir_queues[(idx + offset) % self.worker_count].popleft()
+            except IndexError:
+                continue
+        return None
+
+    def _push_dirs(self, idx: int, subdirs: List[str]):
+        with self.cond:
+            self.pending_dirs += len(subdirs)
+            self.dir_queues[idx].extend(subdirs)
+            if self.idle_workers:
+                self.cond.notify(min(self.idle_workers, len(subdirs)))
+
+    def _worker(self, idx: int):
+        buffer: List[ScanRecord] = []
+        try:
+            while not self.cancelled.is_set():
+                dir_path = self._next_dir(idx)
+                if dir_path is None:
+                    # 空闲前先交出未满的批次，避免消费者等待
+                    if buffer:
+                        if not self._emit(buffer):
+                            break
+                        buffer = []
+                    with self.cond:
+                        if self.pending_dirs == 0:
+                            self.cond.notify_all()
+                            break
+                        self.idle_workers += 1
+                        self.cond.wait(_IDLE_WAIT_TIMEOUT)
+                        self.idle_workers -= 1
+                    continue
+                try:
+                    buffer = self._scan_dir(idx, dir_path, buffer)
+                finally:
+                    with self.cond:
+                        self.pending_dirs -= 1
+                        if self.pending_dirs == 0:
+                            self.cond.notify_all()
+            if buffer and not self.cancelled.is_set():
+                self._emit(buffer)
+        except Exception as e:
+            logger.error(f"{self.walker.context_prefix} 目录遍历线程 {idx} 异常退出: {str(e)}", exc_info=True)
+            self.cancel()
+        finally:
+            with self.alive_lock:
+                self.alive -= 1
+                last = self.alive == 0
+            if last:
+                try:
+                    self.sink(_DONE)
+                except RuntimeError:
+                    pass
+
+    def _replay_dir(self, idx: int, subdirs: List[str], files: List[ScanRecord],
+                    buffer: List[ScanRecord]) -> List[ScanRecord]:
+        """产出上次扫描记录的目录列表（目录 mtime 未变化）"""
+        stats = self.worker_stats[idx]
+        batch_size = self.walker.batch_size
+        stats.dirs_reused += 1
+        stats.files_reused += len(files)
+        for record in files:
+            buffer.append(record)
+            stats.files_found += 1
+            stats.bytes_found += record.size
+            if len(buffer) >= batch_size:
+                if not self._emit(buffer):
+                    return []
+                buffer = []
+        if subdirs:
+            self._push_dirs(idx, subdirs)
+        return buffer
+
+    def _scan_dir(self, idx: int, dir_path: str, buffer: List[ScanRecord]) -> List[ScanRecord]:
+        stats = self.worker_stats[idx]
+        walker = self.walker
+        matcher = walker.exclude_matcher
+        batch_size = walker.batch_size
+        catalog = self.catalog
+        subdirs: List[str] = []
+        stats.dirs_scanned += 1
+        dir_files: Optional[List[ScanRecord]] = None
+        if catalog is not None:
+            try:
+                dir_mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                catalog = None
+            else:
+                if catalog.trusted:
+                    cached = catalog.lookup(dir_path, dir_mtime_ns)
+                    if cached is not None:
+                        return self._replay_dir(idx, cached[0], cached[1], buffer)
+                dir_files = []
+                child_count = 0
+                complete = True
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if dir_files is not None:
+                        child_count += 1
+                    try:
+                        entry_path = entry.path
+                        if matcher and matcher.excludes_child(entry_path):
+                            stats.excluded_entries += 1
+                            if entry.is_file(follow_symlinks=False):
+                                stats.excluded_bytes += entry.stat(follow_symlinks=False).st_size
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            if _is_junction(entry):
+                                stats.symlinks_skipped += 1
+                            else:
+                                subdirs.append(entry_path)
+                            continue
+                        if entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            record = ScanRecord(entry_path, st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode)
+                            buffer.append(record)
+                            if dir_files is not None:
+                                dir_files.append(record)
+                            stats.files_found += 1
+                            stats.bytes_found += st.st_size
+                            if len(buffer) >= batch_size:
+                                if not self._emit(buffer):
+                                    return []
+                                buffer = []
+                            continue
+                        if entry.is_symlink():
+                            stats.symlinks_skipped += 1
+                        else:
+                            stats.error_entries += 1
+                            complete = False
+                    except OSError:
+                        stats.error_entries += 1
+                        complete = False
+        except OSError as e:
+            stats.error_dirs += 1
+            complete = False
+            if stats.error_dirs <= 20:
+                logger.warning(f"{walker.context_prefix} 无法打开目录: {dir_path[:200]}, 错误: {str(e)}")
+        # 只记录完整列出的目录，出错的目录下次重新扫描
+        if dir_files is not None and complete:
+            catalog.record(dir_path, dir_mtime_ns, child_count, subdirs, dir_files)
+        if subdirs:
+            self._push_dirs(idx, subdirs)
+        return buffer
+
+
+class ParallelDirWalker:
+    """Work-stealing 并行目录遍历器
+
+    用法：
+        walker = ParallelDirWalker(batch_size=2000, exclude_matcher=matcher)
+        async for records in walker.walk(root):
+            ...  # records: List[ScanRecord]
+        walker.stats  # 累计统计（可跨多个根目录）
+    """
+
+    def __init__(self, workers: Optional[int] = None, batch_size: int = 2000,
+                 max_pending_batches: Optional[int] = None,
+                 exclude_matcher: Optional[ExcludeMatcher] = None,
+                 context_prefix: str = "[目录遍历]", log_interval: Optional[float] = None,
+                 dir_cache=None):
+        """初始化并行目录遍历器
+
+        Args:
+            workers: 工作线程数，None 时按 SCAN_THREADS / USE_SCAN_MULTITHREAD 配置
+            batch_size: 每批记录数
+            max_pending_batches: 最多等待消费的批次数，None 时按 SCAN_MAX_PENDING_BATCHES 配置（0 表示线程数×2）
+            exclude_matcher: 编译后的排除规则
+            context_prefix: 日志上下文前缀
+            log_interval: 进度日志输出间隔（秒），None 时按 SCAN_LOG_INTERVAL_SECONDS 配置
+            dir_cache: 目录状态缓存（backup.dir_state_catalog.DirScanCache），None 时不记录也不复用
+        """
+        settings = get_settings()
+        self.workers = max(1, int(workers)) if workers is not None else get_scan_workers(settings)
+        self.batch_size = max(1, int(batch_size or 1))
+        if max_pending_batches is None:
+            max_pending_batches = getattr(settings, 'SCAN_MAX_PENDING_BATCHES', 0)
+        self.max_pending_batches = max(1, int(max_pending_batches or self.workers * 2))
+        self.exclude_matcher = exclude_matcher
+        self.context_prefix = context_prefix
+        if log_interval is None:
+            log_interval = getattr(settings, 'SCAN_LOG_INTERVAL_SECONDS', 60) or 60
+        self.log_interval = log_interval
+        self.dir_cache = dir_cache
+        self.stats = WalkStats()
+        self._run: Optional[_WalkRun] = None
+
+    def progress(self) -> WalkStats:
+        """累计统计（包括正在进行的遍历）"""
+        total = WalkStats()
+        total.add(self.stats)
+        if self._run is not None:
+            total.add(self._run.snapshot())
+        return total
+
+    async def walk(self, root) -> AsyncGenerator[List[ScanRecord], None]:
+        """遍历目录树，分批产出扫描记录
+
+        Args:
+            root: 根目录路径（str 或 Path，UNC 路径需先规范化）
+
+        Yields:
+            List[ScanRecord]: 文件记录批次（批次对象归消费者所有）
+        """
+        root_str = str(root)
+        if self.exclude_matcher and self.exclude_matcher.excludes(root_str):
+            logger.info(f"{self.context_prefix} 根目录被排除规则排除，跳过: {root_str}")
+            self.stats.excluded_entries += 1
+            return
+
+        loop = asyncio.get_running_loop()
+        batches: asyncio.Queue = asyncio.Queue()
+        run = _WalkRun(self, root_str, lambda item: loop.call_soon_threadsafe(batches.put_nowait, item))
+        self._run = run
+        start_time = time.time()
+        last_log_time = start_time
+        run.start()
+        logger.debug(f"{self.context_prefix} 开始遍历: {root_str} (线程数: {self.workers})")
+        try:
+            while True:
+                item = await batches.get()
+                if item is _DONE:
+                    break
+                run.release_slot()
+                yield item
+
+                current_time = time.time()
+                if current_time - last_log_time >= self.log_interval:
+                    last_log_time = current_time
+                    snapshot = run.snapshot()
+                    logger.info(
+                        f"{self.context_prefix} 遍历进度: 已扫描 {snapshot.dirs_scanned} 个目录, "
+                        f"发现 {snapshot.files_found} 个文件, 复用 {snapshot.dirs_reused} 个未变化目录, "
+                        f"待扫描 {run.pending_dirs} 个目录, "
+                        f"错误 {snapshot.error_dirs + snapshot.error_entries} 个, "
+                        f"耗时: {current_time - start_time:.1f} 秒"
+                    )
+        finally:
+            run.cancel()
+            await asyncio.to_thread(run.join)
+            self.stats.add(run.snapshot())
+            self._run = None
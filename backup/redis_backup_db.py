@@ -39,6 +39,10 @@ KEY_INDEX_BACKUP_SET_BY_TASK_ID = "backup_sets:by_task_id"  # Set: task_id -> se
 KEY_INDEX_BACKUP_FILE_BY_SET_ID = "backup_files:by_set_id"  # Set: backup_set_id -> file_id[]
 KEY_INDEX_BACKUP_FILE_PENDING = "backup_files:pending"  # Sorted Set: backup_set_id -> {file_id: file_size} (未压缩文件，按大小排序)
 KEY_INDEX_BACKUP_FILE_BY_PATH = "backup_files:by_path"  # Hash: backup_set_id -> {file_path: file_id}
+KEY_INDEX_BACKUP_FILE_NAME_LEX = "backup_files:name_lex"  # Sorted Set: backup_set_id -> "小写文件名\0file_id"（字典序，文件名搜索）
+KEY_INDEX_BACKUP_FILE_RNAME_LEX = "backup_files:rname_lex"  # Sorted Set: backup_set_id -> "反转的小写文件名\0file_id"（扩展名搜索）
+KEY_INDEX_BACKUP_FILE_PATH_LEX = "backup_files:path_lex"  # Sorted Set: backup_set_id -> "小写路径\0file_id"（路径搜索）
+KEY_INDEX_BACKUP_FILE_LEX_META = "backup_files:lex_meta"  # Hash: backup_set_id -> {file_count}（搜索索引建立时的文件数）
 KEY_COUNTER_BACKUP_SET = "backup_set:id"  # Counter for backup_set IDs
 KEY_COUNTER_BACKUP_FILE = "backup_file:id"  # Counter for backup_file IDs
 
@@ -783,6 +787,13 @@ async def delete_backup_task_redis(task_id: int) -> bool:
             # 阶段1优化：删除未压缩文件索引（Sorted Set）
             pending_index_key = f"{KEY_INDEX_BACKUP_FILE_PENDING}:{set_db_id}"
             pipe.delete(pending_index_key)
+            # 删除文件名搜索索引
+            pipe.delete(
+                f"{KEY_INDEX_BACKUP_FILE_NAME_LEX}:{set_db_id}",
+                f"{KEY_INDEX_BACKUP_FILE_RNAME_LEX}:{set_db_id}",
+                f"{KEY_INDEX_BACKUP_FILE_PATH_LEX}:{set_db_id}",
+                f"{KEY_INDEX_BACKUP_FILE_LEX_META}:{set_db_id}",
+            )
             await pipe.execute()
             
             return files_deleted
@@ -1617,6 +1628,8 @@ async def mark_files_as_copied_redis(
         )
         is_compressed = bool(compressed_file.get("compression_enabled", True))
         checksum = compressed_file.get("checksum")
+        file_checksums = compressed_file.get("file_checksums") or {}  # 压缩时计算的每个文件内容校验和
+        file_references = compressed_file.get("file_references") or {}  # 内容去重命中的文件 {file_path: dedup_ref}，数据在其他备份集的压缩包中
         copy_time = datetime.now()
 
         file_paths: List[str] = []
@@ -1748,6 +1761,10 @@ async def mark_files_as_copied_redis(
             metadata["tape_file_path"] = tape_file_path
             metadata["chunk_number"] = chunk_number
             metadata.setdefault("original_path", file_path)
+            dedup_ref = file_references.get(file_path)
+            if dedup_ref:
+                metadata["tape_file_path"] = dedup_ref["tape_file_path"]
+                metadata["dedup_ref"] = dedup_ref
             metadata_json = json.dumps(metadata) if metadata else "{}"
 
             created_time = _parse_datetime_value(processed_file.get("created_time"))
@@ -1771,7 +1788,7 @@ async def mark_files_as_copied_redis(
                     'file_size': str(file_size),
                     'compressed_size': str(per_file_compressed_size),
                     'compressed': '1' if is_compressed else '0',
-                    'checksum': checksum or '',
+                    'checksum': file_checksums.get(file_path, checksum) or '',
                     'backup_time': backup_time.isoformat(),
                     'chunk_number': str(chunk_number),
                     'tape_block_start': '0',
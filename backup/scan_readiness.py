@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+扫描 → 压缩 就绪信号模块
+Scan Readiness Signal Module
+
+替代固定的 SCAN_WAIT_TIMEOUT 等待：扫描器 / MemoryDBWriter / BatchDBWriter 每写入一批
+backup_files 记录（压缩流程可以读取到）后上报文件数和字节数，备份引擎在以下任一条件满足时立即启动压缩：
+1. 已写入的待压缩字节数达到水位线（默认 MAX_FILE_SIZE，即一个压缩组的大小）
+2. 扫描结束
+SCAN_WAIT_TIMEOUT 仍作为最长等待时间。
+
+同时记录"扫描开始 → 第一个压缩组完成"的耗时，作为流水线启动延迟指标。
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+# 就绪原因
+READY_REASON_THRESHOLD = "threshold"
+READY_REASON_FINISHED = "finished"
+READY_REASON_TIMEOUT = "timeout"
+
+
+class ScanReadiness:
+    """单个备份集的扫描就绪信号（水位计数器 + asyncio.Event）
+
+    所有方法都在事件循环线程中调用（扫描器和数据库写入器均为协程）。
+    """
+
+    def __init__(self, backup_set_db_id: int, threshold_bytes: int):
+        self.backup_set_db_id = backup_set_db_id
+        self.threshold_bytes = max(1, int(threshold_bytes or 1))
+        self.scan_started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self.ready_reason: Optional[str] = None
+        self.first_group_at: Optional[float] = None
+        self.pending_files = 0
+        self.pending_bytes = 0
+        self.finished = False
+        self._ready_event = asyncio.Event()
+
+    def add_pending(self, file_count: int, total_bytes: int):
+        """上报一批已写入数据库、可被压缩流程读取的文件"""
+        self.pending_files += max(0, int(file_count or 0))
+        self.pending_bytes += max(0, int(total_bytes or 0))
+        if self.pending_bytes >= self.threshold_bytes and not self._ready_event.is_set():
+            self._set_ready(READY_REASON_THRESHOLD)
+
+    def mark_finished(self):
+        """扫描结束（成功、失败或取消都应调用，避免压缩端一直等待）"""
+        self.finished = True
+        if not self._ready_event.is_set():
+            self._set_ready(READY_REASON_FINISHED)
+
+    def _set_ready(self, reason: str):
+        self.ready_at = time.time()
+        self.ready_reason = reason
+        self._ready_event.set()
+        logger.info(
+            f"[扫描就绪] backup_set_id={self.backup_set_db_id} 已就绪（原因: {reason}），"
+            f"待压缩 {self.pending_files} 个文件 / {self.pending_bytes} 字节，"
+            f"距扫描开始 {self.ready_at - self.scan_started_at:.1f} 秒"
+        )
+
+    def is_ready(self) -> bool:
+        return self._ready_event.is_set()
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> str:
+        """等待就绪，返回就绪原因（超时返回 'timeout'）"""
+        try:
+            if timeout:
+                await asyncio.wait_for(self._ready_event.wait(), timeout=timeout)
+            else:
+                await self._ready_event.wait()
+        except asyncio.TimeoutError:
+            return READY_REASON_TIMEOUT
+        return self.ready_reason or READY_REASON_FINISHED
+
+    def mark_first_group(self) -> Optional[float]:
+        """记录第一个压缩组完成的时间，返回距扫描开始的秒数（仅首次调用有效）"""
+        if self.first_group_at is not None:
+            return None
+        self.first_group_at = time.time()
+        return self.first_group_at - self.scan_started_at
+
+    @property
+    def time_to_first_group(self) -> Optional[float]:
+        """扫描开始 → 第一个压缩组完成的耗时（秒）"""
+        if self.first_group_at is None:
+            return None
+        return self.first_group_at - self.scan_started_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'backup_set_id': self.backup_set_db_id,
+            'threshold_bytes': self.threshold_bytes,
+            'pending_files': self.pending_files,
+            'pending_bytes': self.pending_bytes,
+            'finished': self.finished,
+            'ready_reason': self.ready_reason,
+            'time_to_ready': (self.ready_at - self.scan_started_at) if self.ready_at else None,
+            'time_to_first_group': self.time_to_first_group,
+        }
+
+
+# 按 backup_set_db_id 登记的就绪信号（扫描器、数据库写入器只知道 backup_set_db_id）
+_readiness_registry: Dict[int, ScanReadiness] = {}
+
+
+def create_scan_readiness(backup_set_db_id: int, threshold_bytes: int) -> ScanReadiness:
+    """为备份集创建并登记新的就绪信号（覆盖同一备份集的旧信号）"""
+    readiness = ScanReadiness(backup_set_db_id, threshold_bytes)
+    _readiness_registry[backup_set_db_id] = readiness
+    return readiness
+
+
+def get_scan_readiness(backup_set_db_id: Optional[int]) -> Optional[ScanReadiness]:
+    if backup_set_db_id is None:
+        return None
+    return _readiness_registry.get(backup_set_db_id)
+
+
+def release_scan_readiness(backup_set_db_id: Optional[int]):
+    """备份流程结束后移除登记"""
+    if backup_set_db_id is not None:
+        _readiness_registry.pop(backup_set_db_id, None)
+
+
+def notify_files_written(backup_set_db_id: Optional[int], file_count: int, total_bytes: int):
+    """数据库写入器上报已写入的文件（没有登记就绪信号时为空操作）"""
+    readiness = get_scan_readiness(backup_set_db_id)
+    if readiness is not None:
+        readiness.add_pending(file_count, total_bytes)
+
+
+def notify_scan_finished(backup_set_db_id: Optional[int]):
+    """扫描器上报扫描结束（没有登记就绪信号时为空操作）"""
+    readiness = get_scan_readiness(backup_set_db_id)
+    if readiness is not None:
+        readiness.mark_finished()
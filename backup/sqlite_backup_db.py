@@ -1167,6 +1167,8 @@ async def mark_files_as_copied_sqlite(
         )
         is_compressed = bool(compressed_file.get("compression_enabled", True))
         checksum = compressed_file.get("checksum")
+        file_checksums = compressed_file.get("file_checksums") or {}  # 压缩时计算的每个文件内容校验和
+        file_references = compressed_file.get("file_references") or {}  # 内容去重命中的文件 {file_path: dedup_ref}，数据在其他备份集的压缩包中
         copy_time = datetime.now()
 
         file_paths: List[str] = []
@@ -1255,6 +1257,10 @@ async def mark_files_as_copied_sqlite(
                 metadata["tape_file_path"] = tape_file_path
                 metadata["chunk_number"] = chunk_number
                 metadata.setdefault("original_path", file_path)
+                dedup_ref = file_references.get(file_path)
+                if dedup_ref:
+                    metadata["tape_file_path"] = dedup_ref["tape_file_path"]
+                    metadata["dedup_ref"] = dedup_ref
                 metadata_json = json.dumps(metadata) if metadata else None
 
                 file_type_enum = _normalize_file_type(processed_file)
@@ -1277,7 +1283,7 @@ async def mark_files_as_copied_sqlite(
                         file_name, display_name, directory_path, file_type_value,
                         file_size, per_file_compressed_size, file_permissions, file_owner,
                         file_group, final_created_time, final_modified_time, final_accessed_time,
-                        final_tape_block_start, final_tape_block_count, 1 if is_compressed else 0, checksum,
+                        final_tape_block_start, final_tape_block_count, 1 if is_compressed else 0, file_checksums.get(file_path, checksum),
                         backup_time, chunk_number, metadata_json, 1,  # is_copy_success = 1 (True)
                         copy_time, datetime.now(), file_id
                     ))
@@ -1287,7 +1293,7 @@ async def mark_files_as_copied_sqlite(
                         backup_set_db_id, file_path, file_name, directory_path, display_name,
                         file_type_value, file_size, per_file_compressed_size, file_permissions, file_owner,
                         file_group, created_time, modified_time, accessed_time, tape_block_start,
-                        tape_block_count, 1 if is_compressed else 0, 0, checksum, 1,  # is_copy_success = 1 (True)
+                        tape_block_count, 1 if is_compressed else 0, 0, file_checksums.get(file_path, checksum), 1,  # is_copy_success = 1 (True)
                         copy_time, backup_time, chunk_number, 1, metadata_json, json.dumps({'status': 'compressed'}),
                         datetime.now(), datetime.now()
                     ))
@@ -6,10 +6,13 @@ Tape Handler Module
 """
 
 import logging
+import os
 from pathlib import Path
 from typing import Optional
 
 from models.backup import BackupSet
+from backup.tape_stream_writer import PART_SUFFIX, copy_file_with_checksum, compute_file_checksum
+from backup.tape_throughput_governor import get_tape_governor
 from tape.tape_manager import TapeManager
 from tape.tape_cartridge import TapeCartridge, TapeStatus
 
@@ -134,8 +137,8 @@ class TapeHandler:
         """将压缩文件从本地目录复制到磁带机（LTFS挂载的盘符）
         
         流程：
-        1. 先复制文件到磁带盘符（通过LTFS挂载）
-        2. 验证复制成功（检查文件大小）
+        1. 先复制文件到磁带盘符（通过LTFS挂载，环形缓冲区 + 对齐大块写，写入时计算校验和）
+        2. 验证复制成功（源文件与写入数据的校验和、大小一致）
         3. 确认成功后再删除源文件
         
         Args:
@@ -147,8 +150,6 @@ class TapeHandler:
             str: 磁带上的相对路径，如果失败则返回None
         """
         try:
-            import shutil
-            
             source_file = Path(source_path)
             if not source_file.exists():
                 logger.error(f"压缩文件不存在: {source_path}")
@@ -163,36 +164,54 @@ class TapeHandler:
             tape_backup_dir = Path(tape_drive) / backup_set.set_id
             tape_backup_dir.mkdir(parents=True, exist_ok=True)
             
-            # 目标文件路径
+            # 目标文件路径（先写 .part，校验通过后改名）
             target_file = tape_backup_dir / source_file.name
+            part_file = target_file.with_name(target_file.name + PART_SUFFIX)
             
             # 步骤1: 复制文件到磁带机（LTFS挂载的盘符）
             # 使用异步方式执行文件复制，避免阻塞事件循环
             logger.warning(f"正在复制文件到磁带机: {source_file} -> {target_file}")
             import asyncio
+            governor = get_tape_governor(self.settings)
+            buffer_size = getattr(self.settings, 'TAPE_STREAM_BUFFER_SIZE', 256 * 1024 * 1024)
+            if governor is not None:
+                buffer_size = governor.stream_buffer_size(buffer_size)
             try:
-                await asyncio.to_thread(shutil.copy2, str(source_file), str(target_file))
+                copy_result = await asyncio.to_thread(
+                    copy_file_with_checksum, str(source_file), str(part_file),
+                    getattr(self.settings, 'TAPE_STREAM_BLOCK_SIZE', 1024 * 1024),
+                    buffer_size,
+                    getattr(self.settings, 'TAPE_STREAM_CHECKSUM', 'sha256'),
+                    governor
+                )
             except asyncio.CancelledError:
                 logger.warning(f"文件复制任务被取消（Ctrl+C）")
                 raise
             
-            # 步骤2: 验证复制成功（检查文件是否存在且大小匹配）
-            if not target_file.exists():
-                logger.error(f"复制后目标文件不存在: {target_file}")
-                return None
-            
-            target_size = target_file.stat().st_size
-            if target_size != source_size:
-                logger.error(f"文件大小不匹配: 源文件={source_size} 字节, 目标文件={target_size} 字节")
+            # 步骤2: 核对写入的字节（大小与写入校验和都必须与源文件一致）；开启回读时改用回读得到的校验和
+            target_checksum = copy_result['target_checksum']
+            readback = getattr(self.settings, 'TAPE_STREAM_VERIFY_READBACK', True)
+            if readback:
+                target_checksum = await asyncio.to_thread(
+                    compute_file_checksum, str(part_file), copy_result['checksum_algorithm']
+                )
+            if copy_result['bytes_written'] != source_size or target_checksum != copy_result['source_checksum']:
+                logger.error(
+                    f"文件校验失败: 源文件={source_size} 字节/{copy_result['source_checksum']}, "
+                    f"目标文件={copy_result['bytes_written']} 字节/{target_checksum}"
+                )
                 # 删除不完整的文件
                 try:
-                    target_file.unlink()
+                    part_file.unlink()
                 except Exception:
                     pass
                 return None
+            os.replace(part_file, target_file)
+            target_size = copy_result['bytes_written']
             
             # 步骤3: 验证成功，删除源文件
-            logger.info(f"文件复制成功，验证通过（大小: {target_size} 字节），删除源文件")
+            check_label = "回读校验通过" if readback else "写入字节核对一致（未回读）"
+            logger.info(f"文件复制成功，{check_label}（大小: {target_size} 字节，{copy_result['checksum_algorithm']}: {target_checksum}），删除源文件")
             try:
                 # 删除操作也使用异步方式
                 try:
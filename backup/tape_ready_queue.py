@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+待写磁带压缩包就绪队列（持久化日志）
+Tape Ready Queue Module
+
+压缩完成并移动到 final 目录的压缩包（及其 .idx 索引）由压缩器发布到本队列，
+FinalDirMonitor 在一个长期运行的事件循环中按发布顺序消费，写入磁带。
+队列持久化在一个小的 SQLite 日志中，每个条目的状态：
+    pending  → 等待写入磁带
+    copying  → 正在写入磁带
+    verified → 已写入磁带且校验通过（源文件已删除）
+    failed   → 多次重试后仍失败（保留源文件，需人工处理）
+
+进程崩溃或重启时，copying 状态的条目重置为 pending 重新写入，verified 条目不会重复处理。
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATE_PENDING = "pending"
+STATE_COPYING = "copying"
+STATE_VERIFIED = "verified"
+STATE_FAILED = "failed"
+
+
+class TapeReadyQueue:
+    """基于 SQLite 日志的待写磁带队列（线程安全，发布后立即唤醒消费者）"""
+
+    def __init__(self, journal_path, max_attempts: int = 3):
+        self.journal_path = Path(journal_path)
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max(1, int(max_attempts or 1))
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(str(self.journal_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")  # 状态变化必须在崩溃后可恢复
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ready_archives (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source_path TEXT NOT NULL UNIQUE,
+                    set_id TEXT NOT NULL,
+                    file_size INTEGER NOT NULL DEFAULT 0,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    tape_file_path TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ready_archives_state ON ready_archives(state, id)"
+            )
+
+    # ---------- 发布（压缩器调用） ----------
+
+    def publish(self, source_path, set_id: str, file_size: int = 0) -> bool:
+        """发布一个待写磁带的文件（同一路径重复发布时重置为 pending）"""
+        now = time.time()
+        with self._available:
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT INTO ready_archives (source_path, set_id, file_size, state, attempts, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, 0, ?, ?)
+                    ON CONFLICT(source_path) DO UPDATE SET
+                        set_id = excluded.set_id, file_size = excluded.file_size,
+                        state = excluded.state, attempts = 0, error = NULL, updated_at = excluded.updated_at
+                    """,
+                    (str(source_path), set_id, int(file_size or 0), STATE_PENDING, now, now)
+                )
+            self._available.notify_all()
+        logger.debug(f"[磁带就绪队列] 已发布: {source_path} (备份集: {set_id})")
+        return True
+
+    # ---------- 消费（FinalDirMonitor 调用） ----------
+
+    def claim_next(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """取出最早发布的 pending 条目并标记为 copying；队列为空时等待发布或超时"""
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._available:
+            while True:
+                row = self._conn.execute(
+                    "SELECT * FROM ready_archives WHERE state = ? ORDER BY id LIMIT 1", (STATE_PENDING,)
+                ).fetchone()
+                if row is not None:
+                    with self._conn:
+                        self._conn.execute(
+                            "UPDATE ready_archives SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                            (STATE_COPYING, time.time(), row['id'])
+                        )
+                    entry = dict(row)
+                    entry['attempts'] += 1
+                    return entry
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._available.wait(remaining)
+
+    def wake_up(self):
+        """唤醒等待中的消费者（停止监控时使用）"""
+        with self._available:
+            self._available.notify_all()
+
+    def mark_verified(self, entry_id: int, tape_file_path: Optional[str]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE ready_archives SET state = ?, tape_file_path = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (STATE_VERIFIED, tape_file_path, time.time(), entry_id)
+            )
+
+    def mark_failed(self, entry_id: int, error: str, attempts: int) -> str:
+        """写入失败：未超过重试次数时回到 pending，否则标记为 failed；返回新状态"""
+        state = STATE_PENDING if attempts < self.max_attempts else STATE_FAILED
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE ready_archives SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                (state, (error or '')[:1000], time.time(), entry_id)
+            )
+        return state
+
+    def mark_missing(self, entry_id: int):
+        """源文件已不存在（例如已被其他流程写入磁带），直接结束该条目"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE ready_archives SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                (STATE_FAILED, '源文件不存在', time.time(), entry_id)
+            )
+
+    # ---------- 恢复与统计 ----------
+
+    def recover(self) -> int:
+        """启动时恢复未完成的条目：copying（写入中途进程退出）重置为 pending"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE ready_archives SET state = ?, updated_at = ? WHERE state = ?",
+                (STATE_PENDING, time.time(), STATE_COPYING)
+            )
+            return cursor.rowcount or 0
+
+    def is_known(self, source_path) -> bool:
+        """文件是否已在日志中（任意状态，已写入磁带但源文件删除失败的不会重复写入）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM ready_archives WHERE source_path = ?", (str(source_path),)
+            ).fetchone()
+            return row is not None
+
+    def unfinished_stats(self) -> Tuple[int, int]:
+        """pending + copying 的条目数和字节数"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM ready_archives WHERE state IN (?, ?)",
+                (STATE_PENDING, STATE_COPYING)
+            ).fetchone()
+            return int(row[0] or 0), int(row[1] or 0)
+
+    def state_counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM ready_archives GROUP BY state").fetchall()
+            return {row[0]: int(row[1]) for row in rows}
+
+    def purge_verified(self, older_than_seconds: float) -> int:
+        """删除已完成超过指定时间的 verified 条目，保持日志文件很小"""
+        cutoff = time.time() - max(0.0, float(older_than_seconds or 0))
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM ready_archives WHERE state = ? AND updated_at < ?", (STATE_VERIFIED, cutoff)
+            )
+            return cursor.rowcount or 0
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+
+
+_ready_queue: Optional[TapeReadyQueue] = None
+_ready_queue_lock = threading.Lock()
+
+
+def resolve_journal_path(journal_path) -> Path:
+    """相对路径按项目根目录解析（不依赖进程工作目录），绝对路径原样返回"""
+    path = Path(journal_path)
+    if path.is_absolute():
+        return path
+    project_root = Path(__file__).parent.parent  # backup -> 项目根目录
+    return project_root / path
+
+
+def get_tape_ready_queue(settings=None) -> TapeReadyQueue:
+    """获取进程内唯一的待写磁带队列"""
+    global _ready_queue
+    if _ready_queue is not None:
+        return _ready_queue
+    if settings is None:
+        from config.settings import get_settings
+        settings = get_settings()
+    with _ready_queue_lock:
+        if _ready_queue is None:
+            _ready_queue = TapeReadyQueue(
+                resolve_journal_path(getattr(settings, 'TAPE_READY_QUEUE_PATH', 'data/tape_ready_queue.db')),
+                max_attempts=getattr(settings, 'TAPE_READY_QUEUE_MAX_ATTEMPTS', 3),
+            )
+    return _ready_queue
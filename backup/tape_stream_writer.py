@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+直写磁带的流水线写入器
+Tape Stream Writer Module
+
+压缩线程把压缩包数据写入有界环形缓冲区，独立的写入线程按固定块大小（对齐 LTFS/磁带块）
+把数据顺序写入 LTFS 挂载盘上的目标文件，并在写入的同时计算校验和：
+- 不再经过 temp/compress → final → LTFS 的三次落盘
+- 缓冲区满时压缩线程阻塞（背压），缓冲区空时写入线程等待，两者的等待次数作为统计输出
+- 写入时计算校验和，默认回读磁带文件比对（替代原先只比较文件大小的验证）
+"""
+
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024  # 1MB，LTO/LTFS 推荐的大块顺序写
+DEFAULT_BUFFER_SIZE = 256 * 1024 * 1024  # 256MB 环形缓冲区
+PART_SUFFIX = ".part"
+
+_SENTINEL = None
+
+
+def create_checksum(algorithm: Optional[str]):
+    """创建校验和对象，算法不可用时回退到 sha256"""
+    algorithm = (algorithm or "sha256").lower()
+    try:
+        return hashlib.new(algorithm)
+    except (ValueError, TypeError):
+        logger.warning(f"[直写磁带] 不支持的校验算法 {algorithm}，使用 sha256")
+        return hashlib.sha256()
+
+
+class TapeStreamWriter:
+    """有界环形缓冲区 + 后台写入线程的只写文件对象（供 tarfile / zstd / pgzip 作为 fileobj 使用）"""
+
+    def __init__(self, target_path, block_size: int = DEFAULT_BLOCK_SIZE,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE, checksum_algorithm: str = "sha256",
+                 governor=None):
+        self.target_path = Path(target_path)
+        self.governor = governor  # TapeThroughputGovernor（可选），写入线程上报吞吐和等待次数
+        self.block_size = max(64 * 1024, int(block_size or DEFAULT_BLOCK_SIZE))
+        slots = max(2, int(buffer_size or DEFAULT_BUFFER_SIZE) // self.block_size)
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=slots)
+        self._staging = bytearray()
+        self._position = 0
+        self._checksum = create_checksum(checksum_algorithm)
+        self.checksum_algorithm = self._checksum.name
+        self._error: Optional[BaseException] = None
+        self.closed = False
+        self.bytes_written = 0  # 已落盘字节数（写入线程更新）
+        self.producer_stalls = 0  # 缓冲区满导致压缩线程等待的次数
+        self.consumer_stalls = 0  # 缓冲区空导致写入线程等待的次数
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+        self.target_path.parent.mkdir(parents=True, exist_ok=True)
+        # 无缓冲打开，写入线程自己保证大块对齐写
+        self._fh = open(self.target_path, "wb", buffering=0)
+        self._writer_thread = threading.Thread(
+            target=self._writer_loop, name=f"TapeStreamWriter-{self.target_path.name}", daemon=True
+        )
+        if self.governor is not None:
+            self.governor.stream_started()
+        self._writer_thread.start()
+        logger.info(
+            f"[直写磁带] 开始写入: {self.target_path} (块大小: {self.block_size}, 缓冲块数: {slots}, "
+            f"校验算法: {self.checksum_algorithm})"
+        )
+
+    # ---------- 文件对象接口（压缩线程调用） ----------
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        """返回已接收的字节数（tarfile/zstd 用作流位置）"""
+        return self._position
+
+    def write(self, data) -> int:
+        self._raise_if_failed()
+        if self.closed:
+            raise ValueError("写入已关闭的磁带流")
+        view = memoryview(data)
+        size = len(view)
+        if not size:
+            return 0
+        self._staging += view
+        self._position += size
+        if len(self._staging) >= self.block_size:
+            full = len(self._staging) - len(self._staging) % self.block_size
+            for start in range(0, full, self.block_size):
+                self._put(bytes(self._staging[start:start + self.block_size]))
+            del self._staging[:full]
+        return size
+
+    def flush(self):
+        self._raise_if_failed()
+
+    def close(self):
+        """写完剩余数据并等待写入线程结束，返回校验和（十六进制）"""
+        if self.closed:
+            return self.hexdigest
+        try:
+            if self._staging:
+                self._put(bytes(self._staging))
+                self._staging.clear()
+            self._put(_SENTINEL)
+            self._writer_thread.join()
+            if self._error is None:
+                os.fsync(self._fh.fileno())
+        except OSError as e:
+            if self._error is None:
+                self._error = e
+        finally:
+            self.closed = True
+            self.finished_at = time.time()
+            try:
+                self._fh.close()
+            except OSError:
+                pass
+        self._raise_if_failed()
+        elapsed = max(self.finished_at - self.started_at, 0.001)
+        logger.info(
+            f"[直写磁带] 写入完成: {self.target_path.name}, {self.bytes_written} 字节, "
+            f"{self.bytes_written / elapsed / 1024 / 1024:.1f} MB/s, "
+            f"压缩端等待 {self.producer_stalls} 次, 写入端等待 {self.consumer_stalls} 次"
+        )
+        return self.hexdigest
+
+    def abort(self):
+        """异常时终止写入并删除不完整的目标文件"""
+        self.closed = True
+        try:
+            # 清空缓冲区并通知写入线程退出
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(_SENTINEL)
+        except queue.Full:
+            pass
+        self._writer_thread.join(timeout=30)
+        try:
+            self._fh.close()
+        except OSError:
+            pass
+        try:
+            if self.target_path.exists():
+                self.target_path.unlink()
+        except OSError as e:
+            logger.warning(f"[直写磁带] 删除不完整文件失败: {self.target_path}, 错误: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    # ---------- 内部实现 ----------
+
+    def _put(self, block):
+        try:
+            self._queue.put_nowait(block)
+        except queue.Full:
+            self.producer_stalls += 1
+            if self.governor is not None:
+                self.governor.record_producer_stall()
+            while True:
+                self._raise_if_failed()
+                try:
+                    self._queue.put(block, timeout=1.0)
+                    return
+                except queue.Full:
+                    continue
+
+    def _writer_loop(self):
+        try:
+            while True:
+                try:
+                    block = self._queue.get_nowait()
+                except queue.Empty:
+                    self.consumer_stalls += 1
+                    if self.governor is not None:
+                        self.governor.record_consumer_stall()
+                    block = self._queue.get()
+                if block is _SENTINEL:
+                    return
+                view = memoryview(block)
+                while len(view):
+                    written = self._fh.write(view)
+                    if not written:
+                        raise OSError(f"写入磁带返回 0 字节: {self.target_path}")
+                    view = view[written:]
+                self._checksum.update(block)
+                self.bytes_written += len(block)
+                if self.governor is not None:
+                    self.governor.record_bytes(len(block), self.buffer_fill)
+        except BaseException as e:
+            self._error = e
+            logger.error(f"[直写磁带] 写入失败: {self.target_path}, 错误: {e}")
+        finally:
+            if self.governor is not None:
+                self.governor.stream_finished()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise IOError(f"写入磁带失败: {self.target_path}: {self._error}") from self._error
+
+    @property
+    def hexdigest(self) -> str:
+        return self._checksum.hexdigest()
+
+    @property
+    def buffer_fill(self) -> float:
+        """缓冲区占用比例（0~1）"""
+        return self._queue.qsize() / max(self._queue.maxsize, 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        elapsed = max(end - self.started_at, 0.001)
+        return {
+            'target': str(self.target_path),
+            'bytes_written': self.bytes_written,
+            'rate_bytes_per_sec': self.bytes_written / elapsed,
+            'buffer_fill': self.buffer_fill,
+            'producer_stalls': self.producer_stalls,
+            'consumer_stalls': self.consumer_stalls,
+        }
+
+
+def compute_file_checksum(path, algorithm: str = "sha256", block_size: int = DEFAULT_BLOCK_SIZE) -> str:
+    """按大块顺序读取文件计算校验和（用于回读校验）"""
+    checksum = create_checksum(algorithm)
+    with open(path, "rb", buffering=0) as fh:
+        while True:
+            chunk = fh.read(block_size)
+            if not chunk:
+                break
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def copy_file_with_checksum(source_path, target_path, block_size: int = DEFAULT_BLOCK_SIZE,
+                            buffer_size: int = DEFAULT_BUFFER_SIZE,
+                            checksum_algorithm: str = "sha256", governor=None) -> Dict[str, Any]:
+    """通过环形缓冲区把本地文件复制到磁带（读、写两个线程流水线执行），返回源/目标校验和与大小
+
+    target_checksum 是写入线程对写出字节计算的校验和，不是回读磁带文件得到的，
+    只能说明写入过程中数据没有损坏；需要确认磁带上的内容时另行调用 compute_file_checksum 回读。
+    """
+    source_checksum = create_checksum(checksum_algorithm)
+    writer = TapeStreamWriter(target_path, block_size=block_size, buffer_size=buffer_size,
+                              checksum_algorithm=checksum_algorithm, governor=governor)
+    try:
+        with open(source_path, "rb", buffering=0) as src:
+            while True:
+                chunk = src.read(writer.block_size)
+                if not chunk:
+                    break
+                source_checksum.update(chunk)
+                writer.write(chunk)
+        target_digest = writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return {
+        'source_checksum': source_checksum.hexdigest(),
+        'target_checksum': target_digest,
+        'bytes_written': writer.bytes_written,
+        'checksum_algorithm': writer.checksum_algorithm,
+        'stats': writer.get_stats(),
+    }
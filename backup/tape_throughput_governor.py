@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+磁带写入吞吐调节器
+Tape Throughput Governor Module
+
+LTO 驱动器在数据供给低于最低流式速度时会停带、回绕、重新定位（shoe-shining），
+实际吞吐会损失 30%~50%。本模块统计写入 LTFS 挂载盘的每秒字节数、环形缓冲区占用、
+写入端/压缩端等待次数以及待写磁带的压缩包队列深度，并据此给出压缩并行度和
+直写磁带缓冲区大小的调整建议：
+- 驱动器供给不足（低于最低流式速度，写入端在等数据）→ 增加压缩并行度、扩大缓冲区
+- 驱动器是瓶颈（压缩端在等缓冲区、待写队列积压）→ 减少压缩并行度，避免临时目录堆积
+
+所有磁带写入都经过 TapeStreamWriter，写入线程直接向本模块上报，因此一个进程一个实例
+（系统只挂载一个磁带盘符）。
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# 调整动作
+ACTION_HOLD = "hold"
+ACTION_BOOST = "boost"  # 驱动器供给不足
+ACTION_THROTTLE = "throttle"  # 驱动器跟不上
+ACTION_RECOVER = "recover"  # 积压消化后恢复
+
+
+class TapeThroughputGovernor:
+    """磁带写入吞吐统计与压缩并行度调节（线程安全）"""
+
+    def __init__(self, min_streaming_rate: int, window_seconds: int = 10,
+                 queue_high_watermark: int = 3, max_extra_batches: int = 2,
+                 max_buffer_multiplier: int = 4, adjust_interval: float = 10.0):
+        self.min_streaming_rate = max(0, int(min_streaming_rate or 0))  # 字节/秒
+        self.window_seconds = max(2, int(window_seconds or 10))
+        self.queue_high_watermark = max(1, int(queue_high_watermark or 3))
+        self.max_extra_batches = max(0, int(max_extra_batches or 0))
+        self.max_buffer_multiplier = max(1, int(max_buffer_multiplier or 1))
+        self.adjust_interval = max(0.0, float(adjust_interval if adjust_interval is not None else 10.0))
+
+        self._lock = threading.Lock()
+        self._buckets: deque = deque()  # [(秒, 字节数)]
+        self.total_bytes = 0
+        self.producer_stalls = 0
+        self.consumer_stalls = 0
+        self.buffer_fill = 0.0
+        self.active_streams = 0
+        self.ready_queue_files = 0
+        self.ready_queue_bytes = 0
+        self.starved_seconds = 0.0  # 驱动器在写但低于最低流式速度的累计时间
+
+        # 调整状态
+        self.extra_batches = 0  # 在扫描阶段策略基础上增减的并行批次
+        self.buffer_multiplier = 1
+        self.last_action = ACTION_HOLD
+        self._last_adjust_at = 0.0
+        self._last_producer_stalls = 0
+        self._last_consumer_stalls = 0
+        self._last_rate_check = time.monotonic()
+
+    # ---------- 上报（写入线程 / 监控线程调用） ----------
+
+    def stream_started(self):
+        with self._lock:
+            self.active_streams += 1
+
+    def stream_finished(self):
+        with self._lock:
+            self.active_streams = max(0, self.active_streams - 1)
+            if self.active_streams == 0:
+                self.buffer_fill = 0.0
+
+    def record_bytes(self, nbytes: int, buffer_fill: Optional[float] = None):
+        """写入线程每写出一个块调用一次"""
+        second = int(time.monotonic())
+        with self._lock:
+            if self._buckets and self._buckets[-1][0] == second:
+                self._buckets[-1][1] += nbytes
+            else:
+                self._buckets.append([second, nbytes])
+            self.total_bytes += nbytes
+            if buffer_fill is not None:
+                self.buffer_fill = buffer_fill
+            self._trim(second)
+
+    def record_producer_stall(self):
+        """缓冲区满，压缩端等待（驱动器是瓶颈）"""
+        with self._lock:
+            self.producer_stalls += 1
+
+    def record_consumer_stall(self):
+        """缓冲区空，写入端等待（驱动器在等数据）"""
+        with self._lock:
+            self.consumer_stalls += 1
+
+    def set_ready_queue(self, file_count: int, total_bytes: int = 0):
+        """待写入磁带的压缩包队列深度"""
+        with self._lock:
+            self.ready_queue_files = max(0, int(file_count or 0))
+            self.ready_queue_bytes = max(0, int(total_bytes or 0))
+
+    # ---------- 统计 ----------
+
+    def _trim(self, now_second: int):
+        while self._buckets and self._buckets[0][0] <= now_second - self.window_seconds:
+            self._buckets.popleft()
+
+    def drive_rate(self) -> float:
+        """最近窗口内的平均写入速度（字节/秒），只统计窗口内有写入发生后的时间段"""
+        now_second = int(time.monotonic())
+        with self._lock:
+            self._trim(now_second)
+            if not self._buckets:
+                return 0.0
+            span = max(1, min(self.window_seconds, now_second - self._buckets[0][0] + 1))
+            return sum(nbytes for _, nbytes in self._buckets) / span
+
+    def is_drive_active(self) -> bool:
+        """有写入流打开，或最近 2 秒内有数据写出"""
+        if self.active_streams > 0:
+            return True
+        with self._lock:
+            return bool(self._buckets) and self._buckets[-1][0] >= int(time.monotonic()) - 2
+
+    def get_stats(self) -> Dict[str, Any]:
+        rate = self.drive_rate()
+        with self._lock:
+            return {
+                'drive_rate_bytes_per_sec': rate,
+                'min_streaming_rate': self.min_streaming_rate,
+                'total_bytes': self.total_bytes,
+                'buffer_fill': round(self.buffer_fill, 3),
+                'producer_stalls': self.producer_stalls,
+                'consumer_stalls': self.consumer_stalls,
+                'active_streams': self.active_streams,
+                'ready_queue_files': self.ready_queue_files,
+                'ready_queue_bytes': self.ready_queue_bytes,
+                'starved_seconds': round(self.starved_seconds, 1),
+                'extra_batches': self.extra_batches,
+                'buffer_multiplier': self.buffer_multiplier,
+                'last_action': self.last_action,
+            }
+
+    # ---------- 调整 ----------
+
+    def recommend_parallel_batches(self, planned_batches: int, max_batches: Optional[int] = None) -> int:
+        """在扫描阶段策略给出的并行批次上叠加吞吐调整（每 adjust_interval 秒最多调整一步）
+
+        Args:
+            planned_batches: 按扫描状态计算的并行批次数
+            max_batches: 并行批次上限（默认 planned_batches + max_extra_batches）
+
+        Returns:
+            int: 建议的并行批次数（至少为 1）
+        """
+        now = time.monotonic()
+        if now - self._last_adjust_at >= self.adjust_interval:
+            self._last_adjust_at = now
+            self._evaluate(now, planned_batches)
+        upper = max_batches if max_batches is not None else planned_batches + self.max_extra_batches
+        return max(1, min(planned_batches + self.extra_batches, max(1, upper)))
+
+    def _evaluate(self, now: float, planned_batches: int):
+        rate = self.drive_rate()
+        active = self.is_drive_active()
+        with self._lock:
+            new_producer_stalls = self.producer_stalls - self._last_producer_stalls
+            new_consumer_stalls = self.consumer_stalls - self._last_consumer_stalls
+            self._last_producer_stalls = self.producer_stalls
+            self._last_consumer_stalls = self.consumer_stalls
+            elapsed = now - self._last_rate_check
+            self._last_rate_check = now
+            queue_backlog = self.ready_queue_files >= self.queue_high_watermark
+
+            starving = active and self.min_streaming_rate > 0 and rate < self.min_streaming_rate
+            if starving:
+                self.starved_seconds += elapsed
+
+            if queue_backlog or (new_producer_stalls > 0 and not starving):
+                # 驱动器跟不上（已达流式速度且压缩端在等缓冲区，或待写队列积压）：减少压缩并行度（最少保留 1 个压缩任务）
+                action = ACTION_THROTTLE
+                self.extra_batches = max(1 - max(1, planned_batches), self.extra_batches - 1)
+            elif starving and new_consumer_stalls > 0 and self.ready_queue_files == 0:
+                # 驱动器在等数据：增加压缩并行度，并扩大缓冲区吸收压缩速度波动
+                action = ACTION_BOOST
+                self.extra_batches = min(self.max_extra_batches, self.extra_batches + 1)
+                self.buffer_multiplier = min(self.max_buffer_multiplier, self.buffer_multiplier * 2)
+            elif self.extra_batches < 0 and self.ready_queue_files == 0 and new_producer_stalls == 0:
+                # 积压已消化：逐步恢复到扫描阶段策略的并行度
+                action = ACTION_RECOVER
+                self.extra_batches += 1
+            else:
+                action = ACTION_HOLD
+
+        if action != ACTION_HOLD or self.last_action != ACTION_HOLD:
+            logger.info(
+                f"[磁带吞吐] {action}: 写入速度 {rate / 1024 / 1024:.1f} MB/s "
+                f"(最低流式速度 {self.min_streaming_rate / 1024 / 1024:.1f} MB/s), "
+                f"缓冲区占用 {self.buffer_fill:.0%}, 压缩端等待 +{new_producer_stalls}, 写入端等待 +{new_consumer_stalls}, "
+                f"待写队列 {self.ready_queue_files} 个, 并行批次调整 {self.extra_batches:+d}, 缓冲区倍数 {self.buffer_multiplier}"
+            )
+        self.last_action = action
+
+    def stream_buffer_size(self, base_size: int) -> int:
+        """直写磁带的环形缓冲区大小（供给不足时按倍数放大）"""
+        return int(base_size) * self.buffer_multiplier
+
+
+_governor: Optional[TapeThroughputGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_tape_governor(settings=None) -> Optional[TapeThroughputGovernor]:
+    """获取进程内唯一的吞吐调节器（TAPE_GOVERNOR_ENABLED=False 时返回 None）"""
+    global _governor
+    if _governor is not None:
+        return _governor
+    if settings is None:
+        from config.settings import get_settings
+        settings = get_settings()
+    if not getattr(settings, 'TAPE_GOVERNOR_ENABLED', True):
+        return None
+    with _governor_lock:
+        if _governor is None:
+            _governor = TapeThroughputGovernor(
+                min_streaming_rate=int(getattr(settings, 'TAPE_MIN_STREAMING_RATE_MB', 100)) * 1024 * 1024,
+                window_seconds=getattr(settings, 'TAPE_GOVERNOR_WINDOW_SECONDS', 10),
+                queue_high_watermark=getattr(settings, 'TAPE_GOVERNOR_QUEUE_HIGH_WATERMARK', 3),
+                max_extra_batches=getattr(settings, 'TAPE_GOVERNOR_MAX_EXTRA_BATCHES', 2),
+                max_buffer_multiplier=getattr(settings, 'TAPE_GOVERNOR_MAX_BUFFER_MULTIPLIER', 4),
+            )
+    return _governor
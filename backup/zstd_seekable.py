@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可随机访问的多帧 Zstandard 格式（zstd seekable format）
+Seekable Multi-Frame Zstandard Module
+
+压缩时每累计 N MiB 未压缩数据（在 tar 成员边界处）结束当前 zstd 帧并开始新帧，
+最后在文件尾部追加 seek table（可跳过帧，兼容 zstd contrib/seekable_format 规范）：
+
+    Skippable_Magic_Number (4B, 0x184D2A5E) | Frame_Size (4B)
+    [Compressed_Size (4B) | Decompressed_Size (4B)] * Number_Of_Frames
+    Number_Of_Frames (4B) | Seek_Table_Descriptor (1B) | Seekable_Magic_Number (4B, 0x8F92EAB1)
+
+普通 zstd 解压工具会忽略尾部的可跳过帧，因此输出仍是合法的 .tar.zst；
+恢复时可根据 seek table 只解压包含目标文件的帧，帧之间也可以并行解压。
+"""
+
+import io
+import bisect
+import logging
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, BinaryIO
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+logger = logging.getLogger(__name__)
+
+SKIPPABLE_MAGIC_NUMBER = 0x184D2A5E
+SEEKABLE_MAGIC_NUMBER = 0x8F92EAB1
+SEEK_TABLE_FOOTER_SIZE = 9
+# seek table 中帧大小字段为 32 位，单帧未压缩大小必须小于 4GB，这里强制在 1GB 处切帧
+MAX_FRAME_DECOMPRESSED_SIZE = 1024 * 1024 * 1024
+
+
+class SeekableZstdWriter:
+    """多帧 zstd 写入器（供 tarfile 以 'w' 模式写入）
+
+    tell() 返回未压缩数据的位置，使 TarFile.offset 与 tar 流中的偏移一致；
+    调用方在 tar 成员写完后检查 frame_bytes，达到阈值时调用 end_frame() 切帧。
+    """
+
+    def __init__(self, raw_out: BinaryIO, compressor, write_size: int,
+                 max_frame_size: int = MAX_FRAME_DECOMPRESSED_SIZE):
+        if zstd is None:
+            raise RuntimeError("未安装 zstandard 库，无法使用 zstd 压缩（请运行 pip install zstandard）")
+        self._raw = raw_out
+        self._stream = compressor.stream_writer(raw_out, closefd=False, write_size=write_size)
+        self._max_frame_size = max(1, min(int(max_frame_size), MAX_FRAME_DECOMPRESSED_SIZE))
+        self._position = 0
+        self._frame_compressed_start = raw_out.tell()
+        self._frame_decompressed_start = 0
+        self.frames: List[List[int]] = []  # [compressed_offset, compressed_size, decompressed_offset, decompressed_size]
+        self.closed = False
+
+    @property
+    def frame_bytes(self) -> int:
+        """当前帧已写入的未压缩字节数"""
+        return self._position - self._frame_decompressed_start
+
+    def write(self, data) -> int:
+        view = memoryview(data)
+        total = len(view)
+        while len(view):
+            # 单个大文件也不能让帧超过 seek table 能表示的大小
+            room = self._max_frame_size - self.frame_bytes
+            chunk = view[:room]
+            self._stream.write(chunk)
+            self._position += len(chunk)
+            view = view[len(chunk):]
+            if self.frame_bytes >= self._max_frame_size:
+                self.end_frame()
+        return total
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def end_frame(self):
+        """结束当前帧（之后写入的数据进入新帧）"""
+        if self.frame_bytes == 0:
+            return
+        self._stream.flush(zstd.FLUSH_FRAME)
+        compressed_end = self._raw.tell()
+        self.frames.append([
+            self._frame_compressed_start,
+            compressed_end - self._frame_compressed_start,
+            self._frame_decompressed_start,
+            self.frame_bytes,
+        ])
+        self._frame_compressed_start = compressed_end
+        self._frame_decompressed_start = self._position
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self):
+        """结束最后一帧并写入 seek table（不关闭底层文件）"""
+        if self.closed:
+            return
+        self.end_frame()
+        self._raw.write(build_seek_table(self.frames))
+        self.closed = True
+
+
+def build_seek_table(frames: List[List[int]]) -> bytes:
+    """生成 seek table 可跳过帧（不带校验和）"""
+    entries = b''.join(struct.pack('<II', frame[1], frame[3]) for frame in frames)
+    footer = struct.pack('<IBI', len(frames), 0, SEEKABLE_MAGIC_NUMBER)
+    payload = entries + footer
+    return struct.pack('<II', SKIPPABLE_MAGIC_NUMBER, len(payload)) + payload
+
+
+def read_seek_table(fileobj: BinaryIO) -> Optional[List[List[int]]]:
+    """从文件尾部读取 seek table，不是 seekable 格式时返回 None
+
+    Returns:
+        [[compressed_offset, compressed_size, decompressed_offset, decompressed_size], ...]
+    """
+    try:
+        fileobj.seek(0, io.SEEK_END)
+        file_size = fileobj.tell()
+        if file_size < SEEK_TABLE_FOOTER_SIZE + 8:
+            return None
+        fileobj.seek(file_size - SEEK_TABLE_FOOTER_SIZE)
+        frame_count, descriptor, magic = struct.unpack('<IBI', fileobj.read(SEEK_TABLE_FOOTER_SIZE))
+        if magic != SEEKABLE_MAGIC_NUMBER:
+            return None
+        entry_size = 12 if descriptor & 0x80 else 8
+        table_size = frame_count * entry_size + SEEK_TABLE_FOOTER_SIZE
+        table_start = file_size - table_size - 8
+        if table_start < 0:
+            return None
+        fileobj.seek(table_start)
+        skippable_magic, payload_size = struct.unpack('<II', fileobj.read(8))
+        if skippable_magic != SKIPPABLE_MAGIC_NUMBER or payload_size != table_size:
+            return None
+        raw_entries = fileobj.read(frame_count * entry_size)
+    except (OSError, struct.error):
+        return None
+
+    frames = []
+    compressed_offset = 0
+    decompressed_offset = 0
+    for i in range(frame_count):
+        compressed_size, decompressed_size = struct.unpack_from('<II', raw_entries, i * entry_size)
+        frames.append([compressed_offset, compressed_size, decompressed_offset, decompressed_size])
+        compressed_offset += compressed_size
+        decompressed_offset += decompressed_size
+    return frames
+
+
+class SeekableZstdFile(io.RawIOBase):
+    """只读、可 seek 的多帧 zstd 文件视图（按帧解压，并可预取后续帧并行解压）"""
+
+    def __init__(self, fileobj: BinaryIO, frames: List[List[int]], workers: int = 1):
+        if zstd is None:
+            raise RuntimeError("无法解压 .tar.zst 文件，因为未安装 zstandard 库")
+        self._fileobj = fileobj
+        self._frames = frames
+        self._starts = [frame[2] for frame in frames]
+        self._size = frames[-1][2] + frames[-1][3] if frames else 0
+        self._position = 0
+        self._cached_index = -1
+        self._cached_data = b''
+        self._workers = max(1, int(workers or 1))
+        self._executor = ThreadPoolExecutor(max_workers=self._workers) if self._workers > 1 else None
+        self._pending = {}
+
+    @classmethod
+    def open(cls, fileobj: BinaryIO, workers: int = 1) -> Optional['SeekableZstdFile']:
+        """读取 seek table 并创建视图，不是 seekable 格式时返回 None"""
+        frames = read_seek_table(fileobj)
+        if not frames:
+            return None
+        return cls(fileobj, frames, workers=workers)
+
+    @property
+    def frames(self) -> List[List[int]]:
+        return self._frames
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self._size + offset
+        self._position = max(0, self._position)
+        return self._position
+
+    def _read_frame_bytes(self, index: int) -> bytes:
+        compressed_offset, compressed_size, _, decompressed_size = self._frames[index]
+        self._fileobj.seek(compressed_offset)
+        return self._fileobj.read(compressed_size)
+
+    @staticmethod
+    def _decompress(data: bytes, decompressed_size: int) -> bytes:
+        return zstd.ZstdDecompressor().decompress(data, max_output_size=decompressed_size)
+
+    def _load_frame(self, index: int) -> bytes:
+        if index == self._cached_index:
+            return self._cached_data
+        future = self._pending.pop(index, None)
+        if future is not None:
+            data = future.result()
+        else:
+            data = self._decompress(self._read_frame_bytes(index), self._frames[index][3])
+        # 顺序读取时预取后续帧，利用多核并行解压（压缩数据在当前线程读取，避免并发访问文件对象）
+        if self._executor is not None:
+            for stale in [i for i in self._pending if i <= index or i > index + self._workers]:
+                self._pending.pop(stale).cancel()
+            for ahead in range(index + 1, min(index + self._workers, len(self._frames))):
+                if ahead not in self._pending:
+                    self._pending[ahead] = self._executor.submit(
+                        self._decompress, self._read_frame_bytes(ahead), self._frames[ahead][3]
+                    )
+        self._cached_index = index
+        self._cached_data = data
+        return data
+
+    def readinto(self, buffer) -> int:
+        # 跨帧填满缓冲区：tarfile 读取成员数据时把短读当作数据截断
+        view = memoryview(buffer).cast('B')
+        total = 0
+        while total < len(view) and self._position < self._size:
+            index = bisect.bisect_right(self._starts, self._position) - 1
+            frame_data = self._load_frame(index)
+            start = self._position - self._frames[index][2]
+            chunk = memoryview(frame_data)[start:start + len(view) - total]
+            n = len(chunk)
+            if n == 0:
+                break
+            view[total:total + n] = chunk
+            total += n
+            self._position += n
+        return total
+
+    def close(self):
+        if self._executor is not None:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        super().close()
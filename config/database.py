@@ -620,10 +620,110 @@ class DatabaseManager:
                         )
                         conn.commit()
 
+                    # 4. 创建 backup_files_archive_sets（备份成功后文件记录移入的月归档表）
+                    logger.info("检查并创建 backup_files_archive_sets（多表方案归档登记表）...")
+                    cur.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS backup_files_archive_sets (
+                            backup_set_id BIGINT PRIMARY KEY,
+                            table_name TEXT NOT NULL,
+                            source_table TEXT,
+                            file_count BIGINT DEFAULT 0,
+                            archived_at TIMESTAMPTZ DEFAULT NOW()
+                        )
+                        """
+                    )
+                    conn.commit()
+
+                    # 5. 创建 backup_directory_archives（目录 → 压缩包映射，目录恢复时只读取相关压缩包）
+                    logger.info("检查并创建 backup_directory_archives（目录→压缩包映射表）...")
+                    cur.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS backup_directory_archives (
+                            id BIGSERIAL PRIMARY KEY,
+                            backup_set_id BIGINT NOT NULL,
+                            directory_path TEXT NOT NULL,
+                            chunk_number INTEGER NOT NULL,
+                            tape_file_path TEXT,
+                            file_count BIGINT DEFAULT 0,
+                            total_size BIGINT DEFAULT 0
+                        )
+                        """
+                    )
+                    cur.execute(
+                        """
+                        CREATE INDEX IF NOT EXISTS idx_backup_directory_archives_set_dir
+                        ON backup_directory_archives(backup_set_id, directory_path)
+                        """
+                    )
+                    cur.execute(
+                        """
+                        CREATE INDEX IF NOT EXISTS idx_backup_directory_archives_set_chunk
+                        ON backup_directory_archives(backup_set_id, chunk_number)
+                        """
+                    )
+                    conn.commit()
+
+                    # 6. 创建 backup_directory_nodes / backup_directory_trees（备份集目录树索引，恢复浏览按目录分页查询）
+                    logger.info("检查并创建 backup_directory_nodes（备份集目录树索引）...")
+                    cur.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS backup_directory_nodes (
+                            backup_set_id BIGINT NOT NULL,
+                            dir_id BIGINT NOT NULL,
+                            parent_id BIGINT,
+                            name TEXT NOT NULL,
+                            path_key TEXT NOT NULL,
+                            depth INTEGER DEFAULT 0,
+                            file_count BIGINT DEFAULT 0,
+                            total_bytes BIGINT DEFAULT 0,
+                            direct_file_count BIGINT DEFAULT 0,
+                            direct_bytes BIGINT DEFAULT 0,
+                            child_dir_count INTEGER DEFAULT 0,
+                            PRIMARY KEY (backup_set_id, dir_id)
+                        )
+                        """
+                    )
+                    cur.execute(
+                        """
+                        CREATE INDEX IF NOT EXISTS idx_backup_directory_nodes_parent
+                        ON backup_directory_nodes(backup_set_id, parent_id, name)
+                        """
+                    )
+                    cur.execute(
+                        """
+                        CREATE INDEX IF NOT EXISTS idx_backup_directory_nodes_path
+                        ON backup_directory_nodes(backup_set_id, path_key)
+                        """
+                    )
+                    cur.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS backup_directory_trees (
+                            backup_set_id BIGINT PRIMARY KEY,
+                            files_table TEXT NOT NULL,
+                            node_count BIGINT DEFAULT 0,
+                            file_count BIGINT DEFAULT 0,
+                            built_at TIMESTAMPTZ DEFAULT NOW()
+                        )
+                        """
+                    )
+                    conn.commit()
+
                 except Exception as multi_err:
                     # 多表方案相关结构创建失败时，仅记录警告，不阻止主流程
                     logger.warning(f"创建多表方案相关结构时出错（backup_files_template / backup_files_groups 等）: {multi_err}", exc_info=True)
 
+                # 文件名子串搜索使用 pg_trgm（在启动时启用，搜索请求中只探测不建扩展；不支持时搜索回退到 ngram / LIKE）
+                substring_index = str(getattr(self.settings, 'FILE_SEARCH_SUBSTRING_INDEX', 'auto') or 'auto').lower()
+                if getattr(self.settings, 'FILE_SEARCH_INDEX_ENABLED', True) and substring_index in ('auto', 'trgm'):
+                    try:
+                        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                        conn.commit()
+                        logger.info("pg_trgm 扩展已启用（文件名子串搜索索引）")
+                    except Exception as trgm_err:
+                        conn.rollback()
+                        logger.info(f"无法启用 pg_trgm 扩展，文件名子串搜索将使用 ngram 或 LIKE: {trgm_err}")
+
                 # 检查并添加缺失的字段（字段迁移）
                 self._migrate_missing_columns(cur)
 
@@ -850,6 +950,9 @@ class DatabaseManager:
                     ('is_copy_success', 'BOOLEAN', 'FALSE', '是否复制成功'),
                     ('copy_status_at', 'TIMESTAMPTZ', 'NULL', '复制状态更新时间'),
                 ],
+                'backup_files_template': [
+                    ('dir_id', 'BIGINT', 'NULL', '所在目录节点ID（backup_directory_nodes）'),
+                ],
             }
             
             added_columns = []
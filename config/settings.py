@@ -60,6 +60,19 @@ class Settings(BaseSettings):
     # 建议值：300-1800秒（5-30分钟），根据系统负载调整
     DB_FLAVOR: Optional[str] = None  # 显式指定数据库类型（如 opengauss/postgresql/sqlite）
     DB_QUERY_DOP: int = 16  # openGauss 查询并行度（1-64，默认16，用于优化查询性能）
+    DB_BULK_LOAD_METHOD: str = "copy"  # backup_files 批量写入方式: "copy"(COPY FROM STDIN，失败自动回退) 或 "executemany"(逐行参数化INSERT)
+    DB_COPY_FORMAT: str = "native"  # COPY 数据格式: "native"(驱动原生写法：asyncpg 为二进制，psycopg3 为 write_row 文本行) 或 "csv"
+    BACKUP_FILES_TABLE_CACHE_TTL: float = 0  # backup_set → backup_files 分表名进程内缓存有效期（秒），0表示不过期（任务创建/删除时主动失效）
+    BACKUP_FILES_DEFER_INDEXES: bool = False  # 开启后分表扫描写入期间只有主键，扫描结束后在后台用 CREATE INDEX CONCURRENTLY 创建二级索引
+    BACKUP_FILES_ARCHIVE_ENABLED: bool = False  # 开启后备份成功后把备份集文件记录移入按月归档表 backup_files_archive_YYYYMM（分表为空时删除）
+    BACKUP_DIRECTORY_TREE_ENABLED: bool = True  # 备份成功后在后台物化备份集目录树（backup_directory_nodes），恢复浏览按目录分页查询
+    FILE_SEARCH_INDEX_ENABLED: bool = True  # 文件名搜索索引（openGauss 前缀/后缀/子串索引，SQLite FTS5 trigram，Redis 字典序有序集合）
+    FILE_SEARCH_SUBSTRING_INDEX: str = "auto"  # openGauss 子串索引方式：auto（依次尝试 pg_trgm、ngram）、trgm、ngram、none
+    FILE_SEARCH_MAX_SETS: int = 120  # 跨备份集搜索最多搜索的备份集数（按备份时间倒序）
+    FILE_SEARCH_MAX_LIMIT: int = 1000  # 文件搜索每页最多条数
+    BACKUP_FILE_LIST_PAGE_SIZE: int = 1000  # 备份集文件列表键集分页默认每页条数
+    BACKUP_FILE_LIST_MAX_LIMIT: int = 10000  # 备份集文件列表每页最多条数
+    BACKUP_FILE_LIST_FETCH_ROWS: int = 2000  # 流式读取文件列表时服务端游标每批读取行数（Redis 为 SSCAN COUNT）
     OG_HEARTBEAT_INTERVAL: int = 30  # openGauss 心跳间隔（秒）
     OG_HEARTBEAT_TIMEOUT: float = 5.0  # 单次心跳超时时间
     OG_OPERATION_TIMEOUT: float = 45.0  # 默认数据库操作超时
@@ -115,6 +128,20 @@ class Settings(BaseSettings):
     MAX_FILE_SIZE: int = 12 * 1024 * 1024 * 1024  # 12GB (默认值，可通过.env中的MAX_FILE_SIZE覆盖)
     COMPRESSION_DICTIONARY_SIZE: str = "256m"  # 7-Zip字典大小（固定256M）
     COMPRESS_DIRECTLY_TO_TAPE: bool = True  # 是否直接压缩到磁带机（默认True，跳过temp/final目录）
+    TAPE_STREAM_WRITE: bool = False  # 默认关闭（多个压缩任务会同时写LTFS）；开启后直接压缩到磁带时，压缩输出经环形缓冲区流式写入LTFS目标文件（pgzip/tar/zstd）
+    TAPE_STREAM_BLOCK_SIZE: int = 1048576  # 流式写磁带的对齐块大小（字节），默认1MB
+    TAPE_STREAM_BUFFER_SIZE: int = 268435456  # 流式写磁带的环形缓冲区大小（字节），默认256MB
+    TAPE_STREAM_CHECKSUM: str = "sha256"  # 写磁带时的流式校验算法（hashlib算法名）
+    TAPE_STREAM_VERIFY_READBACK: bool = True  # 写入完成后回读磁带文件重新计算校验和并与写入时的校验和比对（磁带上会额外读一遍）；关闭时只核对写入字节数
+    TAPE_GOVERNOR_ENABLED: bool = True  # 磁带吞吐调节：按驱动器写入速度和待写队列动态调整压缩并行度与直写缓冲区
+    TAPE_MIN_STREAMING_RATE_MB: int = 100  # 驱动器最低流式速度（MB/s），低于该速度LTO会停带重定位（按驱动器型号调整）
+    TAPE_GOVERNOR_WINDOW_SECONDS: int = 10  # 写入速度统计窗口（秒）
+    TAPE_GOVERNOR_QUEUE_HIGH_WATERMARK: int = 3  # 待写磁带压缩包数量达到该值时减少压缩并行度
+    TAPE_GOVERNOR_MAX_EXTRA_BATCHES: int = 2  # 驱动器供给不足时最多额外增加的压缩并行批次
+    TAPE_GOVERNOR_MAX_BUFFER_MULTIPLIER: int = 4  # 直写磁带缓冲区最多放大的倍数
+    TAPE_READY_QUEUE_PATH: str = "data/tape_ready_queue.db"  # 待写磁带就绪队列日志（SQLite，状态 pending/copying/verified/failed；相对路径按项目根目录解析）
+    TAPE_READY_QUEUE_MAX_ATTEMPTS: int = 3  # 单个文件写入磁带的最大尝试次数，超过后标记为failed并保留源文件
+    TAPE_READY_QUEUE_RETENTION_DAYS: int = 7  # 已完成（verified）条目在日志中保留的天数
 
     # 计划任务配置
     SCHEDULER_ENABLED: bool = True
@@ -137,6 +164,19 @@ class Settings(BaseSettings):
     # 备份配置
     BACKUP_TEMP_DIR: str = "temp/backup"
     RECOVERY_TEMP_DIR: str = "temp/recovery"
+    RECOVERY_STREAM_BY_ARCHIVE: bool = True  # 恢复时按压缩包分组流式读取（每个压缩包只打开一次，边写边校验）
+    RECOVERY_STREAM_BUFFER_SIZE: int = 4194304  # 流式恢复的读写缓冲区大小（字节），默认4MB
+    RECOVERY_PRESERVE_PATHS: bool = False  # 按压缩包恢复时保留备份源内的相对目录结构（False 时与逐文件恢复一致，恢复到 目标目录/<文件名>）
+    RECOVERY_PLAN_ENABLED: bool = True  # 创建恢复任务时生成恢复计划（按磁带分批、盘内按物理位置排序），通过状态接口预览
+    RECOVERY_PLAN_READ_MBPS: float = 300  # 恢复计划估算用的磁带顺序读取速度（MB/s）
+    RECOVERY_PLAN_LOCATE_SECONDS: float = 50  # 恢复计划估算用的平均定位时间（秒/次，LTO 平均访问时间）
+    RECOVERY_PLAN_LOAD_SECONDS: float = 120  # 恢复计划估算用的换盘时间（卸载、加载、挂载 LTFS，秒/次）
+    RECOVERY_PLAN_LTFS_BLOCK_SIZE: int = 524288  # LTFS 块大小（字节），用于判断压缩包在磁带上是否相邻
+    RECOVERY_EXTRACT_WORKERS: int = 0  # 恢复解压写入线程数（所有恢复任务共用），0 表示 min(8, CPU 核数)
+    RECOVERY_STAGING_ENABLED: bool = False  # 是否把磁带上的压缩包先整体暂存到 RECOVERY_TEMP_DIR/staging 再并行解压（读磁带与解压流水线并行；需要本地磁盘有足够空间，默认关闭）
+    RECOVERY_STAGING_MAX_BYTES: int = 34359738368  # 所有恢复任务合计已暂存、尚未解压完的最大字节数（超过时暂停读磁带），默认32GB
+    RECOVERY_STAGING_MIN_FREE_BYTES: int = 1073741824  # 暂存后暂存目录所在磁盘至少保留的剩余空间（不足时直接从磁带解压），默认1GB
+    RECOVERY_DRIVE_QUANTUM_BYTES: int = 34359738368  # 多个恢复任务共享驱动器时每次轮转可连续读取的字节数，默认32GB
     BACKUP_COMPRESS_DIR: str = "temp/compress"  # 压缩文件临时目录（先压缩到这里，再移动到磁带机）
     COMPRESSION_THREADS: int = 4  # Python压缩线程数（py7zr/PGZip）
     # 压缩方法配置
@@ -147,17 +187,36 @@ class Settings(BaseSettings):
     PGZIP_THREADS: int = 4  # PGZip线程数
     ZSTD_THREADS: int = 4  # Zstandard压缩线程数
     ZSTD_WRITE_SIZE: int = 1048576  # Zstandard压缩写入缓冲区大小（字节），默认1MB（1048576字节）
+    ZSTD_SEEKABLE: bool = False  # Zstandard可随机访问多帧模式（在tar成员边界切帧并写入seek table，恢复时只解压需要的帧）
+    ZSTD_SEEKABLE_FRAME_SIZE: int = 33554432  # 可随机访问模式下每帧的未压缩大小（字节），默认32MB
+    ARCHIVE_INDEX_ENABLED: bool = True  # tar类压缩包（tar/pgzip/zstd）是否生成成员索引文件（{压缩包名}.idx），恢复时可直接定位成员
+    FILE_CHECKSUM_ALGORITHM: str = "xxh3"  # tar类压缩时在同一次读取中计算每个文件的校验和: "xxh3"(需xxhash)、"blake3"(需blake3)、"sha256"，留空不计算
+    COMPRESSION_SMALL_FILE_THRESHOLD: int = 1048576  # tar类压缩中不超过该大小（字节）的文件由读取线程池预读并直接构造 TarInfo，0表示关闭
+    COMPRESSION_SMALL_FILE_READERS: int = 8  # 小文件预读线程数
+    COMPRESSION_SMALL_FILE_QUEUE_BYTES: int = 67108864  # 已预读、等待写入 tar 的小文件内容上限（字节），默认64MB
+    DEDUP_ENABLED: bool = False  # 跨备份集内容去重：内容已存在于仍保留磁带上的文件只记录引用，不再写入新压缩包
+    DEDUP_INDEX_PATH: str = "data/dedup_index.db"  # 内容去重索引（SQLite）路径
+    DEDUP_MIN_FILE_SIZE: int = 1048576  # 参与去重的最小文件大小（字节），小文件引用的开销大于收益
+    DEDUP_MAX_REFERENCE_AGE_DAYS: int = 90  # 只引用最近N天内写入的副本，更旧的内容重新归档（避免旧磁带被长期固定），0表示不限制
+    DEDUP_HASH_UNKNOWN_FILES: bool = False  # 路径提示未命中的文件是否在压缩前额外读取一遍计算校验和（可发现改名/复制的文件，但多一次读取）
 
     # 扫描进度更新配置
     SCAN_UPDATE_INTERVAL: int = 2000  # 后台扫描每处理多少个文件更新一次数据库（total_files/total_bytes）
     # 优化：从500增加到2000，减少数据库写入频率，提升扫描速度
     # 如需更快速度，可增加到5000（需要更多内存，但写入速度更快）
     SCAN_LOG_INTERVAL_SECONDS: int = 60  # 后台扫描进度日志输出的时间间隔（秒）
-    SCAN_WAIT_TIMEOUT: int = 300  # 等待后台扫描写入文件记录的超时时间（秒），默认300秒（5分钟）
+    SCAN_WAIT_TIMEOUT: int = 300  # 等待后台扫描写入文件记录的最长时间（秒），默认300秒（5分钟）；达到就绪水位线或扫描结束会提前开始压缩
+    SCAN_READY_THRESHOLD_BYTES: int = 0  # 启动压缩的就绪水位线（已写入的待压缩字节数），0表示使用 MAX_FILE_SIZE
+    FILE_CATALOG_ENABLED: bool = True  # 是否启用文件状态目录（增量/差异备份只备份新增或变化的文件；完整备份建立基线）
+    FILE_CATALOG_DIR: str = "data/file_catalog"  # 文件状态目录存放位置（每个源路径一个 SQLite 文件）
     ENABLE_BACKGROUND_COPY_UPDATE: bool = False  # 是否启用压缩线程后台标记 is_copy_success
     
     # 压缩并行批次配置
     COMPRESSION_PARALLEL_BATCHES: int = 2  # 压缩并行批次数量（默认2），预读取程序队列数为该值+1
+    COMPRESSION_GROUPING_MODE: str = "legacy"  # 文件组组装方式: "legacy"(分批检索累积) 或 "claim"(服务端游标流式装箱 + UPDATE ... RETURNING 原子认领)
+    COMPRESSION_PACK_WINDOW_FILES: int = 200000  # 装箱候选窗口最多文件数
+    COMPRESSION_PACK_WINDOW_FACTOR: float = 2.0  # 装箱候选窗口最多字节数 = MAX_FILE_SIZE × 该值（窗口越大装得越满）
+    COMPRESSION_GROUPING_POLICY: str = "size"  # 装箱策略（claim 模式）: "size"(按大小装满)、"directory"(同目录/相邻子目录放入同一压缩包) 或 "directory_ext"(按目录装箱，组内再按扩展名排序)
     
     # 扫描方法配置
     SCAN_METHOD: str = "default"  # 扫描方法: "default" (默认) 或 "es" (Everything搜索工具)
@@ -174,9 +233,11 @@ class Settings(BaseSettings):
     
     # 扫描多线程选项（仅当SCAN_METHOD=default时有效）
     USE_SCAN_MULTITHREAD: bool = True  # 是否使用多线程扫描（默认启用）
-    # 当SCAN_METHOD=default时：
-    # - USE_SCAN_MULTITHREAD=True: 使用并发目录扫描（ConcurrentDirScanner）
-    # - USE_SCAN_MULTITHREAD=False: 使用顺序目录扫描（SequentialDirScanner，基于os.scandir）
+    # 当SCAN_METHOD=default时，所有扫描模式共用 ParallelDirWalker（backup/parallel_dir_walker.py）：
+    # - USE_SCAN_MULTITHREAD=True: SCAN_THREADS 个 work-stealing 目录遍历线程
+    # - USE_SCAN_MULTITHREAD=False: 单个目录遍历线程
+    SCAN_MAX_PENDING_BATCHES: int = 0  # 目录遍历最多缓存多少个待消费批次（消费者慢时遍历线程阻塞），0表示线程数×2
+    SCAN_TRUST_DIR_MTIME: bool = False  # 增量/差异备份信任目录 mtime：未变化的目录直接复用上次成功扫描的列表（原地修改且目录 mtime 未变的文件会漏检；完整备份始终完整扫描）
     
     # 内存数据库配置
     USE_MEMORY_DB: bool = True  # 是否使用内存数据库（默认启用，性能最优）
@@ -143,6 +143,12 @@ class SQLiteInitializer:
             # 检查并添加缺失的字段（字段迁移）
             await self._migrate_missing_columns()
             
+            # 文件名搜索索引（FTS5 trigram）
+            await self._create_file_search_index()
+            
+            # 文件列表键集分页索引
+            await self._create_file_listing_index()
+            
             # 设置 SQLite 优化参数
             await self._configure_sqlite_settings()
             
@@ -150,6 +156,30 @@ class SQLiteInitializer:
             logger.error(f"创建 SQLite 数据库表失败: {str(e)}")
             raise
     
+    async def _create_file_search_index(self):
+        """创建文件名搜索索引（FTS5 trigram 外部内容表，触发器与 backup_files 同步）"""
+        if not getattr(self.settings, 'FILE_SEARCH_INDEX_ENABLED', True):
+            return
+        try:
+            from utils.scheduler.sqlite_utils import get_sqlite_connection
+            from backup.file_search_index import ensure_sqlite_search_index
+            
+            async with get_sqlite_connection() as conn:
+                await ensure_sqlite_search_index(conn)
+        except Exception as e:
+            logger.warning(f"创建 SQLite 文件名搜索索引失败（文件搜索使用顺序扫描）: {str(e)}")
+    
+    async def _create_file_listing_index(self):
+        """创建文件列表键集分页使用的 (backup_set_id, file_path) 索引"""
+        try:
+            from utils.scheduler.sqlite_utils import get_sqlite_connection
+            from backup.file_listing import ensure_sqlite_listing_index
+            
+            async with get_sqlite_connection() as conn:
+                await ensure_sqlite_listing_index(conn)
+        except Exception as e:
+            logger.warning(f"创建 SQLite 文件列表索引失败（文件列表分页使用顺序扫描）: {str(e)}")
+    
     async def _configure_sqlite_settings(self):
         """配置 SQLite 性能优化参数"""
         try:
@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按压缩包分组的流式恢复模块
+Archive-Grouped Streaming Restore Module
+
+恢复时按 file_metadata.tape_file_path 将待恢复文件分组，每个压缩包只打开一次，
+顺序流式读取成员并通过固定大小的缓冲区写入目标磁盘，写入的同时按备份时记录的算法
+（sha256 / xxh3 / blake3，见 backup.file_hasher）计算校验和，
+避免把整个压缩包或单个大文件读入内存，也避免写完后再次读取文件做校验。
+内容去重的文件（file_metadata.dedup_ref，见 backup.dedup_index）按引用从原备份集的压缩包中读取。
+"""
+
+import os
+import io
+import logging
+import shutil
+import tarfile
+import threading
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import List, Dict, Any, Optional, Tuple
+
+import py7zr
+
+from backup.archive_index import (
+    load_archive_index, MEMBER_ARCNAME, MEMBER_DATA_OFFSET, MEMBER_SIZE, MEMBER_MTIME
+)
+from backup.zstd_seekable import SeekableZstdFile
+from backup.file_hasher import create_verifier, checksum_matches
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+logger = logging.getLogger(__name__)
+
+# 默认流式缓冲区大小（4MB）
+DEFAULT_STREAM_BUFFER_SIZE = 4 * 1024 * 1024
+# 7z 每批读取的最大原始字节数（py7zr 只能按批读入内存）
+SEVENZIP_BATCH_BYTES = 256 * 1024 * 1024
+
+# 多个压缩包在线程池中并行恢复时共享同一个进度字典
+_progress_lock = threading.Lock()
+
+
+def _normalize_member_name(name: str) -> str:
+    """规范化压缩包成员名/文件路径（统一分隔符、小写，便于后缀匹配）"""
+    normalized = (name or '').replace('\\', '/').lower()
+    while normalized.startswith('./'):
+        normalized = normalized[2:]
+    return normalized.lstrip('/')
+
+
+def _add_progress(progress: Optional[Dict], files: int, nbytes: int):
+    """累加恢复进度（线程安全）"""
+    if progress is None:
+        return
+    with _progress_lock:
+        progress['processed_files'] = progress.get('processed_files', 0) + files
+        progress['processed_bytes'] = progress.get('processed_bytes', 0) + nbytes
+
+
+def _ensure_metadata_dict(metadata: Any) -> Dict:
+    """file_metadata 可能是 dict、JSON 字符串或 None，统一转换为 dict"""
+    if isinstance(metadata, dict):
+        return metadata
+    if isinstance(metadata, (str, bytes)) and metadata:
+        try:
+            import json
+            parsed = json.loads(metadata)
+            return parsed if isinstance(parsed, dict) else {}
+        except (TypeError, ValueError):
+            return {}
+    return {}
+
+
+def group_files_by_archive(files: List[Dict]) -> Tuple[Dict[str, List[Dict]], List[Dict]]:
+    """按压缩包（file_metadata.tape_file_path）对待恢复文件分组
+
+    Args:
+        files: 待恢复文件列表
+
+    Returns:
+        (groups, ungrouped): groups 为 {tape_file_path: [file_info, ...]}（保持首次出现顺序），
+        ungrouped 为缺少压缩包信息、只能走逐文件恢复流程的文件
+    """
+    groups: Dict[str, List[Dict]] = {}
+    ungrouped: List[Dict] = []
+    for file_info in files:
+        metadata = _ensure_metadata_dict(file_info.get('file_metadata'))
+        archive_hint = metadata.get('tape_file_path')
+        if archive_hint:
+            groups.setdefault(str(archive_hint), []).append(file_info)
+        else:
+            ungrouped.append(file_info)
+    return groups, ungrouped
+
+
+def _safe_relative_path(member_name: str) -> Optional[Path]:
+    """把压缩包内的成员名转换为安全的相对路径（去掉盘符、绝对路径和 ..）"""
+    parts = []
+    for part in PurePosixPath((member_name or '').replace('\\', '/')).parts:
+        if part in ('', '.', '..', '/') or part.endswith(':'):
+            continue
+        parts.append(part)
+    if not parts:
+        return None
+    return Path(*parts)
+
+
+def get_dedup_ref(file_info: Dict) -> Optional[Dict]:
+    """内容去重引用（文件数据在其他备份集的压缩包中），普通文件返回 None"""
+    dedup_ref = _ensure_metadata_dict(file_info.get('file_metadata')).get('dedup_ref')
+    return dedup_ref if isinstance(dedup_ref, dict) and dedup_ref.get('member') else None
+
+
+def _target_relative_path(member_name: str, file_info: Dict, preserve_paths: bool = False) -> Path:
+    """恢复目标的相对路径
+
+    preserve_paths 为 False 时与逐文件恢复一致，恢复到 target/<文件名>；
+    为 True 时保留压缩包内的相对路径：普通文件取成员名，去重引用取文件自身的成员名（引用的成员名属于原备份集）
+    """
+    if not preserve_paths:
+        return Path(Path(file_info.get('file_path', '')).name)
+    dedup_ref = get_dedup_ref(file_info)
+    if dedup_ref is not None:
+        member_name = dedup_ref.get('arcname') or ''
+    return _safe_relative_path(member_name) or Path(Path(file_info.get('file_path', '')).name)
+
+
+class _ArchiveRequestIndex:
+    """待恢复文件索引：按文件名分桶，成员到来时 O(1) 查找候选并做路径后缀匹配
+
+    压缩时 arcname 是相对于备份源目录的路径，因此原始路径一定以 "/" + arcname 结尾。
+    去重引用按引用的成员名精确匹配；多个文件引用同一成员时，成员只读取一次，
+    其余文件（followers）在恢复完成后从第一个文件复制。
+    """
+
+    def __init__(self, file_infos: List[Dict]):
+        self._by_name: Dict[str, List[Tuple[str, Dict]]] = {}
+        self._by_member: Dict[str, List[Dict]] = {}
+        self.followers: List[Tuple[str, Dict, List[Dict]]] = []  # [(成员名, 恢复的文件, 复制目标文件)]
+        self.pending = 0
+        for file_info in file_infos:
+            dedup_ref = get_dedup_ref(file_info)
+            if dedup_ref is not None:
+                member = _normalize_member_name(dedup_ref['member'])
+                if member:
+                    self._by_member.setdefault(member, []).append(file_info)
+                    self.pending += 1
+                continue
+            metadata = _ensure_metadata_dict(file_info.get('file_metadata'))
+            original_path = metadata.get('original_path') or file_info.get('file_path') or ''
+            normalized = _normalize_member_name(original_path)
+            if not normalized:
+                continue
+            base_name = normalized.rsplit('/', 1)[-1]
+            self._by_name.setdefault(base_name, []).append((normalized, file_info))
+            self.pending += 1
+
+    def match(self, member_name: str) -> Optional[Dict]:
+        """匹配成员名，命中后从索引中移除（同一文件只恢复一次）"""
+        normalized = _normalize_member_name(member_name)
+        if not normalized:
+            return None
+        referencing = self._by_member.pop(normalized, None)
+        if referencing:
+            self.pending -= len(referencing)
+            if len(referencing) > 1:
+                self.followers.append((member_name, referencing[0], referencing[1:]))
+            return referencing[0]
+        base_name = normalized.rsplit('/', 1)[-1]
+        candidates = self._by_name.get(base_name)
+        if not candidates:
+            return None
+        for idx, (full_path, file_info) in enumerate(candidates):
+            if full_path == normalized or full_path.endswith('/' + normalized):
+                candidates.pop(idx)
+                if not candidates:
+                    self._by_name.pop(base_name, None)
+                self.pending -= 1
+                return file_info
+        return None
+
+    def remaining(self) -> List[Dict]:
+        """返回未在压缩包中找到的文件"""
+        remaining = [file_info for candidates in self._by_name.values() for _, file_info in candidates]
+        remaining.extend(file_info for referencing in self._by_member.values() for file_info in referencing)
+        return remaining
+
+
+class _BoundedReader(io.RawIOBase):
+    """只读取底层文件从当前位置开始的 size 个字节"""
+
+    def __init__(self, raw, size: int):
+        self._raw = raw
+        self._remaining = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._remaining <= 0:
+            return 0
+        view = memoryview(buffer)
+        if len(view) > self._remaining:
+            view = view[:self._remaining]
+        n = self._raw.readinto(view) or 0
+        self._remaining -= n
+        return n
+
+
+def estimate_read_bytes(archive_path: Path, file_infos: List[Dict]) -> Optional[int]:
+    """按成员索引估算恢复 file_infos 需要从压缩包读取的字节数
+
+    .tar 累加命中成员的数据大小；.tar.zst 累加包含命中成员数据的 zstd 帧的压缩后大小
+    （非 seekable 的单帧压缩包即整个压缩包）。没有成员索引、无法按索引定位读取时返回 None。
+    """
+    name = archive_path.name.lower()
+    if not name.endswith(('.tar', '.tar.zst', '.tzst')):
+        return None
+    archive_index = load_archive_index(archive_path)
+    if not archive_index:
+        return None
+    index = _ArchiveRequestIndex(file_infos)
+    ranges = []
+    for member in archive_index.get('members', []):
+        if index.pending == 0:
+            break
+        if index.match(member[MEMBER_ARCNAME]) is not None and member[MEMBER_SIZE] > 0:
+            ranges.append((member[MEMBER_DATA_OFFSET], member[MEMBER_DATA_OFFSET] + member[MEMBER_SIZE]))
+    if name.endswith('.tar'):
+        return sum(end - start for start, end in ranges)
+
+    frames = archive_index.get('frames') or []
+    if not frames:
+        return None
+    # 成员数据区互不重叠，按起始偏移排序后与按解压偏移排序的帧做一次归并
+    ranges.sort()
+    total = 0
+    position = 0
+    for compressed_offset, compressed_size, decompressed_offset, decompressed_size in sorted(frames, key=lambda f: f[2]):
+        while position < len(ranges) and ranges[position][1] <= decompressed_offset:
+            position += 1
+        if position < len(ranges) and ranges[position][0] < decompressed_offset + decompressed_size:
+            total += compressed_size
+    return total
+
+
+class ArchiveStreamRestorer:
+    """按压缩包流式恢复文件
+
+    所有方法都是同步阻塞的，调用方应通过 asyncio.to_thread 在线程中执行。
+    进度直接累加到调用方传入的 progress 字典（processed_files / processed_bytes），
+    与压缩流程共享 compress_progress 字典的方式一致。
+    """
+
+    def __init__(self, settings=None, buffer_size: Optional[int] = None):
+        self.settings = settings
+        if buffer_size is None:
+            buffer_size = getattr(settings, 'RECOVERY_STREAM_BUFFER_SIZE', DEFAULT_STREAM_BUFFER_SIZE) if settings else DEFAULT_STREAM_BUFFER_SIZE
+        self.buffer_size = max(64 * 1024, int(buffer_size or DEFAULT_STREAM_BUFFER_SIZE))
+        self.preserve_paths = bool(getattr(settings, 'RECOVERY_PRESERVE_PATHS', False)) if settings else False
+
+    def resolve_archive_path(self, tape_file_path: str, set_id: Optional[str] = None) -> Optional[Path]:
+        """定位压缩包的实际位置
+
+        tape_file_path 可能是磁带上的相对路径（set_id\\xxx.tar.gz），也可能是压缩时的本地路径
+        （文件随后被移动到磁带盘符 {TAPE_DRIVE_LETTER}:\\{set_id}\\ 下），依次尝试。
+        """
+        if not tape_file_path:
+            return None
+
+        archive_hint = Path(tape_file_path)
+        candidates: List[Path] = []
+        drive_letter = getattr(self.settings, 'TAPE_DRIVE_LETTER', None) if self.settings else None
+        if drive_letter:
+            tape_drive = Path(drive_letter.upper() + ":\\")
+            if not archive_hint.is_absolute():
+                candidates.append(tape_drive / archive_hint)
+            if set_id:
+                candidates.append(tape_drive / set_id / archive_hint.name)
+        candidates.append(archive_hint)
+
+        for candidate in candidates:
+            try:
+                if candidate.is_file():
+                    return candidate
+            except OSError:
+                continue
+        return None
+
+    def restore_archive(self, archive_path: Path, file_infos: List[Dict], target_root: Path,
+                        progress: Optional[Dict] = None) -> Dict[str, Any]:
+        """从一个压缩包中恢复一组文件（压缩包只打开一次）
+
+        Args:
+            archive_path: 压缩包路径
+            file_infos: 该压缩包内需要恢复的文件
+            target_root: 恢复目标目录
+            progress: 共享进度字典（可选）
+
+        Returns:
+            dict: {restored_files, restored_bytes, failed: [file_info], missing: [file_info]}
+        """
+        result = {'restored_files': 0, 'restored_bytes': 0, 'failed': [], 'missing': []}
+        index = _ArchiveRequestIndex(file_infos)
+        if index.pending == 0:
+            result['missing'] = list(file_infos)
+            return result
+
+        name = archive_path.name.lower()
+        archive_index = load_archive_index(archive_path) if name.endswith(('.tar', '.tar.zst', '.tzst')) else None
+        if archive_index and name.endswith('.tar'):
+            # 有成员索引的 tar 包：直接定位到成员数据区读取
+            with open(archive_path, 'rb', buffering=0) as raw:
+                self._restore_indexed_members(raw, archive_index, index, target_root, progress, result)
+        elif name.endswith(('.tar.gz', '.tgz')):
+            self._restore_from_tar(archive_path, 'r|gz', index, target_root, progress, result)
+        elif name.endswith(('.tar.zst', '.tzst')):
+            self._restore_from_tar_zst(archive_path, archive_index, index, target_root, progress, result)
+        elif name.endswith('.tar'):
+            self._restore_from_tar(archive_path, 'r|', index, target_root, progress, result)
+        elif name.endswith('.zip'):
+            self._restore_from_zip(archive_path, index, target_root, progress, result)
+        elif name.endswith('.7z'):
+            self._restore_from_7z(archive_path, index, target_root, progress, result)
+        else:
+            logger.warning(f"[流式恢复] 不支持的压缩包格式: {archive_path}")
+            result['missing'] = list(file_infos)
+            return result
+
+        result['missing'].extend(index.remaining())
+        self._restore_followers(index, target_root, progress, result)
+        return result
+
+    def _restore_followers(self, index: _ArchiveRequestIndex, target_root: Path,
+                           progress: Optional[Dict], result: Dict):
+        """多个文件引用同一成员：从已恢复的文件复制，不再重复读取压缩包"""
+        for member_name, primary, followers in index.followers:
+            source_file = target_root / _target_relative_path(member_name, primary, self.preserve_paths)
+            if any(failed is primary for failed in result['failed']):
+                result['failed'].extend(followers)
+                continue
+            for file_info in followers:
+                target_file = target_root / _target_relative_path(member_name, file_info, self.preserve_paths)
+                try:
+                    if target_file != source_file:
+                        target_file.parent.mkdir(parents=True, exist_ok=True)
+                        shutil.copy2(source_file, target_file)
+                    written = target_file.stat().st_size
+                except OSError as e:
+                    logger.error(f"[流式恢复] 复制去重引用文件失败 {file_info.get('file_path')}: {str(e)}")
+                    result['failed'].append(file_info)
+                    continue
+                result['restored_files'] += 1
+                result['restored_bytes'] += written
+                _add_progress(progress, 1, written)
+
+    def _restore_from_tar(self, archive_path: Path, mode: str, index: _ArchiveRequestIndex,
+                          target_root: Path, progress: Optional[Dict], result: Dict):
+        with open(archive_path, 'rb', buffering=self.buffer_size) as raw:
+            self._restore_from_tar_stream(raw, mode, index, target_root, progress, result)
+
+    def _restore_indexed_members(self, fileobj, archive_index: Dict, index: _ArchiveRequestIndex,
+                                 target_root: Path, progress: Optional[Dict], result: Dict):
+        """根据成员索引随机读取 tar 数据（fileobj 为可 seek 的 tar 流，按数据偏移排序保证顺序读）"""
+        wanted = []
+        for member in archive_index.get('members', []):
+            file_info = index.match(member[MEMBER_ARCNAME])
+            if file_info is not None:
+                wanted.append((member, file_info))
+            if index.pending == 0:
+                break
+        wanted.sort(key=lambda item: item[0][MEMBER_DATA_OFFSET])
+
+        for member, file_info in wanted:
+            fileobj.seek(member[MEMBER_DATA_OFFSET])
+            source = _BoundedReader(fileobj, member[MEMBER_SIZE])
+            self._restore_member(source, member[MEMBER_ARCNAME], file_info, target_root,
+                                 progress, result, mtime=member[MEMBER_MTIME])
+
+    def _restore_from_tar_zst(self, archive_path: Path, archive_index: Optional[Dict], index: _ArchiveRequestIndex,
+                              target_root: Path, progress: Optional[Dict], result: Dict):
+        if zstd is None:
+            raise RuntimeError("无法解压 .tar.zst 文件，因为未安装 zstandard 库")
+
+        # 可随机访问的多帧 zstd：只解压包含目标文件的帧
+        with open(archive_path, 'rb', buffering=0) as raw:
+            workers = getattr(self.settings, 'ZSTD_THREADS', 1) if self.settings else 1
+            seekable_file = SeekableZstdFile.open(raw, workers=workers)
+            if seekable_file is not None:
+                with seekable_file:
+                    if archive_index:
+                        self._restore_indexed_members(seekable_file, archive_index, index, target_root, progress, result)
+                    else:
+                        self._restore_from_tar_stream(seekable_file, 'r:', index, target_root, progress, result)
+                return
+
+        dctx = zstd.ZstdDecompressor()
+        with open(archive_path, 'rb', buffering=self.buffer_size) as raw:
+            try:
+                reader = dctx.stream_reader(raw, read_size=self.buffer_size, read_across_frames=True)
+            except TypeError:
+                # 旧版本 zstandard 不支持 read_across_frames 参数
+                reader = dctx.stream_reader(raw, read_size=self.buffer_size)
+            with reader:
+                self._restore_from_tar_stream(reader, 'r|', index, target_root, progress, result)
+
+    def _restore_from_tar_stream(self, fileobj, mode: str, index: _ArchiveRequestIndex,
+                                 target_root: Path, progress: Optional[Dict], result: Dict):
+        """顺序读取 tar 流（流模式不可回退），命中的成员直接写盘"""
+        with tarfile.open(fileobj=fileobj, mode=mode, bufsize=self.buffer_size) as tar:
+            for member in tar:
+                if index.pending == 0:
+                    # 需要的文件都已恢复，无需读完整个压缩包
+                    break
+                if not member.isfile():
+                    continue
+                file_info = index.match(member.name)
+                if file_info is None:
+                    continue
+                source = tar.extractfile(member)
+                if source is None:
+                    result['failed'].append(file_info)
+                    continue
+                with source:
+                    self._restore_member(source, member.name, file_info, target_root,
+                                         progress, result, mtime=member.mtime)
+
+    def _restore_from_zip(self, archive_path: Path, index: _ArchiveRequestIndex,
+                          target_root: Path, progress: Optional[Dict], result: Dict):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                if index.pending == 0:
+                    break
+                if info.is_dir():
+                    continue
+                file_info = index.match(info.filename)
+                if file_info is None:
+                    continue
+                with zf.open(info) as source:
+                    self._restore_member(source, info.filename, file_info, target_root, progress, result)
+
+    def _restore_from_7z(self, archive_path: Path, index: _ArchiveRequestIndex,
+                         target_root: Path, progress: Optional[Dict], result: Dict):
+        """py7zr 不支持逐成员流式读取，按批次（限制原始字节数）读取后写盘"""
+        with py7zr.SevenZipFile(archive_path, mode='r') as archive:
+            batches: List[List[Tuple[str, Dict]]] = []
+            current: List[Tuple[str, Dict]] = []
+            current_bytes = 0
+            for info in archive.list():
+                if info.is_directory:
+                    continue
+                file_info = index.match(info.filename)
+                if file_info is None:
+                    continue
+                size = getattr(info, 'uncompressed', 0) or 0
+                if current and current_bytes + size > SEVENZIP_BATCH_BYTES:
+                    batches.append(current)
+                    current, current_bytes = [], 0
+                current.append((info.filename, file_info))
+                current_bytes += size
+            if current:
+                batches.append(current)
+
+            for batch in batches:
+                archive.reset()
+                data_map = archive.read([name for name, _ in batch])
+                for member_name, file_info in batch:
+                    stream = data_map.pop(member_name, None)
+                    if stream is None:
+                        result['failed'].append(file_info)
+                        continue
+                    if isinstance(stream, bytes):
+                        stream = io.BytesIO(stream)
+                    self._restore_member(stream, member_name, file_info, target_root, progress, result)
+
+    def _restore_member(self, source, member_name: str, file_info: Dict, target_root: Path,
+                        progress: Optional[Dict], result: Dict, mtime: Optional[float] = None):
+        """通过固定缓冲区把单个成员写入目标路径，写入时计算校验和并校验"""
+        target_file = target_root / _target_relative_path(member_name, file_info, self.preserve_paths)
+        temp_file = target_file.with_name(target_file.name + '.part')
+
+        try:
+            target_file.parent.mkdir(parents=True, exist_ok=True)
+            expected_checksum = file_info.get('checksum')
+            verifier = create_verifier(expected_checksum)
+            written = 0
+            buffer = bytearray(self.buffer_size)
+            view = memoryview(buffer)
+            readinto = getattr(source, 'readinto', None)
+
+            with open(temp_file, 'wb') as out:
+                while True:
+                    if readinto is not None:
+                        n = readinto(buffer)
+                        if not n:
+                            break
+                        chunk = view[:n]
+                    else:
+                        data = source.read(self.buffer_size)
+                        if not data:
+                            break
+                        chunk = data
+                        n = len(data)
+                    out.write(chunk)
+                    if verifier is not None:
+                        verifier.update(chunk)
+                    written += n
+
+            expected_size = file_info.get('file_size')
+            if expected_size is not None and written != expected_size:
+                raise ValueError(f"文件大小不匹配: 期望 {expected_size}, 实际 {written}")
+            if verifier is not None and not checksum_matches(expected_checksum, verifier):
+                raise ValueError("文件校验和不匹配")
+
+            os.replace(temp_file, target_file)
+            if mtime:
+                try:
+                    os.utime(target_file, (mtime, mtime))
+                except OSError:
+                    pass
+
+            result['restored_files'] += 1
+            result['restored_bytes'] += written
+            _add_progress(progress, 1, written)
+            logger.debug(f"[流式恢复] 文件恢复成功: {file_info.get('file_path')} -> {target_file}")
+
+        except Exception as e:
+            logger.error(f"[流式恢复] 恢复文件失败 {file_info.get('file_path')}: {str(e)}")
+            result['failed'].append(file_info)
+            try:
+                if temp_file.exists():
+                    temp_file.unlink()
+            except OSError:
+                pass
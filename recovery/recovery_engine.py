@@ -12,7 +12,8 @@ import zipfile
 import tarfile
 import asyncio
 import logging
-import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Callable
@@ -26,6 +27,12 @@ from tape.tape_manager import TapeManager
 from utils.dingtalk_notifier import DingTalkNotifier
 from utils.scheduler.db_utils import is_opengauss, get_opengauss_connection
 from utils.scheduler.sqlite_utils import get_sqlite_connection
+from recovery.restore_planner import ArchiveRead, CartridgeBatch, RestorePlan, RestorePlanner
+from recovery.restore_executor import (
+    ArchiveRestoreExecutor, TapeDriveScheduler, DEFAULT_DRIVE_QUANTUM_BYTES, default_extract_workers, staging_budget
+)
+from backup.zstd_seekable import SeekableZstdFile
+from backup.file_hasher import compute_checksum, parse_checksum
 from datetime import datetime, timedelta
 import json
 
@@ -36,6 +43,13 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# 保留最近结束的恢复任务状态（供状态接口查询）
+_FINISHED_RECOVERY_HISTORY = 100
+
+
+class BackupSetNotFoundError(LookupError):
+    """请求的备份集不存在"""
+
 
 class RecoveryEngine:
     """恢复引擎"""
@@ -45,7 +59,16 @@ class RecoveryEngine:
         self.tape_manager: Optional[TapeManager] = None
         self.dingtalk_notifier: Optional[DingTalkNotifier] = None
         self._initialized = False
-        self._current_recovery: Optional[Dict] = None
+        # 多个恢复任务可并发执行：磁带驱动器按字节配额轮转，解压写入共用线程池
+        self._recoveries: Dict[str, Dict] = {}
+        self._plans: Dict[str, RestorePlan] = {}
+        self._finished_recoveries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._drive_scheduler = TapeDriveScheduler(
+            getattr(self.settings, 'RECOVERY_DRIVE_QUANTUM_BYTES', DEFAULT_DRIVE_QUANTUM_BYTES)
+        )
+        self._extract_pool: Optional[ThreadPoolExecutor] = None
+        # 暂存字节上限由所有恢复任务共用（N 个任务不会各自暂存到上限）
+        self._staging_budget = staging_budget(self.settings)
         self._progress_callbacks: List[Callable] = []
 
     async def initialize(self):
@@ -339,9 +362,9 @@ class RecoveryEngine:
                     KEY_PREFIX_BACKUP_FILE, 
                     KEY_PREFIX_BACKUP_SET,
                     KEY_INDEX_BACKUP_FILE_BY_SET_ID,
-                    _get_redis_key,
-                    _parse_datetime_value
+                    _get_redis_key
                 )
+                from backup.file_listing import redis_file_to_dict
                 
                 redis = await get_redis_client()
                 
@@ -390,35 +413,7 @@ class RecoveryEngine:
                         if is_copy_success != '1':
                             continue
                         
-                        # 转换为字典（Redis客户端配置了decode_responses=True，键值都是字符串）
-                        file_dict = {k: v for k, v in file_data.items()}
-                        
-                        # 处理日期时间
-                        def _format_datetime(dt_str):
-                            if not dt_str:
-                                return None
-                            dt = _parse_datetime_value(dt_str)
-                            return dt.isoformat() if dt else None
-                        
-                        file_info = {
-                            'id': int(file_id) if file_id.isdigit() else file_id,
-                            'file_path': file_dict.get('file_path', ''),
-                            'file_name': file_dict.get('file_name', ''),
-                            'directory_path': file_dict.get('directory_path', ''),
-                            'display_name': file_dict.get('display_name', ''),
-                            'file_type': file_dict.get('file_type', 'file'),
-                            'file_size': int(file_dict.get('file_size', 0) or 0),
-                            'compressed_size': int(file_dict.get('compressed_size', 0) or 0),
-                            'file_permissions': file_dict.get('file_permissions', ''),
-                            'created_time': _format_datetime(file_dict.get('created_time')),
-                            'modified_time': _format_datetime(file_dict.get('modified_time')),
-                            'accessed_time': _format_datetime(file_dict.get('accessed_time')),
-                            'compressed': bool(int(file_dict.get('compressed', 0) or 0)),
-                            'checksum': file_dict.get('checksum'),
-                            'backup_time': _format_datetime(file_dict.get('backup_time')),
-                            'chunk_number': int(file_dict.get('chunk_number', 0) or 0)
-                        }
-                        files.append(file_info)
+                        files.append(redis_file_to_dict(file_id, file_data))
                 
                 # 按文件路径排序
                 files.sort(key=lambda x: x.get('file_path', ''))
@@ -466,27 +461,8 @@ class RecoveryEngine:
                         logger.error(f"[openGauss] 查询备份集文件列表失败: backup_set_id={backup_set_id}, backup_set_db_id={backup_set_db_id}, 表: {table_name}, 错误: {str(query_error)}", exc_info=True)
                         return []
 
-                    # 转换为字典格式
-                    for row in rows:
-                        file_info = {
-                            'id': row['id'],
-                            'file_path': row['file_path'],
-                            'file_name': row['file_name'],
-                            'directory_path': row['directory_path'],
-                            'display_name': row['display_name'],
-                            'file_type': row['file_type'].value if hasattr(row['file_type'], 'value') else str(row['file_type']),
-                            'file_size': row['file_size'] or 0,
-                            'compressed_size': row['compressed_size'] or 0,
-                            'file_permissions': row['file_permissions'],
-                            'created_time': row['created_time'].isoformat() if row['created_time'] and isinstance(row['created_time'], datetime) else (str(row['created_time']) if row['created_time'] else None),
-                            'modified_time': row['modified_time'].isoformat() if row['modified_time'] and isinstance(row['modified_time'], datetime) else (str(row['modified_time']) if row['modified_time'] else None),
-                            'accessed_time': row['accessed_time'].isoformat() if row['accessed_time'] and isinstance(row['accessed_time'], datetime) else (str(row['accessed_time']) if row['accessed_time'] else None),
-                            'compressed': row['compressed'] or False,
-                            'checksum': row['checksum'],
-                            'backup_time': row['backup_time'].isoformat() if row['backup_time'] and isinstance(row['backup_time'], datetime) else str(row['backup_time']),
-                            'chunk_number': row['chunk_number']
-                        }
-                        files.append(file_info)
+                    from backup.directory_tree_index import file_row_to_dict
+                    files = [file_row_to_dict(row) for row in rows]
             else:
                 # 使用原生SQL查询（SQLite）
                 async with get_sqlite_connection() as conn:
@@ -514,44 +490,8 @@ class RecoveryEngine:
                     """, (backup_set_db_id,))
                     rows = await cursor.fetchall()
                     
-                    # 转换为字典格式
-                    for row in rows:
-                        # 处理枚举值
-                        file_type_value = row[5]  # file_type
-                        if isinstance(file_type_value, str) and file_type_value.islower():
-                            try:
-                                from models.backup import BackupFileType
-                                file_type_enum = BackupFileType(file_type_value)
-                                file_type_value = file_type_enum.value
-                            except (ValueError, AttributeError):
-                                pass
-                        
-                        # 处理日期时间
-                        def _format_datetime(dt):
-                            if dt is None:
-                                return None
-                            if hasattr(dt, 'isoformat'):
-                                return dt.isoformat()
-                            return str(dt) if dt else None
-                        
-                        files.append({
-                            'id': row[0],  # id
-                            'file_path': row[1],  # file_path
-                            'file_name': row[2],  # file_name
-                            'directory_path': row[3],  # directory_path
-                            'display_name': row[4],  # display_name
-                            'file_type': file_type_value,
-                            'file_size': row[6] or 0,  # file_size
-                            'compressed_size': row[7] or 0,  # compressed_size
-                            'file_permissions': row[8],  # file_permissions
-                            'created_time': _format_datetime(row[9]),  # created_time
-                            'modified_time': _format_datetime(row[10]),  # modified_time
-                            'accessed_time': _format_datetime(row[11]),  # accessed_time
-                            'compressed': bool(row[12]) if row[12] is not None else False,  # compressed
-                            'checksum': row[13],  # checksum
-                            'backup_time': _format_datetime(row[14]),  # backup_time
-                            'chunk_number': row[15]  # chunk_number
-                        })
+                    from backup.file_listing import sqlite_file_row_to_dict
+                    files = [sqlite_file_row_to_dict(row) for row in rows]
 
             logger.info(f"查询到 {len(files)} 个文件 (备份集: {backup_set_id})")
             return files
@@ -562,6 +502,20 @@ class RecoveryEngine:
             logger.error(traceback.format_exc())
             return []
 
+    async def get_backup_set_files_page(self, backup_set_id: str, cursor: Optional[str] = None,
+                                        limit: Optional[int] = None) -> Optional[Dict]:
+        """键集分页获取备份集文件列表，参数与返回值见 backup.file_listing.list_backup_set_files_page
+
+        游标不合法时抛出 ValueError，备份集不存在时返回 None
+        """
+        from backup.file_listing import list_backup_set_files_page
+        return await list_backup_set_files_page(backup_set_id, cursor, limit)
+
+    def iter_backup_set_files(self, backup_set_id: str, cursor: Optional[str] = None):
+        """流式读取备份集文件列表（服务端游标），返回文件字典的异步迭代器"""
+        from backup.file_listing import iter_backup_set_files
+        return iter_backup_set_files(backup_set_id, cursor)
+
     async def get_top_level_directories(self, backup_set_id: str) -> List[Dict]:
         """获取备份集的顶层目录结构（只返回顶层目录和文件，不返回所有文件）
         
@@ -584,6 +538,12 @@ class RecoveryEngine:
             
             directories = {}
             files = []
+
+            if is_opengauss():
+                # 已物化目录树的备份集直接按根节点的子项查询
+                page = await self._browse_directory_tree(backup_set_id, "")
+                if page is not None:
+                    return page['items']
             
             if is_redis():
                 # Redis 版本：从Redis获取所有文件，在Python中解析顶层目录结构
@@ -1218,6 +1178,52 @@ class RecoveryEngine:
             logger.error(traceback.format_exc())
             return []
 
+    async def _browse_directory_tree(self, backup_set_id: str, directory_path: str,
+                                     offset: int = 0, limit: Optional[int] = None) -> Optional[Dict]:
+        """通过目录树索引分页查询目录内容（目录树未构建或查询失败时返回 None，由调用方回退原查询）"""
+        from backup.directory_tree_index import list_directory_page
+        try:
+            async with get_opengauss_connection() as conn:
+                backup_set_db_id = await conn.fetchval(
+                    "SELECT id FROM backup_sets WHERE set_id = $1",
+                    backup_set_id
+                )
+                if backup_set_db_id is None:
+                    return None
+                return await list_directory_page(conn, backup_set_db_id, directory_path, offset, limit)
+        except Exception as e:
+            logger.warning(f"[目录树索引] 查询目录内容失败，回退原查询: {str(e)}")
+            return None
+
+    async def browse_directory(self, backup_set_id: str, directory_path: str = "",
+                               offset: int = 0, limit: Optional[int] = None) -> Dict:
+        """分页浏览备份集目录（子目录在前，再列文件）
+        
+        openGauss 模式下已物化目录树的备份集只查询当前页；其他情况回退到
+        get_top_level_directories / get_directory_contents 后在内存中分页。
+        
+        Args:
+            backup_set_id: 备份集ID
+            directory_path: 目录路径，空字符串表示顶层
+            offset: 跳过的条目数
+            limit: 本页最多条目数，None 表示不限
+            
+        Returns:
+            {'items': 条目列表, 'total': 目录下条目总数, 'offset': offset, 'limit': limit}
+        """
+        offset = max(0, int(offset or 0))
+        if is_opengauss():
+            page = await self._browse_directory_tree(backup_set_id, directory_path or "", offset, limit)
+            if page is not None:
+                return page
+
+        if (directory_path or "").strip('/').strip('\\'):
+            items = await self.get_directory_contents(backup_set_id, directory_path)
+        else:
+            items = await self.get_top_level_directories(backup_set_id)
+        page_items = items[offset:] if limit is None else items[offset:offset + max(0, int(limit))]
+        return {'items': page_items, 'total': len(items), 'offset': offset, 'limit': limit}
+
     async def get_directory_contents(self, backup_set_id: str, directory_path: str) -> List[Dict]:
         """获取指定目录下的文件和子目录列表
         
@@ -1242,6 +1248,12 @@ class RecoveryEngine:
             
             directories = {}
             files = []
+
+            if is_opengauss():
+                # 已物化目录树的备份集直接按目录节点的子项查询
+                page = await self._browse_directory_tree(backup_set_id, directory_path)
+                if page is not None:
+                    return page['items']
             
             if is_redis():
                 # Redis 版本：从Redis获取所有文件，在Python中过滤指定目录的内容
@@ -1736,31 +1748,47 @@ class RecoveryEngine:
             return []
 
     async def search_files(self, backup_set_id: str, search_term: str,
-                         file_type: str = None) -> List[Dict]:
-        """搜索文件"""
+                         file_type: str = None, mode: str = "auto", field: str = "path",
+                         offset: int = 0, limit: int = 1000) -> List[Dict]:
+        """搜索文件（走文件名搜索索引，分页返回）
+        
+        Args:
+            backup_set_id: 备份集ID
+            search_term: 搜索词（mode 为 auto 时："*.pdf" 扩展名、"report*" 前缀、其他子串）
+            file_type: 文件类型过滤
+            mode: auto / prefix / substring / extension
+            field: name（文件名）或 path（完整路径，默认，与原来同时匹配文件名和路径的结果一致）
+            offset / limit: 分页
+        """
         try:
-            all_files = await self.get_backup_set_files(backup_set_id)
-            filtered_files = []
-
-            search_term_lower = search_term.lower()
-
-            for file_info in all_files:
-                # 搜索文件名或路径
-                if (search_term_lower in file_info['file_name'].lower() or
-                    search_term_lower in file_info['file_path'].lower()):
-
-                    # 文件类型过滤
-                    if file_type and file_info['file_type'] != file_type:
-                        continue
-
-                    filtered_files.append(file_info)
-
-            return filtered_files
+            from backup.file_search_index import search_backup_files
+            result = await search_backup_files(
+                search_term, mode=mode, field=field, set_ids=[backup_set_id],
+                file_type=file_type, offset=offset, limit=limit,
+            )
+            return result['items']
 
         except Exception as e:
             logger.error(f"搜索文件失败: {str(e)}")
             return []
 
+    async def search_files_across_sets(self, search_term: str, mode: str = "auto", field: str = "name",
+                                       set_ids: Optional[List[str]] = None,
+                                       backup_group_from: Optional[str] = None,
+                                       backup_group_to: Optional[str] = None,
+                                       file_type: Optional[str] = None, offset: int = 0, limit: int = 100,
+                                       group_by_set: bool = False) -> Dict:
+        """跨备份集搜索文件，参数与返回值见 backup.file_search_index.search_backup_files
+        
+        搜索词或参数不合法时抛出 ValueError
+        """
+        from backup.file_search_index import search_backup_files
+        return await search_backup_files(
+            search_term, mode=mode, field=field, set_ids=set_ids,
+            backup_group_from=backup_group_from, backup_group_to=backup_group_to,
+            file_type=file_type, offset=offset, limit=limit, group_by_set=group_by_set,
+        )
+
     async def create_recovery_task(self, backup_set_id: str, files: List[Dict],
                                  target_path: str, **kwargs) -> Optional[str]:
         """创建恢复任务"""
@@ -1768,12 +1796,22 @@ class RecoveryEngine:
             if not backup_set_id or not files or not target_path:
                 raise ValueError("备份集ID、文件列表和目标路径不能为空")
 
+            # 目录项展开为目录（含子目录）下的文件
+            files = await self._expand_directory_requests(backup_set_id, files)
+            if not files:
+                raise ValueError("所选目录中没有可恢复的文件")
+
             # 验证目标路径
             target_dir = Path(target_path)
             target_dir.mkdir(parents=True, exist_ok=True)
 
-            # 生成恢复任务ID
-            recovery_id = f"recovery_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            # 生成恢复任务ID（同一秒内创建多个恢复任务时追加序号）
+            base_id = f"recovery_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            recovery_id = base_id
+            suffix = 1
+            while recovery_id in self._recoveries or recovery_id in self._finished_recoveries:
+                suffix += 1
+                recovery_id = f"{base_id}_{suffix}"
 
             # 创建恢复任务信息
             recovery_info = {
@@ -1791,10 +1829,22 @@ class RecoveryEngine:
                 'total_bytes': sum(f.get('file_size', 0) for f in files),
                 'processed_bytes': 0,
                 'error_message': None,
+                'failed_files': [],
                 'created_by': kwargs.get('created_by', 'system')
             }
 
-            self._current_recovery = recovery_info
+            self._recoveries[recovery_id] = recovery_info
+
+            # 执行前生成恢复计划（按磁带分批、盘内按物理位置排序），通过状态接口可见
+            if getattr(self.settings, 'RECOVERY_STREAM_BY_ARCHIVE', True) and getattr(self.settings, 'RECOVERY_PLAN_ENABLED', True):
+                try:
+                    backup_set_info = await self._get_backup_set_info(backup_set_id)
+                    if backup_set_info:
+                        plan = await self._build_restore_plan(backup_set_info, files)
+                        self._plans[recovery_id] = plan
+                        recovery_info['plan'] = plan.to_dict()
+                except Exception as plan_error:
+                    logger.warning(f"[恢复计划] 生成恢复计划失败，执行时重新生成: {str(plan_error)}")
 
             logger.info(f"创建恢复任务成功: {recovery_id}")
             return recovery_id
@@ -1809,10 +1859,13 @@ class RecoveryEngine:
             if not self._initialized:
                 raise RuntimeError("恢复引擎未初始化")
 
-            if not self._current_recovery or self._current_recovery['recovery_id'] != recovery_id:
+            recovery_info = self._recoveries.get(recovery_id)
+            if not recovery_info:
                 raise RuntimeError("恢复任务不存在")
+            if recovery_info['status'] == 'cancelled':
+                logger.info(f"恢复任务已在执行前取消: {recovery_id}")
+                return False
 
-            recovery_info = self._current_recovery
             logger.info(f"开始执行恢复任务: {recovery_id}")
 
             # 更新状态
@@ -1831,7 +1884,22 @@ class RecoveryEngine:
 
             # 更新完成状态
             recovery_info['completed_at'] = datetime.now()
-            if success:
+            failed_files = recovery_info['failed_files']
+            if failed_files and not recovery_info['error_message']:
+                recovery_info['error_message'] = f"{len(failed_files)} 个文件恢复失败: " + ", ".join(failed_files[:10])
+            if recovery_info['status'] == 'cancelled':
+                logger.info(f"恢复任务已取消: {recovery_id}")
+            elif success and failed_files:
+                # 部分文件恢复失败（读取/校验失败），任务标记为部分失败
+                success = False
+                recovery_info['status'] = 'partial_failed'
+                if self.dingtalk_notifier:
+                    await self.dingtalk_notifier.send_recovery_notification(
+                        recovery_id,
+                        "failed",
+                        {'error': recovery_info['error_message']}
+                    )
+            elif success:
                 recovery_info['status'] = 'completed'
                 if self.dingtalk_notifier:
                     await self.dingtalk_notifier.send_recovery_notification(
@@ -1857,12 +1925,19 @@ class RecoveryEngine:
 
         except Exception as e:
             logger.error(f"执行恢复任务失败: {str(e)}")
-            if self._current_recovery:
-                self._current_recovery['error_message'] = str(e)
-                self._current_recovery['status'] = 'failed'
+            recovery_info = self._recoveries.get(recovery_id)
+            if recovery_info:
+                recovery_info['error_message'] = str(e)
+                recovery_info['status'] = 'failed'
             return False
         finally:
-            self._current_recovery = None
+            self._plans.pop(recovery_id, None)
+            self._drive_scheduler.leave(recovery_id)
+            recovery_info = self._recoveries.pop(recovery_id, None)
+            if recovery_info:
+                self._finished_recoveries[recovery_id] = recovery_info
+                while len(self._finished_recoveries) > _FINISHED_RECOVERY_HISTORY:
+                    self._finished_recoveries.popitem(last=False)
 
     async def _perform_recovery(self, recovery_info: Dict) -> bool:
         """执行恢复流程"""
@@ -1876,59 +1951,81 @@ class RecoveryEngine:
             if not backup_set_info:
                 raise RuntimeError(f"备份集不存在: {backup_set_id}")
 
-            # 2. 获取磁带信息
-            tape_id = backup_set_info['tape_id']
-            logger.info(f"需要加载磁带: {tape_id}")
-
-            # 3. 加载磁带
-            if not await self.tape_manager.load_tape(tape_id):
-                raise RuntimeError(f"加载磁带失败: {tape_id}")
-
-            # 4. 读取并恢复文件
+            # 2. 读取并恢复文件
             processed_files = 0
             processed_bytes = 0
+            set_tape_id = backup_set_info['tape_id']
+            stream_by_archive = getattr(self.settings, 'RECOVERY_STREAM_BY_ARCHIVE', True)
+
+            # 2.1 按恢复计划流式恢复：每盘磁带加载一次，盘内按物理位置顺序读取压缩包，解压写入交给线程池并行执行
+            if stream_by_archive:
+                plan = self._plans.get(recovery_info['recovery_id'])
+                if plan is None:
+                    plan = await self._build_restore_plan(backup_set_info, files)
+                    recovery_info['plan'] = plan.to_dict()
+                files = await self._restore_files_by_archive(recovery_info, plan, target_path)
+                processed_files = recovery_info['processed_files']
+                processed_bytes = recovery_info['processed_bytes']
+
+            # 2.2 无法定位压缩包的文件走逐文件恢复流程（需要备份集所在磁带，占用驱动器直到处理完）
+            if files or not stream_by_archive:
+                async with self._drive_scheduler.turn(recovery_info['recovery_id']) as turn:
+                    logger.info(f"需要加载磁带: {set_tape_id}")
+                    if not await self._ensure_tape_loaded(set_tape_id):
+                        raise RuntimeError(f"加载磁带失败: {set_tape_id}")
+
+                    for file_info in files:
+                        if recovery_info.get('status') == 'cancelled':
+                            break
+                        try:
+                            # 读取文件数据
+                            file_data = await self._read_file_from_tape(file_info)
+                            if not file_data:
+                                logger.warning(f"无法读取文件: {file_info['file_path']}")
+                                recovery_info['failed_files'].append(file_info['file_path'])
+                                continue
+                            turn.read_bytes += len(file_data)
 
-            for file_info in files:
-                try:
-                    # 读取文件数据
-                    file_data = await self._read_file_from_tape(file_info)
-                    if not file_data:
-                        logger.warning(f"无法读取文件: {file_info['file_path']}")
-                        continue
-
-                    # 解压文件（如果需要）
-                    if file_info.get('compressed_size', 0) > 0:
-                        file_data = await self._decompress_file_data(file_data, file_info)
+                            # 解压文件（如果需要）
+                            if file_info.get('compressed_size', 0) > 0:
+                                file_data = await self._decompress_file_data(file_data, file_info)
 
-                    # 写入目标位置
-                    target_file_path = target_path / Path(file_info['file_path']).name
-                    target_file_path.parent.mkdir(parents=True, exist_ok=True)
+                            # 写入目标位置
+                            target_file_path = target_path / Path(file_info['file_path']).name
+                            target_file_path.parent.mkdir(parents=True, exist_ok=True)
 
-                    with open(target_file_path, 'wb') as f:
-                        f.write(file_data)
+                            with open(target_file_path, 'wb') as f:
+                                f.write(file_data)
 
-                    # 验证文件完整性
-                    if await self._verify_file_integrity(target_file_path, file_info):
-                        processed_files += 1
-                        processed_bytes += len(file_data)
-                        logger.info(f"文件恢复成功: {file_info['file_path']}")
-                    else:
-                        logger.error(f"文件完整性验证失败: {file_info['file_path']}")
+                            # 验证文件完整性
+                            if await self._verify_file_integrity(target_file_path, file_info):
+                                processed_files += 1
+                                processed_bytes += len(file_data)
+                                logger.info(f"文件恢复成功: {file_info['file_path']}")
+                            else:
+                                logger.error(f"文件完整性验证失败: {file_info['file_path']}")
+                                recovery_info['failed_files'].append(file_info['file_path'])
 
-                    # 更新进度
-                    recovery_info['processed_files'] = processed_files
-                    recovery_info['processed_bytes'] = processed_bytes
-                    recovery_info['progress_percent'] = (processed_files / recovery_info['total_files']) * 100
+                            # 更新进度
+                            recovery_info['processed_files'] = processed_files
+                            recovery_info['processed_bytes'] = processed_bytes
+                            recovery_info['progress_percent'] = (processed_files / recovery_info['total_files']) * 100
 
-                    # 通知进度更新
-                    await self._notify_progress(recovery_info)
+                            # 通知进度更新
+                            await self._notify_progress(recovery_info)
 
-                except Exception as e:
-                    logger.error(f"恢复文件失败 {file_info['file_path']}: {str(e)}")
-                    continue
+                        except Exception as e:
+                            logger.error(f"恢复文件失败 {file_info['file_path']}: {str(e)}")
+                            recovery_info['failed_files'].append(file_info['file_path'])
+                            continue
 
-            # 5. 卸载磁带
-            await self.tape_manager.unload_tape()
+            # 3. 卸载磁带（其他恢复任务仍在使用驱动器时保持加载，由最后结束的任务卸载）
+            other_running = any(
+                other_id != recovery_info['recovery_id'] and other['status'] == 'running'
+                for other_id, other in self._recoveries.items()
+            )
+            if not other_running:
+                await self.tape_manager.unload_tape()
 
             return processed_files > 0
 
@@ -1937,6 +2034,331 @@ class RecoveryEngine:
             recovery_info['error_message'] = str(e)
             return False
 
+    async def _build_restore_plan(self, backup_set_info: Dict, files: List[Dict]) -> RestorePlan:
+        """生成恢复计划（补充压缩包信息，读取当前已加载磁带的 LTFS 位置和磁头位置）"""
+        files = await self._attach_archive_metadata(backup_set_info, files)
+        current_tape = getattr(self.tape_manager, 'current_tape', None)
+        mounted_tape_id = current_tape.tape_id if current_tape else None
+        head_block = await self._tape_head_block() if mounted_tape_id else None
+        planner = RestorePlanner(self.settings)
+        plan = await asyncio.to_thread(planner.plan, files, backup_set_info, mounted_tape_id, head_block)
+        summary = plan.to_dict()
+        logger.info(
+            f"[恢复计划] {summary['planned_files']} 个文件分布在 {summary['tape_loads']} 次换盘、"
+            f"{summary['archive_count']} 个压缩包中，定位 {summary['locates']} 次，"
+            f"预计 {summary['estimated_seconds']:.0f} 秒（按请求顺序约 {summary['request_order_seconds']:.0f} 秒）"
+        )
+        return plan
+
+    async def plan_recovery(self, backup_set_id: str, files: List[Dict]) -> Dict:
+        """只生成恢复计划不执行（预览磁带加载顺序、压缩包读取顺序和估算时间）
+
+        备份集不存在时抛出 BackupSetNotFoundError
+        """
+        backup_set_info = await self._get_backup_set_info(backup_set_id)
+        if not backup_set_info:
+            raise BackupSetNotFoundError(f"备份集不存在: {backup_set_id}")
+        files = await self._expand_directory_requests(backup_set_id, files, backup_set_info)
+        plan = await self._build_restore_plan(backup_set_info, files)
+        return plan.to_dict()
+
+    async def _expand_directory_requests(self, backup_set_id: str, files: List[Dict],
+                                         backup_set_info: Optional[Dict] = None) -> List[Dict]:
+        """把待恢复列表中的目录项（type == 'directory'，路径取 directory_path / file_path）展开为其中的文件
+
+        openGauss 通过目录→压缩包映射只查询相关压缩包中的文件记录；其他数据库按目录前缀过滤备份集文件列表。
+        已在列表中的文件不重复添加。
+        """
+        directories = []
+        expanded = []
+        for file_info in files:
+            if file_info.get('type') == 'directory':
+                directory_path = (file_info.get('directory_path') or file_info.get('file_path') or '').rstrip('/\\')
+                if directory_path:
+                    directories.append(directory_path)
+            else:
+                expanded.append(file_info)
+        if not directories:
+            return files
+
+        seen = {f.get('file_path') for f in expanded}
+
+        def add(file_info: Dict):
+            if file_info.get('file_path') not in seen:
+                seen.add(file_info.get('file_path'))
+                expanded.append(file_info)
+
+        if is_opengauss():
+            backup_set_info = backup_set_info or await self._get_backup_set_info(backup_set_id)
+            if not backup_set_info:
+                raise BackupSetNotFoundError(f"备份集不存在: {backup_set_id}")
+            from backup.directory_archive_map import find_directory_files
+            from backup.directory_tree_index import file_row_to_dict
+            from utils.scheduler.db_utils import get_backup_files_table_by_set_id
+            async with get_opengauss_connection() as conn:
+                table_name = await get_backup_files_table_by_set_id(conn, backup_set_info['id'])
+                for directory_path in directories:
+                    for row in await find_directory_files(conn, table_name, backup_set_info['id'], directory_path):
+                        file_info = file_row_to_dict(row)
+                        file_info['file_metadata'] = row['file_metadata']
+                        add(file_info)
+        else:
+            prefixes = [(d, d + '/', d + '\\') for d in directories]
+            for file_info in await self.get_backup_set_files(backup_set_id):
+                directory_path = file_info.get('directory_path') or ''
+                if any(directory_path == d or directory_path.startswith(p1) or directory_path.startswith(p2)
+                       for d, p1, p2 in prefixes):
+                    add(file_info)
+
+        logger.info(f"[目录恢复] {len(directories)} 个目录展开后共 {len(expanded)} 个待恢复文件")
+        return expanded
+
+    async def _tape_head_block(self) -> Optional[int]:
+        """当前磁头位置（块号），驱动器不支持查询时返回 None"""
+        tape_operations = getattr(self.tape_manager, 'tape_operations', None)
+        if tape_operations is None:
+            return None
+        return await tape_operations.get_tape_position()
+
+    async def _ensure_tape_loaded(self, tape_id: str) -> bool:
+        """确保指定磁带已加载（已加载时不重复加载，加载其他磁带前先卸载当前磁带）"""
+        current_tape = getattr(self.tape_manager, 'current_tape', None)
+        if current_tape is not None and current_tape.tape_id == tape_id:
+            return True
+        if current_tape is not None:
+            await self.tape_manager.unload_tape()
+        return await self.tape_manager.load_tape(tape_id)
+
+    def _get_extract_pool(self) -> ThreadPoolExecutor:
+        """解压写入线程池（所有恢复任务共用，首次使用时创建）"""
+        if self._extract_pool is None:
+            workers = default_extract_workers(self.settings)
+            self._extract_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="restore-extract")
+            logger.info(f"[并行恢复] 解压线程池已创建: {workers} 个线程")
+        return self._extract_pool
+
+    async def _restore_files_by_archive(self, recovery_info: Dict, plan: RestorePlan,
+                                        target_path: Path) -> List[Dict]:
+        """按恢复计划流式恢复文件：逐盘加载磁带（每盘只加载一次），盘内按物理位置顺序读取压缩包
+
+        磁带上的压缩包顺序暂存到磁盘后立即读取下一个，解压写入在线程池中并行执行；
+        已在磁盘上的压缩包不占用驱动器，直接并行解压。
+
+        Returns:
+            List[Dict]: 未能通过压缩包恢复、需要回退到逐文件恢复的文件
+        """
+        remaining = list(plan.loose_files)
+        if not plan.batches:
+            return remaining
+
+        recovery_id = recovery_info['recovery_id']
+        planner = RestorePlanner(self.settings)
+        restorer = planner.restorer
+        executor = ArchiveRestoreExecutor(
+            recovery_id, self.settings, restorer, self._get_extract_pool(), self._drive_scheduler,
+            budget=self._staging_budget
+        )
+
+        async def finish(archive_hint: str, archive_path: Path, group: List[Dict],
+                         result: Optional[Dict], error: Optional[BaseException]):
+            await self._finish_archive_group(archive_hint, archive_path, group, result, error,
+                                             recovery_info, remaining)
+
+        try:
+            for batch in plan.batches:
+                if recovery_info.get('status') == 'cancelled':
+                    break
+
+                # 1. 已在磁盘上的压缩包（缓存/暂存副本）直接提交解压，不占用驱动器
+                tape_reads = []
+                for read in batch.reads:
+                    archive_path = await asyncio.to_thread(restorer.resolve_archive_path, read.archive_hint, read.set_id)
+                    if archive_path and (batch.tape_id is None or not executor.is_on_tape(archive_path)):
+                        executor.submit(read.archive_hint, archive_path, read.files, target_path, recovery_info, finish)
+                    elif batch.tape_id is None:
+                        logger.warning(f"[流式恢复] 找不到压缩包，回退到逐文件恢复: {read.archive_hint}")
+                        remaining.extend(read.files)
+                    else:
+                        tape_reads.append(read)
+                if not tape_reads:
+                    continue
+
+                # 2. 磁带上的压缩包：加载磁带后读取 LTFS 物理位置重新排序，再按顺序逐个读取
+                tape_batch = CartridgeBatch(tape_id=batch.tape_id, reads=tape_reads, load_required=batch.load_required)
+                async with self._drive_scheduler.turn(recovery_id):
+                    if tape_batch.load_required:
+                        logger.info(
+                            f"[流式恢复] 加载磁带 {tape_batch.tape_id}：{tape_batch.file_count} 个文件，"
+                            f"{len(tape_reads)} 个压缩包"
+                        )
+                    loaded = await self._ensure_tape_loaded(tape_batch.tape_id)
+                    if loaded and tape_batch.load_required:
+                        head_block = await self._tape_head_block()
+                        await asyncio.to_thread(planner.refine_positions, tape_batch, head_block)
+                if not loaded:
+                    logger.error(f"[流式恢复] 加载磁带失败，该磁带上的文件无法恢复: {tape_batch.tape_id}")
+                    for read in tape_reads:
+                        remaining.extend(read.files)
+                    continue
+
+                for read in tape_batch.reads:
+                    if recovery_info.get('status') == 'cancelled':
+                        logger.info("[流式恢复] 恢复任务已取消，停止处理剩余压缩包")
+                        break
+                    await self._read_archive_from_tape(executor, tape_batch.tape_id, read, target_path,
+                                                       recovery_info, remaining, finish)
+
+            # 等待已提交的解压完成
+            await executor.drain()
+        finally:
+            await asyncio.to_thread(executor.cleanup)
+
+        if recovery_info.get('status') == 'cancelled':
+            return []
+        return remaining
+
+    async def _read_archive_from_tape(self, executor: ArchiveRestoreExecutor, tape_id: str, read: ArchiveRead,
+                                      target_path: Path, recovery_info: Dict, remaining: List[Dict],
+                                      finish: Callable):
+        """从磁带读取一个压缩包：整体暂存后交给线程池解压，不适合暂存时占用驱动器直接解压"""
+        recovery_id = recovery_info['recovery_id']
+        # 暂存空间不足时先等待（不占用驱动器，其他恢复任务可以使用）
+        reserved = read.archive_bytes if executor.can_stage(read.archive_bytes) else 0
+        if reserved:
+            await executor.budget.acquire(reserved)
+
+        staged_path = None
+        async with self._drive_scheduler.turn(recovery_id) as turn:
+            archive_path = None
+            if await self._ensure_tape_loaded(tape_id):
+                archive_path = await asyncio.to_thread(
+                    executor.restorer.resolve_archive_path, read.archive_hint, read.set_id
+                )
+            if not archive_path:
+                if reserved:
+                    await executor.budget.release(reserved)
+                logger.warning(f"[流式恢复] 找不到压缩包，回退到逐文件恢复: {read.archive_hint}")
+                remaining.extend(read.files)
+                return
+
+            if reserved and executor.should_stage(archive_path, read.files, read.archive_bytes):
+                try:
+                    staged_path = await asyncio.to_thread(executor.stage, archive_path)
+                    turn.read_bytes += read.archive_bytes
+                except Exception as e:
+                    logger.warning(f"[并行恢复] 暂存压缩包失败，直接从磁带读取 {archive_path.name}: {str(e)}")
+            if staged_path is None:
+                if reserved:
+                    await executor.budget.release(reserved)
+                    reserved = 0
+                # 直接从磁带解压（按成员索引定位读取或暂存失败），读取完成前占用驱动器
+                result = error = None
+                try:
+                    result = await executor.extract(archive_path, read.files, target_path, recovery_info)
+                except Exception as e:
+                    error = e
+                turn.read_bytes += read.archive_bytes
+
+        if staged_path is None:
+            await finish(read.archive_hint, archive_path, read.files, result, error)
+            return
+        logger.debug(f"[并行恢复] 压缩包已暂存: {archive_path.name} -> {staged_path}")
+        executor.submit(read.archive_hint, staged_path, read.files, target_path, recovery_info, finish,
+                        staged=True, reserved_bytes=reserved)
+
+    async def _finish_archive_group(self, archive_hint: str, archive_path: Path, group: List[Dict],
+                                    result: Optional[Dict], error: Optional[BaseException],
+                                    recovery_info: Dict, remaining: List[Dict]):
+        """处理一个压缩包的恢复结果，未能恢复的文件追加到 remaining"""
+        if error is not None:
+            logger.error(f"[流式恢复] 读取压缩包失败 {archive_hint}: {str(error)}", exc_info=error)
+            remaining.extend(group)
+            return
+
+        if result['missing']:
+            logger.warning(f"[流式恢复] 压缩包 {archive_path.name} 中未找到 {len(result['missing'])} 个文件")
+            remaining.extend(result['missing'])
+        if result['failed']:
+            # 读取或校验失败的文件不回退到逐文件恢复（同一压缩包再读一次结果相同），记入任务状态
+            logger.error(f"[流式恢复] 压缩包 {archive_path.name} 中 {len(result['failed'])} 个文件恢复失败")
+            recovery_info['failed_files'].extend(f.get('file_path') or '' for f in result['failed'])
+
+        logger.info(
+            f"[流式恢复] 压缩包 {archive_path.name} 处理完成: 恢复 {result['restored_files']} 个文件, "
+            f"{self._format_bytes(result['restored_bytes'])}"
+        )
+        recovery_info['progress_percent'] = (recovery_info['processed_files'] / (recovery_info['total_files'] or 1)) * 100
+        await self._notify_progress(recovery_info)
+
+    async def _attach_archive_metadata(self, backup_set_info: Dict, files: List[Dict]) -> List[Dict]:
+        """为缺少 file_metadata 的待恢复文件补充压缩包信息（tape_file_path / original_path）"""
+        missing_paths = [f['file_path'] for f in files if f.get('file_path') and not f.get('file_metadata')]
+        if not missing_paths:
+            return files
+
+        metadata_map: Dict[str, Any] = {}
+        batch_size = 1000
+        try:
+            from utils.scheduler.db_utils import is_redis
+            if is_redis():
+                from config.redis_db import get_redis_client
+                from backup.redis_backup_db import KEY_PREFIX_BACKUP_FILE, _get_redis_key
+                redis = await get_redis_client()
+                id_files = [f for f in files if f.get('id') is not None and not f.get('file_metadata')]
+                for i in range(0, len(id_files), batch_size):
+                    batch = id_files[i:i + batch_size]
+                    pipe = redis.pipeline()
+                    for file_info in batch:
+                        pipe.hget(_get_redis_key(KEY_PREFIX_BACKUP_FILE, file_info['id']), 'file_metadata')
+                    for file_info, metadata in zip(batch, await pipe.execute()):
+                        if metadata:
+                            metadata_map[file_info['file_path']] = metadata
+            elif is_opengauss():
+                async with get_opengauss_connection() as conn:
+                    from utils.scheduler.db_utils import get_backup_files_table_by_set_id
+                    table_name = await get_backup_files_table_by_set_id(conn, backup_set_info['id'])
+                    for i in range(0, len(missing_paths), batch_size):
+                        rows = await conn.fetch(
+                            f"""
+                            SELECT file_path, file_metadata
+                            FROM {table_name}
+                            WHERE backup_set_id = $1 AND file_path = ANY($2)
+                            """,
+                            backup_set_info['id'],
+                            missing_paths[i:i + batch_size]
+                        )
+                        for row in rows:
+                            if row['file_metadata']:
+                                metadata_map[row['file_path']] = row['file_metadata']
+            else:
+                async with get_sqlite_connection() as conn:
+                    for i in range(0, len(missing_paths), batch_size):
+                        batch = missing_paths[i:i + batch_size]
+                        placeholders = ','.join('?' * len(batch))
+                        cursor = await conn.execute(
+                            f"""
+                            SELECT file_path, file_metadata
+                            FROM backup_files
+                            WHERE backup_set_id = ? AND file_path IN ({placeholders})
+                            """,
+                            (backup_set_info['id'], *batch)
+                        )
+                        for row in await cursor.fetchall():
+                            if row[1]:
+                                metadata_map[row[0]] = row[1]
+        except Exception as e:
+            logger.warning(f"[流式恢复] 查询文件压缩包信息失败，回退到逐文件恢复: {str(e)}")
+            return files
+
+        enriched = []
+        for file_info in files:
+            metadata = metadata_map.get(file_info.get('file_path'))
+            if metadata and not file_info.get('file_metadata'):
+                file_info = dict(file_info)
+                file_info['file_metadata'] = metadata
+            enriched.append(file_info)
+        return enriched
+
     async def _get_backup_set_info(self, backup_set_id: str) -> Optional[Dict]:
         """获取备份集信息（从数据库查询真实数据）"""
         try:
@@ -2051,6 +2473,12 @@ class RecoveryEngine:
             return None
 
     async def _decompress_file_data(self, compressed_data: bytes, file_info: Dict) -> bytes:
+        """根据文件后缀自动选择解压方式（在线程中解压，不阻塞事件循环）"""
+        if not compressed_data:
+            return compressed_data
+        return await asyncio.to_thread(self._decompress_file_data_sync, compressed_data, file_info)
+
+    def _decompress_file_data_sync(self, compressed_data: bytes, file_info: Dict) -> bytes:
         """根据文件后缀自动选择解压方式"""
         if not compressed_data:
             return compressed_data
@@ -2115,6 +2543,27 @@ class RecoveryEngine:
             logger.warning("无法解压 .tar.zst 文件，因为未安装 zstandard 库")
             return compressed_data
         try:
+            # 可随机访问的多帧 zstd：按 seek table 只解压用到的帧
+            seekable_file = SeekableZstdFile.open(io.BytesIO(compressed_data))
+            if seekable_file is not None:
+                with seekable_file:
+                    with tarfile.open(fileobj=seekable_file, mode='r:') as tar:
+                        # 找到目标成员即停止，不再解压后续帧（找不到时与 _select_archive_entry 一致取第一个）
+                        normalized_target = (target_name or '').replace('\\', '/').lower()
+                        selected = None
+                        for member in tar:
+                            if not member.isfile():
+                                continue
+                            if selected is None:
+                                selected = member
+                            normalized = member.name.replace('\\', '/').lower()
+                            if normalized_target and (normalized == normalized_target
+                                                      or normalized.endswith('/' + normalized_target)):
+                                selected = member
+                                break
+                        extracted = tar.extractfile(selected) if selected else None
+                        return extracted.read() if extracted else compressed_data
+
             decompressed = self._decompress_zstd_blob(compressed_data)
             return self._extract_from_tar_archive(decompressed, target_name, mode='r:')
         except Exception as e:
@@ -2170,8 +2619,8 @@ class RecoveryEngine:
 
             # 检查校验和
             if file_info.get('checksum'):
-                actual_checksum = self._calculate_file_checksum(file_path)
-                if actual_checksum != file_info['checksum']:
+                actual_checksum = self._calculate_file_checksum(file_path, file_info['checksum'])
+                if actual_checksum is not None and parse_checksum(actual_checksum) != parse_checksum(file_info['checksum']):
                     logger.warning(f"文件校验和不匹配: {file_path}")
                     return False
 
@@ -2181,13 +2630,9 @@ class RecoveryEngine:
             logger.error(f"验证文件完整性失败: {str(e)}")
             return False
 
-    def _calculate_file_checksum(self, file_path: Path) -> str:
-        """计算文件校验和"""
-        sha256_hash = hashlib.sha256()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
+    def _calculate_file_checksum(self, file_path: Path, expected_checksum: Optional[str] = None) -> Optional[str]:
+        """计算文件校验和（算法与备份时记录的一致，本机缺少对应算法库时返回 None）"""
+        return compute_checksum(file_path, expected_checksum=expected_checksum)
 
     async def _notify_progress(self, recovery_info: Dict):
         """通知进度更新"""
@@ -2211,8 +2656,9 @@ class RecoveryEngine:
     async def get_recovery_status(self, recovery_id: str) -> Optional[Dict]:
         """获取恢复状态"""
         try:
-            if self._current_recovery and self._current_recovery['recovery_id'] == recovery_id:
-                recovery_info = self._current_recovery.copy()
+            recovery_info = self._recoveries.get(recovery_id) or self._finished_recoveries.get(recovery_id)
+            if recovery_info:
+                recovery_info = recovery_info.copy()
                 # 转换datetime对象为字符串
                 for key in ['created_at', 'started_at', 'completed_at']:
                     if recovery_info.get(key):
@@ -2226,9 +2672,10 @@ class RecoveryEngine:
     async def cancel_recovery(self, recovery_id: str) -> bool:
         """取消恢复任务"""
         try:
-            if self._current_recovery and self._current_recovery['recovery_id'] == recovery_id:
-                self._current_recovery['status'] = 'cancelled'
-                self._current_recovery = None
+            recovery_info = self._recoveries.get(recovery_id)
+            if recovery_info and recovery_info['status'] in ('pending', 'running'):
+                # 执行中的任务在处理下一个压缩包/文件前检查状态并停止
+                recovery_info['status'] = 'cancelled'
                 logger.info(f"恢复任务已取消: {recovery_id}")
                 return True
             return False
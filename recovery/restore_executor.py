@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并行恢复执行模块
+Parallel Restore Executor Module
+
+按压缩包分组后恢复仍是单线程：读磁带、解压、写文件串行执行，解压慢的格式（7z / 高压缩级别）
+跑不满磁带读取速度，且同一时间只能执行一个恢复任务。本模块把恢复拆成两段流水线：
+1. 读磁带：驱动器只有一个，仍按恢复计划的物理顺序顺序读取。压缩包先整体复制到暂存目录
+   （磁带顺序读取，速度最快），复制完立即读取下一个；所有恢复任务暂存中、尚未解压完的字节数
+   共用一个上限，超过时读取方等待；暂存目录所在磁盘剩余空间不足时不暂存，直接从磁带解压
+2. 解压写入：暂存副本交给共享线程池解压、写文件、校验，完成后删除暂存副本。
+   已经在磁盘上的压缩包（LTFS 之外的缓存/暂存副本）不占用驱动器，直接并行解压
+
+多个恢复任务可以同时执行：驱动器按字节配额在任务间轮转（TapeDriveScheduler），
+一个任务用满配额且有其他任务等待时让出驱动器，换盘由拿到驱动器的任务自行完成。
+
+使用线程池而不是进程池：gzip / zstd / lzma 解压和文件读写都会释放 GIL，
+且解压线程需要直接累加恢复任务的共享进度字典。
+"""
+
+import os
+import asyncio
+import logging
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from backup.archive_index import get_archive_index_path
+from recovery.archive_restore import ArchiveStreamRestorer, estimate_read_bytes
+
+logger = logging.getLogger(__name__)
+
+# 默认暂存上限与驱动器轮转配额（32GB）
+DEFAULT_STAGING_MAX_BYTES = 32 * 1024 * 1024 * 1024
+DEFAULT_DRIVE_QUANTUM_BYTES = 32 * 1024 * 1024 * 1024
+# 暂存后磁盘至少保留的剩余空间（1GB）
+DEFAULT_STAGING_MIN_FREE_BYTES = 1024 * 1024 * 1024
+# 持有驱动器的任务空闲超过该时间且有其他任务等待时让出驱动器
+_DRIVE_IDLE_GRACE_SECONDS = 1.0
+# 有成员索引的压缩包只恢复少量成员时直接按索引定位读取，不整体暂存
+_STAGE_MIN_REQUESTED_FRACTION = 0.5
+
+# (archive_hint, archive_path, files, result, error) -> 处理结果
+FinishCallback = Callable[[str, Path, List[Dict], Optional[Dict], Optional[BaseException]], Awaitable[None]]
+
+
+def default_extract_workers(settings=None) -> int:
+    workers = int(getattr(settings, 'RECOVERY_EXTRACT_WORKERS', 0) or 0)
+    return workers if workers > 0 else min(8, os.cpu_count() or 1)
+
+
+def staging_budget(settings=None) -> "ByteBudget":
+    """暂存字节上限（由恢复引擎创建一个，所有恢复任务共用）"""
+    return ByteBudget(getattr(settings, 'RECOVERY_STAGING_MAX_BYTES', DEFAULT_STAGING_MAX_BYTES))
+
+
+class _DriveTurn:
+    """一次驱动器使用，read_bytes 由持有方累加，归还时计入配额"""
+
+    def __init__(self):
+        self.read_bytes = 0
+
+
+class TapeDriveScheduler:
+    """磁带驱动器公平共享：多个恢复任务按字节配额轮转
+
+    任务每次读磁带前 acquire，读完 release 并报告读取的字节数。有其他任务等待时，持有者用满配额、
+    或空闲超过 idle_grace 秒（例如只剩解压、或在等待暂存空间）即把驱动器交给等待最久的任务，
+    原持有者再次 acquire 时排到队尾；没有其他任务等待时持有者继续使用。
+    任务结束时必须调用 leave 让出驱动器。所有方法都在事件循环线程中调用。
+    """
+
+    def __init__(self, quantum_bytes: int = DEFAULT_DRIVE_QUANTUM_BYTES, idle_grace: float = _DRIVE_IDLE_GRACE_SECONDS):
+        self.quantum_bytes = max(1, int(quantum_bytes))
+        self.idle_grace = idle_grace
+        self._holder: Optional[str] = None
+        self._holder_bytes = 0
+        self._busy = False
+        self._waiters: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+
+    @property
+    def holder(self) -> Optional[str]:
+        return self._holder
+
+    async def acquire(self, job_id: str):
+        if not self._busy and (self._holder == job_id or (self._holder is None and not self._waiters)):
+            if self._holder != job_id:
+                self._holder_bytes = 0
+            self._holder = job_id
+            self._busy = True
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[job_id] = future
+        self._schedule_idle_check()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if self._waiters.get(job_id) is future:
+                del self._waiters[job_id]
+            elif self._holder == job_id:
+                self._busy = False
+                self._hand_over()
+            raise
+
+    def release(self, job_id: str, read_bytes: int = 0):
+        if self._holder != job_id:
+            return
+        self._busy = False
+        self._holder_bytes += max(0, int(read_bytes))
+        if not self._waiters:
+            return
+        if self._holder_bytes >= self.quantum_bytes:
+            logger.info(f"[驱动器调度] 恢复任务 {job_id} 用满配额，驱动器交给下一个恢复任务")
+            self._hand_over()
+        else:
+            self._schedule_idle_check()
+
+    def leave(self, job_id: str):
+        future = self._waiters.pop(job_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+        if self._holder == job_id:
+            self._holder = None
+            self._busy = False
+            self._hand_over()
+
+    def _schedule_idle_check(self):
+        if self._holder is not None and not self._busy:
+            asyncio.get_running_loop().call_later(self.idle_grace, self._yield_if_idle, self._holder)
+
+    def _yield_if_idle(self, job_id: str):
+        if self._holder == job_id and not self._busy and self._waiters:
+            self._hand_over()
+
+    def _hand_over(self):
+        self._holder = None
+        while self._waiters:
+            job_id, future = self._waiters.popitem(last=False)
+            if future.done():
+                continue
+            self._holder = job_id
+            self._holder_bytes = 0
+            self._busy = True
+            future.set_result(None)
+            return
+
+    @asynccontextmanager
+    async def turn(self, job_id: str):
+        await self.acquire(job_id)
+        turn = _DriveTurn()
+        try:
+            yield turn
+        finally:
+            self.release(job_id, turn.read_bytes)
+
+
+class ByteBudget:
+    """在途字节上限（异步信号量按字节计数）；单个超过上限的请求在没有其他占用时放行"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self._used = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    async def acquire(self, size: int):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._used == 0 or self._used + size <= self.limit)
+            self._used += size
+
+    async def release(self, size: int):
+        async with self._condition:
+            self._used = max(0, self._used - size)
+            self._condition.notify_all()
+
+
+class ArchiveRestoreExecutor:
+    """单个恢复任务的压缩包恢复执行器：暂存磁带上的压缩包，解压写入交给共享线程池
+
+    budget 为所有恢复任务共用的暂存字节上限（未传入时按配置单独创建）
+    """
+
+    def __init__(self, job_id: str, settings, restorer: ArchiveStreamRestorer, pool: ThreadPoolExecutor,
+                 drive: TapeDriveScheduler, budget: Optional[ByteBudget] = None):
+        self.job_id = job_id
+        self.settings = settings
+        self.restorer = restorer
+        self.pool = pool
+        self.drive = drive
+        self.staging_enabled = bool(getattr(settings, 'RECOVERY_STAGING_ENABLED', False))
+        self.budget = budget if budget is not None else staging_budget(settings)
+        self.min_free_bytes = int(getattr(settings, 'RECOVERY_STAGING_MIN_FREE_BYTES', DEFAULT_STAGING_MIN_FREE_BYTES))
+        staging_root = Path(getattr(settings, 'RECOVERY_TEMP_DIR', 'temp/recovery')) / 'staging'
+        self.staging_dir = staging_root / job_id
+        self._staged_count = 0
+        self._pending: List[asyncio.Task] = []
+        drive_letter = getattr(settings, 'TAPE_DRIVE_LETTER', None)
+        self._tape_prefix = (drive_letter.upper() + ":") if drive_letter else None
+
+    def is_on_tape(self, archive_path: Path) -> bool:
+        """压缩包是否位于 LTFS 磁带盘符下（读取需要占用驱动器）"""
+        if not self._tape_prefix:
+            return True
+        return str(archive_path).upper().startswith(self._tape_prefix)
+
+    def can_stage(self, estimated_bytes: int) -> bool:
+        return self.staging_enabled and 0 < estimated_bytes <= self.budget.limit
+
+    def should_stage(self, archive_path: Path, files: List[Dict], archive_bytes: int) -> bool:
+        """有成员索引、且只需读取压缩包一小部分时按索引直接定位读取，不整体暂存
+
+        需要读取的字节数按成员索引估算（见 estimate_read_bytes），与压缩包实际大小比较；
+        没有成员索引时只能顺序读取整个压缩包，整体暂存
+        """
+        try:
+            archive_bytes = archive_path.stat().st_size or archive_bytes
+        except OSError:
+            pass
+        if archive_bytes <= 0:
+            return True
+        requested = estimate_read_bytes(archive_path, files)
+        if requested is None:
+            return True
+        return requested >= archive_bytes * _STAGE_MIN_REQUESTED_FRACTION
+
+    def stage(self, archive_path: Path) -> Path:
+        """把压缩包（及其成员索引）从磁带顺序复制到暂存目录（阻塞，在线程中执行）
+
+        暂存后磁盘剩余空间会低于 RECOVERY_STAGING_MIN_FREE_BYTES 时抛出 OSError（调用方改为直接从磁带解压）
+        """
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        required = archive_path.stat().st_size + self.min_free_bytes
+        free = shutil.disk_usage(self.staging_dir).free
+        if free < required:
+            raise OSError(f"暂存目录剩余空间不足: 剩余 {free} 字节，需要 {required} 字节")
+        self._staged_count += 1
+        staged = self.staging_dir / f"{self._staged_count:06d}_{archive_path.name}"
+        shutil.copyfile(archive_path, staged)
+        index_path = get_archive_index_path(archive_path)
+        if index_path.is_file():
+            shutil.copyfile(index_path, get_archive_index_path(staged))
+        return staged
+
+    async def extract(self, archive_path: Path, files: List[Dict], target_root: Path, progress: Dict) -> Dict:
+        """在线程池中从压缩包恢复一组文件，等待完成"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.pool, self.restorer.restore_archive, archive_path, files, target_root, progress
+        )
+
+    def submit(self, archive_hint: str, archive_path: Path, files: List[Dict], target_root: Path, progress: Dict,
+               on_finish: FinishCallback, staged: bool = False, reserved_bytes: int = 0):
+        """提交到线程池后立即返回（与后续读磁带并行），完成后回调 on_finish"""
+        self._pending.append(asyncio.create_task(
+            self._extract_and_finish(archive_hint, archive_path, files, target_root, progress,
+                                     on_finish, staged, reserved_bytes)
+        ))
+
+    async def _extract_and_finish(self, archive_hint: str, archive_path: Path, files: List[Dict],
+                                  target_root: Path, progress: Dict, on_finish: FinishCallback,
+                                  staged: bool, reserved_bytes: int):
+        result = None
+        error = None
+        try:
+            result = await self.extract(archive_path, files, target_root, progress)
+        except Exception as e:
+            error = e
+        finally:
+            if staged:
+                self._remove_staged(archive_path)
+            if reserved_bytes:
+                await self.budget.release(reserved_bytes)
+        await on_finish(archive_hint, archive_path, files, result, error)
+
+    def _remove_staged(self, staged: Path):
+        for path in (staged, get_archive_index_path(staged)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"[并行恢复] 删除暂存文件失败 {path}: {str(e)}")
+
+    async def drain(self):
+        """等待所有已提交的解压完成"""
+        while self._pending:
+            pending, self._pending = self._pending, []
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def cleanup(self):
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+恢复计划模块
+Restore Planner Module
+
+恢复原来按请求顺序处理文件：先加载备份集的磁带，去重引用到其他磁带的文件再逐盘切换，
+同一磁带内的压缩包按首次出现的顺序读取。请求顺序随机时 LTO 驱动器会反复定位/倒带，
+比按磁带物理顺序读取慢一个数量级。本模块在执行前生成恢复计划：
+1. 把每个待恢复文件解析为 (磁带, 压缩包, 物理位置)，按磁带分批，每盘磁带只加载一次（当前已加载的磁带排在最前）
+2. 同一磁带内按物理位置排序：已挂载的 LTFS 卷读取文件扩展属性 ltfs.partition / ltfs.startblock；
+   读不到时按 (备份集, chunk_number) 排序——压缩包按 chunk 顺序依次写入磁带，该顺序即写入顺序
+3. 估算定位与读取时间（连续相邻的压缩包不需要定位），同时给出按请求顺序读取的估算时间作对比
+
+计划在执行前可见（创建恢复任务后的状态接口，或 /api/recovery/plan 接口）；
+执行时每加载一盘磁带会重新读取 LTFS 位置并重新排序。
+"""
+
+import os
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from recovery.archive_restore import ArchiveStreamRestorer, _ensure_metadata_dict, get_dedup_ref, group_files_by_archive
+
+logger = logging.getLogger(__name__)
+
+# LTFS 默认块大小（512KB），用于由压缩包大小推算占用的块数
+LTFS_DEFAULT_BLOCK_SIZE = 512 * 1024
+# 相邻判定容差（块）：LTFS 在文件之间可能插入少量索引块
+_ADJACENT_SLACK_BLOCKS = 16
+# Linux LTFS 以 user. 命名空间暴露虚拟扩展属性，部分实现不带前缀
+_LTFS_XATTR_PREFIXES = ("user.ltfs.", "ltfs.")
+
+
+@dataclass
+class ArchiveRead:
+    """一次压缩包读取：压缩包内所有待恢复文件在一次顺序读取中完成"""
+    archive_hint: str
+    set_id: Optional[str]
+    tape_id: Optional[str]
+    files: List[Dict]
+    chunk_number: Optional[int] = None
+    archive_bytes: int = 0
+    partition: Optional[str] = None
+    start_block: Optional[int] = None
+    position_source: str = "chunk"  # ltfs（LTFS 扩展属性）/ chunk（写入顺序）
+
+    def sort_key(self) -> Tuple:
+        if self.start_block is not None:
+            return (0, self.partition or "", self.start_block, "", 0, self.archive_hint)
+        chunk = self.chunk_number if self.chunk_number is not None else 1 << 62
+        return (1, "", 0, self.set_id or "", chunk, self.archive_hint)
+
+    def block_count(self, block_size: int) -> int:
+        return max(1, -(-self.archive_bytes // block_size)) if self.archive_bytes else 1
+
+    def follows(self, previous: "ArchiveRead", block_size: int) -> bool:
+        """是否紧接在 previous 之后（读完 previous 后不需要定位）"""
+        if self.start_block is not None and previous.start_block is not None:
+            if self.partition != previous.partition:
+                return False
+            gap = self.start_block - (previous.start_block + previous.block_count(block_size))
+            return 0 <= gap <= _ADJACENT_SLACK_BLOCKS
+        if self.start_block is None and previous.start_block is None:
+            return (
+                self.set_id == previous.set_id
+                and self.chunk_number is not None and previous.chunk_number is not None
+                and self.chunk_number == previous.chunk_number + 1
+            )
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'archive': self.archive_hint,
+            'set_id': self.set_id,
+            'file_count': len(self.files),
+            'bytes': self.archive_bytes,
+            'chunk_number': self.chunk_number,
+            'partition': self.partition,
+            'start_block': self.start_block,
+            'position_source': self.position_source,
+        }
+
+
+@dataclass
+class CartridgeBatch:
+    """一盘磁带上的全部读取（按物理位置排序）"""
+    tape_id: Optional[str]
+    reads: List[ArchiveRead] = field(default_factory=list)
+    load_required: bool = True
+    locates: int = 0
+    seek_seconds: float = 0.0
+    read_seconds: float = 0.0
+
+    @property
+    def file_count(self) -> int:
+        return sum(len(read.files) for read in self.reads)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(read.archive_bytes for read in self.reads)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'tape_id': self.tape_id,
+            'load_required': self.load_required,
+            'file_count': self.file_count,
+            'bytes': self.total_bytes,
+            'locates': self.locates,
+            'estimated_seek_seconds': round(self.seek_seconds, 1),
+            'estimated_read_seconds': round(self.read_seconds, 1),
+            'archives': [read.to_dict() for read in self.reads],
+        }
+
+
+@dataclass
+class RestorePlan:
+    """恢复计划：按磁带分批、批内按物理位置排序的压缩包读取顺序"""
+    batches: List[CartridgeBatch]
+    loose_files: List[Dict]
+    set_tape_id: Optional[str]
+    request_order_seconds: float = 0.0
+    load_seconds: float = 0.0
+
+    @property
+    def tape_loads(self) -> int:
+        return sum(1 for batch in self.batches if batch.load_required)
+
+    @property
+    def estimated_seconds(self) -> float:
+        return (
+            self.tape_loads * self.load_seconds
+            + sum(batch.seek_seconds + batch.read_seconds for batch in self.batches)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'cartridges': [batch.to_dict() for batch in self.batches],
+            'archive_count': sum(len(batch.reads) for batch in self.batches),
+            'planned_files': sum(batch.file_count for batch in self.batches),
+            'unplanned_files': len(self.loose_files),
+            'total_bytes': sum(batch.total_bytes for batch in self.batches),
+            'tape_loads': self.tape_loads,
+            'locates': sum(batch.locates for batch in self.batches),
+            'estimated_load_seconds': round(self.tape_loads * self.load_seconds, 1),
+            'estimated_seek_seconds': round(sum(batch.seek_seconds for batch in self.batches), 1),
+            'estimated_read_seconds': round(sum(batch.read_seconds for batch in self.batches), 1),
+            'estimated_seconds': round(self.estimated_seconds, 1),
+            'request_order_seconds': round(self.request_order_seconds, 1),
+        }
+
+
+def read_ltfs_position(archive_path: Path) -> Optional[Tuple[str, int]]:
+    """读取 LTFS 文件的 (分区, 起始块)，非 LTFS 卷或平台不支持扩展属性时返回 None"""
+    getxattr = getattr(os, "getxattr", None)
+    if getxattr is None:
+        return None
+    for prefix in _LTFS_XATTR_PREFIXES:
+        try:
+            start_block = int(getxattr(str(archive_path), prefix + "startblock"))
+            partition = getxattr(str(archive_path), prefix + "partition").decode("ascii", "ignore").strip()
+        except (OSError, ValueError):
+            continue
+        return partition, start_block
+    return None
+
+
+class RestorePlanner:
+    """生成恢复计划（同步阻塞方法应通过 asyncio.to_thread 执行，会访问 LTFS 卷上的文件属性）"""
+
+    def __init__(self, settings=None, restorer: Optional[ArchiveStreamRestorer] = None):
+        self.settings = settings
+        self.restorer = restorer or ArchiveStreamRestorer(settings)
+        self.block_size = int(getattr(settings, 'RECOVERY_PLAN_LTFS_BLOCK_SIZE', LTFS_DEFAULT_BLOCK_SIZE) or LTFS_DEFAULT_BLOCK_SIZE)
+        self.read_bytes_per_second = max(1.0, float(getattr(settings, 'RECOVERY_PLAN_READ_MBPS', 300)) * 1024 * 1024)
+        self.locate_seconds = float(getattr(settings, 'RECOVERY_PLAN_LOCATE_SECONDS', 50))
+        self.load_seconds = float(getattr(settings, 'RECOVERY_PLAN_LOAD_SECONDS', 120))
+
+    def plan(self, files: List[Dict], backup_set_info: Dict, mounted_tape_id: Optional[str] = None,
+             head_block: Optional[int] = None) -> RestorePlan:
+        """生成恢复计划
+
+        Args:
+            files: 待恢复文件（已补充 file_metadata）
+            backup_set_info: 备份集信息（set_id / tape_id）
+            mounted_tape_id: 当前已加载的磁带（只有该磁带的 LTFS 位置可以读取，且不需要重新加载）
+            head_block: 当前磁头位置（TapeOperations.get_tape_position），用于估算第一次定位
+        """
+        set_tape_id = backup_set_info.get('tape_id')
+        groups, loose_files = group_files_by_archive(files)
+        reads = [self._archive_read(archive_hint, group, backup_set_info) for archive_hint, group in groups.items()]
+
+        by_tape: Dict[Optional[str], List[ArchiveRead]] = {}
+        for read in reads:
+            by_tape.setdefault(read.tape_id, []).append(read)
+
+        # 当前已加载的磁带最先，其次备份集所在磁带，其余按磁带编号
+        tape_order = sorted(
+            by_tape,
+            key=lambda tape_id: (tape_id != mounted_tape_id, tape_id != set_tape_id, str(tape_id or "")),
+        )
+        batches = []
+        for tape_id in tape_order:
+            # 没有磁带编号的压缩包（仍在本地磁盘上）不需要加载磁带
+            batch = CartridgeBatch(tape_id=tape_id, reads=by_tape[tape_id],
+                                   load_required=tape_id is not None and tape_id != mounted_tape_id)
+            if tape_id is not None and tape_id == mounted_tape_id:
+                self.refine_positions(batch, head_block)
+            else:
+                self._order_and_estimate(batch)
+            batches.append(batch)
+
+        plan = RestorePlan(batches=batches, loose_files=loose_files, set_tape_id=set_tape_id,
+                           load_seconds=self.load_seconds)
+        plan.request_order_seconds = self._estimate_request_order(reads, mounted_tape_id)
+        return plan
+
+    def refine_positions(self, batch: CartridgeBatch, head_block: Optional[int] = None):
+        """磁带已挂载：读取 LTFS 物理位置并重新排序、估算"""
+        located = 0
+        for read in batch.reads:
+            archive_path = self.restorer.resolve_archive_path(read.archive_hint, read.set_id)
+            if not archive_path:
+                continue
+            try:
+                read.archive_bytes = archive_path.stat().st_size or read.archive_bytes
+            except OSError:
+                pass
+            position = read_ltfs_position(archive_path)
+            if position:
+                read.partition, read.start_block = position
+                read.position_source = "ltfs"
+                located += 1
+        if located:
+            logger.info(f"[恢复计划] 磁带 {batch.tape_id}: {located}/{len(batch.reads)} 个压缩包读取到 LTFS 物理位置")
+        self._order_and_estimate(batch, head_block)
+
+    def _archive_read(self, archive_hint: str, group: List[Dict], backup_set_info: Dict) -> ArchiveRead:
+        dedup_ref = get_dedup_ref(group[0])
+        metadata = _ensure_metadata_dict(group[0].get('file_metadata'))
+        chunk_number = metadata.get('chunk_number')
+        try:
+            chunk_number = int(chunk_number) if chunk_number is not None else None
+        except (TypeError, ValueError):
+            chunk_number = None
+        return ArchiveRead(
+            archive_hint=archive_hint,
+            set_id=dedup_ref.get('set_id') if dedup_ref else backup_set_info.get('set_id'),
+            tape_id=(dedup_ref.get('tape_id') if dedup_ref else None) or backup_set_info.get('tape_id'),
+            files=group,
+            chunk_number=None if dedup_ref else chunk_number,
+            # 压缩包实际大小未知时按组内文件压缩后大小估算
+            archive_bytes=sum(int(f.get('compressed_size') or f.get('file_size') or 0) for f in group),
+        )
+
+    def _order_and_estimate(self, batch: CartridgeBatch, head_block: Optional[int] = None):
+        batch.reads.sort(key=ArchiveRead.sort_key)
+        self._estimate(batch, head_block)
+
+    def _estimate(self, batch: CartridgeBatch, head_block: Optional[int] = None):
+        batch.locates = self._count_locates(batch.reads, head_block)
+        batch.seek_seconds = batch.locates * self.locate_seconds
+        batch.read_seconds = batch.total_bytes / self.read_bytes_per_second
+
+    def _count_locates(self, reads: List[ArchiveRead], head_block: Optional[int]) -> int:
+        locates = 0
+        previous = None
+        for read in reads:
+            if previous is None:
+                # 刚加载的磁带位于卷首，第一次读取总要定位；磁头恰好在起始块时除外
+                if head_block is None or read.start_block is None or read.start_block != head_block:
+                    locates += 1
+            elif not read.follows(previous, self.block_size):
+                locates += 1
+            previous = read
+        return locates
+
+    def _estimate_request_order(self, reads: List[ArchiveRead], mounted_tape_id: Optional[str]) -> float:
+        """按请求顺序（压缩包首次出现顺序）读取、磁带变化即换盘时的估算时间"""
+        seconds = 0.0
+        current_tape = mounted_tape_id
+        previous = None
+        for read in reads:
+            if read.tape_id != current_tape:
+                if read.tape_id is not None:
+                    seconds += self.load_seconds
+                current_tape = read.tape_id
+                previous = None
+            if previous is None or not read.follows(previous, self.block_size):
+                seconds += self.locate_seconds
+            seconds += read.archive_bytes / self.read_bytes_per_second
+            previous = read
+        return seconds
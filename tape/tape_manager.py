@@ -561,7 +561,10 @@ class TapeManager:
             logger.info(f"找到磁带对象: {tape.tape_id}, 状态: {tape.status.value}")
 
             # 检查磁带状态
-            if tape.is_expired:
+            pinned_until = self._dedup_pinned_until(tape_id) if tape.is_expired else None
+            if pinned_until:
+                logger.warning(f"磁带 {tape_id} 已过期，但其内容被其他备份集引用（保留至 {pinned_until:%Y-%m-%d}），不擦除")
+            elif tape.is_expired:
                 logger.warning(f"磁带 {tape_id} 已过期，将进行擦除")
                 try:
                     await self.erase_tape(tape_id)
@@ -688,6 +691,14 @@ class TapeManager:
 
                 logger.info(f"磁带 {tape_id} 擦除成功")
 
+                # 磁带上的压缩包已不存在，从内容去重索引中移除
+                if getattr(self.settings, 'DEDUP_ENABLED', False):
+                    try:
+                        from backup.dedup_index import get_dedup_index
+                        get_dedup_index(self.settings).forget_tape(tape_id)
+                    except Exception as dedup_error:
+                        logger.warning(f"更新内容去重索引失败: {dedup_error}")
+
             # 如果原本未加载，则卸载
             if not was_loaded:
                 await self.unload_tape()
@@ -783,6 +794,10 @@ class TapeManager:
 
                 if self.settings.AUTO_ERASE_EXPIRED:
                     for tape in expired_tapes:
+                        pinned_until = self._dedup_pinned_until(tape.tape_id)
+                        if pinned_until:
+                            logger.info(f"过期磁带 {tape.tape_id} 的内容被其他备份集引用（保留至 {pinned_until:%Y-%m-%d}），暂不擦除")
+                            continue
                         logger.info(f"自动擦除过期磁带: {tape.tape_id}")
                         await self.erase_tape(tape.tape_id)
 
@@ -798,6 +813,24 @@ class TapeManager:
         except Exception as e:
             logger.error(f"检查磁带保留期失败: {str(e)}")
 
+    def _dedup_pinned_until(self, tape_id: str) -> Optional[datetime]:
+        """磁带内容被其他备份集去重引用时返回引用的保留截止时间（未到期），否则返回 None"""
+        if not getattr(self.settings, 'DEDUP_ENABLED', False):
+            return None
+        try:
+            from backup.dedup_index import get_dedup_index
+            pinned_until = get_dedup_index(self.settings).tape_pinned_until(tape_id)
+        except Exception as e:
+            logger.warning(f"查询磁带 {tape_id} 的去重引用失败: {str(e)}")
+            return None
+        if pinned_until is None:
+            return None
+        try:
+            pinned_until = datetime.fromtimestamp(pinned_until)
+        except (OverflowError, OSError, ValueError):
+            pinned_until = datetime.max  # 永久保留的备份集引用
+        return pinned_until if pinned_until > datetime.now() else None
+
     async def _cleanup_expired_tapes(self):
         """清理过期磁带
         
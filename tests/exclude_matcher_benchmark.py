@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+排除规则匹配性能对比测试
+对比 FileScanner.should_exclude_file 原实现（逐条 fnmatch）与编译后的 ExcludeMatcher
+"""
+
+import fnmatch
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup.exclude_matcher import ExcludeMatcher
+
+
+def legacy_should_exclude_file(file_path, exclude_patterns):
+    """FileScanner.should_exclude_file 的原实现（逐个路径层级、逐条规则 fnmatch）"""
+    if not exclude_patterns:
+        return False
+
+    normalized_path = file_path.replace('\\', '/')
+
+    for pattern in exclude_patterns:
+        normalized_pattern = pattern.replace('\\', '/')
+        if fnmatch.fnmatch(normalized_path, normalized_pattern):
+            return True
+
+    path_parts = normalized_path.split('/')
+    for i in range(len(path_parts)):
+        parent_path = '/'.join(path_parts[:i+1])
+        if not parent_path:
+            continue
+
+        for pattern in exclude_patterns:
+            normalized_pattern = pattern.replace('\\', '/')
+            if fnmatch.fnmatch(parent_path, normalized_pattern):
+                return True
+            if fnmatch.fnmatch(parent_path + '/*', normalized_pattern):
+                return True
+
+    return False
+
+
+EXCLUDE_PATTERNS = [
+    '*.tmp',
+    '*.log',
+    '*/node_modules',
+    '*/.git/*',
+    '*/__pycache__',
+    '/data/share/temp/*',
+    '/data/share/cache',
+    '/data/share/project_?/build/*',
+    '*/Thumbs.db',
+    '*.[bB][aA][kK]',
+]
+
+
+def generate_paths(count):
+    """生成模拟的扫描路径（不同深度，少量命中排除规则）"""
+    paths = []
+    for i in range(count):
+        depth = 3 + i % 6
+        parts = ['/data', 'share'] + [f'dir{(i >> d) % 7}' for d in range(depth)]
+        suffix = i % 50
+        if suffix == 0:
+            name = f'file{i}.tmp'
+        elif suffix == 1:
+            parts.append('node_modules')
+            name = f'index{i}.js'
+        elif suffix == 2:
+            parts = ['/data', 'share', 'temp'] + parts[2:]
+            name = f'file{i}.dat'
+        else:
+            name = f'file{i}.dat'
+        paths.append('/'.join(parts + [name]))
+    return paths
+
+
+def run_benchmark(path_count):
+    """对比完整检查、子条目检查与原实现的耗时，并校验结果一致"""
+    print(f"\n📊 {path_count:,} 个路径 × {len(EXCLUDE_PATTERNS)} 条排除规则")
+    paths = generate_paths(path_count)
+
+    start_time = time.perf_counter()
+    matcher = ExcludeMatcher(EXCLUDE_PATTERNS)
+    compile_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    legacy_results = [legacy_should_exclude_file(p, EXCLUDE_PATTERNS) for p in paths]
+    legacy_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    compiled_results = [matcher.excludes(p) for p in paths]
+    compiled_time = time.perf_counter() - start_time
+
+    # 目录扫描时父目录已检查，子条目只检查自身
+    start_time = time.perf_counter()
+    for p in paths:
+        matcher.excludes_child(p)
+    child_time = time.perf_counter() - start_time
+
+    mismatches = sum(1 for a, b in zip(legacy_results, compiled_results) if a != b)
+
+    print(f"   编译规则: {compile_time*1000:.3f} ms")
+    print(f"   原实现 (fnmatch):        {legacy_time:.3f} 秒，平均 {legacy_time/path_count*1000000:.2f} μs/路径")
+    print(f"   ExcludeMatcher.excludes: {compiled_time:.3f} 秒，平均 {compiled_time/path_count*1000000:.2f} μs/路径"
+          f"（{legacy_time/compiled_time:.1f}x）")
+    print(f"   excludes_child:          {child_time:.3f} 秒，平均 {child_time/path_count*1000000:.2f} μs/路径"
+          f"（{legacy_time/child_time:.1f}x）")
+    print(f"   排除 {sum(compiled_results):,} 个，结果不一致 {mismatches} 个")
+    return mismatches
+
+
+def main():
+    """主函数"""
+    print("排除规则匹配性能对比")
+    print("=" * 60)
+
+    mismatches = 0
+    for path_count in [1000, 10000, 100000]:
+        mismatches += run_benchmark(path_count)
+
+    if mismatches:
+        print(f"\n❌ 编译匹配器与原实现结果不一致: {mismatches} 个")
+        sys.exit(1)
+    print("\n✅ 编译匹配器与原实现结果一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,11 @@ Backup Module Tests
 
 import pytest
 import asyncio
+import io
+import json
+import os
+import re
+import sqlite3
 from unittest.mock import Mock, AsyncMock
 from pathlib import Path
 import sys
@@ -19,6 +24,32 @@ from backup.backup_engine import BackupEngine
 from models.backup import BackupTask, BackupTaskType
 from tape.tape_manager import TapeManager
 from utils.dingtalk_notifier import DingTalkNotifier
+from backup.exclude_matcher import ExcludeMatcher
+from backup.file_state_catalog import ChangeDetector, MODE_FULL, MODE_INCREMENTAL
+from backup.file_listing import encode_cursor, decode_cursor
+from backup.file_search_index import parse_search_query, like_pattern, _opengauss_predicate
+from backup.directory_archive_map import summarize_directories, find_directory_files
+from backup.parallel_dir_walker import ScanRecord, ParallelDirWalker, scan_records_to_backup_files_rows
+from backup.dir_state_catalog import DirScanCache
+from backup import bulk_loader
+from backup import file_hasher
+from backup.simple_scanner import SimpleScanner
+from backup import group_packer
+from backup.group_packer import pack_first_fit_decreasing, pack_by_directory
+from backup.zstd_seekable import SeekableZstdWriter, SeekableZstdFile, read_seek_table, zstd
+from recovery.restore_planner import RestorePlanner
+from recovery.restore_executor import TapeDriveScheduler, ArchiveRestoreExecutor, ByteBudget
+from recovery.archive_restore import ArchiveStreamRestorer
+from backup.archive_index import get_archive_index_path, ArchiveIndex
+from backup.dedup_index import ContentDedupIndex, DedupSession
+from utils.scheduler import db_utils
+from backup.compressor import Compressor
+from backup.tape_stream_writer import TapeStreamWriter, PART_SUFFIX
+from backup import final_dir_monitor
+from backup.final_dir_monitor import FinalDirMonitor
+from backup.tape_ready_queue import (
+    TapeReadyQueue, resolve_journal_path, STATE_PENDING, STATE_COPYING, STATE_VERIFIED, STATE_FAILED,
+)
 
 
 class TestBackupEngine:
@@ -143,4 +174,1599 @@ class TestBackupEngine:
         result = await backup_engine.cancel_task(task.id)
 
         assert result is True
-        assert backup_engine._current_task is None
\ No newline at end of file
+        assert backup_engine._current_task is None
+
+
+@pytest.mark.skipif(zstd is None, reason="未安装 zstandard")
+class TestSeekableZstd:
+    """多帧 zstd 读写测试"""
+
+    @staticmethod
+    def _write(chunks, max_frame_size=1024 * 1024, end_frames=False):
+        raw = io.BytesIO()
+        writer = SeekableZstdWriter(raw, zstd.ZstdCompressor(level=3), write_size=65536,
+                                    max_frame_size=max_frame_size)
+        for chunk in chunks:
+            writer.write(chunk)
+            if end_frames:
+                writer.end_frame()
+        writer.close()
+        return raw, writer
+
+    def test_round_trip_and_seek(self):
+        """切帧写入后按帧随机读取，内容与原始数据一致"""
+        chunks = [bytes([i]) * (1000 + i * 37) for i in range(8)]
+        data = b''.join(chunks)
+        raw, writer = self._write(chunks, end_frames=True)
+
+        frames = read_seek_table(raw)
+        assert frames == writer.frames
+        assert len(frames) == len(chunks)
+        assert sum(frame[3] for frame in frames) == len(data)
+
+        view = SeekableZstdFile.open(raw)
+        assert view.read() == data
+        view.seek(3000)
+        assert view.read(2500) == data[3000:5500]
+        view.seek(-10, io.SEEK_END)
+        assert view.read() == data[-10:]
+        view.close()
+
+    def test_large_write_split_by_max_frame_size(self):
+        """单次写入超过帧上限时自动切帧"""
+        data = bytes(range(256)) * 40
+        raw, writer = self._write([data], max_frame_size=1000)
+        frames = read_seek_table(raw)
+        assert len(frames) == -(-len(data) // 1000)
+        assert all(frame[3] <= 1000 for frame in frames)
+        with SeekableZstdFile.open(raw, workers=2) as view:
+            view.seek(4321)
+            assert view.read(100) == data[4321:4421]
+
+    def test_tar_member_spanning_frames(self):
+        """tar 成员数据跨帧时 tarfile 能完整读取"""
+        import tarfile
+        payload = bytes(range(256)) * 64
+        raw = io.BytesIO()
+        writer = SeekableZstdWriter(raw, zstd.ZstdCompressor(), write_size=65536, max_frame_size=3000)
+        with tarfile.open(fileobj=writer, mode='w') as tar:
+            info = tarfile.TarInfo("dir/data.bin")
+            info.size = len(payload)
+            tar.addfile(info, io.BytesIO(payload))
+        writer.close()
+        assert len(writer.frames) > 1
+
+        with SeekableZstdFile.open(raw) as view:
+            with tarfile.open(fileobj=view, mode='r:') as tar:
+                assert tar.extractfile("dir/data.bin").read() == payload
+
+    def test_not_seekable_format(self):
+        """普通 zstd 流和过短的文件不是 seekable 格式"""
+        plain = io.BytesIO(zstd.ZstdCompressor().compress(b"hello" * 100))
+        assert read_seek_table(plain) is None
+        assert SeekableZstdFile.open(plain) is None
+        assert read_seek_table(io.BytesIO(b"x")) is None
+
+    def test_empty_archive(self):
+        """没有写入数据时 seek table 为空"""
+        raw, writer = self._write([])
+        assert writer.frames == []
+        assert SeekableZstdFile.open(raw) is None
+
+
+class TestExcludeMatcher:
+    """排除规则匹配测试"""
+
+    def test_empty_rules(self):
+        matcher = ExcludeMatcher([])
+        assert not matcher
+        assert matcher.excludes("/data/a.txt") is False
+
+    def test_literal_rule_excludes_subtree(self):
+        matcher = ExcludeMatcher(["/data/tmp"])
+        assert matcher.excludes("/data/tmp")
+        assert matcher.excludes("/data/tmp/a/b.txt")
+        assert not matcher.excludes("/data/tmp2/a.txt")
+        assert not matcher.excludes("/data")
+
+    def test_glob_rules(self):
+        matcher = ExcludeMatcher(["*.log", "/data/cache/*"])
+        assert matcher.excludes("/data/app/run.log")
+        assert not matcher.excludes("/data/app/run.log.txt")
+        # "目录/*" 同时排除目录本身
+        assert matcher.excludes("/data/cache")
+        assert matcher.excludes("/data/cache/x/y")
+
+    def test_windows_separators(self):
+        matcher = ExcludeMatcher(["D:\\temp"])
+        assert matcher.excludes("D:/temp/a.txt")
+        assert matcher.excludes("D:\\temp\\a.txt")
+
+    def test_excludes_child_only_checks_path_itself(self):
+        matcher = ExcludeMatcher(["/data/tmp"])
+        assert matcher.excludes_child("/data/tmp")
+        assert not matcher.excludes_child("/data/tmp/a.txt")
+
+
+class TestFileSearchQuery:
+    """文件搜索词解析测试"""
+
+    @pytest.mark.parametrize("term, mode, expected", [
+        ("*.PDF", "auto", ("extension", ".pdf")),
+        (".pdf", "auto", ("extension", ".pdf")),
+        ("Report*", "auto", ("prefix", "report")),
+        ("quarter", "auto", ("substring", "quarter")),
+        ("a.b.c", "auto", ("substring", "a.b.c")),
+        ("pdf", "extension", ("extension", ".pdf")),
+        ("  Name  ", "prefix", ("prefix", "name")),
+    ])
+    def test_parse(self, term, mode, expected):
+        query = parse_search_query(term, mode)
+        assert (query.mode, query.term) == expected
+        assert query.field == "name"
+
+    @pytest.mark.parametrize("term, mode, field", [
+        ("", "auto", "name"),
+        ("   ", "auto", "name"),
+        ("x", "regex", "name"),
+        ("x", "auto", "size"),
+    ])
+    def test_parse_invalid(self, term, mode, field):
+        with pytest.raises(ValueError):
+            parse_search_query(term, mode, field)
+
+    def test_like_pattern_escapes_wildcards(self):
+        assert like_pattern(parse_search_query("50%_off", "substring")) == "%50\\%\\_off%"
+        assert like_pattern(parse_search_query("rep", "prefix")) == "rep%"
+        assert like_pattern(parse_search_query("*.tar", "auto")) == "%.tar"
+        assert like_pattern(parse_search_query("a\\b", "substring")) == "%a\\\\b%"
+
+
+    def test_ngram_predicate_falls_back_to_like(self):
+        """短于 gram 长度或含标点的搜索词不走 ngram 预筛选"""
+        for term in ("x", "o.p", "a b"):
+            sql, params = _opengauss_predicate(parse_search_query(term, "substring"), "ngram", 2)
+            assert "ngram" not in sql
+            assert params == [like_pattern(parse_search_query(term, "substring"))]
+        sql, params = _opengauss_predicate(parse_search_query("report", "substring"), "ngram", 2)
+        assert "plainto_tsquery('ngram', $2)" in sql and "LIKE $3" in sql
+        assert params == ["report", "%report%"]
+
+
+class TestFileListingCursor:
+    """文件列表分页游标测试"""
+
+    @pytest.mark.parametrize("value", [["/a/中文.txt", 42], ["", 0], 123456, None])
+    def test_round_trip(self, value):
+        token = encode_cursor(value)
+        assert "=" not in token
+        assert decode_cursor(token) == value
+
+    def test_empty_token(self):
+        assert decode_cursor(None) is None
+        assert decode_cursor("") is None
+
+    @pytest.mark.parametrize("token", ["!!!", "e30x", encode_cursor(1)[:-1] + "*"])
+    def test_invalid_token(self, token):
+        with pytest.raises(ValueError):
+            decode_cursor(token)
+
+
+class TestRestorePlanner:
+    """恢复计划排序测试"""
+
+    @staticmethod
+    def _file(path, chunk, archive, size=100, **extra):
+        metadata = {'tape_file_path': archive, 'chunk_number': chunk, **extra}
+        return {'file_path': path, 'compressed_size': size, 'file_metadata': json.dumps(metadata)}
+
+    @pytest.fixture
+    def planner(self):
+        return RestorePlanner(Mock(TAPE_DRIVE_LETTER=None, RECOVERY_PLAN_READ_MBPS=300,
+                                   RECOVERY_PLAN_LOCATE_SECONDS=50, RECOVERY_PLAN_LOAD_SECONDS=120,
+                                   RECOVERY_PLAN_LTFS_BLOCK_SIZE=524288, RECOVERY_STREAM_BUFFER_SIZE=65536))
+
+    def test_reads_sorted_by_chunk_and_grouped_by_archive(self, planner):
+        files = [
+            self._file("/x/9", 9, "S1\\c9.tar"),
+            self._file("/x/1", 1, "S1\\c1.tar"),
+            self._file("/x/3", 3, "S1\\c3.tar"),
+            self._file("/x/1b", 1, "S1\\c1.tar"),
+            {'file_path': '/loose'},
+        ]
+        plan = planner.plan(files, {'set_id': 'S1', 'tape_id': 'T1'})
+        assert [batch.tape_id for batch in plan.batches] == ['T1']
+        reads = plan.batches[0].reads
+        assert [read.chunk_number for read in reads] == [1, 3, 9]
+        assert [f['file_path'] for f in reads[0].files] == ["/x/1", "/x/1b"]
+        assert plan.loose_files == [{'file_path': '/loose'}]
+        assert plan.tape_loads == 1
+
+    def test_tape_order_mounted_then_set_tape(self, planner):
+        files = [
+            self._file("/x/1", 1, "S1\\c1.tar"),
+            self._file("/y/1", 5, "S0\\c5.tar", dedup_ref={'set_id': 'S0', 'tape_id': 'T0', 'member': 'm'}),
+            self._file("/z/1", 2, "S2\\c2.tar", dedup_ref={'set_id': 'S2', 'tape_id': 'T2', 'member': 'm'}),
+        ]
+        plan = planner.plan(files, {'set_id': 'S1', 'tape_id': 'T1'})
+        assert [batch.tape_id for batch in plan.batches] == ['T1', 'T0', 'T2']
+
+        plan = planner.plan(files, {'set_id': 'S1', 'tape_id': 'T1'}, mounted_tape_id='T2')
+        assert [batch.tape_id for batch in plan.batches] == ['T2', 'T1', 'T0']
+        assert [batch.load_required for batch in plan.batches] == [False, True, True]
+        assert plan.tape_loads == 2
+
+
+class TestTapeDriveScheduler:
+    """磁带驱动器轮转测试"""
+
+    @pytest.mark.asyncio
+    async def test_round_robin_by_quantum(self):
+        """用满配额后驱动器交给等待的任务"""
+        scheduler = TapeDriveScheduler(quantum_bytes=10, idle_grace=10)
+        order = []
+
+        async def job(job_id):
+            for _ in range(4):
+                async with scheduler.turn(job_id) as turn:
+                    order.append(job_id)
+                    await asyncio.sleep(0)
+                    turn.read_bytes += 5
+            scheduler.leave(job_id)
+
+        await asyncio.gather(job('a'), job('b'))
+        assert "".join(order) == "aabbaabb"
+        assert scheduler.holder is None
+
+    @pytest.mark.asyncio
+    async def test_holder_keeps_drive_without_waiters(self):
+        scheduler = TapeDriveScheduler(quantum_bytes=1, idle_grace=10)
+        for _ in range(3):
+            async with scheduler.turn('a') as turn:
+                turn.read_bytes += 100
+        assert scheduler.holder == 'a'
+
+    @pytest.mark.asyncio
+    async def test_idle_holder_yields(self):
+        """持有者空闲超过 idle_grace 时让出驱动器"""
+        scheduler = TapeDriveScheduler(quantum_bytes=10 ** 9, idle_grace=0.01)
+        async with scheduler.turn('a'):
+            pass
+        await asyncio.wait_for(scheduler.acquire('b'), timeout=1)
+        assert scheduler.holder == 'b'
+
+    @pytest.mark.asyncio
+    async def test_leave_hands_over(self):
+        scheduler = TapeDriveScheduler(quantum_bytes=10 ** 9, idle_grace=10)
+        await scheduler.acquire('a')
+        waiter = asyncio.create_task(scheduler.acquire('b'))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        scheduler.leave('a')
+        await asyncio.wait_for(waiter, timeout=1)
+        assert scheduler.holder == 'b'
+
+
+class TestChangeDetector:
+    """增量备份变更检测测试"""
+
+    @staticmethod
+    def _files(root, sizes):
+        return [{'path': f"{root}/{name}", 'size': size, 'mtime_ns': 1000, 'inode': index + 1}
+                for index, (name, size) in enumerate(sizes.items())]
+
+    def _run(self, tmp_path, mode, backup_set, files, archived):
+        detector = ChangeDetector([str(tmp_path / "src")], mode, backup_set, tmp_path / "catalog")
+        accepted = detector.filter_batch(list(files))
+        detector.mark_archived([f"{tmp_path}/src/{name}" for name in archived])
+        detector.commit()
+        detector.close()
+        return sorted(Path(f['path']).name for f in accepted)
+
+    def test_only_archived_files_are_committed(self, tmp_path):
+        """压缩失败的文件不写入目录，下次增量备份仍然备份"""
+        root = str(tmp_path / "src")
+        files = self._files(root, {"a": 1, "b": 2, "c": 3})
+        assert self._run(tmp_path, MODE_FULL, "set1", files, ["a", "b"]) == ["a", "b", "c"]
+        # c 在完整备份中写入失败：增量备份时按新文件处理
+        assert self._run(tmp_path, MODE_INCREMENTAL, "set2", files, ["c"]) == ["c"]
+        assert self._run(tmp_path, MODE_INCREMENTAL, "set3", files, []) == []
+
+    def test_failed_incremental_file_is_retried(self, tmp_path):
+        root = str(tmp_path / "src")
+        self._run(tmp_path, MODE_FULL, "set1", self._files(root, {"a": 1}), ["a"])
+        changed = self._files(root, {"a": 5})
+        assert self._run(tmp_path, MODE_INCREMENTAL, "set2", changed, []) == ["a"]
+        assert self._run(tmp_path, MODE_INCREMENTAL, "set3", changed, ["a"]) == ["a"]
+        assert self._run(tmp_path, MODE_INCREMENTAL, "set4", changed, []) == []
+
+
+class TestDirScanCache:
+    """目录状态目录重放测试"""
+
+    @staticmethod
+    async def _walk(tmp_path, backup_set, trust):
+        cache = DirScanCache([str(tmp_path / "src")], backup_set, tmp_path / "catalog", trust=trust)
+        walker = ParallelDirWalker(workers=2, batch_size=4, dir_cache=cache)
+        records = []
+        async for batch in walker.walk(tmp_path / "src"):
+            records.extend(batch)
+        cache.commit()
+        cache.close()
+        return {Path(rec.path).name: rec.size for rec in records}, walker.stats
+
+    @staticmethod
+    def _make_tree(tmp_path):
+        sub = tmp_path / "src" / "sub"
+        sub.mkdir(parents=True)
+        (tmp_path / "src" / "a.txt").write_bytes(b"a")
+        (sub / "b.txt").write_bytes(b"bb")
+        return sub
+
+    @pytest.mark.asyncio
+    async def test_unchanged_dir_mtime_replays_listing(self, tmp_path):
+        """目录 mtime 未变化时复用上次的列表（原地修改的文件按上次的大小产出）"""
+        sub = self._make_tree(tmp_path)
+        files, stats = await self._walk(tmp_path, "set1", trust=False)
+        assert files == {"a.txt": 1, "b.txt": 2}
+        assert stats.dirs_reused == 0
+
+        dir_mtime = os.stat(sub).st_mtime_ns
+        (sub / "b.txt").write_bytes(b"bbbb")
+        os.utime(sub, ns=(dir_mtime, dir_mtime))
+        files, stats = await self._walk(tmp_path, "set2", trust=True)
+        assert files == {"a.txt": 1, "b.txt": 2}
+        assert stats.dirs_reused == 2
+        assert stats.files_reused == 2
+
+    @pytest.mark.asyncio
+    async def test_changed_dir_mtime_rescans_dir(self, tmp_path):
+        """目录 mtime 变化时重新扫描该目录，其余目录仍复用"""
+        sub = self._make_tree(tmp_path)
+        await self._walk(tmp_path, "set1", trust=False)
+
+        dir_mtime = os.stat(sub).st_mtime_ns
+        (sub / "c.txt").write_bytes(b"ccc")
+        os.utime(sub, ns=(dir_mtime, dir_mtime + 1_000_000_000))
+        files, stats = await self._walk(tmp_path, "set2", trust=True)
+        assert files == {"a.txt": 1, "b.txt": 2, "c.txt": 3}
+        assert stats.dirs_reused == 1
+        assert stats.files_reused == 1
+
+        # 重新扫描的结果已合并：下次两个目录都复用
+        files, stats = await self._walk(tmp_path, "set3", trust=True)
+        assert files == {"a.txt": 1, "b.txt": 2, "c.txt": 3}
+        assert stats.dirs_reused == 2
+
+
+class TestDirectoryArchiveMap:
+    """目录 → 压缩包映射测试"""
+
+    def test_summarize_directories(self):
+        files = [
+            {'path': '/data/a/1.txt', 'size': 10},
+            {'file_path': '/data/a/2.txt', 'file_size': 5},
+            {'path': '/data/b/3.txt', 'size': 1, 'directory_path': '/data/b'},
+        ]
+        assert summarize_directories(files) == {'/data/a': [2, 15], '/data/b': [1, 1]}
+
+    @pytest.mark.asyncio
+    async def test_find_directory_files_limits_to_mapped_archives(self):
+        """有映射记录时只查询目录所在压缩包中的文件"""
+        conn = Mock()
+        conn.fetch = AsyncMock(side_effect=[
+            [{'chunk_number': 3, 'tape_file_path': 'x', 'file_count': 1, 'total_size': 1}],
+            [],
+        ])
+        await find_directory_files(conn, 'backup_files_000001', 1, '/data/a/')
+        sql, *params = conn.fetch.call_args_list[1].args
+        assert "chunk_number = ANY($4)" in sql
+        assert params == [1, '/data/a', '/data/a/%', [3]]
+
+    @pytest.mark.asyncio
+    async def test_find_directory_files_without_mapping(self):
+        conn = Mock()
+        conn.fetch = AsyncMock(side_effect=[[], []])
+        await find_directory_files(conn, 'backup_files_000001', 1, '/data/a')
+        sql, *params = conn.fetch.call_args_list[1].args
+        assert "chunk_number" not in sql.split("WHERE", 1)[1]
+        assert params == [1, '/data/a', '/data/a/%']
+
+
+class TestGroupPacker:
+    """压缩文件组装箱测试"""
+
+    def test_first_fit_decreasing_fills_capacity(self):
+        candidates = [(1, 30), (2, 60), (3, 50), (4, 20), (5, 10)]
+        file_ids, total = pack_first_fit_decreasing(candidates, capacity=100, oversize_threshold=95)
+        # 降序：60 → 30 → 10 装满，50、20 放不下
+        assert (file_ids, total) == ([1, 2, 5], 100)
+
+    def test_first_fit_decreasing_oversize_goes_alone(self):
+        """超过阈值的文件单独成组，取最早的一个"""
+        candidates = [(1, 10), (2, 300), (3, 200), (4, 10)]
+        assert pack_first_fit_decreasing(candidates, capacity=100, oversize_threshold=95) == ([2], 300)
+
+    def test_first_fit_decreasing_never_exceeds_capacity(self):
+        candidates = [(index, size) for index, size in enumerate([40, 40, 40, 15, 7, 3], start=1)]
+        file_ids, total = pack_first_fit_decreasing(candidates, capacity=90, oversize_threshold=85)
+        assert total <= 90
+        assert total == sum(dict(candidates)[file_id] for file_id in file_ids)
+        assert file_ids == sorted(file_ids)
+
+    def test_pack_by_directory_keeps_directories_together(self):
+        candidates = [
+            (1, 30, "/d/a", "1.txt"),
+            (2, 30, "/d/b", "2.txt"),
+            (3, 30, "/d/a", "3.txt"),
+            (4, 50, "/d/c", "4.txt"),
+            (5, 30, "/d/b", "5.txt"),
+        ]
+        # 从最早文件所在目录 /d/a 开始：/d/a(60) 放入，/d/b(60) 放不下，/d/c(50) 放不下
+        file_ids, total = pack_by_directory(candidates, capacity=100, oversize_threshold=95, min_fill=0)
+        assert (file_ids, total) == ([1, 3], 60)
+
+    def test_pack_by_directory_fills_from_skipped_directories(self):
+        candidates = [
+            (1, 30, "/d/a", "1.txt"),
+            (2, 30, "/d/b", "2.log"),
+            (3, 30, "/d/a", "3.txt"),
+            (4, 30, "/d/b", "4.bin"),
+            (5, 30, "/d/b", "5.bin"),
+        ]
+        file_ids, total = pack_by_directory(candidates, capacity=100, oversize_threshold=95, min_fill=90,
+                                            by_extension=True)
+        # /d/b 整体(90)放不下，按扩展名顺序补满：先 .bin（id 4）
+        assert (file_ids, total) == ([1, 3, 4], 90)
+
+    def test_pack_by_directory_subdirectory_follows_parent(self):
+        candidates = [
+            (1, 10, "/d/a", "1"),
+            (2, 10, "/d/a-b", "2"),
+            (3, 10, "/d/a/sub", "3"),
+        ]
+        file_ids, total = pack_by_directory(candidates, capacity=20, oversize_threshold=19, min_fill=0)
+        assert (file_ids, total) == ([1, 3], 20)
+
+    def test_pack_by_directory_oversize_and_empty(self):
+        assert pack_by_directory([], capacity=100, oversize_threshold=95, min_fill=0) == ([], 0)
+        candidates = [(1, 10, "/d", "a"), (2, 500, "/d", "b")]
+        assert pack_by_directory(candidates, capacity=100, oversize_threshold=95, min_fill=0) == ([2], 500)
+
+    @pytest.mark.asyncio
+    async def test_claim_retries_next_window_after_losing_race(self, monkeypatch):
+        """装箱的文件被其他工作者抢先认领时读取下一个窗口重新装箱"""
+        windows = [([(1, 60), (2, 40)], False), ([(3, 50), (4, 50)], False)]
+        claimed = []
+
+        async def fake_window(*args, **kwargs):
+            return windows.pop(0)
+
+        async def fake_claim(conn, table_name, backup_set_id, file_ids):
+            claimed.append(list(file_ids))
+            if len(claimed) == 1:
+                return []
+            return [{'id': file_id, 'file_path': f"/f{file_id}"} for file_id in file_ids]
+
+        monkeypatch.setattr(group_packer, "stream_pending_window", fake_window)
+        monkeypatch.setattr(group_packer, "claim_files", fake_claim)
+        group, exhausted = await group_packer.claim_pending_group(
+            None, "backup_files_000001", 1, max_file_size=100, allow_partial=False
+        )
+        assert claimed == [[1, 2], [3, 4]]
+        assert [file_info['id'] for file_info in group] == [3, 4]
+        assert exhausted is False
+
+
+class TestArchiveRestoreExecutor:
+    """压缩包暂存策略测试"""
+
+    @staticmethod
+    def _executor(tmp_path, budget=None, **overrides):
+        settings = Mock()
+        settings.RECOVERY_STAGING_ENABLED = True
+        settings.RECOVERY_STAGING_MAX_BYTES = 1000
+        settings.RECOVERY_STAGING_MIN_FREE_BYTES = overrides.get('min_free', 0)
+        settings.RECOVERY_TEMP_DIR = str(tmp_path / "recovery")
+        settings.TAPE_DRIVE_LETTER = None
+        return ArchiveRestoreExecutor("job", settings, Mock(), Mock(), Mock(), budget=budget)
+
+    @staticmethod
+    def _indexed_archive(path, writer_factory=None):
+        """写入带成员索引的 tar / tar.zst：src/big.bin 64KB（随机内容，基本不可压缩）+ src/small.txt 100 字节"""
+        import tarfile
+        members = {"src/big.bin": os.urandom(64 * 1024), "src/small.txt": b"s" * 100}
+        archive_index = ArchiveIndex()
+        with open(path, "wb") as fh:
+            writer = writer_factory(fh) if writer_factory else fh
+            with tarfile.open(fileobj=writer, mode="w") as tar:
+                for name, data in members.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    header_offset = tar.offset
+                    tar.addfile(info, io.BytesIO(data))
+                    archive_index.record_member(tar, header_offset)
+            if writer_factory:
+                writer.close()
+                archive_index.frames = [list(frame) for frame in writer.frames]
+        archive_index.write(path)
+
+    @staticmethod
+    def _request(member, compressed_size=0):
+        return {'file_path': f"/data/{member}", 'compressed_size': compressed_size}
+
+    def test_should_stage_uses_index_member_sizes(self, tmp_path):
+        archive = tmp_path / "a.tar"
+        self._indexed_archive(archive)
+        executor = self._executor(tmp_path)
+        # 按索引只需读取 100 字节：直接定位读取（与按文件数平摊的 compressed_size 无关）
+        assert executor.should_stage(archive, [self._request("src/small.txt", 10 ** 9)], 1) is False
+        assert executor.should_stage(archive, [self._request("src/big.bin")], 1) is True
+        # 没有成员索引时只能顺序读取整个压缩包
+        plain = tmp_path / "b.tar"
+        plain.write_bytes(archive.read_bytes())
+        assert executor.should_stage(plain, [self._request("src/small.txt")], 1) is True
+
+    @pytest.mark.skipif(zstd is None, reason="未安装 zstandard")
+    def test_should_stage_uses_zstd_frames(self, tmp_path):
+        seekable = tmp_path / "a.tar.zst"
+        self._indexed_archive(seekable, lambda fh: SeekableZstdWriter(
+            fh, zstd.ZstdCompressor(), write_size=65536, max_frame_size=8192))
+        executor = self._executor(tmp_path)
+        # 只解压包含 small.txt 的帧
+        assert executor.should_stage(seekable, [self._request("src/small.txt")], 1) is False
+        assert executor.should_stage(seekable, [self._request("src/big.bin")], 1) is True
+
+    def test_budget_shared_between_jobs(self, tmp_path):
+        budget = ByteBudget(1000)
+        first = self._executor(tmp_path, budget=budget)
+        second = self._executor(tmp_path, budget=budget)
+        assert first.budget is second.budget
+
+    def test_stage_refuses_when_disk_is_full(self, tmp_path):
+        archive = tmp_path / "a.tar"
+        archive.write_bytes(b"x" * 10)
+        executor = self._executor(tmp_path, min_free=1 << 62)
+        with pytest.raises(OSError):
+            executor.stage(archive)
+        staged = self._executor(tmp_path).stage(archive)
+        assert staged.read_bytes() == b"x" * 10
+
+
+class TestScanRecordRows:
+    """扫描记录 → backup_files 数据元组测试"""
+
+    def test_directory_path_is_parent_directory(self):
+        records = [
+            ScanRecord("/a.txt", 1, 0, 1, 0o100644),
+            ScanRecord("/data/b.txt", 2, 0, 2, 0o100600),
+        ]
+        rows = scan_records_to_backup_files_rows(records, 7)
+        # 根目录下的文件同样记录父目录，目录恢复、按目录装箱按该值匹配
+        assert [(row[1], row[2], row[3]) for row in rows] == [
+            ("/a.txt", "a.txt", "/"),
+            ("/data/b.txt", "b.txt", "/data"),
+        ]
+        assert rows[1][0] == 7 and rows[1][6] == 2 and rows[1][8] == "600"
+        assert all(len(row) == 24 for row in rows)
+
+
+class TestBulkLoaderFallback:
+    """COPY 写入失败回退 executemany 测试"""
+
+    class _FailingCopyConn:
+        """asyncpg 风格连接：COPY 总是失败，executemany 返回写入行数"""
+
+        def __init__(self):
+            self.copy_calls = 0
+            self.executemany = AsyncMock(side_effect=lambda sql, rows: len(rows))
+
+        async def copy_records_to_table(self, table_name, records, columns):
+            self.copy_calls += 1
+            raise RuntimeError("COPY not supported")
+
+    @pytest.mark.asyncio
+    async def test_copy_failure_falls_back_to_executemany(self, monkeypatch):
+        monkeypatch.setattr(bulk_loader, "_copy_failures", 0)
+        scanner = SimpleScanner.__new__(SimpleScanner)
+        scanner.settings = Mock(DB_BULK_LOAD_METHOD="copy", DB_COPY_FORMAT="native")
+        conn = self._FailingCopyConn()
+        records = [ScanRecord("/data/a.txt", 1, 0, 1, 0o100644), ScanRecord("/data/b.txt", 2, 0, 2, 0o100644)]
+
+        written = await scanner._write_batch_to_db(conn, conn, records, 7, "backup_files_7", 1)
+
+        assert written == 2
+        assert conn.copy_calls == 1
+        conn.executemany.assert_awaited_once()
+        assert len(conn.executemany.await_args.args[1]) == 2
+        assert bulk_loader._copy_failures == 1
+
+    def test_copy_disabled_after_consecutive_failures(self, monkeypatch):
+        monkeypatch.setattr(bulk_loader, "_copy_failures", 0)
+        settings = Mock(DB_BULK_LOAD_METHOD="copy")
+        for _ in range(bulk_loader._COPY_MAX_FAILURES - 1):
+            bulk_loader.record_copy_failure(RuntimeError("boom"))
+        assert bulk_loader.use_copy_protocol(settings)
+        bulk_loader.record_copy_failure(RuntimeError("boom"))
+        assert not bulk_loader.use_copy_protocol(settings)
+        # 停用期满后放行试探，试探成功后计数清零
+        monkeypatch.setattr(bulk_loader, "_copy_disabled_until", 0.0)
+        assert bulk_loader.use_copy_protocol(settings)
+        bulk_loader._record_copy_success()
+        assert bulk_loader._copy_failures == 0
+        # executemany 配置下不使用 COPY
+        monkeypatch.setattr(bulk_loader, "_copy_failures", 0)
+        assert not bulk_loader.use_copy_protocol(Mock(DB_BULK_LOAD_METHOD="executemany"))
+
+
+class _SqliteAsyncpgConn:
+    """用 sqlite 模拟 asyncpg 连接：execute 返回状态串，COPY 逐行插入"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def execute(self, sql):
+        cursor = self.db.execute(sql)
+        verb = sql.split(None, 1)[0].upper()
+        return f"INSERT 0 {cursor.rowcount}" if verb == "INSERT" else f"{verb} {cursor.rowcount}"
+
+    async def copy_records_to_table(self, table_name, records, columns):
+        placeholders = ", ".join("?" for _ in columns)
+        self.db.executemany(f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})", records)
+
+    def transaction(self):
+        db = self.db
+
+        class _Transaction:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, exc_type, exc, tb):
+                db.commit() if exc_type is None else db.rollback()
+
+        return _Transaction()
+
+
+class _SqlitePsycopgConn:
+    """用 sqlite 模拟 psycopg3 AsyncConnection：cursor().copy() + write_row"""
+
+    def __init__(self, db):
+        self.db = db
+        self.info = Mock(transaction_status=0)
+        self.commits = 0
+
+    def cursor(self):
+        db = self.db
+
+        class _Copy:
+            def __init__(self, sql):
+                match = re.match(r"COPY (\w+) \(([^)]*)\) FROM STDIN$", sql)
+                self.table, self.columns = match.group(1), match.group(2)
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, exc_type, exc, tb):
+                return False
+
+            async def write_row(self, row):
+                placeholders = ", ".join("?" for _ in row)
+                db.execute(f"INSERT INTO {self.table} ({self.columns}) VALUES ({placeholders})", tuple(row))
+
+        class _Cursor:
+            rowcount = -1
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, exc_type, exc, tb):
+                return False
+
+            async def execute(self, sql):
+                self.rowcount = db.execute(sql).rowcount
+
+            def copy(self, sql):
+                return _Copy(sql)
+
+        return _Cursor()
+
+    async def commit(self):
+        self.commits += 1
+        self.db.commit()
+
+    async def rollback(self):
+        self.db.rollback()
+
+
+class TestCopyUpsert:
+    """经临时暂存表的 COPY upsert 测试"""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("conn_type", [_SqliteAsyncpgConn, _SqlitePsycopgConn])
+    async def test_upsert_updates_existing_and_inserts_new_rows(self, conn_type):
+        db = sqlite3.connect(":memory:")
+        db.execute("CREATE TABLE files (set_id INTEGER, path TEXT, size INTEGER, checksum TEXT)")
+        db.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", [
+            (1, "/a", 10, "old-a"),
+            (1, "/b", 20, "old-b"),
+            (2, "/a", 30, "other-set"),
+        ])
+        db.commit()
+        conn = conn_type(db)
+
+        updated, inserted = await bulk_loader.copy_upsert(
+            conn, "files", ["set_id", "path", "size", "checksum"],
+            [(1, "/a", 11, "stale"), (1, "/c", 40, "new-c"), (1, "/a", 12, "new-a")],
+            key_columns=["set_id", "path"],
+        )
+
+        assert (updated, inserted) == (1, 1)
+        assert db.execute("SELECT set_id, path, size, checksum FROM files ORDER BY set_id, path").fetchall() == [
+            (1, "/a", 12, "new-a"),
+            (1, "/b", 20, "old-b"),
+            (1, "/c", 40, "new-c"),
+            (2, "/a", 30, "other-set"),
+        ]
+        # 暂存表随事务删除
+        assert db.execute("SELECT name FROM sqlite_temp_master WHERE type = 'table'").fetchall() == []
+
+    @pytest.mark.asyncio
+    async def test_upsert_without_update_columns_only_inserts_missing(self):
+        db = sqlite3.connect(":memory:")
+        db.execute("CREATE TABLE files (set_id INTEGER, path TEXT, size INTEGER)")
+        db.execute("INSERT INTO files VALUES (1, '/a', 10)")
+
+        updated, inserted = await bulk_loader.copy_upsert(
+            _SqliteAsyncpgConn(db), "files", ["set_id", "path", "size"],
+            [(1, "/a", 99), (1, "/b", 20)], key_columns=["set_id", "path"], update_columns=[],
+        )
+
+        assert (updated, inserted) == (0, 1)
+        assert db.execute("SELECT path, size FROM files ORDER BY path").fetchall() == [("/a", 10), ("/b", 20)]
+
+
+class TestTapeReadyQueue:
+    """待写磁带就绪队列（SQLite 日志）测试"""
+
+    @pytest.fixture
+    def queue(self, tmp_path):
+        ready_queue = TapeReadyQueue(tmp_path / "journal" / "ready.db", max_attempts=2)
+        yield ready_queue
+        ready_queue.close()
+
+    @staticmethod
+    def _state(queue, entry_id):
+        return queue._conn.execute("SELECT state FROM ready_archives WHERE id = ?", (entry_id,)).fetchone()[0]
+
+    def test_publish_claim_and_verify(self, queue):
+        queue.publish("/final/s1/a.tar.zst", "s1", 100)
+        queue.publish("/final/s1/b.tar.zst", "s1", 50)
+
+        entry = queue.claim_next(timeout=0.01)
+        assert entry['source_path'] == "/final/s1/a.tar.zst"
+        assert entry['state'] == STATE_PENDING and entry['attempts'] == 1
+        assert self._state(queue, entry['id']) == STATE_COPYING
+        assert queue.unfinished_stats() == (2, 150)
+
+        queue.mark_verified(entry['id'], "/ltfs/s1/a.tar.zst")
+        assert queue.state_counts() == {STATE_VERIFIED: 1, STATE_PENDING: 1}
+        assert queue.claim_next(timeout=0.01)['source_path'] == "/final/s1/b.tar.zst"
+        assert queue.claim_next(timeout=0.01) is None
+
+    def test_recover_resets_only_copying_entries(self, queue, tmp_path):
+        for name in ("a", "b", "c"):
+            queue.publish(f"/final/s1/{name}.7z", "s1", 1)
+        verified = queue.claim_next(timeout=0.01)
+        queue.mark_verified(verified['id'], "/ltfs/a.7z")
+        interrupted = queue.claim_next(timeout=0.01)
+        queue.close()
+
+        # 模拟进程重启：重新打开同一个日志
+        reopened = TapeReadyQueue(tmp_path / "journal" / "ready.db", max_attempts=2)
+        try:
+            assert reopened.recover() == 1
+            assert self._state(reopened, interrupted['id']) == STATE_PENDING
+            assert self._state(reopened, verified['id']) == STATE_VERIFIED
+            assert reopened.state_counts() == {STATE_VERIFIED: 1, STATE_PENDING: 2}
+        finally:
+            reopened.close()
+
+    def test_mark_failed_after_max_attempts(self, queue):
+        queue.publish("/final/s1/a.tar", "s1", 1)
+        entry = queue.claim_next(timeout=0.01)
+        assert queue.mark_failed(entry['id'], "write error", entry['attempts']) == STATE_PENDING
+        entry = queue.claim_next(timeout=0.01)
+        assert entry['attempts'] == 2
+        assert queue.mark_failed(entry['id'], "write error", entry['attempts']) == STATE_FAILED
+        assert self._state(queue, entry['id']) == STATE_FAILED
+        assert queue.claim_next(timeout=0.01) is None
+
+    def test_republish_resets_attempts(self, queue):
+        queue.publish("/final/s1/a.tar", "s1", 1)
+        entry = queue.claim_next(timeout=0.01)
+        queue.mark_failed(entry['id'], "write error", entry['attempts'])
+        entry = queue.claim_next(timeout=0.01)
+        queue.mark_failed(entry['id'], "write error", entry['attempts'])
+        assert self._state(queue, entry['id']) == STATE_FAILED
+
+        queue.publish("/final/s1/a.tar", "s1", 2)
+        entry = queue.claim_next(timeout=0.01)
+        assert entry['attempts'] == 1 and entry['file_size'] == 2 and entry['error'] is None
+
+    def test_relative_journal_path_resolves_against_project_root(self, tmp_path):
+        assert resolve_journal_path("data/ready.db") == project_root / "data" / "ready.db"
+        assert resolve_journal_path(tmp_path / "ready.db") == tmp_path / "ready.db"
+
+    def test_startup_adopts_leftover_final_files(self, queue, tmp_path, monkeypatch):
+        final_dir = tmp_path / "compress" / "final"
+        (final_dir / "s1").mkdir(parents=True)
+        known = final_dir / "s1" / "known.tar.zst"
+        for path in (known, final_dir / "s1" / "new.tar.zst", final_dir / "s1" / "new.tar.zst.idx",
+                     final_dir / "s1" / "notes.txt"):
+            path.write_bytes(b"x" * 4)
+        queue.publish(known, "s1", 4)
+        entry = queue.claim_next(timeout=0.01)
+        queue.mark_verified(entry['id'], "/ltfs/known.tar.zst")
+
+        monkeypatch.setattr(final_dir_monitor, "get_tape_ready_queue", lambda settings=None: queue)
+        monkeypatch.setattr(final_dir_monitor, "get_tape_governor", lambda settings=None: None)
+        settings = Mock(BACKUP_COMPRESS_DIR=str(tmp_path / "compress"), TAPE_READY_QUEUE_RETENTION_DAYS=7)
+        monitor = FinalDirMonitor(Mock(), settings)
+        monitor._recover_unfinished()
+
+        rows = queue._conn.execute("SELECT source_path, set_id, state FROM ready_archives ORDER BY id").fetchall()
+        # 已知文件不重复登记；压缩包先于其 .idx 登记；非压缩包文件忽略
+        assert [tuple(row) for row in rows] == [
+            (str(known), "s1", STATE_VERIFIED),
+            (str(final_dir / "s1" / "new.tar.zst"), "s1", STATE_PENDING),
+            (str(final_dir / "s1" / "new.tar.zst.idx"), "s1", STATE_PENDING),
+        ]
+
+
+class TestTapeStreamWriter:
+    """直写磁带流水线写入器测试"""
+
+    @staticmethod
+    def _payload(size):
+        return bytes((i * 7 + i // 251) % 256 for i in range(size))
+
+    def test_stream_writes_bytes_and_checksum(self, tmp_path):
+        import hashlib
+        data = self._payload(300 * 1024 + 17)
+        target = tmp_path / "tape" / "a.tar.zst"
+        writer = TapeStreamWriter(target, block_size=64 * 1024, buffer_size=128 * 1024)
+        for start in range(0, len(data), 10000):
+            writer.write(data[start:start + 10000])
+        digest = writer.close()
+
+        assert target.read_bytes() == data
+        assert digest == hashlib.sha256(data).hexdigest()
+        assert writer.bytes_written == writer.tell() == len(data)
+
+    def test_abort_removes_part_file(self, tmp_path):
+        part_path = tmp_path / ("a.tar.zst" + PART_SUFFIX)
+        writer = TapeStreamWriter(part_path, block_size=64 * 1024, buffer_size=128 * 1024)
+        writer.write(self._payload(200 * 1024))
+        writer.abort()
+        assert not part_path.exists()
+
+    def test_producer_exception_leaves_no_file(self, tmp_path):
+        part_path = tmp_path / ("a.tar.zst" + PART_SUFFIX)
+        with pytest.raises(RuntimeError):
+            with TapeStreamWriter(part_path, block_size=64 * 1024, buffer_size=128 * 1024) as writer:
+                writer.write(self._payload(100 * 1024))
+                raise RuntimeError("压缩失败")
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.parametrize("compress_result", [
+        {'compress_error': "tar 写入失败", 'successful_files': ["/data/a.txt"]},
+        {'successful_files': []},
+    ])
+    def test_failed_compression_is_not_renamed_to_archive(self, tmp_path, compress_result):
+        compressor = Compressor.__new__(Compressor)
+        compressor.settings = Mock(TAPE_STREAM_VERIFY_READBACK=True)
+        target = tmp_path / "a.tar.zst"
+        part_path = tmp_path / (target.name + PART_SUFFIX)
+        writer = TapeStreamWriter(part_path, block_size=64 * 1024, buffer_size=128 * 1024)
+        writer.write(self._payload(1000))
+
+        error = compressor._finish_tape_stream(writer, part_path, target, compress_result)
+
+        assert error
+        assert list(tmp_path.iterdir()) == []
+        assert 'archive_path' not in compress_result
+
+    def test_finish_verifies_readback_and_renames(self, tmp_path):
+        compressor = Compressor.__new__(Compressor)
+        compressor.settings = Mock(TAPE_STREAM_VERIFY_READBACK=True)
+        target = tmp_path / "a.tar.zst"
+        part_path = tmp_path / (target.name + PART_SUFFIX)
+        data = self._payload(70 * 1024)
+        writer = TapeStreamWriter(part_path, block_size=64 * 1024, buffer_size=128 * 1024)
+        writer.write(data)
+        compress_result = {'successful_files': ["/data/a.txt"]}
+
+        assert compressor._finish_tape_stream(writer, part_path, target, compress_result) is None
+        assert target.read_bytes() == data and not part_path.exists()
+        assert compress_result['bytes_written'] == len(data)
+        assert compress_result['archive_path'] == str(target)
+
+    def test_readback_mismatch_discards_part(self, tmp_path, monkeypatch):
+        from backup import compressor as compressor_module
+        monkeypatch.setattr(compressor_module, "compute_file_checksum", lambda *args, **kwargs: "0" * 64)
+        compressor = Compressor.__new__(Compressor)
+        compressor.settings = Mock(TAPE_STREAM_VERIFY_READBACK=True)
+        target = tmp_path / "a.tar.zst"
+        part_path = tmp_path / (target.name + PART_SUFFIX)
+        writer = TapeStreamWriter(part_path, block_size=64 * 1024, buffer_size=128 * 1024)
+        writer.write(self._payload(1000))
+
+        error = compressor._finish_tape_stream(writer, part_path, target, {'successful_files': ["/data/a.txt"]})
+
+        assert "回读校验失败" in error
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestArchiveStreamRestorer:
+    """按压缩包流式恢复测试"""
+
+    MEMBERS = {
+        "src/a.txt": b"alpha\n" * 100,
+        "src/sub/b.bin": bytes(range(256)) * 40,
+        "src/c.txt": b"gamma",
+    }
+
+    @classmethod
+    def _tar_bytes(cls, fileobj, archive_index=None):
+        import tarfile
+        with tarfile.open(fileobj=fileobj, mode="w") as tar:
+            for name, data in cls.MEMBERS.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = 1700000000
+                header_offset = tar.offset
+                tar.addfile(info, io.BytesIO(data))
+                if archive_index is not None:
+                    archive_index.record_member(tar, header_offset)
+
+    @classmethod
+    def _build(cls, tmp_path, kind):
+        import zipfile
+        import py7zr
+        if kind == "tar":
+            path = tmp_path / "backup_1.tar"
+            with open(path, "wb") as fh:
+                cls._tar_bytes(fh)
+        elif kind == "tar.zst":
+            raw = io.BytesIO()
+            cls._tar_bytes(raw)
+            path = tmp_path / "backup_1.tar.zst"
+            path.write_bytes(zstd.ZstdCompressor().compress(raw.getvalue()))
+        elif kind == "tar.zst-seekable":
+            path = tmp_path / "backup_1.tar.zst"
+            archive_index = ArchiveIndex()
+            with open(path, "wb") as fh:
+                writer = SeekableZstdWriter(fh, zstd.ZstdCompressor(), write_size=65536, max_frame_size=4096)
+                cls._tar_bytes(writer, archive_index)
+                writer.close()
+            assert archive_index.write(path) is not None
+        elif kind == "zip":
+            path = tmp_path / "backup_1.zip"
+            with zipfile.ZipFile(path, "w") as zf:
+                for name, data in cls.MEMBERS.items():
+                    zf.writestr(name, data)
+        else:
+            path = tmp_path / "backup_1.7z"
+            with py7zr.SevenZipFile(path, "w") as archive:
+                for name, data in cls.MEMBERS.items():
+                    archive.writestr(data, name)
+        return path
+
+    @staticmethod
+    def _file_info(member, data, checksum=None):
+        import hashlib
+        return {
+            'file_path': f"/data/{member}",
+            'file_size': len(data),
+            'checksum': checksum or hashlib.sha256(data).hexdigest(),
+            'file_metadata': {'tape_file_path': "s1\\backup_1"},
+        }
+
+    @pytest.mark.skipif(zstd is None, reason="未安装 zstandard")
+    @pytest.mark.parametrize("kind", ["tar", "tar.zst", "tar.zst-seekable", "zip", "7z"])
+    def test_restores_selected_members(self, tmp_path, kind):
+        archive_path = self._build(tmp_path, kind)
+        wanted = [
+            self._file_info("src/sub/b.bin", self.MEMBERS["src/sub/b.bin"]),
+            self._file_info("src/a.txt", self.MEMBERS["src/a.txt"]),
+        ]
+        missing = self._file_info("src/zz.txt", b"not in archive")
+        target_root = tmp_path / "restore"
+        progress = {}
+
+        result = ArchiveStreamRestorer(buffer_size=64 * 1024).restore_archive(
+            archive_path, wanted + [missing], target_root, progress
+        )
+
+        assert result['restored_files'] == 2
+        assert result['restored_bytes'] == len(self.MEMBERS["src/a.txt"]) + len(self.MEMBERS["src/sub/b.bin"])
+        assert result['failed'] == []
+        assert result['missing'] == [missing]
+        assert (target_root / "a.txt").read_bytes() == self.MEMBERS["src/a.txt"]
+        assert (target_root / "b.bin").read_bytes() == self.MEMBERS["src/sub/b.bin"]
+        assert not (target_root / "c.txt").exists()
+        assert progress == {'processed_files': 2, 'processed_bytes': result['restored_bytes']}
+
+    @pytest.mark.parametrize("kind", ["tar", "zip"])
+    def test_checksum_mismatch_removes_part_and_reports_failure(self, tmp_path, kind):
+        archive_path = self._build(tmp_path, kind)
+        corrupt = self._file_info("src/a.txt", self.MEMBERS["src/a.txt"], checksum="0" * 64)
+        intact = self._file_info("src/c.txt", self.MEMBERS["src/c.txt"])
+        target_root = tmp_path / "restore"
+
+        result = ArchiveStreamRestorer().restore_archive(archive_path, [corrupt, intact], target_root)
+
+        assert result['failed'] == [corrupt]
+        assert result['restored_files'] == 1
+        assert sorted(path.name for path in target_root.iterdir()) == ["c.txt"]
+
+
+class TestContentDedup:
+    """跨备份集内容去重测试"""
+
+    @pytest.fixture
+    def index(self, tmp_path):
+        dedup_index = ContentDedupIndex(tmp_path / "dedup.db")
+        yield dedup_index
+        dedup_index.close()
+
+    @staticmethod
+    def _session(index, set_id="s2", tape_id="T2", **kwargs):
+        return DedupSession(index, set_id, backup_set_db_id=int(set_id[1:]), tape_id=tape_id, retention_until=1e10,
+                            algorithm="sha256", min_file_size=0, **kwargs)
+
+    def test_index_registers_content_only_after_commit(self, index):
+        index.stage("s1", contents=[("c1", 10, 1, "T1", "s1\\backup_1.tar.zst", "src/a.txt")],
+                    hints=[("/data/src/a.txt", 10, 123, 7, "c1")])
+        assert index.lookup_content(["c1"]) == {}
+        assert index.lookup_hints(["/data/src/a.txt"]) == {}
+
+        assert index.commit_stage("s1") == (1, 0)
+        content = index.lookup_content(["c1", "missing"])
+        assert list(content) == ["c1"]
+        assert (content["c1"]["set_id"], content["c1"]["tape_id"], content["c1"]["member_name"]) == ("s1", "T1", "src/a.txt")
+        assert index.lookup_hints(["/data/src/a.txt"]) == {"/data/src/a.txt": (10, 123, 7, "c1")}
+
+        # 丢弃的暂存数据不会生效；磁带擦除后内容从索引移除
+        index.stage("s9", contents=[("c9", 1, 9, "T9", "x.tar", "x")])
+        index.discard_stage("s9")
+        assert index.commit_stage("s9") == (0, 0)
+        assert index.forget_tape("T1") == 1
+        assert index.lookup_content(["c1"]) == {}
+
+    def test_duplicate_is_recorded_as_reference(self, index, tmp_path):
+        import hashlib
+        duplicate = tmp_path / "src" / "same.bin"
+        changed = tmp_path / "src" / "changed.bin"
+        duplicate.parent.mkdir()
+        duplicate.write_bytes(b"unchanged content")
+        changed.write_bytes(b"new content")
+        checksum = hashlib.sha256(b"unchanged content").hexdigest()
+        first = self._session(index, set_id="s1", tape_id="T1")
+        files = [{"path": str(duplicate), "size": duplicate.stat().st_size},
+                 {"path": str(changed), "size": changed.stat().st_size}]
+        first.register_archive(files[:1], {str(duplicate): checksum}, "s1\\backup_1.tar.zst",
+                               {str(duplicate): "src/same.bin"})
+        first.commit()
+
+        second = self._session(index)
+        to_compress, references = second.split_group(files)
+
+        assert to_compress == files[1:]
+        assert references == {str(duplicate): {
+            "checksum": checksum, "set_id": "s1", "backup_set_id": 1, "tape_id": "T1",
+            "tape_file_path": "s1\\backup_1.tar.zst", "member": "src/same.bin",
+        }}
+        assert second.get_stats()["referenced"] == 1
+        # 引用其他磁带的内容：备份成功后该磁带被固定
+        second.commit()
+        assert index.tape_pinned_until("T1") == 1e10
+
+        # 同一备份集内不引用自己的内容
+        again = self._session(index, set_id="s1", tape_id="T1")
+        assert again.split_group(files) == (files, {})
+
+    def test_unknown_file_is_hashed_to_find_copies(self, index, tmp_path):
+        import hashlib
+        copy = tmp_path / "renamed.bin"
+        copy.write_bytes(b"payload")
+        checksum = hashlib.sha256(b"payload").hexdigest()
+        index.stage("s1", contents=[(checksum, 7, 1, "T1", "s1\\backup_1.tar", "src/orig.bin")])
+        index.commit_stage("s1")
+        files = [{"path": str(copy), "size": 7}]
+
+        assert self._session(index).split_group(files) == (files, {})
+        session = self._session(index, hash_unknown_files=True)
+        to_compress, references = session.split_group(files)
+        assert to_compress == [] and references[str(copy)]["member"] == "src/orig.bin"
+        assert session.get_stats()["hashed"] == 1
+
+    def test_restore_resolves_reference_from_original_archive(self, tmp_path):
+        import hashlib
+        import tarfile
+        data = b"shared payload" * 50
+        archive_path = tmp_path / "backup_1.tar"
+        with tarfile.open(archive_path, "w") as tar:
+            for name, payload in (("src/other.txt", b"other"), ("src/orig.bin", data)):
+                info = tarfile.TarInfo(name)
+                info.size = len(payload)
+                tar.addfile(info, io.BytesIO(payload))
+        checksum = hashlib.sha256(data).hexdigest()
+
+        def referencing(path, arcname):
+            return {
+                'file_path': path, 'file_size': len(data), 'checksum': checksum,
+                'file_metadata': {'tape_file_path': "s1\\backup_1.tar", 'dedup_ref': {
+                    'checksum': checksum, 'set_id': "s1", 'tape_file_path': "s1\\backup_1.tar",
+                    'member': "src/orig.bin", 'arcname': arcname,
+                }},
+            }
+        first = referencing("/data/new/copy1.bin", "new/copy1.bin")
+        second = referencing("/data/new/copy2.bin", "new/copy2.bin")
+        target_root = tmp_path / "restore"
+
+        result = ArchiveStreamRestorer().restore_archive(archive_path, [first, second], target_root)
+
+        assert result['failed'] == [] and result['missing'] == []
+        assert result['restored_files'] == 2
+        # 引用的成员只读取一次，第二个文件从第一个复制
+        assert (target_root / "copy1.bin").read_bytes() == data
+        assert (target_root / "copy2.bin").read_bytes() == data
+
+
+class TestDeleteBackupSetSideTables:
+    """删除备份集附属表记录测试"""
+
+    class _UndefinedTable(Exception):
+        sqlstate = "42P01"
+
+    @pytest.mark.asyncio
+    async def test_deletes_all_side_tables_and_skips_missing(self, caplog):
+        conn = Mock()
+        conn.execute = AsyncMock(side_effect=[None, self._UndefinedTable("missing"), RuntimeError("lock timeout"), None])
+
+        with caplog.at_level("DEBUG", logger=db_utils.logger.name):
+            await db_utils.delete_backup_set_side_tables(conn, backup_set_id=5)
+
+        assert [call.args for call in conn.execute.await_args_list] == [
+            (f"DELETE FROM {table} WHERE backup_set_id = $1", 5) for table in db_utils.BACKUP_SET_SIDE_TABLES
+        ]
+        warnings = [record.getMessage() for record in caplog.records if record.levelname == "WARNING"]
+        assert len(warnings) == 1 and "backup_directory_nodes" in warnings[0]
+
+    @pytest.mark.asyncio
+    async def test_deletes_by_task(self):
+        conn = Mock()
+        conn.execute = AsyncMock()
+        await db_utils.delete_backup_set_side_tables(conn, task_id=9)
+        sql, param = conn.execute.await_args_list[0].args
+        assert "SELECT id FROM backup_sets WHERE backup_task_id = $1" in sql and param == 9
+
+
+class _FakeOpenGaussConn:
+    """按 SQL 返回固定结果的 openGauss 连接（一个任务、一个备份集）"""
+
+    def __init__(self, task_id, backup_set_id):
+        self.task_id = task_id
+        self.backup_set_id = backup_set_id
+        self.table_name = f"backup_files_{task_id:06d}"
+        self._ids = iter([task_id, 1])
+
+    async def fetchval(self, sql, *args):
+        return next(self._ids)
+
+    async def fetchrow(self, sql, *args):
+        if "FROM backup_sets bs" in sql:
+            return {"backup_task_id": self.task_id, "backup_files_table": self.table_name, "archive_table": None}
+        if "SELECT task_name, is_template, status" in sql:
+            return {"task_name": "任务", "is_template": False, "status": "completed"}
+        if "COUNT(*)" in sql:
+            return {"count": 1 if "backup_sets" in sql else 0}
+        return None
+
+    async def fetch(self, sql, *args):
+        return [{"id": self.backup_set_id}] if "FROM backup_sets" in sql else []
+
+    async def execute(self, sql, *args):
+        return "DELETE 1" if sql.startswith("DELETE FROM backup_tasks") else "OK"
+
+    async def commit(self):
+        pass
+
+
+class TestBackupFilesTableCache:
+    """分表名缓存在任务创建/删除后失效测试"""
+
+    @pytest.fixture(autouse=True)
+    def _clear_cache(self):
+        db_utils.invalidate_backup_files_table_cache()
+        yield
+        db_utils.invalidate_backup_files_table_cache()
+
+    @staticmethod
+    def _patch_opengauss(monkeypatch, module, conn):
+        from contextlib import asynccontextmanager
+
+        @asynccontextmanager
+        async def connection():
+            yield conn
+
+        monkeypatch.setattr(module, "is_opengauss", lambda: True)
+        monkeypatch.setattr(module, "is_redis", lambda: False)
+        monkeypatch.setattr(module, "get_opengauss_connection", connection)
+        monkeypatch.setattr(module, "log_operation", AsyncMock())
+
+    @staticmethod
+    async def _prime(conn):
+        table_name = await db_utils.get_backup_files_table_by_set_id(conn, conn.backup_set_id)
+        assert table_name == conn.table_name
+        assert conn.backup_set_id in db_utils._backup_files_table_cache
+
+    @pytest.mark.asyncio
+    async def test_dropped_after_create(self, monkeypatch):
+        from web.api.backup import tasks_create
+        from web.api.backup.models import BackupTaskRequest
+
+        conn = _FakeOpenGaussConn(task_id=7, backup_set_id=70)
+        await self._prime(conn)
+        self._patch_opengauss(monkeypatch, tasks_create, conn)
+        monkeypatch.setattr(tasks_create, "get_system_instance", lambda request: Mock())
+
+        result = await tasks_create.create_backup_task(
+            BackupTaskRequest(task_name="任务", source_paths=["/data"]), Mock()
+        )
+        assert result["task_id"] == 7
+        assert conn.backup_set_id not in db_utils._backup_files_table_cache
+
+    @pytest.mark.asyncio
+    async def test_dropped_after_delete(self, monkeypatch):
+        from web.api.backup import tasks_delete
+
+        conn = _FakeOpenGaussConn(task_id=8, backup_set_id=80)
+        await self._prime(conn)
+        other = _FakeOpenGaussConn(task_id=9, backup_set_id=90)
+        await self._prime(other)
+        self._patch_opengauss(monkeypatch, tasks_delete, conn)
+
+        result = await tasks_delete.delete_backup_task(8, Mock())
+        assert result["success"]
+        assert conn.backup_set_id not in db_utils._backup_files_table_cache
+        assert other.backup_set_id in db_utils._backup_files_table_cache
+
+
+class TestBackupFilesLifecycle:
+    """backup_files 分表生命周期测试"""
+
+    class _IndexConn:
+        """asyncpg 风格连接：记录执行的 SQL，pg_index 查询返回给定的已存在索引"""
+
+        def __init__(self, existing, fail_concurrently=False):
+            self.existing = existing
+            self.fail_concurrently = fail_concurrently
+            self.statements = []
+
+        async def fetch(self, sql, *args):
+            return [{"index_name": name, "is_valid": valid} for name, valid in self.existing.items()]
+
+        async def execute(self, sql, *args):
+            self.statements.append(sql)
+            if self.fail_concurrently and "CONCURRENTLY" in sql:
+                raise RuntimeError("concurrent build failed")
+
+    def test_archive_table_name(self):
+        from datetime import datetime
+        from backup.backup_files_lifecycle import archive_table_name
+
+        assert archive_table_name("2024-03") == "backup_files_archive_202403"
+        assert archive_table_name("weekly", datetime(2023, 11, 5)) == "backup_files_archive_202311"
+
+    @pytest.mark.asyncio
+    async def test_rejects_unsafe_table_name(self):
+        from backup.backup_files_lifecycle import build_backup_files_indexes
+
+        for table_name in ("backup_files_1; DROP TABLE backup_sets", "backup_files_template", "backup_sets"):
+            with pytest.raises(ValueError):
+                await build_backup_files_indexes(self._IndexConn({}), table_name)
+
+    @pytest.mark.asyncio
+    async def test_builds_missing_and_invalid_indexes(self):
+        from backup.backup_files_lifecycle import build_backup_files_indexes, backup_files_index_definitions
+
+        names = [name for name, _ in backup_files_index_definitions("backup_files_000001")]
+        conn = self._IndexConn({names[0]: True, names[1]: False})
+        created = await build_backup_files_indexes(conn, "backup_files_000001")
+
+        assert created == names[1:]
+        assert conn.statements[0] == f"DROP INDEX IF EXISTS {names[1]}"
+        assert all("CONCURRENTLY" in sql for sql in conn.statements[1:])
+        assert not any(names[0] in sql for sql in conn.statements)
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_plain_index_build(self):
+        from backup.backup_files_lifecycle import build_backup_files_indexes, backup_files_index_definitions
+
+        names = [name for name, _ in backup_files_index_definitions("backup_files_000002")]
+        conn = self._IndexConn({}, fail_concurrently=True)
+        assert await build_backup_files_indexes(conn, "backup_files_000002") == names
+        plain = [sql for sql in conn.statements if sql.startswith("CREATE INDEX IF NOT EXISTS")]
+        assert [sql.split()[5] for sql in plain] == names
+
+
+class TestFileHasher:
+    """带算法前缀的文件校验和测试"""
+
+    @pytest.mark.parametrize("algorithm", [
+        "sha256",
+        pytest.param("xxh3", marks=pytest.mark.skipif(not file_hasher.XXHASH_AVAILABLE, reason="未安装 xxhash")),
+        pytest.param("blake3", marks=pytest.mark.skipif(not file_hasher.BLAKE3_AVAILABLE, reason="未安装 blake3")),
+    ])
+    def test_round_trip(self, tmp_path, algorithm):
+        import tarfile
+        source = tmp_path / "a.bin"
+        source.write_bytes(b"payload" * 1000)
+        with tarfile.open(tmp_path / "a.tar", "w") as tar:
+            checksum = file_hasher.add_file_to_tar(tar, source, "a.bin", file_hasher.resolve_algorithm(algorithm))
+
+        parsed_algorithm, hexdigest = file_hasher.parse_checksum(checksum)
+        assert parsed_algorithm == algorithm
+        assert checksum.startswith(f"{algorithm}:") == (algorithm != "sha256")
+        assert file_hasher.compute_checksum(source, expected_checksum=checksum) == checksum
+        verifier = file_hasher.create_verifier(checksum)
+        verifier.update(b"payload" * 1000)
+        assert file_hasher.checksum_matches(checksum, verifier)
+        verifier.update(b"x")
+        assert not file_hasher.checksum_matches(checksum, verifier)
+        with tarfile.open(tmp_path / "a.tar") as tar:
+            assert tar.extractfile("a.bin").read() == b"payload" * 1000
+
+    def test_legacy_checksum_without_prefix_is_sha256(self, tmp_path):
+        import hashlib
+        source = tmp_path / "a.bin"
+        source.write_bytes(b"legacy")
+        legacy = hashlib.sha256(b"legacy").hexdigest().upper()
+        assert file_hasher.parse_checksum(legacy) == ("sha256", legacy.lower())
+        assert file_hasher.compute_checksum(source, expected_checksum=legacy) == legacy.lower()
+        assert file_hasher.parse_checksum(None) == (None, None)
+        assert file_hasher.create_verifier("") is None
+
+    def test_blake3_falls_back_when_not_installed(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(file_hasher, "BLAKE3_AVAILABLE", False)
+        monkeypatch.setattr(file_hasher, "blake3", None)
+        assert file_hasher.resolve_algorithm("blake3") == "sha256"
+        # 本机无法计算 blake3 时跳过校验，而不是误判为不匹配
+        assert file_hasher.create_verifier("blake3:" + "0" * 64) is None
+        source = tmp_path / "a.bin"
+        source.write_bytes(b"data")
+        assert file_hasher.compute_checksum(source, expected_checksum="blake3:" + "0" * 64) is None
+        assert file_hasher.resolve_algorithm("") is None
+
+
+class TestSmallFileReader:
+    """小文件预读测试"""
+
+    def test_preserves_order_under_small_byte_budget(self, tmp_path, monkeypatch):
+        """字节预算只够两个文件时，乱序完成的读取仍按文件组顺序产出，预读不超出预算"""
+        import random
+        import threading
+        import time
+        from types import SimpleNamespace
+        from backup import small_file_reader
+        from backup.small_file_reader import SmallFileTarWriter
+
+        file_group = []
+        for index in range(30):
+            path = tmp_path / f"f{index:02d}"
+            size = 40 if index % 7 == 3 else 10  # 每 7 个文件中一个超过阈值
+            path.write_bytes(bytes([index]) * size)
+            file_group.append({'path': str(path), 'size': size})
+        file_group.append({'path': str(tmp_path / "missing"), 'size': 10})
+
+        started = []
+        lock = threading.Lock()
+        real_read = small_file_reader.read_small_file
+
+        def slow_read(path, max_size):
+            with lock:
+                started.append(path)
+            time.sleep(random.uniform(0, 0.005))
+            return real_read(path, max_size)
+
+        monkeypatch.setattr(small_file_reader, "read_small_file", slow_read)
+        settings = SimpleNamespace(
+            COMPRESSION_SMALL_FILE_THRESHOLD=16,
+            COMPRESSION_SMALL_FILE_READERS=4,
+            COMPRESSION_SMALL_FILE_QUEUE_BYTES=1,  # 不足阈值时按阈值：最多预读两个 10 字节文件
+        )
+        writer = SmallFileTarWriter(file_group, [str(tmp_path)], settings)
+        assert writer.queue_bytes == 16
+
+        yielded = []
+        for file_info, prefetched in writer:
+            yielded.append(file_info)
+            with lock:
+                ahead = len(set(started) - {info['path'] for info in yielded[:-1]})
+            assert ahead <= 2
+            if file_info['size'] > 16 or file_info['path'].endswith("missing"):
+                assert prefetched is None
+            else:
+                assert prefetched.data == Path(file_info['path']).read_bytes()
+
+        assert yielded == file_group
+        assert writer.prefetched_count == sum(1 for info in file_group if info['size'] <= 16) - 1
+
+
+class _FakeTreeConn:
+    """目录树索引用的 openGauss 连接：在内存中执行 build_directory_tree / list_directory_page 发出的语句"""
+
+    def __init__(self, backup_set_id, files_table, paths):
+        from contextlib import asynccontextmanager
+        from backup.directory_tree_index import normalize_path_key
+
+        self.backup_set_id = backup_set_id
+        self.files_table = files_table
+        self.registered = None
+        self.nodes = []
+        self.files = []
+        for file_id, (path, size) in enumerate(paths, start=1):
+            self.files.append({
+                'id': file_id, 'file_path': path, 'file_name': normalize_path_key(path).rpartition("/")[2],
+                'file_type': 'directory' if size is None else 'file', 'file_size': size or 0, 'dir_id': None,
+                'directory_path': None, 'display_name': None, 'compressed_size': 0, 'file_permissions': None,
+                'created_time': None, 'modified_time': None, 'accessed_time': None, 'compressed': True,
+                'checksum': None, 'backup_time': None, 'chunk_number': None,
+            })
+
+        @asynccontextmanager
+        async def transaction():
+            yield
+
+        self.transaction = transaction
+
+    @staticmethod
+    def _page(rows, sql, args):
+        if "LIMIT" in sql:
+            limit, offset = args[-2:]
+            return rows[offset:offset + limit]
+        return rows[args[-1]:]
+
+    def _file_dir_key(self, row):
+        from backup.directory_tree_index import normalize_path_key, parent_key
+
+        key = normalize_path_key(row['file_path'])
+        return key if row['file_type'] == 'directory' else parent_key(key)
+
+    async def execute(self, sql, *args):
+        from backup.directory_tree_index import normalize_path_key, parent_key
+
+        if sql.startswith("DELETE"):
+            return "DELETE 0"
+        if "UPDATE" in sql and "SET dir_id" in sql:
+            # 文件和目录记录都指向所在目录
+            dir_ids = {node['path_key']: node['dir_id'] for node in self.nodes}
+            updated = 0
+            for row in self.files:
+                if args[1] <= row['id'] < args[2]:
+                    row['dir_id'] = dir_ids.get(parent_key(normalize_path_key(row['file_path'])))
+                    updated += 1
+            return f"UPDATE {updated}"
+        if sql.startswith("INSERT INTO backup_directory_trees"):
+            self.registered = args[1]
+            return "INSERT 0 1"
+        return "OK"
+
+    async def executemany(self, sql, rows):
+        from backup.directory_tree_index import DirectoryNode
+
+        self.nodes.extend(dict(zip(DirectoryNode._fields, row[1:])) for row in rows)
+
+    async def fetchval(self, sql, *args):
+        return self.registered if "FROM backup_directory_trees" in sql else None
+
+    async def fetchrow(self, sql, *args):
+        if "FROM backup_sets bs" in sql:
+            return {"backup_task_id": 1, "backup_files_table": self.files_table, "archive_table": None}
+        if "MIN(id)" in sql:
+            return {"min_id": self.files[0]['id'], "max_id": self.files[-1]['id']}
+        if "path_key = $2" in sql:
+            return next((node for node in self.nodes if node['path_key'] == args[1]), None)
+        return None
+
+    async def fetch(self, sql, *args):
+        if "information_schema.columns" in sql:
+            return [{"column_name": column} for column in self.files[0]]
+        if "GROUP BY 1" in sql:
+            groups = {}
+            for row in self.files:
+                entry = groups.setdefault(self._file_dir_key(row), [0, 0])
+                if row['file_type'] != 'directory':
+                    entry[0] += 1
+                    entry[1] += row['file_size']
+            return [{"dir_key": key, "file_count": count, "total_bytes": size}
+                    for key, (count, size) in groups.items()]
+        if "parent_id = $2" in sql:
+            children = sorted((node for node in self.nodes if node['parent_id'] == args[1]),
+                              key=lambda node: node['name'])
+            return self._page(children, sql, args)
+        if "dir_id = $2" in sql:
+            files = sorted((row for row in self.files if row['dir_id'] == args[1] and row['file_type'] != 'directory'),
+                           key=lambda row: (row['file_name'], row['id']))
+            return self._page(files, sql, args)
+        return []
+
+
+class TestDirectoryTreeIndex:
+    """备份集目录树索引测试"""
+
+    @pytest.fixture(autouse=True)
+    def _clear_cache(self):
+        db_utils.invalidate_backup_files_table_cache()
+        yield
+        db_utils.invalidate_backup_files_table_cache()
+
+    @pytest.fixture
+    def conn(self):
+        return _FakeTreeConn(501, "backup_files_000501", [
+            ("D:\\data\\a.txt", 10),
+            ("D:\\data\\sub", None),
+            ("D:\\data\\sub\\c.txt", 30),
+            ("D:\\data\\sub\\b.txt", 20),
+            ("D:\\data\\\\empty", None),
+            ("D:\\data\\sub\\deep\\d.txt", 40),
+        ])
+
+    @pytest.mark.asyncio
+    async def test_build_then_list(self, conn):
+        from backup.directory_tree_index import build_directory_tree, list_directory_page
+
+        assert await build_directory_tree(conn, 501) == 6  # 根、D:、data、empty、sub、deep
+        assert conn.registered == "backup_files_000501"
+
+        page = await list_directory_page(conn, 501, "D:\\data")
+        assert [(item['type'], item['name']) for item in page['items']] == [
+            ('directory', 'empty'), ('directory', 'sub'), ('file', 'a.txt'),
+        ]
+        assert (page['total'], page['file_count'], page['total_bytes']) == (3, 4, 100)
+        sub = page['items'][1]
+        assert (sub['file_count'], sub['total_bytes'], sub['child_dir_count'], sub['has_children']) == (3, 90, 1, True)
+        assert page['items'][0]['has_children'] is False
+
+        page = await list_directory_page(conn, 501, "D:/data/sub/")
+        assert [item['name'] for item in page['items']] == ['deep', 'b.txt', 'c.txt']
+        assert page['items'][1]['file']['file_size'] == 20
+
+        root = await list_directory_page(conn, 501, "")
+        assert [item['path'] for item in root['items']] == ['D:']
+
+    @pytest.mark.asyncio
+    async def test_list_pages_across_dirs_and_files(self, conn):
+        from backup.directory_tree_index import build_directory_tree, list_directory_page
+
+        await build_directory_tree(conn, 501)
+        names = []
+        for offset in range(0, 3):
+            page = await list_directory_page(conn, 501, "D:/data/sub", offset=offset, limit=1)
+            assert page['total'] == 3
+            names.extend(item['name'] for item in page['items'])
+        assert names == ['deep', 'b.txt', 'c.txt']
+        page = await list_directory_page(conn, 501, "D:/data/sub", offset=3, limit=5)
+        assert page['items'] == []
+        assert await list_directory_page(conn, 501, "D:/missing") == {
+            'items': [], 'total': 0, 'offset': 0, 'limit': None, 'file_count': 0, 'total_bytes': 0,
+        }
+
+    @pytest.mark.asyncio
+    async def test_list_returns_none_before_build(self, conn, monkeypatch):
+        from backup import directory_tree_index
+
+        monkeypatch.setattr(directory_tree_index, "is_opengauss", lambda: False)
+        assert await directory_tree_index.list_directory_page(conn, 501, "D:/data") is None
@@ -16,7 +16,7 @@ from models.backup import BackupTask, BackupTaskType, BackupTaskStatus
 from config.database import db_manager
 from sqlalchemy import select, and_
 from utils.log_utils import log_system, LogLevel, LogCategory, log_operation, OperationType
-from .db_utils import is_opengauss, is_redis, get_opengauss_connection
+from .db_utils import is_opengauss, is_redis, get_opengauss_connection, invalidate_backup_files_table_cache
 from .sqlite_utils import is_sqlite
 import json
 
@@ -649,6 +649,7 @@ class BackupActionHandler(ActionHandler):
                             table_name,
                             backup_task_id,
                         )
+                        invalidate_backup_files_table_cache(task_ids=[backup_task_id])
 
                         # 3. 为该任务创建物理表（基于 backup_files_template 结构）
                         # 注意：表名不能用参数占位符，只能通过受控字符串拼接
@@ -1137,8 +1138,9 @@ class RecoveryActionHandler(ActionHandler):
                 }
             else:
                 error_msg = "恢复任务执行失败"
-                if recovery_engine._current_recovery and recovery_engine._current_recovery.get('error_message'):
-                    error_msg = recovery_engine._current_recovery['error_message']
+                recovery_status = await recovery_engine.get_recovery_status(recovery_id)
+                if recovery_status and recovery_status.get('error_message'):
+                    error_msg = recovery_status['error_message']
                 
                 logger.error(f"恢复任务执行失败: {recovery_id}, 错误: {error_msg}")
                 return {
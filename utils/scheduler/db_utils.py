@@ -7,7 +7,8 @@ Database Utility Functions
 
 import asyncio
 import logging
-from typing import Optional, Tuple
+import time
+from typing import Dict, Iterable, Optional, Tuple
 from contextlib import asynccontextmanager
 from config.database import db_manager
 from utils.opengauss.guard import get_opengauss_monitor
@@ -18,6 +19,11 @@ logger = logging.getLogger(__name__)
 _opengauss_pool: Optional[object] = None
 _pool_lock = asyncio.Lock()
 
+# backup_set_id -> (backup_task_id, 物理表名, 缓存时间)；只缓存已分配的分表名，回退到主表的结果不缓存
+_backup_files_table_cache: Dict[int, Tuple[int, str, float]] = {}
+_BACKUP_FILES_TABLE_CACHE_MAX = 10000
+_backup_files_table_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
 
 def is_opengauss() -> bool:
     """检查当前数据库是否为openGauss"""
@@ -42,33 +48,122 @@ def is_redis() -> bool:
     return url_lower.startswith("redis://") or url_lower.startswith("rediss://")
 
 
+def _backup_files_table_cache_ttl() -> float:
+    try:
+        return float(getattr(db_manager.settings, "BACKUP_FILES_TABLE_CACHE_TTL", 0) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def invalidate_backup_files_table_cache(backup_set_ids: Optional[Iterable[int]] = None,
+                                        task_ids: Optional[Iterable[int]] = None):
+    """使 backup_set → 分表名缓存失效
+
+    任务的分表名被写入/修改，或任务、备份集被删除时调用；不传参数时清空全部缓存。
+    """
+    if backup_set_ids is None and task_ids is None:
+        removed = len(_backup_files_table_cache)
+        _backup_files_table_cache.clear()
+    else:
+        set_ids = set(backup_set_ids or [])
+        task_id_set = set(task_ids or [])
+        stale = [
+            set_id for set_id, (task_id, _, _) in _backup_files_table_cache.items()
+            if set_id in set_ids or task_id in task_id_set
+        ]
+        for set_id in stale:
+            _backup_files_table_cache.pop(set_id, None)
+        removed = len(stale)
+    _backup_files_table_cache_stats["invalidations"] += removed
+
+
+def get_backup_files_table_cache_stats() -> Dict[str, int]:
+    """分表名缓存统计（命中/未命中/失效条目数/当前条目数）"""
+    return dict(_backup_files_table_cache_stats, size=len(_backup_files_table_cache))
+
+
 async def get_backup_files_table_by_set_id(conn, backup_set_id: int) -> str:
     """根据 backup_set_id 获取对应的 backup_files 物理表名（多表方案）
 
-    - 优先从 backup_tasks.backup_files_table 读取
+    - 已归档的备份集返回 backup_files_archive_sets 登记的月归档表，否则从 backup_tasks.backup_files_table 读取
     - 表名必须以 'backup_files_' 开头，否则回退为主表 'backup_files'
     - 仅在 openGauss 模式下使用
+    - 分表名在进程内缓存（BACKUP_FILES_TABLE_CACHE_TTL 秒后过期，0 表示不过期），
+      任务创建/删除时通过 invalidate_backup_files_table_cache() 失效
     """
+    cached = _backup_files_table_cache.get(backup_set_id)
+    if cached is not None:
+        ttl = _backup_files_table_cache_ttl()
+        if ttl <= 0 or time.monotonic() - cached[2] < ttl:
+            _backup_files_table_cache_stats["hits"] += 1
+            return cached[1]
+        _backup_files_table_cache.pop(backup_set_id, None)
+    _backup_files_table_cache_stats["misses"] += 1
+
     table_name = "backup_files"
     try:
         row = await conn.fetchrow(
             """
-            SELECT bt.backup_files_table
+            SELECT bt.id AS backup_task_id, bt.backup_files_table, a.table_name AS archive_table
             FROM backup_sets bs
             JOIN backup_tasks bt ON bs.backup_task_id = bt.id
+            LEFT JOIN backup_files_archive_sets a ON a.backup_set_id = bs.id
             WHERE bs.id = $1
             """,
             backup_set_id,
         )
-        if row and row.get("backup_files_table"):
-            candidate = row["backup_files_table"]
+        if row and (row.get("archive_table") or row.get("backup_files_table")):
+            candidate = row.get("archive_table") or row["backup_files_table"]
             if isinstance(candidate, str) and candidate.startswith("backup_files_"):
                 table_name = candidate
+                if len(_backup_files_table_cache) >= _BACKUP_FILES_TABLE_CACHE_MAX:
+                    # 淘汰最早缓存的条目
+                    _backup_files_table_cache.pop(next(iter(_backup_files_table_cache)), None)
+                _backup_files_table_cache[backup_set_id] = (row.get("backup_task_id"), table_name, time.monotonic())
     except Exception as e:
         logger.warning(f"[多表方案] 根据 backup_set_id={backup_set_id} 获取 backup_files 表名失败，回退到主表 backup_files: {e}")
     return table_name
 
 
+# 随备份集一起删除的附属表：归档登记、目录→压缩包映射、目录树
+BACKUP_SET_SIDE_TABLES = (
+    "backup_files_archive_sets",
+    "backup_directory_archives",
+    "backup_directory_nodes",
+    "backup_directory_trees",
+)
+
+
+def _is_undefined_table_error(error: Exception) -> bool:
+    """表不存在（SQLSTATE 42P01，asyncpg/psycopg3 均提供 sqlstate）"""
+    if getattr(error, "sqlstate", None) == "42P01":
+        return True
+    message = str(error).lower()
+    return "relation" in message and "does not exist" in message
+
+
+async def delete_backup_set_side_tables(conn, backup_set_id: Optional[int] = None,
+                                        task_id: Optional[int] = None):
+    """删除备份集的附属表记录（按 backup_set_id，或按 task_id 删除该任务的全部备份集）
+
+    必须在删除 backup_sets 之前调用；附属表不存在（功能未启用）时忽略，其他错误记录警告后继续。
+    """
+    if backup_set_id is not None:
+        predicate, param = "backup_set_id = $1", backup_set_id
+    elif task_id is not None:
+        predicate, param = "backup_set_id IN (SELECT id FROM backup_sets WHERE backup_task_id = $1)", task_id
+    else:
+        raise ValueError("backup_set_id 和 task_id 至少需要一个")
+    for table in BACKUP_SET_SIDE_TABLES:
+        try:
+            await conn.execute(f"DELETE FROM {table} WHERE {predicate}", param)
+        except Exception as e:
+            if _is_undefined_table_error(e):
+                logger.debug(f"[删除备份集] 附属表 {table} 不存在，跳过")
+            else:
+                logger.warning(f"[删除备份集] 删除附属表 {table} 记录失败（{predicate}, {param}）: {e}")
+
+
 async def _create_opengauss_pool():
     """创建openGauss连接池（优先使用 psycopg3，修复 BufferError）"""
     import re
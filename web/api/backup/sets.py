@@ -8,7 +8,9 @@ Backup Management API - Backup Sets Query
 import logging
 from typing import Optional
 from fastapi import APIRouter, HTTPException
-from utils.scheduler.db_utils import is_redis, is_opengauss
+from utils.scheduler.db_utils import (
+    is_redis, is_opengauss, invalidate_backup_files_table_cache, delete_backup_set_side_tables
+)
 from utils.scheduler.sqlite_utils import is_sqlite
 
 logger = logging.getLogger(__name__)
@@ -201,12 +203,15 @@ async def delete_backup_set(set_id: str):
                 files_deleted = files_result if hasattr(files_result, '__int__') else 0
                 logger.info(f"已删除备份集 {set_id} 的 {files_deleted} 个文件记录")
                 
+                await delete_backup_set_side_tables(conn, backup_set_id=backup_set_id)
+                
                 # 删除备份集
                 set_result = await conn.execute(
                     "DELETE FROM backup_sets WHERE id = $1",
                     backup_set_id
                 )
                 sets_deleted = set_result if hasattr(set_result, '__int__') else 0
+                invalidate_backup_files_table_cache(backup_set_ids=[backup_set_id])
                 
                 if sets_deleted > 0:
                     logger.info(f"已删除备份集: {set_id}（文件数: {files_deleted}）")
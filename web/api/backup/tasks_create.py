@@ -11,7 +11,9 @@ from typing import Dict, Any
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, Request
 from models.backup import BackupTaskStatus
-from utils.scheduler.db_utils import is_opengauss, is_redis, get_opengauss_connection
+from utils.scheduler.db_utils import (
+    is_opengauss, is_redis, get_opengauss_connection, invalidate_backup_files_table_cache
+)
 from utils.scheduler.sqlite_utils import is_sqlite, get_sqlite_connection
 from models.system_log import OperationType
 from utils.log_utils import log_operation
@@ -108,6 +110,7 @@ async def create_backup_task(
                     table_name,
                     task_id,
                 )
+                invalidate_backup_files_table_cache(task_ids=[task_id])
 
                 # 3. 为该任务创建物理表（基于 backup_files_template 结构）
                 # 注意：表名不能用参数占位符，只能通过受控字符串拼接
@@ -164,7 +167,6 @@ async def create_backup_task(
                 raise HTTPException(status_code=501, detail="Redis模式下创建备份任务模板暂未实现，请使用Redis相关API")
             
             if not is_sqlite():
-                from utils.scheduler.db_utils import is_opengauss
                 db_type = "openGauss" if is_opengauss() else "未知类型"
                 logger.warning(f"[{db_type}模式] 当前数据库类型不支持使用SQLite连接创建备份任务模板，抛出HTTPException")
                 raise HTTPException(status_code=400, detail=f"{db_type}模式下不支持使用SQLite连接创建备份任务模板")
@@ -9,7 +9,10 @@ import logging
 import asyncio
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, Request
-from utils.scheduler.db_utils import is_opengauss, is_redis, get_opengauss_connection
+from utils.scheduler.db_utils import (
+    is_opengauss, is_redis, get_opengauss_connection, invalidate_backup_files_table_cache,
+    delete_backup_set_side_tables
+)
 from utils.scheduler.sqlite_utils import is_sqlite, get_sqlite_connection
 from models.system_log import OperationType
 from utils.log_utils import log_operation
@@ -244,6 +247,7 @@ async def delete_backup_task(task_id: int, http_request: Request):
                         if total_files_deleted > 0:
                             logger.debug(f"已删除 {total_files_deleted} 个备份文件记录")
                     
+                    await delete_backup_set_side_tables(conn, task_id=task_id)
                     # 再删除备份集
                     try:
                         await conn.execute(
@@ -266,6 +270,7 @@ async def delete_backup_task(task_id: int, http_request: Request):
                             raise
                 
                 # 检查是否有执行记录引用此模板（template_id外键）
+                child_task_ids = []
                 if is_template:
                     # 使用 fetchrow 代替 fetchval，避免 openGauss 缓冲区错误
                     # 使用原生 openGauss SQL
@@ -315,6 +320,7 @@ async def delete_backup_task(task_id: int, http_request: Request):
                                         else:
                                             logger.error(f"删除备份文件失败: {error_msg}")
                                             raise
+                                await delete_backup_set_side_tables(conn, task_id=child_task_id)
                                 # 再删除备份集
                                 try:
                                     await conn.execute(
@@ -387,6 +393,8 @@ async def delete_backup_task(task_id: int, http_request: Request):
                             logger.debug(f"备份任务 {task_id} 删除事务已提交")
                         except Exception as commit_err:
                             logger.warning(f"提交删除事务失败（可能已自动提交）: {commit_err}")
+                    # 已删除任务的备份集不再需要分表名缓存
+                    invalidate_backup_files_table_cache(task_ids=[task_id, *child_task_ids])
                     
                 except HTTPException:
                     raise
@@ -9,8 +9,11 @@ import logging
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from recovery.recovery_engine import BackupSetNotFoundError
+
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
@@ -22,22 +25,36 @@ class RecoveryRequest(BaseModel):
     target_path: str
 
 
+class RecoveryPlanRequest(BaseModel):
+    """恢复计划请求模型"""
+    backup_set_id: str
+    files: List[Dict[str, Any]]
+
+
 # 注意：路由顺序很重要，更具体的路径应该放在前面
 # 先定义带路径参数的具体路由，再定义通用路由
 
 @router.get("/backup-sets/{backup_set_id}/top-level")
-async def get_top_level_directories(backup_set_id: str, request: Request):
-    """获取备份集的顶层目录结构（优化性能，避免一次性加载所有文件）"""
+async def get_top_level_directories(
+    backup_set_id: str,
+    request: Request,
+    offset: int = 0,
+    limit: Optional[int] = None
+):
+    """获取备份集的顶层目录结构（优化性能，避免一次性加载所有文件）
+
+    offset/limit 分页（limit 为空时返回全部），total 为顶层条目总数
+    """
     try:
-        logger.debug(f"收到获取顶层目录请求: backup_set_id={backup_set_id}")
+        logger.debug(f"收到获取顶层目录请求: backup_set_id={backup_set_id}, offset={offset}, limit={limit}")
         system = request.app.state.system
         if not system:
             logger.error("系统未初始化")
             raise HTTPException(status_code=500, detail="系统未初始化")
 
-        directories = await system.recovery_engine.get_top_level_directories(backup_set_id)
-        logger.info(f"返回 {len(directories)} 个顶层目录项")
-        return {"items": directories}
+        page = await system.recovery_engine.browse_directory(backup_set_id, "", offset, limit)
+        logger.info(f"返回 {len(page['items'])} 个顶层目录项（共 {page['total']} 个）")
+        return page
 
     except HTTPException:
         raise
@@ -50,16 +67,20 @@ async def get_top_level_directories(backup_set_id: str, request: Request):
 async def get_directory_contents(
     backup_set_id: str, 
     path: str = "",
+    offset: int = 0,
+    limit: Optional[int] = None,
     request: Request = None
 ):
-    """获取指定目录下的文件和子目录列表"""
+    """获取指定目录下的文件和子目录列表
+
+    offset/limit 分页（limit 为空时返回全部），total 为目录下条目总数
+    """
     try:
         system = request.app.state.system
         if not system:
             raise HTTPException(status_code=500, detail="系统未初始化")
 
-        contents = await system.recovery_engine.get_directory_contents(backup_set_id, path)
-        return {"items": contents}
+        return await system.recovery_engine.browse_directory(backup_set_id, path, offset, limit)
 
     except Exception as e:
         logger.error(f"获取目录内容失败: {str(e)}")
@@ -67,21 +88,122 @@ async def get_directory_contents(
 
 
 @router.get("/backup-sets/{backup_set_id}/files")
-async def get_backup_set_files(backup_set_id: str, request: Request):
-    """获取备份集文件列表"""
+async def get_backup_set_files(
+    backup_set_id: str,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    format: str = "json"
+):
+    """获取备份集文件列表
+
+    - format=ndjson：流式返回全部文件（每行一个 JSON 对象，可用 cursor 从某一页之后继续）
+    - 指定 cursor 或 limit：键集分页，返回 {files, next_cursor, limit}，next_cursor 为空表示已读完
+    - 都不指定：一次性返回全部文件（兼容旧接口）
+    """
     try:
         system = request.app.state.system
         if not system:
             raise HTTPException(status_code=500, detail="系统未初始化")
 
+        if format == "ndjson":
+            from backup.file_listing import ndjson_chunks
+            files = system.recovery_engine.iter_backup_set_files(backup_set_id, cursor)
+            return StreamingResponse(
+                ndjson_chunks(files),
+                media_type="application/x-ndjson"
+            )
+        if format != "json":
+            raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+
+        if cursor or limit:
+            page = await system.recovery_engine.get_backup_set_files_page(backup_set_id, cursor, limit)
+            if page is None:
+                raise HTTPException(status_code=404, detail="备份集不存在")
+            return page
+
         files = await system.recovery_engine.get_backup_set_files(backup_set_id)
         return {"files": files}
 
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"获取备份集文件列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/backup-sets/{backup_set_id}/search")
+async def search_backup_set_files(
+    backup_set_id: str,
+    request: Request,
+    q: str,
+    mode: str = "auto",
+    field: str = "name",
+    file_type: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 100
+):
+    """在备份集中搜索文件（前缀 / 子串 / 扩展名，分页）"""
+    try:
+        system = request.app.state.system
+        if not system:
+            raise HTTPException(status_code=500, detail="系统未初始化")
+
+        return await system.recovery_engine.search_files_across_sets(
+            q, mode=mode, field=field, set_ids=[backup_set_id],
+            file_type=file_type, offset=offset, limit=limit
+        )
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"搜索备份集文件失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/files/search")
+async def search_files_across_sets(
+    request: Request,
+    q: str,
+    mode: str = "auto",
+    field: str = "name",
+    set_ids: Optional[str] = None,
+    backup_group_from: Optional[str] = None,
+    backup_group_to: Optional[str] = None,
+    file_type: Optional[str] = None,
+    group_by_set: bool = False,
+    offset: int = 0,
+    limit: int = 100
+):
+    """跨备份集搜索文件
+
+    set_ids 为逗号分隔的备份集ID（为空时搜索全部）；group_by_set=true 时只返回包含匹配文件的备份集
+    """
+    try:
+        system = request.app.state.system
+        if not system:
+            raise HTTPException(status_code=500, detail="系统未初始化")
+
+        set_id_list = [set_id.strip() for set_id in set_ids.split(",") if set_id.strip()] if set_ids else None
+        return await system.recovery_engine.search_files_across_sets(
+            q, mode=mode, field=field, set_ids=set_id_list,
+            backup_group_from=backup_group_from, backup_group_to=backup_group_to,
+            file_type=file_type, offset=offset, limit=limit, group_by_set=group_by_set
+        )
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"跨备份集搜索文件失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/backup-sets")
 async def search_backup_sets(
     request: Request,
@@ -115,13 +237,40 @@ async def search_backup_sets(
         return {"backup_sets": []}
 
 
+@router.post("/plan")
+async def plan_recovery(recovery_request: RecoveryPlanRequest, request: Request):
+    """生成恢复计划（不执行）：磁带加载顺序、每盘内按物理位置排序的压缩包读取顺序、估算定位和读取时间"""
+    try:
+        system = request.app.state.system
+        if not system:
+            raise HTTPException(status_code=500, detail="系统未初始化")
+
+        return await system.recovery_engine.plan_recovery(
+            recovery_request.backup_set_id, recovery_request.files
+        )
+
+    except HTTPException:
+        raise
+    except BackupSetNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"生成恢复计划失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/tasks")
 async def create_recovery_task(
     recovery_request: RecoveryRequest,
     background_tasks: BackgroundTasks,
     request: Request
 ):
-    """创建恢复任务"""
+    """创建恢复任务
+
+    文件恢复到 target_path/<文件名>；设置 RECOVERY_PRESERVE_PATHS=True 时按压缩包恢复的文件保留备份源内的相对目录结构。
+    files 中 type 为 'directory' 的项（directory_path 为备份记录中的目录路径）恢复该目录及子目录下的所有文件
+    """
     try:
         system = request.app.state.system
         if not system:
@@ -155,7 +304,10 @@ async def create_recovery_task(
 
 @router.get("/tasks/{recovery_id}/status")
 async def get_recovery_status(recovery_id: str, request: Request):
-    """获取恢复状态"""
+    """获取恢复状态
+
+    status 为 partial_failed 时部分文件恢复失败，失败的文件列在 failed_files 中
+    """
     try:
         system = request.app.state.system
         if not system: